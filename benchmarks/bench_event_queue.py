@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""Measure how many events per second flow from EventHandler through MainLoop._process_file_event_queue.
+
+The current FileEvent tuple is compared against the previous representation, a frozen pydantic model holding the watchdog event, the whole folder config and a timezone-aware datetime.
+Every path is already in the upload record, so the numbers reflect the queueing and bookkeeping cost (including the work journal) rather than any uploading.
+
+Usage: python benchmarks/bench_event_queue.py [--num-events 100000]
+"""
+
+import argparse
+import datetime
+import logging
+import queue
+import tempfile
+import time
+from collections.abc import Callable
+from pathlib import Path
+from queue import SimpleQueue
+
+import boto3
+from pydantic import BaseModel
+from pydantic import Field
+from watchdog.events import FileClosedEvent
+from watchdog.events import FileSystemEvent
+
+from cloud_courier import FileFilter
+from cloud_courier import FolderToWatch
+from cloud_courier import MainLoop
+from cloud_courier import SpillingEventQueue
+from cloud_courier.main import EventHandler
+from cloud_courier.upload_record import UploadRecordEntry
+
+FOLDER_DESCRIPTOR = "benchmark"
+
+
+class LegacyFileEventInfo(BaseModel, frozen=True):
+    file_system_event: FileSystemEvent
+    folder_config: FolderToWatch
+    timestamp: datetime.datetime = Field(default_factory=lambda: datetime.datetime.now(tz=datetime.UTC))
+
+
+def _time_per_second(num_events: int, func: Callable[[], None]) -> float:
+    start = time.perf_counter()
+    func()
+    return num_events / (time.perf_counter() - start)
+
+
+def _create_loop(record_dir: str, folder_config: FolderToWatch, paths: list[str]) -> MainLoop:
+    loop = MainLoop(
+        stop_flag_dir=record_dir,
+        boto_session=boto3.Session(region_name="us-east-1"),
+        idle_loop_sleep_seconds=0,
+        previously_uploaded_files_record_path=Path(record_dir) / "record.sqlite3",
+    )
+    loop.file_system_events = SpillingEventQueue(
+        spill_file_path=Path(record_dir) / "spill.jsonl", max_in_memory=len(paths)
+    )
+    loop.watched_folders[FOLDER_DESCRIPTOR] = folder_config
+    loop.uploaded_files.add_many(UploadRecordEntry(path, f"s3://bucket{path}", "checksum") for path in paths)
+    return loop
+
+
+def benchmark_file_event(folder_config: FolderToWatch, events: list[FileClosedEvent]) -> tuple[float, float]:
+    with tempfile.TemporaryDirectory() as record_dir:
+        loop = _create_loop(record_dir, folder_config, [str(event.src_path) for event in events])
+        handler = EventHandler(
+            folder_descriptor=FOLDER_DESCRIPTOR,
+            file_filter=FileFilter(folder_config),
+            enqueue=loop._enqueue_file,  # noqa: SLF001 # benchmarking the private method directly
+        )
+
+        def handle():
+            for event in events:
+                handler.on_closed(event)
+
+        def process():
+            for _ in events:
+                _ = loop._process_file_event_queue()  # noqa: SLF001 # benchmarking the private method directly
+
+        rates = _time_per_second(len(events), handle), _time_per_second(len(events), process)
+        loop.file_system_events.close()
+        loop.work_journal.close()
+        loop.uploaded_files.close()
+        return rates
+
+
+def benchmark_legacy_event_info(folder_config: FolderToWatch, events: list[FileClosedEvent]) -> tuple[float, float]:
+    """Replicate the handler and queue processing as they were when FileEventInfo was a pydantic model."""
+    file_system_events: SimpleQueue[LegacyFileEventInfo] = SimpleQueue()
+    uploaded_files = {Path(str(event.src_path)): {"checksum"} for event in events}
+    watched_folders = {FOLDER_DESCRIPTOR: folder_config}
+
+    def handle():
+        for event in events:
+            file_system_events.put(LegacyFileEventInfo(file_system_event=event, folder_config=folder_config))
+
+    def process():
+        for _ in events:
+            try:
+                event_info = file_system_events.get(timeout=0.05)
+            except queue.Empty:
+                return
+            seconds_since_event = (datetime.datetime.now(tz=datetime.UTC) - event_info.timestamp).total_seconds()
+            if seconds_since_event < event_info.folder_config.delay_seconds_before_upload:
+                file_system_events.put(event_info)
+                continue
+            if event_info.folder_config not in watched_folders.values():
+                continue
+            _ = Path(str(event_info.file_system_event.src_path)) in uploaded_files
+
+    return _time_per_second(len(events), handle), _time_per_second(len(events), process)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _ = parser.add_argument("--num-events", type=int, default=100_000)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)  # the per-event log messages would otherwise dominate the measurement
+
+    folder_config = FolderToWatch(
+        folder_path="/benchmark", s3_key_prefix="prefix", s3_bucket_name="bucket", delay_seconds_before_upload=0
+    )
+    events = [FileClosedEvent(src_path=f"/benchmark/{idx}.txt") for idx in range(args.num_events)]
+
+    for name, benchmark in (
+        ("FileEvent (tuple)", benchmark_file_event),
+        ("FileEventInfo (pydantic, previous)", benchmark_legacy_event_info),
+    ):
+        handle_rate, process_rate = benchmark(folder_config, events)
+        print(  # noqa: T201 # this is a command line tool
+            f"{name:<36} EventHandler: {handle_rate:>12,.0f} events/s   _process_file_event_queue: {process_rate:>12,.0f} events/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
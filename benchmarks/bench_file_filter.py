@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""Measure the cost per path of FileFilter.should_upload as the number of ignore patterns grows.
+
+The compiled FileFilter is compared against checking each pattern in turn with fnmatch, which is what a naive implementation would do for every event.
+
+Usage: python benchmarks/bench_file_filter.py [--num-paths 20000] [--num-patterns 10 100 500]
+"""
+
+import argparse
+import fnmatch
+import time
+from collections.abc import Callable
+
+from cloud_courier import FileFilter
+from cloud_courier import FolderToWatch
+
+FOLDER_PATH = "/data/instrument"
+
+
+def _make_patterns(num_patterns: int) -> list[str]:
+    return ["~$*", "*.tmp", *(f"*.ext{idx}" for idx in range(num_patterns - 2))]
+
+
+def _make_paths(num_paths: int) -> list[str]:
+    return [f"{FOLDER_PATH}/run{idx % 100}/plate_{idx}.fcs" for idx in range(num_paths)]
+
+
+def _nanoseconds_per_path(paths: list[str], should_upload: Callable[[str], bool]) -> float:
+    start = time.perf_counter_ns()
+    for path in paths:
+        _ = should_upload(path)
+    return (time.perf_counter_ns() - start) / len(paths)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _ = parser.add_argument("--num-paths", type=int, default=20_000)
+    _ = parser.add_argument("--num-patterns", type=int, nargs="+", default=[10, 100, 500])
+    args = parser.parse_args()
+    paths = _make_paths(args.num_paths)
+
+    for num_patterns in args.num_patterns:
+        patterns = _make_patterns(num_patterns)
+        file_filter = FileFilter(
+            FolderToWatch(
+                folder_path=FOLDER_PATH, s3_key_prefix="prefix", s3_bucket_name="bucket", ignore_patterns=patterns
+            )
+        )
+
+        def naive_should_upload(path: str, patterns: list[str] = patterns) -> bool:
+            file_name = path.rpartition("/")[2]
+            return not any(fnmatch.fnmatch(file_name, pattern) for pattern in patterns)
+
+        compiled_ns = _nanoseconds_per_path(paths, file_filter.should_upload)
+        naive_ns = _nanoseconds_per_path(paths, naive_should_upload)
+        print(  # noqa: T201 # this is a command line tool
+            f"{num_patterns:>5} patterns   FileFilter: {compiled_ns:>10,.0f} ns/path   fnmatch per pattern: {naive_ns:>10,.0f} ns/path"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""Measure how many entries per second can be added to the upload record with each backend and commit policy.
+
+The previous behavior (opening, appending to and closing the TSV file for every entry) is included for comparison.
+
+Usage: python benchmarks/bench_upload_record.py [--num-entries 2000]
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from cloud_courier import UploadRecord
+from cloud_courier import add_to_upload_record
+from cloud_courier import create_record_file
+from cloud_courier import open_upload_record
+
+# name, commit interval seconds, commit max entries, fsync
+COMMIT_POLICIES = (
+    ("every entry, fsync", 0, 1, True),
+    ("every entry, no fsync", 0, 1, False),
+    ("group of 100 or 1s, fsync", 1, 100, True),
+)
+
+
+def _entries_per_second(num_entries: int, record: UploadRecord | None, record_path: Path) -> float:
+    start = time.perf_counter()
+    for idx in range(num_entries):
+        file_path = Path(f"/data/instrument/plate_{idx}.fcs")
+        if record is None:
+            add_to_upload_record(
+                record_file_path=record_path, uploaded_file_path=file_path, checksum="abc", cloud_path="s3://bucket/key"
+            )
+        else:
+            record.add(file_path=file_path, checksum="abc", cloud_path="s3://bucket/key")
+    if record is not None:
+        record.close()
+    return num_entries / (time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _ = parser.add_argument("--num-entries", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        legacy_path = Path(temp_dir) / "legacy.tsv"
+        create_record_file(legacy_path)
+        rate = _entries_per_second(args.num_entries, None, legacy_path)
+        print(f"{'TSV (previous, open/append/close)':<36} {rate:>12,.0f} entries/s")  # noqa: T201 # this is a command line tool
+        for suffix in (".tsv", ".sqlite3"):
+            for name, interval, max_entries, fsync in COMMIT_POLICIES:
+                record_path = Path(temp_dir) / f"{name.replace(' ', '_')}{suffix}"
+                record = open_upload_record(record_path)
+                record.set_commit_policy(commit_interval_seconds=interval, commit_max_entries=max_entries, fsync=fsync)
+                rate = _entries_per_second(args.num_entries, record, record_path)
+                print(f"{suffix:<8} {name:<27} {rate:>12,.0f} entries/s")  # noqa: T201 # this is a command line tool
+
+
+if __name__ == "__main__":
+    main()
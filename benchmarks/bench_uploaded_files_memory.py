@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Measure the memory used to hold the set of uploaded files in memory, at 1 million and 10 million entries by default.
+
+UploadedFilesIndex (used by the TSV upload record) and the optional BloomFilter (in front of the SQLite upload record) are compared against the previous
+dict of Path objects to sets of checksum strings. The previous representation needs several GB at 10 million entries, so above --max-legacy-entries it is
+measured at that size and extrapolated linearly.
+
+Usage: python benchmarks/bench_uploaded_files_memory.py [--num-entries 1000000 10000000] [--max-legacy-entries 1000000]
+"""
+
+import argparse
+import gc
+import time
+import tracemalloc
+from collections import defaultdict
+from collections.abc import Callable
+from pathlib import Path
+
+from cloud_courier import UploadedFilesIndex
+from cloud_courier.uploaded_files_index import BloomFilter
+
+
+def _file_path(idx: int) -> str:
+    return f"C:\\ProgramData\\Instrument\\run_{idx // 1000:05d}\\plate_{idx:08d}.fcs"
+
+
+def _checksum(idx: int) -> str:
+    return f"{idx:032x}"
+
+
+def _build_legacy(num_entries: int) -> object:
+    uploaded_files: dict[Path, set[str]] = defaultdict(set)
+    for idx in range(num_entries):
+        uploaded_files[Path(_file_path(idx))].add(_checksum(idx))
+    return uploaded_files
+
+
+def _build_index(num_entries: int) -> object:
+    index = UploadedFilesIndex()
+    for idx in range(num_entries):
+        index.add(_file_path(idx), _checksum(idx))
+    return index
+
+
+def _build_bloom_filter(num_entries: int) -> object:
+    bloom_filter = BloomFilter(num_entries)
+    for idx in range(num_entries):
+        bloom_filter.add(_file_path(idx))
+    return bloom_filter
+
+
+def _measure(build: Callable[[int], object], num_entries: int) -> tuple[int, float]:
+    """Return the bytes still allocated by the built structure, and how long building it took."""
+    _ = gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    structure = build(num_entries)
+    elapsed = time.perf_counter() - start
+    allocated_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del structure
+    return allocated_bytes, elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _ = parser.add_argument("--num-entries", type=int, nargs="+", default=[1_000_000, 10_000_000])
+    _ = parser.add_argument("--max-legacy-entries", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    for num_entries in args.num_entries:
+        legacy_entries = min(num_entries, args.max_legacy_entries)
+        legacy_bytes, _ = _measure(_build_legacy, legacy_entries)
+        legacy_bytes = legacy_bytes * num_entries // legacy_entries
+        note = "" if legacy_entries == num_entries else f" (extrapolated from {legacy_entries:,})"
+        print(  # noqa: T201 # this is a command line tool
+            f"{num_entries:>12,} entries   dict[Path, set[str]]: {legacy_bytes / 2**20:>9,.0f} MiB ({legacy_bytes / num_entries:>5.0f} B/entry){note}"
+        )
+        for name, build in (("UploadedFilesIndex", _build_index), ("BloomFilter", _build_bloom_filter)):
+            allocated_bytes, elapsed = _measure(build, num_entries)
+            print(  # noqa: T201 # this is a command line tool
+                f"{num_entries:>12,} entries   {name + ':':<21} {allocated_bytes / 2**20:>9,.0f} MiB ({allocated_bytes / num_entries:>5.1f} B/entry), built in {elapsed:.1f}s"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""Drive watched folders with synthetic instrument output, and measure how quickly a MainLoop uploads it to a local S3 stand-in (e.g. localstack).
+
+Each --instrument writes into its own watched folder following a profile: how many files per second (optionally in bursts), a log-uniform distribution of file sizes,
+whether each file is written slowly in chunks, and whether it is written under a temporary name then renamed. The profiles can be adjusted with the other options.
+The MainLoop runs in this process, exactly as in the agent, with its configuration stored in SSM on the stand-in.
+
+The report gives, for each instrument and overall, the latency percentiles from the file being closed (or renamed) to its upload being verified and recorded,
+and the sustained files per second and MB per second. Files still not uploaded when the drain timeout runs out are reported as missing.
+
+Usage:
+    python benchmarks/load_generator.py [--instrument steady] [--instrument slow-large] [--duration-seconds 30] [--output results.json]
+    python benchmarks/load_generator.py --instrument bursty --burst-size 500 --files-per-second 100
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import math
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any
+from typing import NamedTuple
+from typing import override
+
+import boto3
+
+from cloud_courier import FolderToWatch
+from cloud_courier import MainLoop
+from cloud_courier.courier_config_models import SSM_PARAMETER_PREFIX
+from cloud_courier.courier_config_models import SSM_PARAMETER_PREFIX_TO_ALIASES
+
+KIB = 1024
+MIB = 1024 * KIB
+ROLE_NAME = "cloud-courier-load-generator"
+TEMP_FILE_SUFFIX = ".tmp"
+PERCENTILES = (50, 90, 95, 99)
+
+
+class InstrumentProfile(NamedTuple):
+    files_per_second: float
+    min_file_bytes: int
+    max_file_bytes: int
+    burst_size: int = 1
+    """Write this many files back to back, then pause long enough to keep to the average rate."""
+    chunk_bytes: int | None = None
+    """Write each file in chunks of this size with a pause in between, like an instrument streaming its output. None writes it all at once."""
+    seconds_between_chunks: float = 0
+    rename_from_temp: bool = False
+    """Write each file under a temporary name that is ignored, then rename it, like many acquisition programs do."""
+
+
+INSTRUMENT_PROFILES = {
+    "steady": InstrumentProfile(files_per_second=5, min_file_bytes=10 * KIB, max_file_bytes=MIB),
+    "bursty": InstrumentProfile(files_per_second=20, min_file_bytes=KIB, max_file_bytes=100 * KIB, burst_size=100),
+    "slow-large": InstrumentProfile(
+        files_per_second=0.1,
+        min_file_bytes=20 * MIB,
+        max_file_bytes=100 * MIB,
+        chunk_bytes=MIB,
+        seconds_between_chunks=0.05,
+    ),
+    "tiny-many": InstrumentProfile(files_per_second=200, min_file_bytes=100, max_file_bytes=2 * KIB),
+    "temp-rename": InstrumentProfile(
+        files_per_second=5, min_file_bytes=10 * KIB, max_file_bytes=MIB, rename_from_temp=True
+    ),
+}
+
+
+class LoadTestMainLoop(MainLoop):
+    """Record when each upload completed, after it has been verified and added to the upload record."""
+
+    def __init__(self, **kwargs: Any):  # noqa: ANN401 # passed straight through to MainLoop
+        super().__init__(**kwargs)
+        self.uploaded_at: dict[str, float] = {}
+
+    @override
+    def _upload_file(self, file_path: Path, folder_config: FolderToWatch):
+        super()._upload_file(file_path, folder_config)
+        self.uploaded_at[str(file_path)] = time.perf_counter()
+
+
+class InstrumentWriter:
+    def __init__(self, *, name: str, folder: Path, profile: InstrumentProfile, seed: int):
+        super().__init__()
+        self.name = name
+        self.folder = folder
+        self.profile = profile
+        self._random = random.Random(seed)  # only for repeatable synthetic data
+        self._block = self._random.randbytes(max(profile.chunk_bytes or 0, MIB))
+        self.closed_at: dict[str, float] = {}
+        self.file_sizes: dict[str, int] = {}
+
+    def _file_size(self) -> int:
+        log_min = math.log(self.profile.min_file_bytes)
+        log_max = math.log(self.profile.max_file_bytes)
+        return round(math.exp(self._random.uniform(log_min, log_max)))
+
+    def _write_file(self, file_path: Path, size: int) -> None:
+        chunk_bytes = self.profile.chunk_bytes or size
+        with file_path.open("wb") as f:
+            remaining = size
+            while remaining > 0:
+                chunk = self._block[: min(chunk_bytes, remaining, len(self._block))]
+                _ = f.write(chunk)
+                remaining -= len(chunk)
+                if self.profile.chunk_bytes is not None and remaining > 0:
+                    f.flush()
+                    time.sleep(self.profile.seconds_between_chunks)
+
+    def run(self, *, duration_seconds: float) -> None:
+        started_at = time.perf_counter()
+        next_burst_at = started_at
+        file_number = 0
+        while next_burst_at < started_at + duration_seconds:
+            time.sleep(max(0.0, next_burst_at - time.perf_counter()))
+            for _ in range(self.profile.burst_size):
+                file_path = self.folder / f"{self.name}_{file_number:06d}.dat"
+                file_number += 1
+                size = self._file_size()
+                if self.profile.rename_from_temp:
+                    temp_path = file_path.with_name(f"{file_path.name}{TEMP_FILE_SUFFIX}")
+                    self._write_file(temp_path, size)
+                    _ = temp_path.replace(file_path)
+                else:
+                    self._write_file(file_path, size)
+                self.closed_at[str(file_path)] = time.perf_counter()
+                self.file_sizes[str(file_path)] = size
+            next_burst_at += self.profile.burst_size / self.profile.files_per_second
+
+
+def _percentile(sorted_values: list[float], percentile: float) -> float:
+    # nearest rank, so the result is always one of the measurements
+    return sorted_values[max(0, math.ceil(percentile / 100 * len(sorted_values)) - 1)]
+
+
+def summarize(writers: list[InstrumentWriter], uploaded_at: dict[str, float]) -> dict[str, Any]:
+    closed_at = {path: closed for writer in writers for path, closed in writer.closed_at.items()}
+    file_sizes = {path: size for writer in writers for path, size in writer.file_sizes.items()}
+    uploaded = [path for path in closed_at if path in uploaded_at]
+    summary: dict[str, Any] = {
+        "files_written": len(closed_at),
+        "files_uploaded": len(uploaded),
+        "files_missing": len(closed_at) - len(uploaded),
+        "bytes_uploaded": sum(file_sizes[path] for path in uploaded),
+    }
+    if not uploaded:
+        return summary
+    latencies = sorted(uploaded_at[path] - closed_at[path] for path in uploaded)
+    summary["latency_seconds"] = {
+        **{f"p{percentile}": _percentile(latencies, percentile) for percentile in PERCENTILES},
+        "mean": statistics.fmean(latencies),
+        "max": latencies[-1],
+    }
+    elapsed = max(uploaded_at[path] for path in uploaded) - min(closed_at.values())
+    summary["files_per_second"] = len(uploaded) / elapsed
+    summary["megabytes_per_second"] = summary["bytes_uploaded"] / MIB / elapsed
+    return summary
+
+
+def _print_summary(name: str, summary: dict[str, Any]) -> None:
+    line = f"{name:<16} {summary['files_uploaded']:>7}/{summary['files_written']:<7} uploaded"
+    if "latency_seconds" in summary:
+        latency = summary["latency_seconds"]
+        line += (
+            " latency "
+            + " ".join(f"p{percentile}={latency[f'p{percentile}']:.2f}s" for percentile in PERCENTILES)
+            + f" max={latency['max']:.2f}s"
+            + f"  {summary['files_per_second']:.1f} files/s {summary['megabytes_per_second']:.2f} MB/s"
+        )
+    if summary["files_missing"]:
+        line += f"  MISSING {summary['files_missing']}"
+    print(line)  # noqa: T201 # this is a command line tool
+
+
+def _assume_role_session() -> boto3.Session:
+    # the agent finds its configuration from the name of the role it's running as, so run as a role rather than the stand-in's root user
+    credentials = boto3.client("sts").assume_role(
+        RoleArn=f"arn:aws:iam::000000000000:role/{ROLE_NAME}", RoleSessionName="load-generator"
+    )["Credentials"]
+    return boto3.Session(
+        aws_access_key_id=credentials["AccessKeyId"],
+        aws_secret_access_key=credentials["SecretAccessKey"],
+        aws_session_token=credentials["SessionToken"],
+    )
+
+
+def _store_config(boto_session: boto3.Session, folders_to_watch: dict[str, FolderToWatch]) -> list[str]:
+    ssm_client = boto_session.client("ssm")
+    parameters = {f"{SSM_PARAMETER_PREFIX_TO_ALIASES}/{ROLE_NAME}": ROLE_NAME}
+    for descriptor, folder_config in folders_to_watch.items():
+        parameters[f"{SSM_PARAMETER_PREFIX}/{ROLE_NAME}/folders/{descriptor}"] = folder_config.model_dump_json()
+    for name, value in parameters.items():
+        _ = ssm_client.put_parameter(Name=name, Value=value, Type="String", Overwrite=True)
+    return list(parameters)
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _ = parser.add_argument(
+        "--instrument",
+        action="append",
+        choices=INSTRUMENT_PROFILES.keys(),
+        help="An instrument writing into its own watched folder. Repeat to run several at once. Defaults to a single steady one.",
+    )
+    _ = parser.add_argument("--duration-seconds", type=float, default=30, help="How long the instruments keep writing.")
+    _ = parser.add_argument(
+        "--drain-timeout-seconds",
+        type=float,
+        default=120,
+        help="How long to wait after the instruments stop for the rest of the files to be uploaded.",
+    )
+    for option, value_type in (
+        ("--files-per-second", float),
+        ("--min-file-bytes", int),
+        ("--max-file-bytes", int),
+        ("--burst-size", int),
+        ("--chunk-bytes", int),
+        ("--seconds-between-chunks", float),
+    ):
+        _ = parser.add_argument(option, type=value_type, help="Override this setting of every instrument's profile.")
+    _ = parser.add_argument(
+        "--rename-from-temp", action="store_true", default=None, help="Make every instrument write then rename."
+    )
+    _ = parser.add_argument("--delay-seconds-before-upload", type=float, default=0)
+    _ = parser.add_argument("--idle-loop-sleep-seconds", type=float, default=0.05)
+    _ = parser.add_argument(
+        "--aws-profile", default="localstack", help="The AWS profile pointing at the local S3 stand-in."
+    )
+    _ = parser.add_argument("--bucket", default="cloud-courier-load-generator")
+    _ = parser.add_argument("--seed", type=int, default=0)
+    _ = parser.add_argument("--output", type=Path, help="Also write the results to this JSON file.")
+    _ = parser.add_argument(
+        "--show-logs", action="store_true", help="Show the agent's logs, which are hidden so they don't slow it down."
+    )
+    return parser.parse_args()
+
+
+def _create_instruments(
+    args: argparse.Namespace, work_dir: Path
+) -> tuple[list[InstrumentWriter], dict[str, FolderToWatch]]:
+    overrides = {field: value for field in InstrumentProfile._fields if (value := getattr(args, field)) is not None}
+    run_id = uuid.uuid4().hex[:8]
+    writers: list[InstrumentWriter] = []
+    folders_to_watch: dict[str, FolderToWatch] = {}
+    for idx, instrument in enumerate(args.instrument or ["steady"]):
+        descriptor = f"{instrument}-{idx}"
+        folder = work_dir / "instruments" / descriptor
+        folder.mkdir(parents=True)
+        writers.append(
+            InstrumentWriter(
+                name=descriptor,
+                folder=folder,
+                profile=INSTRUMENT_PROFILES[instrument]._replace(**overrides),
+                seed=args.seed + idx,
+            )
+        )
+        folders_to_watch[descriptor] = FolderToWatch(
+            folder_path=str(folder),
+            s3_key_prefix=f"load-generator/{run_id}/{descriptor}",
+            s3_bucket_name=args.bucket,
+            ignore_patterns=[f"*{TEMP_FILE_SUFFIX}"],
+            delay_seconds_before_upload=args.delay_seconds_before_upload,
+        )
+    return writers, folders_to_watch
+
+
+def _generate_load(
+    args: argparse.Namespace, boto_session: boto3.Session, writers: list[InstrumentWriter], work_dir: Path
+) -> LoadTestMainLoop:
+    """Run the agent while the instruments write, then until everything is uploaded or the drain timeout runs out."""
+    stop_flag_dir = work_dir / "stop-flags"
+    stop_flag_dir.mkdir()
+    loop = LoadTestMainLoop(
+        stop_flag_dir=str(stop_flag_dir),
+        boto_session=boto_session,
+        idle_loop_sleep_seconds=args.idle_loop_sleep_seconds,
+        previously_uploaded_files_record_path=work_dir / "record" / "previously_uploaded_files.sqlite3",
+    )
+    loop_thread = threading.Thread(target=loop.run, name="main-loop")
+    loop_thread.start()
+    _ = loop.main_loop_entered.wait(timeout=30)
+
+    writer_threads = [
+        threading.Thread(
+            target=writer.run, kwargs={"duration_seconds": args.duration_seconds}, name=f"writer-{writer.name}"
+        )
+        for writer in writers
+    ]
+    for thread in writer_threads:
+        thread.start()
+    for thread in writer_threads:
+        thread.join()
+
+    drain_deadline = time.perf_counter() + args.drain_timeout_seconds
+    num_written = sum(len(writer.closed_at) for writer in writers)
+    while loop_thread.is_alive() and time.perf_counter() < drain_deadline:
+        if sum(path in loop.uploaded_at for writer in writers for path in writer.closed_at) == num_written:
+            break
+        time.sleep(0.1)
+    (stop_flag_dir / "stop.txt").touch()
+    loop_thread.join()
+    return loop
+
+
+def main() -> int:
+    args = _parse_args()
+    if not args.show_logs:
+        # every file system event is logged, so this would otherwise measure the console
+        logging.disable(logging.CRITICAL)
+    os.environ["AWS_PROFILE"] = args.aws_profile  # so every session and client created by the agent uses the stand-in
+
+    boto_session = _assume_role_session()
+    s3_client = boto_session.client("s3")
+    with contextlib.suppress(s3_client.exceptions.BucketAlreadyOwnedByYou):
+        _ = s3_client.create_bucket(Bucket=args.bucket)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        writers, folders_to_watch = _create_instruments(args, Path(work_dir))
+        parameter_names = _store_config(boto_session, folders_to_watch)
+        try:
+            loop = _generate_load(args, boto_session, writers, Path(work_dir))
+        finally:
+            _ = boto_session.client("ssm").delete_parameters(Names=parameter_names)
+
+    results: dict[str, Any] = {
+        "instruments": {
+            writer.name: {"profile": writer.profile._asdict(), **summarize([writer], loop.uploaded_at)}
+            for writer in writers
+        },
+        "overall": summarize(writers, loop.uploaded_at),
+    }
+    for name, summary in results["instruments"].items():
+        _print_summary(name, summary)
+    _print_summary("overall", results["overall"])
+    if args.output is not None:
+        _ = args.output.write_text(json.dumps(results, indent=2))
+    return 1 if results["overall"]["files_missing"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""Run the benchmark suite for the hot paths, write the results as JSON, and optionally compare them against a stored baseline.
+
+The unit tests only check correctness, this measures speed. Nothing here needs AWS, so it runs offline.
+Covered: calculate_aws_checksum across file and part sizes, parse_upload_record, convert_path_to_s3_object_key,
+EventHandler events into the queue, and the boot-up folder scan (FolderScan, as started by MainLoop._boot_up) on a synthetic tree, both cold and with every directory unchanged.
+
+Each benchmark is run for several rounds and the median is reported. Only compare against a baseline recorded on the same computer with the same --scale,
+since the numbers depend heavily on the hardware. The exit code is 1 if any benchmark got slower than the baseline by more than --max-regression.
+
+Usage:
+    python benchmarks/run_benchmarks.py --output results.json [--scale quick|default|full] [--filter checksum]
+    python benchmarks/run_benchmarks.py --output results.json --baseline baseline.json [--max-regression 0.25]
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any
+from typing import NamedTuple
+
+import boto3
+from watchdog.events import FileClosedEvent
+
+from cloud_courier import MIN_MULTIPART_BYTES
+from cloud_courier import FileFilter
+from cloud_courier import FolderScan
+from cloud_courier import FolderToWatch
+from cloud_courier import MainLoop
+from cloud_courier import SpillingEventQueue
+from cloud_courier import calculate_aws_checksum
+from cloud_courier import convert_path_to_s3_object_key
+from cloud_courier import create_record_file
+from cloud_courier import get_version
+from cloud_courier import parse_upload_record
+from cloud_courier.main import EventHandler
+from cloud_courier.upload_record import UploadRecordEntry
+
+BENCHMARK_RESULTS_FORMAT_VERSION = 1
+FOLDER_DESCRIPTOR = "benchmark"
+KIB = 1024
+MIB = 1024 * KIB
+LARGE_RUN_OPERATIONS = 1_000_000  # runs this big take long enough that a single round is representative
+DEFAULT_MAX_REGRESSION = 0.25
+
+
+class Scale(NamedTuple):
+    rounds: int
+    checksum_file_sizes: tuple[int, ...]
+    checksum_part_sizes: tuple[int, ...]
+    record_lines: tuple[int, ...]
+    num_paths: int
+    num_events: int
+    tree_directories: int
+    tree_files_per_directory: int
+
+
+SCALES = {
+    "quick": Scale(
+        rounds=3,
+        checksum_file_sizes=(KIB, 6 * MIB),
+        checksum_part_sizes=(MIN_MULTIPART_BYTES,),
+        record_lines=(10_000,),
+        num_paths=10_000,
+        num_events=10_000,
+        tree_directories=10,
+        tree_files_per_directory=100,
+    ),
+    "default": Scale(
+        rounds=5,
+        checksum_file_sizes=(KIB, 8 * MIB, 64 * MIB),
+        checksum_part_sizes=(MIN_MULTIPART_BYTES, 16 * MIB),
+        record_lines=(10_000, 1_000_000),
+        num_paths=100_000,
+        num_events=100_000,
+        tree_directories=100,
+        tree_files_per_directory=100,
+    ),
+    "full": Scale(
+        rounds=5,
+        checksum_file_sizes=(KIB, 8 * MIB, 64 * MIB, 512 * MIB),
+        checksum_part_sizes=(MIN_MULTIPART_BYTES, 16 * MIB, 64 * MIB),
+        record_lines=(10_000, 1_000_000, 10_000_000),
+        num_paths=1_000_000,
+        num_events=100_000,
+        tree_directories=1000,
+        tree_files_per_directory=100,
+    ),
+}
+
+
+class BenchmarkResult(NamedTuple):
+    name: str
+    operations: int
+    """The number of operations (bytes, lines, paths, events or files) in each round."""
+    unit: str
+    rounds: int
+    min_seconds: float
+    median_seconds: float
+
+    @property
+    def operations_per_second(self) -> float:
+        return self.operations / self.median_seconds
+
+    def to_json(self) -> dict[str, Any]:
+        return {**self._asdict(), "operations_per_second": self.operations_per_second}
+
+
+def _size_label(num_bytes: int) -> str:
+    if num_bytes >= MIB:
+        return f"{num_bytes // MIB}MiB"
+    return f"{num_bytes // KIB}KiB"
+
+
+def _time(run: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    _ = run()
+    return time.perf_counter() - start
+
+
+def _rounds(scale: Scale, operations: int) -> int:
+    return 1 if operations >= LARGE_RUN_OPERATIONS else scale.rounds
+
+
+def _result(name: str, *, operations: int, unit: str, durations: list[float]) -> BenchmarkResult:
+    return BenchmarkResult(name, operations, unit, len(durations), min(durations), statistics.median(durations))
+
+
+def _create_loop(work_dir: Path, folder_config: FolderToWatch, max_in_memory: int) -> MainLoop:
+    loop = MainLoop(
+        stop_flag_dir=str(work_dir),
+        boto_session=boto3.Session(region_name="us-east-1"),
+        idle_loop_sleep_seconds=0,
+        previously_uploaded_files_record_path=work_dir / "record.sqlite3",
+    )
+    loop.file_system_events = SpillingEventQueue(spill_file_path=work_dir / "spill.jsonl", max_in_memory=max_in_memory)
+    loop.watched_folders[FOLDER_DESCRIPTOR] = folder_config
+    return loop
+
+
+def _close_loop(loop: MainLoop) -> None:
+    loop.file_system_events.close()
+    loop.work_journal.close()
+    loop.uploaded_files.close()
+
+
+def bench_calculate_aws_checksum(scale: Scale, work_dir: Path) -> Iterator[BenchmarkResult]:
+    for file_size in scale.checksum_file_sizes:
+        file_path = work_dir / f"checksum-{file_size}.bin"
+        chunk = os.urandom(min(file_size, MIB))
+        with file_path.open("wb") as f:
+            for _ in range(file_size // len(chunk)):
+                _ = f.write(chunk)
+        for part_size in scale.checksum_part_sizes:
+            durations = [
+                _time(lambda file_path=file_path, part_size=part_size: calculate_aws_checksum(file_path, part_size))
+                for _ in range(scale.rounds)
+            ]
+            yield _result(
+                f"calculate_aws_checksum[{_size_label(file_size)},part={_size_label(part_size)}]",
+                operations=file_size,
+                unit="bytes",
+                durations=durations,
+            )
+        file_path.unlink()
+
+
+def bench_parse_upload_record(scale: Scale, work_dir: Path) -> Iterator[BenchmarkResult]:
+    for num_lines in scale.record_lines:
+        record_path = work_dir / f"record-{num_lines}.tsv"
+        create_record_file(record_path)
+        with record_path.open("a") as f:
+            f.writelines(
+                UploadRecordEntry(
+                    f"/data/instrument/run{idx // 1000}/plate_{idx}.fcs",
+                    f"s3://bucket/instrument/run{idx // 1000}/plate_{idx}.fcs",
+                    f"{idx:032x}",
+                    idx,
+                    1_700_000_000_000_000_000 + idx,
+                ).to_tsv_line()
+                for idx in range(num_lines)
+            )
+        durations = [
+            _time(lambda record_path=record_path: parse_upload_record(record_path))
+            for _ in range(_rounds(scale, num_lines))
+        ]
+        yield _result(f"parse_upload_record[{num_lines}]", operations=num_lines, unit="lines", durations=durations)
+        record_path.unlink()
+
+
+def bench_convert_path_to_s3_object_key(scale: Scale, work_dir: Path) -> Iterator[BenchmarkResult]:  # noqa: ARG001 # no files are needed, but every benchmark has the same signature
+    folder_config = FolderToWatch(folder_path="C:\\data", s3_key_prefix="instrument", s3_bucket_name="bucket")
+    paths = [f"C:\\data\\run {idx // 1000}\\plate_{idx}.fcs" for idx in range(scale.num_paths)]
+
+    def convert():
+        for path in paths:
+            _ = convert_path_to_s3_object_key(path, folder_config)
+
+    durations = [_time(convert) for _ in range(_rounds(scale, scale.num_paths))]
+    yield _result("convert_path_to_s3_object_key", operations=scale.num_paths, unit="paths", durations=durations)
+
+
+def bench_event_handler(scale: Scale, work_dir: Path) -> Iterator[BenchmarkResult]:
+    """Events go through the filter, are journaled and queued, exactly as for real file system events (the watchdog observer itself isn't included)."""
+    folder_config = FolderToWatch(folder_path="/benchmark", s3_key_prefix="prefix", s3_bucket_name="bucket")
+    events = [FileClosedEvent(src_path=f"/benchmark/{idx}.txt") for idx in range(scale.num_events)]
+    durations: list[float] = []
+    for round_idx in range(scale.rounds):
+        round_dir = work_dir / f"event-handler-{round_idx}"
+        round_dir.mkdir()
+        loop = _create_loop(round_dir, folder_config, max_in_memory=scale.num_events)
+        handler = EventHandler(
+            folder_descriptor=FOLDER_DESCRIPTOR,
+            file_filter=FileFilter(folder_config),
+            enqueue=loop._enqueue_file,  # noqa: SLF001 # benchmarking the private method directly
+        )
+
+        def handle(handler: EventHandler = handler):
+            for event in events:
+                handler.on_closed(event)
+
+        durations.append(_time(handle))
+        _close_loop(loop)
+    yield _result("event_handler_to_queue", operations=scale.num_events, unit="events", durations=durations)
+
+
+def _create_tree(root: Path, scale: Scale) -> int:
+    for directory_idx in range(scale.tree_directories):
+        directory = root / f"run{directory_idx // 10}" / f"plate{directory_idx}"
+        directory.mkdir(parents=True)
+        for file_idx in range(scale.tree_files_per_directory):
+            (directory / f"well_{file_idx}.fcs").touch()
+    return scale.tree_directories * scale.tree_files_per_directory
+
+
+def _run_scan(loop: MainLoop, folder_config: FolderToWatch) -> None:
+    scan = FolderScan(
+        descriptor=FOLDER_DESCRIPTOR,
+        folder_config=folder_config,
+        file_filter=FileFilter(folder_config),
+        is_already_uploaded=lambda file_path: loop._is_uploaded_and_unchanged(file_path, folder_config),  # noqa: SLF001 # benchmarking the same callbacks that MainLoop uses
+        enqueue=loop._enqueue_file,  # noqa: SLF001 # benchmarking the same callbacks that MainLoop uses
+        work_journal=loop.work_journal,
+    )
+    scan.start()
+    scan.join()
+    loop.work_journal.flush()
+
+
+def bench_folder_scan(scale: Scale, work_dir: Path) -> Iterator[BenchmarkResult]:
+    """Scan the tree the way MainLoop._boot_up does (without AWS), first from an empty work journal and then again with every directory unchanged."""
+    tree_dir = work_dir / "tree"
+    num_files = _create_tree(tree_dir, scale)
+    folder_config = FolderToWatch(
+        folder_path=str(tree_dir), s3_key_prefix="prefix", s3_bucket_name="bucket", recursive=True
+    )
+    cold_durations: list[float] = []
+    unchanged_durations: list[float] = []
+    for round_idx in range(scale.rounds):
+        round_dir = work_dir / f"folder-scan-{round_idx}"
+        round_dir.mkdir()
+        loop = _create_loop(round_dir, folder_config, max_in_memory=2 * num_files)
+        loop.work_journal.start_folder(FOLDER_DESCRIPTOR, folder_config.model_dump_json())
+        cold_durations.append(_time(lambda loop=loop: _run_scan(loop, folder_config)))
+        unchanged_durations.append(_time(lambda loop=loop: _run_scan(loop, folder_config)))
+        _close_loop(loop)
+    yield _result(f"folder_scan[cold,{num_files}]", operations=num_files, unit="files", durations=cold_durations)
+    yield _result(
+        f"folder_scan[unchanged,{num_files}]", operations=num_files, unit="files", durations=unchanged_durations
+    )
+
+
+BENCHMARKS = (
+    bench_calculate_aws_checksum,
+    bench_parse_upload_record,
+    bench_convert_path_to_s3_object_key,
+    bench_event_handler,
+    bench_folder_scan,
+)
+
+
+def compare_to_baseline(
+    results: list[BenchmarkResult], baseline: dict[str, Any], *, max_regression: float
+) -> list[str]:
+    """Print how each result changed since the baseline, and return the names of those that slowed down by more than max_regression (e.g. 0.25 for 25%)."""
+    baseline_medians = {result["name"]: result["median_seconds"] for result in baseline["results"]}
+    regressions: list[str] = []
+    for result in results:
+        baseline_median = baseline_medians.get(result.name)
+        if baseline_median is None:
+            print(f"{result.name:<60} new, no baseline")  # noqa: T201 # this is a command line tool
+            continue
+        change = result.median_seconds / baseline_median - 1
+        is_regression = change > max_regression
+        if is_regression:
+            regressions.append(result.name)
+        print(  # noqa: T201 # this is a command line tool
+            f"{result.name:<60} {baseline_median:>10.4f}s -> {result.median_seconds:>10.4f}s {change:>+8.1%}{'  REGRESSION' if is_regression else ''}"
+        )
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _ = parser.add_argument("--output", type=Path, required=True, help="Write the results to this JSON file.")
+    _ = parser.add_argument("--scale", choices=SCALES.keys(), default="default")
+    _ = parser.add_argument("--filter", help="Only run the benchmarks whose function name contains this.")
+    _ = parser.add_argument("--baseline", type=Path, help="Compare the results against this earlier JSON output.")
+    _ = parser.add_argument("--max-regression", type=float, default=DEFAULT_MAX_REGRESSION)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)  # the per-file log messages would otherwise dominate the measurement
+    scale = SCALES[args.scale]
+
+    results: list[BenchmarkResult] = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for benchmark in BENCHMARKS:
+            if args.filter is not None and args.filter not in benchmark.__name__:
+                continue
+            for result in benchmark(scale, Path(work_dir)):
+                print(  # noqa: T201 # this is a command line tool
+                    f"{result.name:<60} {result.median_seconds:>10.4f}s {result.operations_per_second:>16,.0f} {result.unit}/s"
+                )
+                results.append(result)
+
+    _ = args.output.write_text(
+        json.dumps(
+            {
+                "format_version": BENCHMARK_RESULTS_FORMAT_VERSION,
+                "created_at": datetime.datetime.now(tz=datetime.UTC).isoformat(),
+                "cloud_courier_version": get_version(),
+                "python_version": sys.version,
+                "platform": platform.platform(),
+                "scale": args.scale,
+                "results": [result.to_json() for result in results],
+            },
+            indent=2,
+        )
+    )
+    if args.baseline is None:
+        return 0
+    baseline = json.loads(args.baseline.read_text())
+    if baseline["scale"] != args.scale:
+        print(f"The baseline was run with --scale {baseline['scale']}, so it can't be compared")  # noqa: T201 # this is a command line tool
+        return 2
+    print(f"\nCompared to the baseline from {baseline['created_at']}:")  # noqa: T201 # this is a command line tool
+    regressions = compare_to_baseline(results, baseline, max_regression=args.max_regression)
+    if regressions:
+        print(f"\n{len(regressions)} benchmarks regressed by more than {args.max_regression:.0%}")  # noqa: T201 # this is a command line tool
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
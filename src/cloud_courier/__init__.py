@@ -1,30 +1,146 @@
-from . import aws_credentials
-from . import load_config
-from . import main
-from . import upload
-from .aws_credentials import get_role_arn
-from .aws_credentials import path_to_aws_credentials
-from .aws_credentials import read_aws_creds
-from .cli import get_version
-from .courier_config_models import CLOUDWATCH_HEARTBEAT_NAMESPACE
-from .courier_config_models import CLOUDWATCH_INSTANCE_ID_DIMENSION_NAME
-from .courier_config_models import HEARTBEAT_METRIC_NAME
-from .courier_config_models import AppConfig
-from .courier_config_models import FolderToWatch
-from .load_config import CourierConfig
-from .load_config import extract_role_name_from_arn
-from .load_config import load_config_from_aws
-from .main import INSTALLED_AGENT_VERSION_TAG_KEY
-from .main import RESET_POINT_FOR_LOOP_ITERATION_COUNTER
-from .main import MainLoop
-from .main import add_to_upload_record
-from .main import create_record_file
-from .main import entrypoint
-from .main import parse_upload_record
-from .upload import MIN_MULTIPART_BYTES
-from .upload import ChecksumMismatchError
-from .upload import calculate_aws_checksum
-from .upload import convert_path_to_s3_object_key
-from .upload import convert_path_to_s3_object_tag
-from .upload import dummy_function_during_multipart_upload
-from .upload import upload_to_s3
+import importlib
+from typing import TYPE_CHECKING
+from typing import Any
+
+from . import startup_timer  # first, so its clock starts before anything else is imported
+from .startup_timer import StartupTimer
+
+if TYPE_CHECKING:
+    from . import aws_credentials
+    from . import cli
+    from . import config_snapshot
+    from . import connectivity
+    from . import courier_config_models
+    from . import event_queue
+    from . import file_event
+    from . import file_filter
+    from . import folder_scan
+    from . import liveness
+    from . import load_config
+    from . import log_shipping
+    from . import logger_config
+    from . import main
+    from . import metrics
+    from . import periodic_tasks
+    from . import profiling
+    from . import status_server
+    from . import system_load
+    from . import upload
+    from . import upload_record
+    from . import upload_scheduler
+    from . import uploaded_files_index
+    from . import work_journal
+    from .aws_credentials import get_role_arn
+    from .aws_credentials import path_to_aws_credentials
+    from .aws_credentials import read_aws_creds
+    from .cli import get_version
+    from .config_snapshot import load_config_snapshot
+    from .config_snapshot import save_config_snapshot
+    from .connectivity import ConnectivityMonitor
+    from .courier_config_models import CLOUDWATCH_HEARTBEAT_NAMESPACE
+    from .courier_config_models import CLOUDWATCH_INSTANCE_ID_DIMENSION_NAME
+    from .courier_config_models import HEARTBEAT_METRIC_NAME
+    from .courier_config_models import AppConfig
+    from .courier_config_models import FolderToWatch
+    from .courier_config_models import PauseWindow
+    from .event_queue import SpillingEventQueue
+    from .file_event import FileEvent
+    from .file_filter import FileFilter
+    from .folder_scan import FolderScan
+    from .liveness import PipelineLiveness
+    from .load_config import CourierConfig
+    from .load_config import diff_folders_to_watch
+    from .load_config import extract_role_name_from_arn
+    from .load_config import load_config_from_aws
+    from .log_shipping import LogShipper
+    from .logger_config import configure_logging
+    from .main import INSTALLED_AGENT_VERSION_TAG_KEY
+    from .main import RESET_POINT_FOR_LOOP_ITERATION_COUNTER
+    from .main import MainLoop
+    from .main import entrypoint
+    from .metrics import MetricsAggregator
+    from .periodic_tasks import PeriodicTaskThread
+    from .profiling import Profiler
+    from .status_server import StatusServer
+    from .upload import MIN_MULTIPART_BYTES
+    from .upload import ChecksumMismatchError
+    from .upload import calculate_aws_checksum
+    from .upload import convert_path_to_s3_object_key
+    from .upload import convert_path_to_s3_object_tag
+    from .upload import dummy_function_during_multipart_upload
+    from .upload import upload_to_s3
+    from .upload_record import UploadRecord
+    from .upload_record import add_to_upload_record
+    from .upload_record import create_record_file
+    from .upload_record import open_upload_record
+    from .upload_record import parse_upload_record
+    from .upload_scheduler import UploadScheduler
+    from .uploaded_files_index import UploadedFilesIndex
+    from .work_journal import WorkJournal
+
+# Everything the package exports, by the submodule it's defined in, which the imports above must match (a unit test checks they do).
+# Those imports are only for type checkers. At runtime each submodule (along with its dependencies, like boto3, pydantic and watchdog)
+# is imported the first time it or one of its names is used, so quick commands like --version don't pay for importing all of them.
+_EXPORTS_BY_SUBMODULE: dict[str, tuple[str, ...]] = {
+    "aws_credentials": ("get_role_arn", "path_to_aws_credentials", "read_aws_creds"),
+    "cli": ("get_version",),
+    "config_snapshot": ("load_config_snapshot", "save_config_snapshot"),
+    "connectivity": ("ConnectivityMonitor",),
+    "courier_config_models": (
+        "CLOUDWATCH_HEARTBEAT_NAMESPACE",
+        "CLOUDWATCH_INSTANCE_ID_DIMENSION_NAME",
+        "HEARTBEAT_METRIC_NAME",
+        "AppConfig",
+        "FolderToWatch",
+        "PauseWindow",
+    ),
+    "event_queue": ("SpillingEventQueue",),
+    "file_event": ("FileEvent",),
+    "file_filter": ("FileFilter",),
+    "folder_scan": ("FolderScan",),
+    "liveness": ("PipelineLiveness",),
+    "load_config": ("CourierConfig", "diff_folders_to_watch", "extract_role_name_from_arn", "load_config_from_aws"),
+    "log_shipping": ("LogShipper",),
+    "logger_config": ("configure_logging",),
+    "main": ("INSTALLED_AGENT_VERSION_TAG_KEY", "RESET_POINT_FOR_LOOP_ITERATION_COUNTER", "MainLoop", "entrypoint"),
+    "metrics": ("MetricsAggregator",),
+    "periodic_tasks": ("PeriodicTaskThread",),
+    "profiling": ("Profiler",),
+    "status_server": ("StatusServer",),
+    "system_load": (),
+    "upload": (
+        "MIN_MULTIPART_BYTES",
+        "ChecksumMismatchError",
+        "calculate_aws_checksum",
+        "convert_path_to_s3_object_key",
+        "convert_path_to_s3_object_tag",
+        "dummy_function_during_multipart_upload",
+        "upload_to_s3",
+    ),
+    "upload_record": (
+        "UploadRecord",
+        "add_to_upload_record",
+        "create_record_file",
+        "open_upload_record",
+        "parse_upload_record",
+    ),
+    "upload_scheduler": ("UploadScheduler",),
+    "uploaded_files_index": ("UploadedFilesIndex",),
+    "work_journal": ("WorkJournal",),
+}
+_SUBMODULE_BY_EXPORT = {name: submodule for submodule, names in _EXPORTS_BY_SUBMODULE.items() for name in names}
+
+
+def __getattr__(name: str) -> Any:  # noqa: ANN401 # it's any of the exported names
+    if name in _EXPORTS_BY_SUBMODULE:
+        return importlib.import_module(f".{name}", __name__)
+    submodule = _SUBMODULE_BY_EXPORT.get(name)
+    if submodule is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")  # noqa: TRY003 # the same message as for any other missing module attribute
+    value = getattr(importlib.import_module(f".{submodule}", __name__), name)
+    globals()[name] = value  # so it's only looked up the first time
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted({*globals(), *_EXPORTS_BY_SUBMODULE, *_SUBMODULE_BY_EXPORT})
@@ -1,13 +1,21 @@
 import configparser
 import datetime
+import functools
 import logging
 import os
 from pathlib import Path
+from typing import Self
 from typing import TypedDict
+from typing import override
 
 import boto3
 import botocore.session
+from botocore.config import Config
 from botocore.credentials import RefreshableCredentials
+from watchdog.events import FileDeletedEvent
+from watchdog.events import FileSystemEvent
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers.api import BaseObserver
 
 logger = logging.getLogger(__name__)
 
@@ -30,21 +38,28 @@ def path_to_aws_credentials() -> Path:
     )
 
 
-def read_aws_creds() -> AwsCredentialsMetadata:
+@functools.lru_cache(maxsize=1)
+def _parse_creds_file(creds_path: Path, contents: str) -> tuple[str, str, str]:
     config = configparser.ConfigParser()
-    creds_path = path_to_aws_credentials()
     logger.debug(f'Attempting to read AWS credentials from "{creds_path}"')
-    # TODO: raise an error if file not found...apparently ConfigParser doesn't do that by default
-    _ = config.read(creds_path)
+    config.read_string(contents, source=str(creds_path))
     try:
         creds = config["default"]
     except KeyError:  # pragma: no cover # This is just an extra log message, not worth explicitly testing
         logger.exception(f'Error attempting to read AWS credentials from "{creds_path}".')
         raise
+    return creds["aws_access_key_id"], creds["aws_secret_access_key"], creds["aws_session_token"]
 
-    access_key = creds["aws_access_key_id"]
-    secret_key = creds["aws_secret_access_key"]
-    token = creds["aws_session_token"]
+
+def read_aws_creds() -> AwsCredentialsMetadata:
+    """Read the credentials the SSM agent wrote to its credentials file.
+
+    Parsing is cached on the contents of the file (rather than its modification time, which a rewrite within the timestamp resolution can leave unchanged),
+    so the frequent checks (from botocore and the credentials file watcher) stay cheap.
+    """
+    creds_path = path_to_aws_credentials()
+    contents = creds_path.read_text()  # unlike ConfigParser.read, this raises an error if the file doesn't exist
+    access_key, secret_key, token = _parse_creds_file(creds_path, contents)
     # According to this, credentials are rotated every 30 minutes, so set the expiry to 25 https://github.com/aws/amazon-ssm-agent/issues/570
     expiry_time = (datetime.datetime.now(tz=datetime.UTC) + datetime.timedelta(minutes=25)).strftime(
         "%Y-%m-%dT%H:%M:%SZ"
@@ -53,21 +68,91 @@ def read_aws_creds() -> AwsCredentialsMetadata:
     return AwsCredentialsMetadata(access_key=access_key, secret_key=secret_key, token=token, expiry_time=expiry_time)
 
 
-def refresh_credentials() -> (  # pragma: no cover # This is a callback function that I'm not sure exactly how to test. But the underlying read_aws_creds() is tested
-    AwsCredentialsMetadata
-):
+def refresh_credentials() -> AwsCredentialsMetadata:
     logger.info("Refreshing AWS credentials")
     return read_aws_creds()
 
 
-def create_boto_session(aws_region: str) -> boto3.Session:
-    initial_credentials = read_aws_creds()
-
-    refreshable_creds = RefreshableCredentials.create_from_metadata(
-        metadata=initial_credentials,  # type: ignore[reportArgumentType] # pyright thinks this should accept dict[str, Any] ... but it seems like the TypedDict should be a valid subset of that
-        refresh_using=refresh_credentials,
-        method="custom-refresh",
+class SsmAgentCredentials(RefreshableCredentials):
+    """Credentials from the file the SSM agent keeps rotating, which botocore reads again shortly before the assumed expiry time.
+
+    They can also be refreshed on demand, as soon as the file changes or a request is rejected because they expired.
+    Every client created from the session shares this object, so they all pick up the refreshed credentials.
+    """
+
+    _rotated = False
+
+    @classmethod
+    def from_credentials_file(cls) -> Self:
+        def refresh_using() -> AwsCredentialsMetadata:
+            # cleared before reading, so if the file can't be read the current credentials keep being used, rather than every request failing
+            credentials._rotated = False  # noqa: SLF001 # the refresh callback is part of the credentials
+            return refresh_credentials()
+
+        credentials = cls.create_from_metadata(
+            metadata=read_aws_creds(),  # type: ignore[reportArgumentType] # pyright thinks this should accept dict[str, Any] ... but it seems like the TypedDict should be a valid subset of that
+            refresh_using=refresh_using,
+            method="custom-refresh",
+        )
+        return credentials
+
+    @override
+    def refresh_needed(self, refresh_in: int | None = None) -> bool:
+        return self._rotated or super().refresh_needed(refresh_in)
+
+    def refresh_now(self) -> None:
+        self._rotated = True
+        _ = self.get_frozen_credentials()  # refreshes them, since they're now due for a refresh
+
+
+class CredentialsFileEventHandler(FileSystemEventHandler):
+    """Refresh the credentials as soon as the SSM agent rotates them, instead of waiting for the assumed expiry time."""
+
+    def __init__(self, *, credentials: SsmAgentCredentials, creds_path: Path):
+        super().__init__()
+        self._credentials = credentials
+        self._creds_path = creds_path
+
+    @override
+    def on_any_event(self, event: FileSystemEvent) -> None:
+        if event.is_directory or isinstance(event, FileDeletedEvent):
+            return
+        changed_paths = {Path(os.fsdecode(event.src_path)), Path(os.fsdecode(event.dest_path))}
+        if self._creds_path not in changed_paths:
+            return
+        try:
+            self._credentials.refresh_now()
+        except Exception:
+            # e.g. it was read part way through being written, and there'll be another event once the write is done
+            logger.exception("Failed to refresh the AWS credentials after their file changed")
+
+
+def watch_credentials_file(session: boto3.Session, observer: BaseObserver) -> bool:
+    """Have the observer refresh the session's credentials whenever the SSM agent rewrites their file, returning whether they come from that file."""
+    credentials = session.get_credentials()
+    if not isinstance(credentials, SsmAgentCredentials):
+        return False  # e.g. a generic boto session, whose credentials botocore refreshes itself
+    creds_path = path_to_aws_credentials()
+    logger.info(f'Watching "{creds_path}" so the AWS credentials are refreshed as soon as they are rotated')
+    _ = observer.schedule(
+        CredentialsFileEventHandler(credentials=credentials, creds_path=creds_path),
+        str(creds_path.parent),
+        recursive=False,
     )
+    return True
+
+
+def refresh_session_credentials(session: boto3.Session) -> bool:
+    """Read the credentials file again straight away, returning whether the session's credentials come from it (otherwise botocore refreshes them itself)."""
+    credentials = session.get_credentials()
+    if not isinstance(credentials, SsmAgentCredentials):
+        return False
+    credentials.refresh_now()
+    return True
+
+
+def create_boto_session(aws_region: str) -> boto3.Session:
+    refreshable_creds = SsmAgentCredentials.from_credentials_file()
 
     botocore_session = botocore.session.get_session()
     botocore_session._credentials = refreshable_creds  # type:ignore[reportAttributeAccessIssue] # noqa: SLF001 # assigning directly to the private variable is the recommended approach for refreshable credentials. # pyright thinks this should accept dict[str, Any] ... but it seems like the TypedDict should be a valid subset of that
@@ -75,6 +160,6 @@ def create_boto_session(aws_region: str) -> boto3.Session:
     return boto3.Session(botocore_session=botocore_session)
 
 
-def get_role_arn(session: boto3.Session) -> str:
-    sts_client = session.client("sts")
+def get_role_arn(session: boto3.Session, *, client_config: Config | None = None) -> str:
+    sts_client = session.client("sts", config=client_config)
     return sts_client.get_caller_identity()["Arn"]
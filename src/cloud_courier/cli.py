@@ -1,6 +1,14 @@
 import argparse
+import contextlib
+from collections.abc import Sequence
 from importlib.metadata import version
 
+from .profiling import DEFAULT_PROFILING_DUMP_INTERVAL_SECONDS
+from .profiling import PROFILING_CONTROL_FILE_NAME
+from .status_server import DEFAULT_STATUS_ADDRESS
+
+INFORMATIONAL_ARGS = frozenset(("--version", "--help", "-h"))
+
 
 def get_version() -> str:
     return f"v{version('cloud-courier')}"
@@ -23,7 +31,7 @@ _ = parser.add_argument(
 _ = parser.add_argument(
     "--shut-down-before-main-loop",
     action="store_true",
-    help="Shut down the system before entering the main loop. Useful for unit testing.",
+    help="Check that AWS can be reached (by looking up the role of the credentials), then shut down before loading the configuration or entering the main loop. Useful for testing.",
 )
 _ = parser.add_argument(
     "--use-generic-boto-session",
@@ -49,3 +57,53 @@ _ = parser.add_argument(
     action="store_true",
     help="Suppress console logging. Useful for some SSM Run commands.",
 )
+_ = parser.add_argument(
+    "--synchronous-logging",
+    action="store_true",
+    help="Write each log entry before carrying on, instead of on a background thread. Slower, but nothing is lost if the process is killed. Useful when debugging crashes.",
+)
+_ = parser.add_argument(
+    "--export-upload-record",
+    type=str,
+    help="Write the record of previously uploaded files to this TSV file and then exit.",
+)
+_ = parser.add_argument(
+    "--import-upload-record",
+    type=str,
+    help="Add the entries in this TSV file to the record of previously uploaded files and then exit. Applied before any export.",
+)
+_ = parser.add_argument(
+    "--status-port",
+    type=int,
+    help="Serve the live status on this port, as Prometheus metrics at /metrics and a JSON document at /status. Not served unless set.",
+)
+_ = parser.add_argument(
+    "--status-address",
+    type=str,
+    default=DEFAULT_STATUS_ADDRESS,
+    help="The address to serve the status on. The default only allows connections from this computer, use 0.0.0.0 to allow scraping from the LAN.",
+)
+_ = parser.add_argument(
+    "--profile",
+    action="store_true",
+    help=f"Profile the agent for the whole run, writing CPU stack samples, memory allocations and stage timings to the 'profiles' folder inside the log folder. Profiling can also be turned on and off while the agent runs by creating and deleting a file named '{PROFILING_CONTROL_FILE_NAME}' in the log folder.",
+)
+_ = parser.add_argument(
+    "--profiling-dump-interval-seconds",
+    type=float,
+    default=DEFAULT_PROFILING_DUMP_INTERVAL_SECONDS,
+    help="While profiling, how often to write out what was collected.",
+)
+
+
+def handle_informational_args(argv: Sequence[str]) -> None:
+    """Print the version or the help and exit, if either was asked for.
+
+    The executable calls this before importing the rest of the agent, so that version checks run across the fleet don't pay for importing boto3, pydantic and watchdog.
+    """
+    if INFORMATIONAL_ARGS.isdisjoint(argv):
+        return
+    with contextlib.suppress(
+        argparse.ArgumentError
+    ):  # any error is reported when the arguments are parsed again by the entrypoint
+        _ = parser.parse_known_args(argv)
@@ -0,0 +1,36 @@
+import logging
+import os
+from pathlib import Path
+
+from pydantic import ValidationError
+
+from .load_config import CourierConfig
+
+logger = logging.getLogger(__name__)
+
+
+def save_config_snapshot(config: CourierConfig, snapshot_path: Path) -> None:
+    """Write the configuration, including the versions of the SSM parameters it was loaded from, so the next boot can start from it.
+
+    It's written to a temporary file that then replaces the previous snapshot, so a crash part way through never leaves a truncated snapshot behind.
+    """
+    snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = snapshot_path.with_name(f"{snapshot_path.name}.tmp")
+    with temporary_path.open("w", encoding="utf-8") as file:
+        _ = file.write(config.model_dump_json())
+        file.flush()
+        os.fsync(file.fileno())
+    _ = temporary_path.replace(snapshot_path)
+
+
+def load_config_snapshot(snapshot_path: Path) -> CourierConfig | None:
+    """Read the last configuration that was successfully loaded from SSM, or None if there isn't a usable one."""
+    try:
+        snapshot = snapshot_path.read_text(encoding="utf-8")
+    except FileNotFoundError:
+        return None
+    try:
+        return CourierConfig.model_validate_json(snapshot)
+    except ValidationError:
+        logger.exception(f"Ignoring the configuration snapshot {snapshot_path} because it is not valid")
+        return None
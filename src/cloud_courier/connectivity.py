@@ -0,0 +1,120 @@
+import contextlib
+import logging
+import threading
+import time
+from collections.abc import Callable
+from collections.abc import Generator
+
+from botocore.config import Config
+from botocore.exceptions import ConnectionError as BotocoreConnectionError
+from botocore.exceptions import ReadTimeoutError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROBE_INITIAL_BACKOFF_SECONDS = 5.0
+DEFAULT_PROBE_MAX_BACKOFF_SECONDS = 300.0
+# the probe only needs to find out whether AWS can be reached, so it gives up quickly rather than waiting out botocore's default timeouts and retries
+CONNECTIVITY_PROBE_CLIENT_CONFIG = Config(connect_timeout=5, read_timeout=5, retries={"max_attempts": 1})
+# botocore's ConnectionError covers failing to resolve or connect to the endpoint (including connect timeouts) and the connection being dropped
+_CONNECTIVITY_ERROR_TYPES = (BotocoreConnectionError, ReadTimeoutError)
+
+
+def is_connectivity_error(error: BaseException) -> bool:
+    """Whether the error (or anything in the chain of errors that caused it) means AWS couldn't be reached, as opposed to AWS rejecting the request."""
+    current: BaseException | None = error
+    while current is not None:
+        if isinstance(current, _CONNECTIVITY_ERROR_TYPES):
+            return True
+        current = current.__cause__ or current.__context__
+    return False
+
+
+class ConnectivityMonitor:
+    """Track whether AWS can be reached, so an outage pauses uploads instead of failing (and crashing on) every one of them.
+
+    Anything that fails for lack of connectivity reports it, which switches to offline. While offline the queued files stay in the queue and the work journal,
+    and the probe (a single cheap API call) is tried with exponential backoff. Once it succeeds the agent is back online and uploads resume straight away.
+    """
+
+    def __init__(
+        self,
+        *,
+        probe: Callable[[], object],
+        clock: Callable[[], float] = time.monotonic,
+        initial_backoff_seconds: float = DEFAULT_PROBE_INITIAL_BACKOFF_SECONDS,
+        max_backoff_seconds: float = DEFAULT_PROBE_MAX_BACKOFF_SECONDS,
+    ):
+        super().__init__()
+        self._probe = probe
+        self._clock = clock
+        self._initial_backoff_seconds = initial_backoff_seconds
+        self._max_backoff_seconds = max_backoff_seconds
+        self._lock = threading.Lock()
+        self._offline_since: float | None = None
+        self._backoff_seconds = initial_backoff_seconds
+        self._next_probe_at = 0.0
+        self._seconds_offline_before_current_outage = 0.0
+
+    @property
+    def is_online(self) -> bool:
+        with self._lock:
+            return self._offline_since is None
+
+    def seconds_offline(self) -> float:
+        """Return the total time spent offline since the agent started, including the current outage."""
+        now = self._clock()
+        with self._lock:
+            current_outage_seconds = 0.0 if self._offline_since is None else now - self._offline_since
+            return self._seconds_offline_before_current_outage + current_outage_seconds
+
+    def report_failure(self, error: BaseException) -> None:
+        now = self._clock()
+        with self._lock:
+            if self._offline_since is not None:
+                return
+            self._offline_since = now
+            self._backoff_seconds = self._initial_backoff_seconds
+            self._next_probe_at = now + self._backoff_seconds
+        logger.warning(
+            f"Going offline because AWS could not be reached ({error!r}), uploads are paused until it can be"
+        )
+
+    @contextlib.contextmanager
+    def detect_outage(self) -> Generator[None]:
+        """Report a failure for lack of connectivity in the block (without raising it any further), while any other error is raised as usual."""
+        try:
+            yield
+        except Exception as e:
+            if not is_connectivity_error(e):
+                raise
+            self.report_failure(e)
+
+    def check(self) -> bool:
+        """Return whether AWS can be reached, probing it first if offline and the backoff has elapsed."""
+        now = self._clock()
+        with self._lock:
+            if self._offline_since is None:
+                return True
+            if now < self._next_probe_at:
+                return False
+        try:
+            _ = self._probe()
+        except Exception as e:  # noqa: BLE001 # whatever the probe raises, all that matters is whether it got an answer from AWS
+            if is_connectivity_error(e):
+                with self._lock:
+                    self._backoff_seconds = min(self._backoff_seconds * 2, self._max_backoff_seconds)
+                    self._next_probe_at = self._clock() + self._backoff_seconds
+                    backoff_seconds = self._backoff_seconds
+                logger.info(f"AWS still could not be reached, probing again in {backoff_seconds:.0f} seconds")
+                return False
+            # AWS answered, even if it was to reject the request, so the connection itself is back
+            logger.warning(f"The connectivity probe reached AWS but failed: {e!r}")
+        with self._lock:
+            assert self._offline_since is not None, (
+                "Only the main loop probes, so nothing else can have come back online"
+            )
+            outage_seconds = self._clock() - self._offline_since
+            self._seconds_offline_before_current_outage += outage_seconds
+            self._offline_since = None
+        logger.info(f"Back online after {outage_seconds:.1f} seconds, resuming uploads")
+        return True
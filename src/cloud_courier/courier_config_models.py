@@ -1,45 +1,113 @@
 """Models for the Cloud Courier configuration which are shared between the application and infrastructure code."""
 
+import datetime
+from typing import Literal
+
 from pydantic import BaseModel
 from pydantic import Field
 
 SSM_PARAMETER_PREFIX = "/cloud-courier"
 SSM_PARAMETER_PREFIX_TO_ALIASES = f"{SSM_PARAMETER_PREFIX}/computer-aliases"
+APP_CONFIG_PARAMETER_NAME = "app-config"
+"""The AppConfig of a computer is stored as JSON in the SSM parameter with this name below its alias, next to its folders. Every setting has a default, so the parameter is optional."""
 CLOUDWATCH_BASE_NAMESPACE = "CloudCourier"
 CLOUDWATCH_HEARTBEAT_NAMESPACE = f"{CLOUDWATCH_BASE_NAMESPACE}/Heartbeat"
 HEARTBEAT_METRIC_NAME = "Heartbeat"
 CLOUDWATCH_INSTANCE_ID_DIMENSION_NAME = "NodeRoleName"
+CLOUDWATCH_AGENT_NAMESPACE = f"{CLOUDWATCH_BASE_NAMESPACE}/Agent"
+QUEUED_EVENTS_IN_MEMORY_METRIC_NAME = "QueuedEventsInMemory"
+QUEUED_EVENTS_SPILLED_METRIC_NAME = "QueuedEventsSpilledToDisk"
+PENDING_FILES_METRIC_NAME = "PendingFiles"
+BACKLOG_BYTES_METRIC_NAME = "BacklogBytes"
+OLDEST_PENDING_FILE_AGE_METRIC_NAME = "OldestPendingFileAge"
+UPLOADS_PAUSED_METRIC_NAME = "UploadsPaused"
+FILES_UPLOADED_METRIC_NAME = "FilesUploaded"
+BYTES_UPLOADED_METRIC_NAME = "BytesUploaded"
+UPLOAD_FAILURES_METRIC_NAME = "UploadFailures"
+UPLOAD_DURATION_METRIC_NAME = "UploadDuration"
+UPLOAD_THROUGHPUT_METRIC_NAME = "UploadThroughput"
+UPLOAD_IN_PROGRESS_METRIC_NAME = "UploadInProgress"
+SECONDS_OFFLINE_METRIC_NAME = "SecondsOffline"  # the total since the agent started, so its increase over a period is the time spent offline during it
+SECONDS_SINCE_PIPELINE_PROGRESS_METRIC_NAME = "SecondsSincePipelineProgress"  # together with UploadInProgress, tells a busy agent (in a long upload that's still sending data) from a hung one
 
 
 class FolderToWatch(BaseModel, frozen=True):
     config_format_version: str = "1.0"
     folder_path: str
     recursive: bool = True
-    file_pattern: str = "*"  # TODO: implement
-    ignore_patterns: list[str] = Field(default_factory=list)  # TODO: implement
+    file_pattern: str = "*"
+    """Only upload files matching this fnmatch-style pattern (checked against both the file name and the path relative to folder_path)."""
+    ignore_patterns: list[str] = Field(default_factory=list)
+    """Never upload files matching any of these fnmatch-style patterns (e.g. `~$*` for Office lock files or `*.tmp`)."""
     s3_key_prefix: str
     s3_bucket_name: str
     delay_seconds_before_upload: float = 10
+    change_policy: Literal["ignore", "overwrite", "new_key"] = "ignore"
+    """What to do when a file that was already uploaded changes. `ignore` never uploads it again. `overwrite` uploads the new version to the same key
+    (so enable versioning on the bucket to keep the previous ones), and `new_key` uploads it to the same key with a version suffix before the extension.
+    A change is spotted by comparing the size and modification time with those at the previous upload, and the file is only read again if they differ."""
     # TODO: allow truncating part of the file path prefix
     # TODO: allow deleting after upload
     # TODO: allow specifying a wait period before upload.
     # TODO: add dict of extra key/value pairs to add as metadata to the S3 object (e.g. instrument serial number)
-    # TODO: add a bool if you expect files to change and want to always fully calculate checksums even if the file path itself has already been uploaded (can substantially slow down startup time if lots of large files in the folder)
 
 
 # TODO: check the whole list of folders to watch and confirm there's no overlaps
 
 
 # Future AppConfig level settings:
-# TODO: add time windows where upload/monitoring should be fully paused (e.g. only upload on weekends or at night)
+# TODO: (maybe just infra-side) add heartbeat alert time window. add times when not to check for heartbeats (e.g. if computer is regularly turned off at night or weekends)
 
-# TODO: add the ability to check that CPU usage has been sufficiently low the past X hours before beginning upload (concerns about an overnight run having been started, even when upload is normally restricted to night time only)
 
-# TODO: (maybe just infra-side) add heartbeat alert time window. add times when not to check for heartbeats (e.g. if computer is regularly turned off at night or weekends)
+type Weekday = Literal["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+WEEKDAYS: tuple[Weekday, ...] = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+
+class PauseWindow(BaseModel, frozen=True):
+    """A recurring time window (in the computer's local time) when uploads are paused, e.g. weekdays 08:00-18:00 while the instruments are in use."""
+
+    days: list[Weekday] = Field(default_factory=lambda: list(WEEKDAYS))
+    """The days the window starts on."""
+    start: datetime.time
+    end: datetime.time
+    """A window whose end is before its start runs past midnight into the next day."""
 
 
 class AppConfig(BaseModel, frozen=True):
     config_format_version: str = "1.0"
     config_refresh_frequency_minutes: int = 60
+    config_refresh_jitter_seconds: float = Field(default=300, ge=0)
+    """Each refresh of the configuration is delayed by a random amount up to this, so a fleet of agents started together (e.g. by an update) doesn't all call SSM at the same moment."""
     heartbeat_frequency_seconds: int = 60
     """If it's been this long since the last heartbeat, send another one."""
+    max_in_memory_queued_events: int = Field(default=100_000, gt=0)
+    """Once this many file events are waiting in the queue, any more are spilled to a file on disk to cap memory usage."""
+    max_upload_attempts: int = Field(default=5, gt=0)
+    """A file still pending in the work journal after this many upload attempts (e.g. one that crashed the agent every time) is dropped at the next boot instead of being retried forever."""
+    upload_record_commit_interval_ms: int = Field(default=1000, ge=0)
+    """Entries in the record of uploaded files are committed together at most this long after the first of them was added (zero commits every entry immediately).
+    Together with upload_record_commit_max_entries, this bounds how much of the record a crash can lose (those files would be uploaded again)."""
+    upload_record_commit_max_entries: int = Field(default=100, gt=0)
+    """Commit the record of uploaded files as soon as this many entries are waiting."""
+    upload_record_fsync: bool = True
+    """Whether every commit of the record of uploaded files is synced to disk, so it also survives a power loss and not just a crash of the agent."""
+    upload_record_bloom_filter: bool = False
+    """Keep a Bloom filter (about 10 bits per uploaded file) in memory in front of the record of uploaded files, so checking a new file rarely needs to read the record from disk."""
+    upload_pause_windows: list[PauseWindow] = Field(default_factory=list)
+    """Files are still found and queued during these windows, but not uploaded until the window ends."""
+    max_cpu_percent_for_upload: float | None = Field(default=None, gt=0, le=100)
+    """Defer uploads while the computer's CPU usage is above this (None to never defer for CPU usage)."""
+    max_disk_busy_percent_for_upload: float | None = Field(default=None, gt=0, le=100)
+    """Defer uploads while the busiest disk is doing I/O for more than this share of the time (None to never defer for disk load)."""
+    load_idle_seconds_before_upload: float = Field(default=0, ge=0)
+    """Once the load drops below the thresholds, it must stay there this long before uploads start again (e.g. so a break between acquisitions isn't mistaken for the end of a run)."""
+    load_sample_interval_seconds: float = Field(default=5, gt=0)
+    """How often the CPU and disk load are sampled, when a threshold is set."""
+    log_shipping_s3_bucket_name: str | None = None
+    """Ship the JSON log to this S3 bucket in compressed batches, e.g. for ingestion by a SIEM (None to keep the log only on this computer)."""
+    log_shipping_s3_key_prefix: str = "cloud-courier-logs"
+    """The batches are uploaded under this prefix, followed by the role name of the agent."""
+    log_shipping_batch_max_bytes: int = Field(default=5 * 1024 * 1024, gt=0)
+    """Ship the log as soon as this much of it (before compression) is waiting, rather than waiting for the interval."""
+    log_shipping_interval_seconds: float = Field(default=300, gt=0)
+    """Ship whatever has been logged at least this often."""
@@ -0,0 +1,108 @@
+import json
+import logging
+import queue
+import shutil
+import threading
+from pathlib import Path
+from queue import SimpleQueue
+
+from .file_event import FileEvent
+
+logger = logging.getLogger(__name__)
+
+# how much of the spill file can have been paged back in before it's rewritten without that part, so it can't grow forever while the backlog never quite drains
+SPILL_FILE_COMPACTION_BYTES = 64 * 1024 * 1024
+
+
+class SpillingEventQueue:
+    """A thread-safe FIFO queue of FileEvents with a limit on how many are held in memory.
+
+    Once max_in_memory events are queued, any further events are appended to a spill file on disk (one JSON array per line).
+    They are paged back into memory in batches as the in-memory events are consumed, so the order of events is preserved and memory stays bounded no matter how large the backlog grows.
+    Whether an event goes into memory or to the spill file is decided under a lock, so events put from different threads can't overtake each other across the two.
+    The spill file only lives for the life of the process, it is truncated whenever it is fully drained and when the queue is created,
+    and once compact_after_bytes of it have been paged back in, it is rewritten with only what's left.
+    """
+
+    def __init__(
+        self, *, spill_file_path: Path, max_in_memory: int, compact_after_bytes: int = SPILL_FILE_COMPACTION_BYTES
+    ):
+        super().__init__()
+        assert max_in_memory > 0, f"max_in_memory must be positive, but got {max_in_memory}"
+        self._max_in_memory = max_in_memory
+        self._page_in_batch_size = max(1, max_in_memory // 2)
+        self._in_memory: SimpleQueue[FileEvent] = SimpleQueue()
+        self._num_spilled = 0
+        self._compact_after_bytes = compact_after_bytes
+        self._spill_lock = threading.Lock()
+        spill_file_path.parent.mkdir(parents=True, exist_ok=True)
+        self._spill_file_path = spill_file_path
+        self._spill_writer = spill_file_path.open("w", encoding="utf-8")
+        self._spill_reader = spill_file_path.open("r", encoding="utf-8")
+
+    @property
+    def in_memory_size(self) -> int:
+        return self._in_memory.qsize()
+
+    @property
+    def spilled_size(self) -> int:
+        return self._num_spilled
+
+    def qsize(self) -> int:
+        return self._in_memory.qsize() + self._num_spilled
+
+    def empty(self) -> bool:
+        return self.qsize() == 0
+
+    def put(self, event: FileEvent) -> None:
+        with self._spill_lock:
+            if self._num_spilled == 0 and self._in_memory.qsize() < self._max_in_memory:
+                self._in_memory.put(event)
+                return
+            if self._num_spilled == 0:
+                logger.warning(
+                    f"More than {self._max_in_memory} events are queued, spilling the overflow to {self._spill_file_path}"
+                )
+            # once anything has been spilled, new events must also go to disk so that they stay behind the spilled ones
+            _ = self._spill_writer.write(json.dumps(event) + "\n")
+            self._num_spilled += 1
+
+    def get(self, timeout: float | None = None) -> FileEvent:
+        try:
+            return self._in_memory.get_nowait()
+        except queue.Empty:
+            pass
+        if self._num_spilled > 0:
+            self._page_in()
+        return self._in_memory.get(timeout=timeout)
+
+    def _page_in(self) -> None:
+        with self._spill_lock:
+            self._spill_writer.flush()
+            for _ in range(min(self._page_in_batch_size, self._num_spilled)):
+                self._in_memory.put(FileEvent(*json.loads(self._spill_reader.readline())))
+                self._num_spilled -= 1
+            if self._num_spilled == 0:
+                _ = self._spill_writer.seek(0)
+                _ = self._spill_writer.truncate()
+                _ = self._spill_reader.seek(0)
+                logger.info("Finished paging the spilled events back into memory")
+            elif self._spill_reader.tell() >= self._compact_after_bytes:
+                self._compact()
+
+    def _compact(self) -> None:
+        """Rewrite the spill file with only the events that haven't been paged back in yet, copying it in chunks so they're never all in memory."""
+        compacted_path = self._spill_file_path.with_name(f"{self._spill_file_path.name}.compacting")
+        with compacted_path.open("w", encoding="utf-8") as compacted:
+            shutil.copyfileobj(self._spill_reader, compacted)
+        # closed before being replaced, since Windows can't replace a file that's open
+        self._spill_writer.close()
+        self._spill_reader.close()
+        _ = compacted_path.replace(self._spill_file_path)
+        self._spill_writer = self._spill_file_path.open("a", encoding="utf-8")
+        self._spill_reader = self._spill_file_path.open("r", encoding="utf-8")
+
+    def close(self) -> None:
+        with self._spill_lock:
+            self._spill_writer.close()
+            self._spill_reader.close()
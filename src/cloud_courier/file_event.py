@@ -0,0 +1,13 @@
+from typing import NamedTuple
+
+
+class FileEvent(NamedTuple):
+    """A file waiting in the queue to be uploaded.
+
+    One of these is created in the watchdog emitter thread for every file system event, so it is a plain tuple rather than a validated model.
+    The folder is referenced by its descriptor in the config, and the timestamp comes from time.monotonic so it is unaffected by changes to the system clock.
+    """
+
+    src_path: str
+    folder_descriptor: str
+    monotonic_timestamp: float
@@ -0,0 +1,87 @@
+import fnmatch
+import os
+import re
+
+from .courier_config_models import FolderToWatch
+
+_WILDCARD_CHARACTERS = frozenset("*?[")
+
+
+def _has_wildcards(text: str) -> bool:
+    return not _WILDCARD_CHARACTERS.isdisjoint(text)
+
+
+class _CompiledPatterns:
+    """A set of fnmatch patterns compiled for fast matching.
+
+    Most real-world patterns are a literal name, a literal prefix followed by `*` (e.g. `~$*`) or `*` followed by a literal suffix (e.g. `*.tmp`).
+    Those are checked with a set lookup and str.startswith/str.endswith on a tuple, and only the remaining patterns go into a single combined regular expression.
+    """
+
+    def __init__(self, patterns: list[str], *, ignore_case: bool):
+        super().__init__()
+        self._ignore_case = ignore_case
+        if ignore_case:
+            patterns = [pattern.lower() for pattern in patterns]
+        literals: set[str] = set()
+        prefixes: list[str] = []
+        suffixes: list[str] = []
+        complex_patterns: list[str] = []
+        for pattern in patterns:
+            if not _has_wildcards(pattern):
+                literals.add(pattern)
+            elif pattern.endswith("*") and not _has_wildcards(pattern[:-1]):
+                prefixes.append(pattern[:-1])
+            elif pattern.startswith("*") and not _has_wildcards(pattern[1:]):
+                suffixes.append(pattern[1:])
+            else:
+                complex_patterns.append(pattern)
+        self._literals = frozenset(literals)
+        self._prefixes = tuple(prefixes)
+        self._suffixes = tuple(suffixes)
+        # fnmatch.translate anchors the end of each pattern, so a plain alternation is a full match for any of them
+        self._regex = (
+            re.compile("|".join(fnmatch.translate(pattern) for pattern in complex_patterns))
+            if complex_patterns
+            else None
+        )
+
+    def matches(self, text: str) -> bool:
+        if self._ignore_case:
+            text = text.lower()
+        return (
+            text in self._literals
+            or text.startswith(self._prefixes)
+            or text.endswith(self._suffixes)
+            or (self._regex is not None and self._regex.match(text) is not None)
+        )
+
+
+class FileFilter:
+    """Decide whether a file in a watched folder should be uploaded, based on the folder's file_pattern and ignore_patterns.
+
+    The patterns use fnmatch syntax and are compiled once per folder, so the cost per path barely grows with the number of patterns.
+    A pattern matches if it matches either the file name or the path relative to the watched folder (using forward slashes).
+    """
+
+    def __init__(self, folder_config: FolderToWatch, *, ignore_case: bool = os.name == "nt"):
+        super().__init__()
+        self._ignore_case = ignore_case
+        self._folder_path = self._normalize_path(folder_config.folder_path).rstrip("/") + "/"
+        self._matches_everything = folder_config.file_pattern == "*" and not folder_config.ignore_patterns
+        self._include = _CompiledPatterns([folder_config.file_pattern], ignore_case=ignore_case)
+        self._ignore = _CompiledPatterns(folder_config.ignore_patterns, ignore_case=ignore_case)
+
+    def _normalize_path(self, path: str) -> str:
+        # Windows paths are case-insensitive, so the folder prefix has to be stripped regardless of how either path was capitalized
+        path = path.replace("\\", "/")
+        return path.lower() if self._ignore_case else path
+
+    def should_upload(self, file_path: str) -> bool:
+        if self._matches_everything:
+            return True
+        relative_path = self._normalize_path(file_path).removeprefix(self._folder_path)
+        file_name = relative_path.rpartition("/")[2]
+        if not (self._include.matches(file_name) or self._include.matches(relative_path)):
+            return False
+        return not (self._ignore.matches(file_name) or self._ignore.matches(relative_path))
@@ -0,0 +1,162 @@
+import logging
+import os
+import threading
+from collections.abc import Callable
+from collections.abc import Iterator
+from collections.abc import Mapping
+from pathlib import Path
+
+from .courier_config_models import FolderToWatch
+from .file_filter import FileFilter
+from .work_journal import ScannedDirectory
+from .work_journal import WorkJournal
+
+logger = logging.getLogger(__name__)
+
+SCAN_BATCH_SIZE = 1000
+
+
+def walk_folder(
+    folder_path: str, *, recursive: bool, previously_scanned: Mapping[str, ScannedDirectory] | None = None
+) -> Iterator[os.DirEntry[str] | ScannedDirectory]:
+    """Walk the folder with os.scandir, yielding the entries for files and then a ScannedDirectory once each directory is finished.
+
+    The file type comes from the directory listing itself, so no stat call is made per file. Symlinks to directories are not followed, matching Path.glob.
+    A directory whose modification time matches the one in previously_scanned has had no entries added, removed or renamed since then, so it is not listed again
+    and the walk continues into its previously recorded subdirectories.
+    """
+    if previously_scanned is None:
+        previously_scanned = {}
+    directories = [folder_path]
+    while directories:
+        directory = directories.pop()
+        try:
+            # read the modification time before listing, so that anything added during the listing is picked up by the next scan
+            mtime_ns = os.stat(directory).st_mtime_ns  # noqa: PTH116 # avoids creating a Path for every directory
+            previous = previously_scanned.get(directory)
+            if previous is not None and previous.mtime_ns == mtime_ns:
+                if recursive:
+                    directories.extend(previous.subdirectories)
+                yield previous
+                continue
+            subdirectories: list[str] = []
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirectories.append(entry.path)
+                        continue
+                    if entry.is_file():
+                        yield entry
+        except OSError:
+            logger.warning(f"Unable to scan {directory}, skipping it", exc_info=True)
+            continue
+        if recursive:
+            directories.extend(subdirectories)
+        yield ScannedDirectory(directory, mtime_ns, subdirectories)
+
+
+def iter_files_in_folder(folder_path: str, *, recursive: bool) -> Iterator[os.DirEntry[str]]:
+    """Walk the whole folder and yield the entries for files."""
+    for item in walk_folder(folder_path, recursive=recursive):
+        if not isinstance(item, ScannedDirectory):
+            yield item
+
+
+class FolderScan:
+    """Scan a watched folder in a background thread, queueing any files that match its patterns and have not already been uploaded.
+
+    Candidates are queued in batches, and the scan can be stopped between batches (e.g. when the folder stops being watched).
+    When given a work journal, each directory is recorded once all of its files are queued, and directories that have not changed since the last scan are not listed again
+    (unless the folder's change policy means changed files need to be found).
+    """
+
+    def __init__(  # noqa: PLR0913 # all keyword-only, and the callbacks keep the scan independent of MainLoop
+        self,
+        *,
+        descriptor: str,
+        folder_config: FolderToWatch,
+        file_filter: FileFilter,
+        is_already_uploaded: Callable[[Path], bool],
+        enqueue: Callable[[str, str], None],
+        batch_size: int = SCAN_BATCH_SIZE,
+        work_journal: WorkJournal | None = None,
+    ):
+        super().__init__()
+        self.descriptor = descriptor
+        self.folder_config = folder_config
+        self._file_filter = file_filter
+        self._is_already_uploaded = is_already_uploaded
+        self._enqueue = enqueue
+        self._batch_size = batch_size
+        self._work_journal = work_journal
+        self._stop_requested = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"folder-scan-{descriptor}", daemon=True)
+        self.num_files_queued = 0
+        self.num_files_skipped = 0
+        self.num_files_filtered = 0
+        self.num_directories_unchanged = 0
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop_requested.set()
+
+    def join(self, timeout: float | None = None):
+        self._thread.join(timeout=timeout)
+
+    def is_alive(self) -> bool:
+        return self._thread.is_alive()
+
+    def _queue_batch(self, batch: list[str]):
+        for file_path in batch:
+            self._enqueue(file_path, self.descriptor)
+        self.num_files_queued += len(batch)
+        batch.clear()
+
+    def _run(self):
+        previously_scanned = (
+            {}
+            # a file changed in place doesn't change its directory's modification time, so every directory has to be listed to spot changed files
+            if self._work_journal is None or self.folder_config.change_policy != "ignore"
+            else self._work_journal.scanned_directories(self.descriptor)
+        )
+        visited_directories: set[str] = set()
+        batch: list[str] = []
+        for item in walk_folder(
+            self.folder_config.folder_path,
+            recursive=self.folder_config.recursive,
+            previously_scanned=previously_scanned,
+        ):
+            if isinstance(item, ScannedDirectory):
+                visited_directories.add(item.path)
+                if self._work_journal is None:
+                    continue
+                if previously_scanned.get(item.path) == item:
+                    self.num_directories_unchanged += 1
+                    continue
+                # the directory can only be recorded as scanned once all its files are queued (and so in the journal), otherwise a crash could lose them
+                self._queue_batch(batch)
+                self._work_journal.record_scanned_directory(self.descriptor, item)
+            elif not self._file_filter.should_upload(item.path):
+                self.num_files_filtered += 1
+                continue
+            elif self._is_already_uploaded(Path(item.path)):
+                self.num_files_skipped += 1
+                continue
+            else:
+                batch.append(item.path)
+                if len(batch) < self._batch_size:
+                    continue
+                self._queue_batch(batch)
+            if self._stop_requested.is_set():
+                logger.info(f"Stopped the scan of folder {self.descriptor} before it finished")
+                return
+        self._queue_batch(batch)
+        if self._work_journal is not None:
+            self._work_journal.remove_scanned_directories(
+                self.descriptor, previously_scanned.keys() - visited_directories
+            )
+        logger.info(
+            f"Finished the scan of folder {self.descriptor}. Queued {self.num_files_queued} files, skipped {self.num_files_skipped} already uploaded files, ignored {self.num_files_filtered} files not matching the patterns and skipped {self.num_directories_unchanged} unchanged directories"
+        )
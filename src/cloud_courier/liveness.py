@@ -0,0 +1,97 @@
+import datetime
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+from typing import NamedTuple
+
+RECENT_FAILURES_LIMIT = 20
+
+
+class InFlightUpload(NamedTuple):
+    file_path: str
+    total_bytes: int
+    bytes_sent: int
+    seconds_elapsed: float
+
+
+class RecentFailure(NamedTuple):
+    failed_at: str
+    """ISO 8601 timestamp in UTC."""
+    file_path: str
+    error: str
+
+
+class _UploadProgress:
+    def __init__(self, *, total_bytes: int, started_at: float):
+        super().__init__()
+        self.total_bytes = total_bytes
+        self.bytes_sent = 0
+        self.started_at = started_at
+
+
+class PipelineLiveness:
+    """Track whether the upload pipeline is making progress, so a busy agent (e.g. part way through a long upload) can be told apart from a hung one.
+
+    The main loop records progress on every iteration, and an upload records progress each time more of the file has been sent.
+    """
+
+    def __init__(self, *, clock: Callable[[], float] = time.monotonic):
+        super().__init__()
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._last_progress_at = clock()
+        self._uploads: dict[str, _UploadProgress] = {}
+        self._recent_failures: deque[RecentFailure] = deque(maxlen=RECENT_FAILURES_LIMIT)
+
+    def record_progress(self) -> None:
+        now = self._clock()
+        with self._lock:
+            self._last_progress_at = now
+
+    def upload_started(self, file_path: str, *, total_bytes: int) -> None:
+        now = self._clock()
+        with self._lock:
+            self._uploads[file_path] = _UploadProgress(total_bytes=total_bytes, started_at=now)
+            self._last_progress_at = now
+
+    def record_upload_progress(self, file_path: str, num_bytes: int) -> None:
+        """Add to the bytes sent for the upload, in the form of a progress callback once the file path is bound."""
+        now = self._clock()
+        with self._lock:
+            self._uploads[file_path].bytes_sent += num_bytes
+            self._last_progress_at = now
+
+    def upload_finished(self, file_path: str) -> None:
+        now = self._clock()
+        with self._lock:
+            del self._uploads[file_path]
+            self._last_progress_at = now
+
+    def record_failure(self, file_path: str, error: BaseException) -> None:
+        failure = RecentFailure(datetime.datetime.now(tz=datetime.UTC).isoformat(), file_path, repr(error))
+        with self._lock:
+            self._recent_failures.append(failure)
+
+    def recent_failures(self) -> list[RecentFailure]:
+        """Get the most recent upload failures, oldest first."""
+        with self._lock:
+            return list(self._recent_failures)
+
+    @property
+    def is_upload_in_progress(self) -> bool:
+        with self._lock:
+            return len(self._uploads) > 0
+
+    def in_flight_uploads(self) -> list[InFlightUpload]:
+        now = self._clock()
+        with self._lock:
+            return [
+                InFlightUpload(file_path, progress.total_bytes, progress.bytes_sent, now - progress.started_at)
+                for file_path, progress in self._uploads.items()
+            ]
+
+    def seconds_since_progress(self) -> float:
+        now = self._clock()
+        with self._lock:
+            return max(0.0, now - self._last_progress_at)
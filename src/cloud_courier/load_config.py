@@ -1,59 +1,55 @@
 import logging
 from typing import TYPE_CHECKING
+from typing import NamedTuple
 
 import boto3
-from mypy_boto3_ssm import SSMClient
+from botocore.config import Config
 from pydantic import BaseModel
+from pydantic import Field
 from pydantic import ValidationError
 
 from .aws_credentials import get_role_arn
+from .courier_config_models import APP_CONFIG_PARAMETER_NAME
 from .courier_config_models import SSM_PARAMETER_PREFIX
 from .courier_config_models import SSM_PARAMETER_PREFIX_TO_ALIASES
 from .courier_config_models import AppConfig
 from .courier_config_models import FolderToWatch
 
 if TYPE_CHECKING:
-    from mypy_boto3_ssm.type_defs import ParameterMetadataTypeDef
+    from mypy_boto3_ssm import SSMClient
 logger = logging.getLogger(__name__)
 
-
-def _get_ssm_param_value(ssm_client: SSMClient, name: str) -> str:
-    param = ssm_client.get_parameter(Name=name)["Parameter"]
-    assert "Value" in param, f"Expected 'Value' in {param}"
-    return param["Value"]
+SSM_GET_PARAMETERS_BY_PATH_PAGE_SIZE = 10  # the most AWS allows
+SSM_MAX_ATTEMPTS = 10
+# when a whole fleet loads its configuration at once (e.g. after an update restarts every agent), SSM throttles the requests.
+# The adaptive retry mode backs off and also slows this client down after being throttled, rather than just retrying
+SSM_CLIENT_CONFIG = Config(retries={"mode": "adaptive", "max_attempts": SSM_MAX_ATTEMPTS})
 
 
-def _get_ssm_param_values(ssm_client: SSMClient, prefix: str) -> dict[str, str]:
-    parameters: list[ParameterMetadataTypeDef] = []
-    next_token = None
+class SsmParameter(NamedTuple):
+    value: str
+    version: int
 
-    while True:
-        # API call with optional pagination
-        response = ssm_client.describe_parameters(
-            ParameterFilters=[{"Key": "Name", "Option": "BeginsWith", "Values": [prefix]}],
-            MaxResults=50,  # AWS allows up to 50 results per call
-            NextToken=next_token or "",
-        )
 
-        # Add parameters from this page
-        parameters.extend(response.get("Parameters", []))
-
-        # Check if more pages exist
-        next_token = response.get("NextToken")
-        if not next_token:
-            break
+def _get_ssm_param_value(ssm_client: "SSMClient", name: str) -> str:
+    param = ssm_client.get_parameter(Name=name)["Parameter"]
+    assert "Value" in param, f"Expected 'Value' in {param}"
+    return param["Value"]
 
-    params_dict: dict[str, str] = {}
-    for param in parameters:
-        assert "Name" in param, f"Name not found in parameter {param}"
-        param_name = param["Name"]
-        param_value = _get_ssm_param_value(
-            ssm_client, param_name
-        )  # TODO: consider using get_parameters for just a single API call
-        folder_descriptor = param_name.split("/")[-1]
-        params_dict[folder_descriptor] = param_value
 
-    return params_dict
+def _get_ssm_parameters_by_path(ssm_client: "SSMClient", path: str) -> dict[str, SsmParameter]:
+    """Get every parameter below the path by name, which takes one API call per page of 10 parameters."""
+    parameters: dict[str, SsmParameter] = {}
+    paginator = ssm_client.get_paginator("get_parameters_by_path")
+    for page in paginator.paginate(
+        Path=path, Recursive=True, PaginationConfig={"PageSize": SSM_GET_PARAMETERS_BY_PATH_PAGE_SIZE}
+    ):
+        for parameter in page["Parameters"]:
+            assert "Name" in parameter, f"Name not found in parameter {parameter}"
+            assert "Value" in parameter, f"Value not found in parameter {parameter}"
+            assert "Version" in parameter, f"Version not found in parameter {parameter}"
+            parameters[parameter["Name"]] = SsmParameter(parameter["Value"], parameter["Version"])
+    return parameters
 
 
 class CourierConfig(BaseModel, frozen=True):
@@ -62,6 +58,54 @@ class CourierConfig(BaseModel, frozen=True):
     role_name: str
     alias_name: str | None = None
     aws_region: str
+    parameter_versions: dict[str, int] = Field(default_factory=dict)
+    """The version of each SSM parameter the folders and the app config were loaded from (by parameter name), so reloading only has to validate the ones that changed."""
+
+
+# the settings that decide which files belong to a folder. Changing any other setting (e.g. the delay or the bucket) doesn't need the folder to be watched and scanned again
+_FOLDER_MATCHING_FIELDS = frozenset({"folder_path", "recursive", "file_pattern", "ignore_patterns"})
+
+
+def folder_matching_key(folder_config: FolderToWatch) -> str:
+    """Serialize the settings that decide which files belong to the folder, so two configurations can be compared on just those."""
+    return folder_config.model_dump_json(include=set(_FOLDER_MATCHING_FIELDS))
+
+
+class FolderConfigDiff(BaseModel, frozen=True):
+    added: frozenset[str]
+    removed: frozenset[str]
+    changed: frozenset[str]
+    """Folders where which files belong to them changed, so they need to be watched and scanned again."""
+    updated: frozenset[str] = frozenset()
+    """Folders where only other settings changed, which can be applied to the existing watch."""
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.added or self.removed or self.changed or self.updated)
+
+
+def diff_folders_to_watch(current: dict[str, FolderToWatch], new: dict[str, FolderToWatch]) -> FolderConfigDiff:
+    """Compare two sets of folder configurations by their descriptor.
+
+    Folders whose settings for which files belong to them differ are reported as changed, so the caller can stop watching them and start again with the new settings.
+    Folders where only the other settings differ are reported as updated.
+    """
+    current_descriptors = set(current)
+    new_descriptors = set(new)
+    differing = {
+        descriptor for descriptor in current_descriptors & new_descriptors if current[descriptor] != new[descriptor]
+    }
+    changed = frozenset(
+        descriptor
+        for descriptor in differing
+        if folder_matching_key(current[descriptor]) != folder_matching_key(new[descriptor])
+    )
+    return FolderConfigDiff(
+        added=frozenset(new_descriptors - current_descriptors),
+        removed=frozenset(current_descriptors - new_descriptors),
+        changed=changed,
+        updated=frozenset(differing - changed),
+    )
 
 
 def extract_role_name_from_arn(arn: str) -> str:
@@ -71,24 +115,63 @@ def extract_role_name_from_arn(arn: str) -> str:
     return arn.split("/")[1]
 
 
-def load_config_from_aws(session: boto3.Session) -> CourierConfig:
-    ssm_client = session.client("ssm")
+def _unchanged_folder(previous: CourierConfig | None, parameter_name: str, version: int) -> FolderToWatch | None:
+    if previous is None or previous.parameter_versions.get(parameter_name) != version:
+        return None
+    return previous.folders_to_watch.get(parameter_name.rsplit("/", maxsplit=1)[-1])
+
+
+def _load_app_config(previous: CourierConfig | None, parameter_name: str, parameter: SsmParameter | None) -> AppConfig:
+    if parameter is None:
+        return AppConfig()  # every setting has a default, so a computer doesn't need the parameter
+    if previous is not None and previous.parameter_versions.get(parameter_name) == parameter.version:
+        return previous.app_config
+    try:
+        return AppConfig.model_validate_json(parameter.value)
+    except ValidationError:
+        logger.exception(f"Failed to validate the app config in {parameter_name}")
+        raise
+
+
+def load_config_from_aws(session: boto3.Session, *, previous: CourierConfig | None = None) -> CourierConfig:
+    """Load the configuration from SSM Parameter Store.
+
+    Pass the previously loaded configuration when reloading, so folders whose parameter version hasn't changed are reused rather than validated again.
+    """
+    ssm_client = session.client("ssm", config=SSM_CLIENT_CONFIG)
     role_name = extract_role_name_from_arn(get_role_arn(session))
     alias = _get_ssm_param_value(ssm_client, f"{SSM_PARAMETER_PREFIX_TO_ALIASES}/{role_name}")
-    all_folders = _get_ssm_param_values(ssm_client, f"{SSM_PARAMETER_PREFIX}/{alias}/folders/")
+    alias_path = f"{SSM_PARAMETER_PREFIX}/{alias}"
+    # the app config and the folders are all below the alias, so they're fetched together in the same pages
+    parameters = _get_ssm_parameters_by_path(ssm_client, alias_path)
+    app_config_parameter_name = f"{alias_path}/{APP_CONFIG_PARAMETER_NAME}"
+    app_config = _load_app_config(previous, app_config_parameter_name, parameters.get(app_config_parameter_name))
     folders_to_watch: dict[str, FolderToWatch] = {}
-    for folder_descriptor, folder_info in all_folders.items():
+    num_unchanged = 0
+    for parameter_name, parameter in parameters.items():
+        if not parameter_name.startswith(f"{alias_path}/folders/"):
+            continue
+        folder_descriptor = parameter_name.split("/")[-1]
+        folder_model = _unchanged_folder(previous, parameter_name, parameter.version)
+        if folder_model is not None:
+            num_unchanged += 1
+            folders_to_watch[folder_descriptor] = folder_model
+            continue
         try:
-            folder_model = FolderToWatch.model_validate_json(folder_info)
+            folder_model = FolderToWatch.model_validate_json(parameter.value)
         except ValidationError:
             logger.exception(f"Failed to validate folder info for {folder_descriptor}")
             raise
         folders_to_watch[folder_descriptor] = folder_model
+    logger.info(
+        f"Loaded the configuration of {len(folders_to_watch)} folders from SSM ({num_unchanged} unchanged since the previous load)"
+    )
 
     return CourierConfig(
         folders_to_watch=folders_to_watch,
-        app_config=AppConfig(),
+        app_config=app_config,
         role_name=role_name,
         alias_name=alias,
         aws_region=session.region_name,
+        parameter_versions={parameter_name: parameter.version for parameter_name, parameter in parameters.items()},
     )
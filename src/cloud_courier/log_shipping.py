@@ -0,0 +1,187 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import time
+from collections.abc import Callable
+from pathlib import Path
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+LOG_SHIPPING_STATE_FILE_NAME = "log_shipping_state.json"
+# only the start of the first line is hashed, which is plenty to tell log files apart since it begins with a timestamp
+_FINGERPRINT_MAX_BYTES = 1024
+
+
+class LogShippingState(NamedTuple):
+    """How far the log has been shipped: the offset just past the last shipped line of the log file with this fingerprint."""
+
+    fingerprint: str
+    offset: int
+
+
+def _fingerprint(first_line: bytes) -> str:
+    return hashlib.sha256(first_line).hexdigest()
+
+
+def _read_fingerprint(log_file_path: Path) -> str | None:
+    """Identify the log file by its first line, since it keeps that when it's rotated (renamed) to a backup. None if it doesn't have a complete line yet."""
+    try:
+        with log_file_path.open("rb") as file:
+            first_line = file.readline(_FINGERPRINT_MAX_BYTES)
+    except FileNotFoundError:
+        return None
+    if not first_line.endswith(b"\n") and len(first_line) < _FINGERPRINT_MAX_BYTES:
+        return None
+    return _fingerprint(first_line)
+
+
+def save_log_shipping_state(state: LogShippingState, state_path: Path) -> None:
+    # replaced in one step, like the configuration snapshot, so a crash never leaves a truncated state file behind
+    temporary_path = state_path.with_name(f"{state_path.name}.tmp")
+    with temporary_path.open("w", encoding="utf-8") as file:
+        _ = file.write(json.dumps(state._asdict()))
+        file.flush()
+        os.fsync(file.fileno())
+    _ = temporary_path.replace(state_path)
+
+
+def load_log_shipping_state(state_path: Path) -> LogShippingState | None:
+    try:
+        return LogShippingState(**json.loads(state_path.read_text(encoding="utf-8")))
+    except FileNotFoundError:
+        return None
+    except (ValueError, TypeError):
+        logger.exception(f"Ignoring the log shipping state {state_path} because it is not valid")
+        return None
+
+
+class LogShipper:
+    """Ship the JSON log (including the backups it's rotated into) to the cloud in compressed batches, for ingestion by a SIEM.
+
+    Each batch is a run of complete lines from one log file, compressed with gzip and handed to upload_batch along with a name made from the
+    file's fingerprint and the offset the batch starts at. The offset shipped up to is saved after every batch, so after a restart shipping
+    carries on where it left off. If the agent stops between uploading a batch and saving the offset, the same batch is uploaded again under
+    the same name, replacing the first copy rather than duplicating it.
+
+    Backups are complete, so they're shipped straight away. The live log is shipped once at least max_batch_bytes of it are waiting, or
+    interval_seconds after the last time it was shipped, whichever comes first.
+    """
+
+    def __init__(  # noqa: PLR0913 # all keyword-only
+        self,
+        *,
+        log_file_path: Path,
+        state_path: Path,
+        upload_batch: Callable[[str, bytes], None],
+        max_batch_bytes: int,
+        interval_seconds: float,
+        backup_count: int,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        super().__init__()
+        self._log_file_path = log_file_path
+        self._state_path = state_path
+        self._upload_batch = upload_batch
+        self._max_batch_bytes = max_batch_bytes
+        self._interval_seconds = interval_seconds
+        self._backup_count = backup_count
+        self._clock = clock
+        self._last_shipped_at = clock()
+
+    def reconfigure(self, *, max_batch_bytes: int, interval_seconds: float) -> None:
+        """Change how the log is batched (e.g. after the configuration is refreshed), carrying on from where shipping got to."""
+        self._max_batch_bytes = max_batch_bytes
+        self._interval_seconds = interval_seconds
+
+    def _log_files_oldest_first(self) -> list[tuple[Path, str]]:
+        # the same naming as logging.handlers.RotatingFileHandler, where .1 is the most recent backup
+        paths = [
+            *(
+                self._log_file_path.with_name(f"{self._log_file_path.name}.{number}")
+                for number in range(self._backup_count, 0, -1)
+            ),
+            self._log_file_path,
+        ]
+        log_files: list[tuple[Path, str]] = []
+        for path in paths:
+            fingerprint = _read_fingerprint(path)
+            if fingerprint is not None:
+                log_files.append((path, fingerprint))
+        return log_files
+
+    def _resume_point(self, log_files: list[tuple[Path, str]]) -> tuple[int, int]:
+        """Return the index of the log file to carry on shipping from, and the offset within it."""
+        state = load_log_shipping_state(self._state_path)
+        if state is None:
+            return 0, 0
+        for index, (_, fingerprint) in enumerate(log_files):
+            if fingerprint == state.fingerprint:
+                return index, state.offset
+        logger.warning(
+            "The log file that was being shipped was rotated away before all of it could be shipped, some log lines were not shipped"
+        )
+        return 0, 0
+
+    def _read_batch(self, log_file_path: Path, *, fingerprint: str, offset: int) -> bytes | None:
+        """Read complete lines from the offset, up to max_batch_bytes (unless a single line is longer than that). None if the file is no longer the one with this fingerprint."""
+        try:
+            file = log_file_path.open("rb")
+        except FileNotFoundError:
+            return None  # caught in the middle of being rotated
+        with file:
+            if _fingerprint(file.readline(_FINGERPRINT_MAX_BYTES)) != fingerprint:
+                return None  # it was rotated since the fingerprint was read
+            _ = file.seek(offset)
+            data = file.read(self._max_batch_bytes)
+            last_line_end = data.rfind(b"\n") + 1
+            if last_line_end > 0:
+                return data[:last_line_end]
+            if len(data) < self._max_batch_bytes:
+                return b""  # the line being written hasn't been finished yet
+            return data + file.readline()  # a very long line, shipped whole (once it's finished)
+
+    def _ship_log_file(self, log_file_path: Path, *, fingerprint: str, offset: int) -> tuple[int, bool]:
+        """Ship the rest of the log file, returning the number of batches uploaded and whether it was all shipped (rather than being rotated part way through)."""
+        num_batches = 0
+        while True:
+            batch = self._read_batch(log_file_path, fingerprint=fingerprint, offset=offset)
+            if batch is None:
+                return num_batches, False
+            if not batch:
+                return num_batches, True
+            self._upload_batch(f"{fingerprint[:16]}-{offset:012d}.jsonl.gz", gzip.compress(batch))
+            offset += len(batch)
+            save_log_shipping_state(LogShippingState(fingerprint=fingerprint, offset=offset), self._state_path)
+            num_batches += 1
+
+    def ship_if_due(self) -> int:
+        """Ship whatever is due, returning the number of batches uploaded."""
+        now = self._clock()
+        interval_elapsed = now - self._last_shipped_at >= self._interval_seconds
+        log_files = self._log_files_oldest_first()
+        if not log_files:
+            return 0
+        start_index, offset = self._resume_point(log_files)
+        num_batches = 0
+        for index in range(start_index, len(log_files)):
+            log_file_path, fingerprint = log_files[index]
+            is_live_log = index == len(log_files) - 1
+            if is_live_log and not interval_elapsed and log_file_path.stat().st_size - offset < self._max_batch_bytes:
+                break
+            num_batches_from_file, finished = self._ship_log_file(log_file_path, fingerprint=fingerprint, offset=offset)
+            num_batches += num_batches_from_file
+            if not finished:
+                break  # the files were rotated since they were listed, so the rest is picked up next time
+            if not is_live_log:
+                # moving on to the next file, so the state never points at a backup that could be rotated away before the next batch
+                _, next_fingerprint = log_files[index + 1]
+                save_log_shipping_state(LogShippingState(fingerprint=next_fingerprint, offset=0), self._state_path)
+            offset = 0
+        if interval_elapsed:
+            self._last_shipped_at = now
+        if num_batches > 0:
+            logger.info(f"Shipped {num_batches} batches of the log")
+        return num_batches
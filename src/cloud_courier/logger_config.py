@@ -1,32 +1,319 @@
+import atexit
+import copy
+import functools
+import logging
+import queue
 import socket
+import threading
+import time
+import weakref
+from collections.abc import Callable
+from collections.abc import Mapping
 from logging.config import dictConfig
+from logging.handlers import QueueHandler
+from logging.handlers import QueueListener
 from pathlib import Path
+from typing import NamedTuple
+from typing import override
 
 import structlog
+from structlog.typing import EventDict
+from structlog.typing import WrappedLogger
+
+logger = logging.getLogger(__name__)
 
 SUBSYSTEM_NAME = "courier"
+LOG_MAX_BYTES = 25 * 1024 * 1024
+# the number of files the log is rotated into once it reaches LOG_MAX_BYTES (e.g. cloud-courier-courier.log.1), on top of the live log
+LOG_BACKUP_COUNT = 5
+# enough to ride out a burst of thousands of file events while the disk is slow, without holding an unbounded amount of memory if it never catches up
+LOG_QUEUE_MAX_RECORDS = 10_000
+# pass as `extra` for lines that make up the record of what was uploaded, so they're never rate limited (and can be searched for)
+AUDIT_LOG_EXTRA = {"audit": True}
+
+
+class LogRateLimit(NamedTuple):
+    max_per_window: int
+    window_seconds: float
+
+
+# by logger name, applying to its child loggers too. None turns off rate limiting for that logger
+DEFAULT_LOG_RATE_LIMITS: Mapping[str, LogRateLimit | None] = {"": LogRateLimit(max_per_window=5, window_seconds=60)}
+
+
+class _CallSiteWindow(NamedTuple):
+    started_at: float
+    num_logged: int = 0
+    num_suppressed: int = 0
+
+
+class RateLimitingFilter(logging.Filter):
+    """Limit how often each line of code can log, so a message in a hot path (like one logged on every loop iteration) doesn't fill the disk and rotate the upload history out of the log.
+
+    Records are grouped by where they were logged from, since most messages are f-strings that differ every time. Each call site may log
+    max_per_window records per window, after that they're suppressed until the window ends. The next record from that call site says how many were
+    suppressed, or if the call site has gone quiet, report_suppressed logs the number once its window has ended (see report_suppressed_log_records).
+    Warnings, errors and audit lines (see AUDIT_LOG_EXTRA) are always kept.
+    """
+
+    def __init__(
+        self,
+        *,
+        rate_limits: Mapping[str, LogRateLimit | None] = DEFAULT_LOG_RATE_LIMITS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        super().__init__()
+        self._rate_limits = rate_limits
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._windows: dict[tuple[str, str, int], _CallSiteWindow] = {}
+        # when logging synchronously each handler filters the same record, so it must only be counted the first time
+        self._decisions: weakref.WeakKeyDictionary[logging.LogRecord, bool] = weakref.WeakKeyDictionary()
+
+    def rate_limit_for(self, logger_name: str) -> LogRateLimit | None:
+        name = logger_name
+        while name not in self._rate_limits:
+            if name == "":
+                return None
+            name = name.rpartition(".")[0]
+        return self._rate_limits[name]
+
+    @override
+    def filter(self, record: logging.LogRecord) -> bool:
+        with self._lock:
+            decision = self._decisions.get(record)
+        if decision is None:
+            decision = self._should_log(record)
+            with self._lock:
+                self._decisions[record] = decision
+        return decision
+
+    def report_suppressed(self, *, include_current_windows: bool = False) -> None:
+        """Log how many records were suppressed at each call site whose window has ended, or at every call site if include_current_windows (e.g. when shutting down)."""
+        now = self._clock()
+        to_report: list[tuple[tuple[str, str, int], int]] = []
+        with self._lock:
+            for call_site, window in list(self._windows.items()):
+                rate_limit = self.rate_limit_for(call_site[0])
+                window_ended = rate_limit is None or now - window.started_at >= rate_limit.window_seconds
+                if window_ended:
+                    del self._windows[call_site]
+                elif include_current_windows and window.num_suppressed > 0:
+                    self._windows[call_site] = window._replace(num_suppressed=0)
+                else:
+                    continue
+                if window.num_suppressed > 0:
+                    to_report.append((call_site, window.num_suppressed))
+        for (logger_name, pathname, lineno), num_suppressed in to_report:
+            logging.getLogger(logger_name).info(
+                f"{num_suppressed:,} more log records from {pathname}:{lineno} were suppressed",
+                extra={"num_suppressed": num_suppressed},
+            )
+
+    def _should_log(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or getattr(record, "audit", False) or hasattr(record, "num_suppressed"):
+            return True
+        rate_limit = self.rate_limit_for(record.name)
+        if rate_limit is None:
+            return True
+        call_site = (record.name, record.pathname, record.lineno)
+        now = self._clock()
+        num_suppressed_in_previous_window = 0
+        with self._lock:
+            window = self._windows.get(call_site)
+            if window is None or now - window.started_at >= rate_limit.window_seconds:
+                if window is not None:
+                    num_suppressed_in_previous_window = window.num_suppressed
+                window = _CallSiteWindow(started_at=now)
+            if window.num_logged >= rate_limit.max_per_window:
+                self._windows[call_site] = window._replace(num_suppressed=window.num_suppressed + 1)
+                return False
+            self._windows[call_site] = window._replace(num_logged=window.num_logged + 1)
+        if num_suppressed_in_previous_window > 0:
+            record.msg = f"{record.getMessage()} [{num_suppressed_in_previous_window:,} more from the same place suppressed in the previous {rate_limit.window_seconds:g} s]"
+            record.args = None
+            record.num_suppressed = num_suppressed_in_previous_window
+        return True
+
+
+class HostFields:
+    """Add the name and IP address of the host to every log entry.
+
+    Looking up the IP address goes through DNS, which can block for many seconds when the network is down, so it's resolved on a background thread
+    and only added to entries once it's known rather than holding up startup.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.host_name = socket.gethostname()
+        self.host_ip: str | None = None
+        threading.Thread(target=self._resolve_ip, name="resolve-host-ip", daemon=True).start()
+
+    def _resolve_ip(self) -> None:
+        try:
+            self.host_ip = socket.gethostbyname(self.host_name)
+        except OSError:
+            logger.warning(f"Could not resolve the IP address of {self.host_name}, logging without it")
+
+    def __call__(
+        self,
+        _logger: WrappedLogger,  # noqa: ARG002 # the signature structlog calls processors with
+        _method_name: str,  # noqa: ARG002 # the signature structlog calls processors with
+        event_dict: EventDict,
+    ) -> EventDict:
+        _ = event_dict.setdefault("host.name", self.host_name)
+        if self.host_ip is not None:
+            _ = event_dict.setdefault("host.ip", self.host_ip)
+        return event_dict
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Hand records to a background thread that renders and writes them, so logging never blocks the thread that logged.
+
+    If the queue is full (the disk can't keep up), new records are dropped rather than waiting for space. How many were dropped is logged as
+    a warning once there is room again, so the gap in the log is visible.
+    """
 
+    def __init__(self, log_queue: queue.Queue[logging.LogRecord]):
+        super().__init__(log_queue)
+        self._lock = threading.Lock()
+        self.num_dropped = 0
+        self._num_dropped_not_yet_reported = 0
 
-def configure_logging(
-    *, log_filename_prefix: str = "logs/cloud-courier-", log_level: str = "INFO", suppress_console_logging: bool = False
-):
+    @override
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Unlike the base class, the record isn't formatted here (that's the work being moved off this thread), and the exception info is kept
+        # so the formatter can render the traceback. Only the message is merged with its arguments now, in case they're changed after logging.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    @override
+    def enqueue(self, record: logging.LogRecord) -> None:
+        with self._lock:
+            num_dropped = self._num_dropped_not_yet_reported
+        if num_dropped > 0:
+            if not self._put(self._dropped_records_warning(num_dropped)):
+                self._drop()
+                return
+            with self._lock:
+                self._num_dropped_not_yet_reported -= num_dropped
+        if not self._put(record):
+            self._drop()
+
+    def _put(self, record: logging.LogRecord) -> bool:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            return False
+        return True
+
+    def _drop(self) -> None:
+        with self._lock:
+            self.num_dropped += 1
+            self._num_dropped_not_yet_reported += 1
+
+    def _dropped_records_warning(self, num_dropped: int) -> logging.LogRecord:
+        return logger.makeRecord(
+            logger.name,
+            logging.WARNING,
+            __file__,
+            0,
+            f"Dropped {num_dropped} log records because they were logged faster than they could be written",
+            (),
+            None,
+        )
+
+
+class _LogQueueListener:
+    """The listener for the most recent call to configure_logging, so it can be stopped (writing out what's still queued) when logging is reconfigured or the process exits."""
+
+    current: QueueListener | None = None
+
+    @classmethod
+    def replace(cls, listener: QueueListener | None) -> None:
+        if cls.current is not None:
+            cls.current.stop()
+        cls.current = listener
+
+
+class _CurrentRateLimitingFilter:
+    """The filter for the most recent call to configure_logging, so what it has suppressed can be reported periodically and before the process exits."""
+
+    current: RateLimitingFilter | None = None
+
+
+def report_suppressed_log_records(*, include_current_windows: bool = False) -> None:
+    """Log how many records were suppressed by the rate limiting that configure_logging set up (see RateLimitingFilter.report_suppressed)."""
+    if _CurrentRateLimitingFilter.current is not None:
+        _CurrentRateLimitingFilter.current.report_suppressed(include_current_windows=include_current_windows)
+
+
+def stop_log_listener() -> None:
+    """Report what the rate limiting has suppressed, then write out whatever is still queued and stop the background thread that writes the log."""
+    report_suppressed_log_records(include_current_windows=True)
+    _LogQueueListener.replace(None)
+
+
+_ = atexit.register(stop_log_listener)
+
+
+def path_to_log_file(log_filename_prefix: str) -> Path:
+    """Return the path of the live JSON log file (its backups have .1, .2 etc. appended)."""
+    return Path(f"{log_filename_prefix}{SUBSYSTEM_NAME}.log")
+
+
+@functools.cache
+def _host_fields() -> HostFields:
+    # only resolved once per process, however many times logging is configured
+    return HostFields()
+
+
+def _switch_to_queue(*, max_records: int) -> DroppingQueueHandler:
+    root_logger = logging.getLogger()
+    handlers = list(root_logger.handlers)
+    log_queue: queue.Queue[logging.LogRecord] = queue.Queue(maxsize=max_records)
+    queue_handler = DroppingQueueHandler(log_queue)
+    for handler in handlers:
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(queue_handler)
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _LogQueueListener.replace(listener)
+    listener.start()
+    return queue_handler
+
+
+def configure_logging(  # noqa: PLR0913 # all keyword-only
+    *,
+    log_filename_prefix: str = "logs/cloud-courier-",
+    log_level: str = "INFO",
+    suppress_console_logging: bool = False,
+    asynchronous: bool = True,
+    queue_max_records: int = LOG_QUEUE_MAX_RECORDS,
+    rate_limits: Mapping[str, LogRateLimit | None] = DEFAULT_LOG_RATE_LIMITS,
+) -> DroppingQueueHandler | None:
     """Configure structlog to output both to the console and JSON to a file.
 
     This also configures stdlib logging to also use the same structlog formatters using details found here.
     https://www.structlog.org/en/stable/standard-library.html#rendering-using-structlog-based-formatters-within-logging
+
+    When asynchronous, records are rendered and written on a background thread (see DroppingQueueHandler), which is returned.
+    Chatty call sites are rate limited (see RateLimitingFilter) according to rate_limits.
     """
+    stop_log_listener()  # so nothing is still being written to the handlers that are about to be closed
     _ = structlog.contextvars.bind_contextvars(
         **{
             "event.dataset": "cloud-courier",
             "subsystem": SUBSYSTEM_NAME,
-            "host.name": socket.gethostname(),
-            "host.ip": socket.gethostbyname(socket.gethostname()),
         }
     )
 
     shared_processors = [
         # Merges context vars
         structlog.contextvars.merge_contextvars,
+        # Add the host name and (once it's been resolved) IP address
+        _host_fields(),
         # Add the log level to the event dict.
         structlog.stdlib.add_log_level,
         # Add the name of the logger to event dict.
@@ -64,12 +351,8 @@ def configure_logging(
         logger_factory=structlog.stdlib.LoggerFactory(),
     )
 
-    log_filename = f"{log_filename_prefix}{SUBSYSTEM_NAME}.log"
-    directory = Path(log_filename).parent
-    Path(directory).mkdir(parents=True, exist_ok=True)
-
-    # Defaults to 25MB
-    log_size_max_bytes = 25 * 1024 * 1024
+    log_filename = path_to_log_file(log_filename_prefix)
+    log_filename.parent.mkdir(parents=True, exist_ok=True)
 
     json_processors = [
         *shared_processors,
@@ -110,10 +393,10 @@ def configure_logging(
                 },
                 "file": {
                     "class": "logging.handlers.RotatingFileHandler",
-                    "filename": log_filename,
+                    "filename": str(log_filename),
                     "formatter": "json",
-                    "maxBytes": log_size_max_bytes,
-                    "backupCount": 5,
+                    "maxBytes": LOG_MAX_BYTES,
+                    "backupCount": LOG_BACKUP_COUNT,
                 },
             },
             "loggers": {
@@ -125,3 +408,13 @@ def configure_logging(
             },
         }
     )
+    rate_limiting_filter = RateLimitingFilter(rate_limits=rate_limits)
+    _CurrentRateLimitingFilter.current = rate_limiting_filter
+    if not asynchronous:
+        for handler in logging.getLogger().handlers:
+            handler.addFilter(rate_limiting_filter)
+        return None
+    queue_handler = _switch_to_queue(max_records=queue_max_records)
+    # filtered before being queued, so suppressed records don't take up room in the queue
+    queue_handler.addFilter(rate_limiting_filter)
+    return queue_handler
@@ -1,20 +1,22 @@
 import argparse
 import datetime
+import functools
 import logging
 import os
 import queue
+import random
+import shutil
 import threading
 import time
-from collections import defaultdict
+from collections.abc import Callable
 from collections.abc import Sequence
 from pathlib import Path
 from queue import SimpleQueue
+from typing import TYPE_CHECKING
+from typing import Any
 from typing import override
 
 import boto3
-from mypy_boto3_ssm.client import SSMClient
-from pydantic import BaseModel
-from pydantic import Field
 from watchdog.events import DirCreatedEvent
 from watchdog.events import DirModifiedEvent
 from watchdog.events import FileClosedEvent
@@ -26,29 +28,95 @@ from watchdog.observers import Observer
 
 from .aws_credentials import create_boto_session
 from .aws_credentials import get_role_arn
+from .aws_credentials import watch_credentials_file
 from .cli import get_version
 from .cli import parser
-from .constants import Checksum
+from .config_snapshot import load_config_snapshot
+from .config_snapshot import save_config_snapshot
+from .connectivity import CONNECTIVITY_PROBE_CLIENT_CONFIG
+from .connectivity import ConnectivityMonitor
+from .connectivity import is_connectivity_error
+from .courier_config_models import BACKLOG_BYTES_METRIC_NAME
+from .courier_config_models import BYTES_UPLOADED_METRIC_NAME
+from .courier_config_models import CLOUDWATCH_AGENT_NAMESPACE
 from .courier_config_models import CLOUDWATCH_HEARTBEAT_NAMESPACE
 from .courier_config_models import CLOUDWATCH_INSTANCE_ID_DIMENSION_NAME
+from .courier_config_models import FILES_UPLOADED_METRIC_NAME
 from .courier_config_models import HEARTBEAT_METRIC_NAME
+from .courier_config_models import OLDEST_PENDING_FILE_AGE_METRIC_NAME
+from .courier_config_models import PENDING_FILES_METRIC_NAME
+from .courier_config_models import QUEUED_EVENTS_IN_MEMORY_METRIC_NAME
+from .courier_config_models import QUEUED_EVENTS_SPILLED_METRIC_NAME
+from .courier_config_models import SECONDS_OFFLINE_METRIC_NAME
+from .courier_config_models import SECONDS_SINCE_PIPELINE_PROGRESS_METRIC_NAME
+from .courier_config_models import UPLOAD_DURATION_METRIC_NAME
+from .courier_config_models import UPLOAD_FAILURES_METRIC_NAME
+from .courier_config_models import UPLOAD_IN_PROGRESS_METRIC_NAME
+from .courier_config_models import UPLOAD_THROUGHPUT_METRIC_NAME
+from .courier_config_models import UPLOADS_PAUSED_METRIC_NAME
 from .courier_config_models import FolderToWatch
+from .event_queue import SpillingEventQueue
+from .file_event import FileEvent
+from .file_filter import FileFilter
+from .folder_scan import FolderScan
+from .liveness import PipelineLiveness
 from .load_config import CourierConfig
+from .load_config import diff_folders_to_watch
 from .load_config import extract_role_name_from_arn
+from .load_config import folder_matching_key
 from .load_config import load_config_from_aws
+from .log_shipping import LOG_SHIPPING_STATE_FILE_NAME
+from .log_shipping import LogShipper
+from .logger_config import AUDIT_LOG_EXTRA
+from .logger_config import LOG_BACKUP_COUNT
 from .logger_config import configure_logging
+from .logger_config import path_to_log_file
+from .logger_config import report_suppressed_log_records
+from .logger_config import stop_log_listener
+from .metrics import MetricsAggregator
+from .periodic_tasks import PERIODIC_TASK_TICK_SECONDS
+from .periodic_tasks import PeriodicTaskThread
+from .profiling import PROFILING_CONTROL_FILE_NAME
+from .profiling import Profiler
+from .startup_timer import IMPORTS_STARTED_AT
+from .startup_timer import StartupTimer
+from .status_server import DEFAULT_STATUS_ADDRESS
+from .status_server import PrometheusGauge
+from .status_server import StatusServer
+from .status_server import render_prometheus
+from .system_load import create_load_sampler
+from .system_load import process_rss_bytes
+from .upload import calculate_aws_checksum
 from .upload import convert_path_to_s3_object_key
 from .upload import upload_to_s3
+from .upload import versioned_object_key
+from .upload_record import open_upload_record
+from .upload_scheduler import UploadScheduler
+from .uploaded_files_index import FileStat
+from .work_journal import Backlog
+from .work_journal import WorkJournal
+
+if TYPE_CHECKING:
+    from mypy_boto3_cloudwatch.client import CloudWatchClient
+    from mypy_boto3_cloudwatch.type_defs import DimensionTypeDef
+    from mypy_boto3_s3.client import S3Client
+    from mypy_boto3_ssm.client import SSMClient
+    from watchdog.observers.api import ObservedWatch
 
 RESET_POINT_FOR_LOOP_ITERATION_COUNTER = 20  # this is only for assertions in unit tests, so just reset the value if it gets arbitrarily high so that it doesn't cause an overflow when running in production
 INSTALLED_AGENT_VERSION_TAG_KEY = "installed-cloud-courier-agent-version"  # Warning! This tag key is originally created by the cloud-courier-infrastructure Pulumi code, so don't change it here without changing it there
+EVENT_QUEUE_SPILL_FILE_NAME = "event_queue_overflow.jsonl"
+WORK_JOURNAL_FILE_NAME = "work_journal.sqlite3"
+CONFIG_SNAPSHOT_FILE_NAME = "config_snapshot.json"
+# after booting from the snapshot, how often loading the configuration from SSM is retried until it succeeds
+CONFIG_RECONCILE_RETRY_SECONDS = 60
+BACKLOG_BYTES_SAMPLE_SIZE = 1000  # the size of the backlog is estimated from this many of the pending files, so the cost of measuring it is bounded
 logger = logging.getLogger(__name__)
 
 
-class FileEventInfo(BaseModel, frozen=True):
-    file_system_event: FileSystemEvent
-    folder_config: FolderToWatch
-    timestamp: datetime.datetime = Field(default_factory=lambda: datetime.datetime.now(tz=datetime.UTC))
+def _monotonic_seconds() -> float:
+    # separate function for easy mocking in unit tests, since time_machine does not affect time.monotonic
+    return time.monotonic()
 
 
 def path_to_previously_uploaded_files_record() -> Path:
@@ -60,55 +128,54 @@ def path_to_previously_uploaded_files_record() -> Path:
             / "ProgramData"
             / "LabAutomationAndScreening"
             / "CloudCourier"
-            / "previously_uploaded_files.tsv"
+            / "previously_uploaded_files.sqlite3"
         )
     return (  # pragma: no cover # In Windows test environments, pathlib will probably throw an error about this
-        Path("~/") / ".lab_automation_and_screening" / "cloud_courier" / "previously_uploaded_files.tsv"
+        Path("~").expanduser() / ".lab_automation_and_screening" / "cloud_courier" / "previously_uploaded_files.sqlite3"
     )
 
 
-def create_record_file(record_file_path: Path):
-    if record_file_path.exists():
-        return
-
-    parent_dir = record_file_path.parent
-    parent_dir.mkdir(parents=True, exist_ok=True)
-    with record_file_path.open("w") as f:
-        _ = f.write("file_path\tcloud_path\tchecksum\n")
-
+LEGACY_RECORD_FOLDER = Path("~") / ".lab_automation_and_screening" / "cloud_courier"
+"""Where the upload record (and the rest of the state kept next to it) used to be on Linux: the home directory wasn't expanded, so it was a folder
+literally named ~ in the agent's working directory."""
 
-def add_to_upload_record(*, record_file_path: Path, uploaded_file_path: Path, checksum: str, cloud_path: str):
-    with record_file_path.open("a") as f:
-        _ = f.write(f"{uploaded_file_path}\t{cloud_path}\t{checksum}\n")
 
+def migrate_legacy_record_folder(*, record_path: Path, legacy_folder: Path = LEGACY_RECORD_FOLDER) -> None:
+    """Move everything in the legacy folder next to the upload record, so the history of uploaded files isn't lost (which would upload every file again).
 
-def parse_upload_record(record_file_path: Path) -> dict[Path, set[Checksum]]:
-    uploaded_files: dict[Path, set[Checksum]] = defaultdict(set)
-    with record_file_path.open("r") as f:
-        for line_idx, line in enumerate(f):
-            if line_idx == 0:
-                continue  # skip header
-            file_path, _, checksum = line.strip().split("\t")
-            uploaded_files[Path(file_path)].add(checksum)
-    return uploaded_files
+    A TSV record from before the SQLite record is then imported when the record is opened. Anything that already exists at the new location is left
+    where it is rather than overwritten.
+    """
+    if not legacy_folder.is_dir():
+        return
+    record_path.parent.mkdir(parents=True, exist_ok=True)
+    for legacy_file in sorted(legacy_folder.iterdir()):
+        destination = record_path.parent / legacy_file.name
+        if destination.exists():
+            logger.warning(f"Not moving {legacy_file} from the legacy folder, since {destination} already exists")
+            continue
+        logger.info(f"Moving {legacy_file} from the legacy folder to {destination}")
+        _ = shutil.move(legacy_file, destination)  # the working directory may be on a different file system
 
 
 class EventHandler(FileSystemEventHandler):
     def __init__(
         self,
         *,
-        file_system_events: SimpleQueue[FileEventInfo],
-        folder_config: FolderToWatch,
-        file_system_events_for_test_monitoring: SimpleQueue[FileEventInfo] | None = None,
+        folder_descriptor: str,
+        file_filter: FileFilter,
+        enqueue: Callable[[str, str], None],
     ):
         super().__init__()
-        self.file_system_events = file_system_events
-        self.folder_config = folder_config
-        self.file_system_events_for_test_monitoring = file_system_events_for_test_monitoring
+        self.folder_descriptor = folder_descriptor
+        self.file_filter = file_filter
+        self.enqueue = enqueue
 
     @override
     def on_any_event(self, event: FileSystemEvent) -> None:
-        logger.critical(f"{event} at {datetime.datetime.now(tz=datetime.UTC)}")
+        # this runs on the watchdog thread for every event, so it stays cheap unless debug logging is on
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"{event} at {datetime.datetime.now(tz=datetime.UTC)}")
 
     # FileCreatedEvent and FileModifiedEvent are prevalent on Windows
     @override
@@ -128,14 +195,14 @@ class EventHandler(FileSystemEventHandler):
         self._add_event_to_queue(event)
 
     def _add_event_to_queue(self, event: FileSystemEvent):
-        event_info = FileEventInfo(file_system_event=event, folder_config=self.folder_config)
-        self.file_system_events.put(event_info)
-        if self.file_system_events_for_test_monitoring is not None:
-            self.file_system_events_for_test_monitoring.put(event_info)
+        src_path = os.fsdecode(event.src_path)
+        if not self.file_filter.should_upload(src_path):
+            return
+        self.enqueue(src_path, self.folder_descriptor)
 
 
 class MainLoop:
-    def __init__(
+    def __init__(  # noqa: PLR0913 # all keyword-only
         self,
         *,
         stop_flag_dir: str,
@@ -143,6 +210,12 @@ class MainLoop:
         idle_loop_sleep_seconds: float,
         previously_uploaded_files_record_path: Path,
         create_duplicate_event_stream_for_test_monitoring: bool = False,
+        status_port: int | None = None,
+        status_address: str = DEFAULT_STATUS_ADDRESS,
+        profiler: Profiler | None = None,
+        startup_timer: StartupTimer | None = None,
+        log_file_path: Path | None = None,
+        periodic_task_tick_seconds: float = PERIODIC_TASK_TICK_SECONDS,
     ):
         super().__init__()
         self.num_loop_iterations = 0
@@ -151,36 +224,96 @@ class MainLoop:
         self.stop_flag_dir = Path(stop_flag_dir)
         self.boto_session = boto_session
         self._idle_loop_sleep_seconds = idle_loop_sleep_seconds
-        self.file_system_events: SimpleQueue[FileEventInfo]
-        self.file_system_events_for_test_monitoring: SimpleQueue[FileEventInfo]
-        self.observers: list[Observer] = []  # type: ignore[reportInvalidTypeForm] # pyright doesn't seem to like Observer
-        self.event_handler: EventHandler
+        self.file_system_events: SpillingEventQueue
+        self.file_system_events_for_test_monitoring: SimpleQueue[FileEvent]
+        self.observer: Observer  # type: ignore[reportInvalidTypeForm] # pyright doesn't seem to like Observer
+        self.watches: dict[str, ObservedWatch] = {}
+        self.watched_folders: dict[str, FolderToWatch] = {}
+        self.folder_scans: dict[str, FolderScan] = {}
         self.config: CourierConfig
         self.main_loop_entered = threading.Event()  # helpful for unit testing
-        create_record_file(self.previously_uploaded_files_record_path)
-        self.uploaded_files = parse_upload_record(self.previously_uploaded_files_record_path)
+        self.uploaded_files = open_upload_record(self.previously_uploaded_files_record_path)
+        self.work_journal = WorkJournal(self.previously_uploaded_files_record_path.parent / WORK_JOURNAL_FILE_NAME)
+        self.config_snapshot_path = self.previously_uploaded_files_record_path.parent / CONFIG_SNAPSHOT_FILE_NAME
+        self.config_reconciled = True
+        """Whether the configuration has been loaded from SSM since booting, rather than only from the snapshot."""
+        self.upload_scheduler = UploadScheduler(load_sampler=create_load_sampler())
+        self.metrics = MetricsAggregator(namespace=CLOUDWATCH_AGENT_NAMESPACE)
+        self.liveness = PipelineLiveness(clock=_monotonic_seconds)
+        self.connectivity = ConnectivityMonitor(probe=self._probe_connectivity, clock=_monotonic_seconds)
+        self.cloudwatch_client: CloudWatchClient
+        self.log_file_path = log_file_path
+        """The live JSON log, which is shipped to S3 when the configuration names a bucket for it. Never shipped if None."""
+        self.log_shipper: LogShipper | None = None
+        self.log_shipping_s3_client: S3Client
+        self.periodic_tasks: PeriodicTaskThread
+        self._periodic_task_tick_seconds = periodic_task_tick_seconds
+        self._status_port = status_port
+        self._status_address = status_address
+        self.status_server: StatusServer | None = None
+        self.profiler = profiler
+        self.startup_timer = StartupTimer() if startup_timer is None else startup_timer
         self.last_heartbeat_timestamp = datetime.datetime(
             year=1988, month=1, day=19, tzinfo=datetime.UTC
         )  # infinitely long ago
+        self.last_config_refresh_timestamp = self.last_heartbeat_timestamp
+        self.config_refresh_jitter_seconds = 0.0
+        self.role_arn: str | None = None
+        """Looked up once AWS can first be reached, rather than calling STS on every loop iteration."""
+        self.instance_tag_attempted = False
+        """Whether tagging the managed instance with the agent version has reached AWS (whether or not it succeeded), so it isn't tried again."""
 
     def _send_heartbeat_if_needed(self):
+        # runs in the periodic task thread, so a long upload in the main loop doesn't hold up the heartbeat
+        if not self.connectivity.is_online:
+            return  # it's sent as soon as the main loop's probe finds AWS can be reached again
         current_timestamp = datetime.datetime.now(tz=datetime.UTC)
         seconds_since_last_heartbeat = (current_timestamp - self.last_heartbeat_timestamp).total_seconds()
         if seconds_since_last_heartbeat >= self.config.app_config.heartbeat_frequency_seconds:
-            self._send_heartbeat()
-            self.last_heartbeat_timestamp = current_timestamp
+            with self.connectivity.detect_outage():
+                self._send_heartbeat()
+                self.last_heartbeat_timestamp = current_timestamp
+
+    def _ship_logs_if_due(self):
+        # runs in the periodic task thread, like the heartbeat, so shipping a large batch doesn't hold up uploads
+        if (
+            self.log_shipper is None
+            or self.config.app_config.log_shipping_s3_bucket_name is None
+            or not self.connectivity.is_online
+        ):
+            return
+        with self.connectivity.detect_outage():
+            _ = self.log_shipper.ship_if_due()
+
+    def _upload_log_batch(self, batch_name: str, compressed_batch: bytes):
+        app_config = self.config.app_config
+        assert app_config.log_shipping_s3_bucket_name is not None, "Logs are only shipped when a bucket is configured"
+        _ = self.log_shipping_s3_client.put_object(
+            Bucket=app_config.log_shipping_s3_bucket_name,
+            Key=f"{app_config.log_shipping_s3_key_prefix}/{self.config.role_name}/{batch_name}",
+            Body=compressed_batch,
+            ContentType="application/gzip",
+        )
+
+    def _probe_connectivity(self):
+        # the probe only runs while offline, so this logs the identity each time the connection comes back
+        logger.info(
+            f"Connected to AWS as: {get_role_arn(self.boto_session, client_config=CONNECTIVITY_PROBE_CLIENT_CONFIG)}"
+        )
+
+    def _metric_dimensions(self) -> list["DimensionTypeDef"]:
+        return [
+            {"Name": "Application", "Value": "CloudCourier"},
+            {"Name": CLOUDWATCH_INSTANCE_ID_DIMENSION_NAME, "Value": self.config.role_name},
+        ]
 
     def _send_heartbeat(self):
-        cloudwatch_client = self.boto_session.client("cloudwatch")
-        _ = cloudwatch_client.put_metric_data(
+        _ = self.cloudwatch_client.put_metric_data(
             Namespace=CLOUDWATCH_HEARTBEAT_NAMESPACE,
             MetricData=[
                 {
                     "MetricName": HEARTBEAT_METRIC_NAME,
-                    "Dimensions": [
-                        {"Name": "Application", "Value": "CloudCourier"},
-                        {"Name": CLOUDWATCH_INSTANCE_ID_DIMENSION_NAME, "Value": self.config.role_name},
-                    ],
+                    "Dimensions": self._metric_dimensions(),
                     "Timestamp": datetime.datetime.now(tz=datetime.UTC),
                     "Value": 1,
                     "Unit": "Count",
@@ -188,98 +321,476 @@ class MainLoop:
             ],
         )
         logger.info("Sent heartbeat to CloudWatch")
+        self._flush_metrics()
+
+    def _update_live_metrics(self) -> Backlog:
+        """Update the gauges that are measured rather than counted as things happen."""
+        self.metrics.set_gauge(QUEUED_EVENTS_IN_MEMORY_METRIC_NAME, self.file_system_events.in_memory_size)
+        self.metrics.set_gauge(QUEUED_EVENTS_SPILLED_METRIC_NAME, self.file_system_events.spilled_size)
+        self.metrics.set_gauge(
+            UPLOADS_PAUSED_METRIC_NAME,
+            int(self.upload_scheduler.pause_reason is not None or not self.connectivity.is_online),
+        )
+        self.metrics.set_gauge(SECONDS_OFFLINE_METRIC_NAME, self.connectivity.seconds_offline(), unit="Seconds")
+        backlog = self.work_journal.backlog(sample_size=BACKLOG_BYTES_SAMPLE_SIZE)
+        self.metrics.set_gauge(PENDING_FILES_METRIC_NAME, backlog.num_pending)
+        oldest_age = 0.0 if backlog.oldest_ready_at is None else max(0.0, time.time() - backlog.oldest_ready_at)
+        self.metrics.set_gauge(OLDEST_PENDING_FILE_AGE_METRIC_NAME, oldest_age, unit="Seconds")
+        sampled_bytes = 0
+        num_sampled = 0
+        for file_path in backlog.sampled_file_paths:
+            try:
+                sampled_bytes += Path(file_path).stat().st_size
+            except OSError:
+                continue  # deleted since it was queued
+            num_sampled += 1
+        backlog_bytes = 0 if num_sampled == 0 else sampled_bytes * backlog.num_pending / num_sampled
+        self.metrics.set_gauge(BACKLOG_BYTES_METRIC_NAME, backlog_bytes, unit="Bytes")
+        self.metrics.set_gauge(UPLOAD_IN_PROGRESS_METRIC_NAME, int(self.liveness.is_upload_in_progress))
+        self.metrics.set_gauge(
+            SECONDS_SINCE_PIPELINE_PROGRESS_METRIC_NAME, self.liveness.seconds_since_progress(), unit="Seconds"
+        )
+        return backlog
+
+    def _upload_record_size_bytes(self) -> int | None:
+        try:
+            return self.previously_uploaded_files_record_path.stat().st_size
+        except OSError:
+            return None
+
+    def _render_status_metrics(self) -> str:
+        backlog = self._update_live_metrics()
+        extra_gauges = [
+            PrometheusGauge("pending_files_by_folder", num_pending, {"folder": descriptor})
+            for descriptor, num_pending in sorted(backlog.num_pending_by_folder.items())
+        ]
+        for name, value in (
+            ("upload_record_size_bytes", self._upload_record_size_bytes()),
+            ("process_resident_memory_bytes", process_rss_bytes()),
+        ):
+            if value is not None:
+                extra_gauges.append(PrometheusGauge(name, value))
+        return render_prometheus(self.metrics.snapshot(), extra_gauges=extra_gauges)
+
+    def _build_status(self) -> dict[str, Any]:
+        backlog = self._update_live_metrics()
+        snapshot = self.metrics.snapshot()
+        bytes_uploaded = snapshot.counters.get(BYTES_UPLOADED_METRIC_NAME, 0)
+        upload_durations = snapshot.statistic_sets.get(UPLOAD_DURATION_METRIC_NAME)
+        upload_seconds = 0.0 if upload_durations is None else upload_durations.sum
+        return {
+            "version": get_version(),
+            "uploads_paused_because": self.upload_scheduler.pause_reason
+            if self.connectivity.is_online
+            else "AWS cannot be reached",
+            "seconds_offline": self.connectivity.seconds_offline(),
+            "queued_events": {
+                "in_memory": self.file_system_events.in_memory_size,
+                "spilled_to_disk": self.file_system_events.spilled_size,
+            },
+            "pending_files_by_folder": backlog.num_pending_by_folder,
+            "oldest_pending_file_age_seconds": snapshot.gauges[OLDEST_PENDING_FILE_AGE_METRIC_NAME],
+            "in_flight_uploads": [upload._asdict() for upload in self.liveness.in_flight_uploads()],
+            "seconds_since_pipeline_progress": self.liveness.seconds_since_progress(),
+            "files_uploaded": snapshot.counters.get(FILES_UPLOADED_METRIC_NAME, 0),
+            "bytes_uploaded": bytes_uploaded,
+            "average_throughput_bytes_per_second": None if upload_seconds == 0 else bytes_uploaded / upload_seconds,
+            "upload_failures": snapshot.counters.get(UPLOAD_FAILURES_METRIC_NAME, 0),
+            "recent_failures": [failure._asdict() for failure in self.liveness.recent_failures()],
+            "upload_record_size_bytes": self._upload_record_size_bytes(),
+            "process_resident_memory_bytes": process_rss_bytes(),
+        }
+
+    def _flush_metrics(self):
+        """Send the metrics collected since the last flush, which happens on the heartbeat cadence so it's around one API call per heartbeat."""
+        _ = self._update_live_metrics()
+        _ = self.metrics.flush(
+            self.cloudwatch_client,
+            dimensions=self._metric_dimensions(),
+            timestamp=datetime.datetime.now(tz=datetime.UTC),
+        )
+
+    def _refresh_config_if_needed(self):
+        # runs in the periodic task thread, like the heartbeat, so a long upload in the main loop doesn't hold up configuration changes
+        if not self.connectivity.is_online:
+            return  # SSM can't be reached either, so the refresh waits until the main loop's probe finds AWS again (and then happens straight away if it's due)
+        current_timestamp = datetime.datetime.now(tz=datetime.UTC)
+        seconds_since_last_refresh = (current_timestamp - self.last_config_refresh_timestamp).total_seconds()
+        seconds_between_refreshes = (
+            self.config.app_config.config_refresh_frequency_minutes * 60 + self.config_refresh_jitter_seconds
+            if self.config_reconciled
+            else CONFIG_RECONCILE_RETRY_SECONDS
+        )
+        if seconds_since_last_refresh >= seconds_between_refreshes:
+            if self._refresh_config():
+                self.config_reconciled = True
+            self.last_config_refresh_timestamp = current_timestamp
+            self._choose_config_refresh_jitter()
+
+    def _choose_config_refresh_jitter(self):
+        self.config_refresh_jitter_seconds = random.uniform(  # noqa: S311 # this only spreads out the load on SSM, it's nothing to do with security
+            0, self.config.app_config.config_refresh_jitter_seconds
+        )
+
+    def _refresh_config(self) -> bool:
+        """Reload the configuration and only adjust the watches for folders that were added, removed or changed, returning whether it could be loaded.
+
+        Unchanged folders keep their watch and anything already in the queue, so they are not rescanned. Neither are folders where only settings
+        that don't affect which files belong to them changed (e.g. the delay or the bucket), which are applied in place.
+        A folder that can't be watched with its new settings is logged and keeps its previous watch (if it had one), rather than failing the refresh.
+        """
+        try:
+            new_config = load_config_from_aws(self.boto_session, previous=self.config)
+        except Exception as e:
+            if is_connectivity_error(e):
+                self.connectivity.report_failure(e)
+            else:
+                logger.exception("Failed to refresh the configuration, continuing with the current configuration")
+            return False
+        save_config_snapshot(new_config, self.config_snapshot_path)
+        self.config = new_config
+        self._configure_upload_record()
+        if self.log_shipper is not None:
+            # the bucket and key prefix are looked up for every batch, only the batching needs updating
+            self.log_shipper.reconfigure(
+                max_batch_bytes=new_config.app_config.log_shipping_batch_max_bytes,
+                interval_seconds=new_config.app_config.log_shipping_interval_seconds,
+            )
+        diff = diff_folders_to_watch(self.watched_folders, new_config.folders_to_watch)
+        if diff.is_empty:
+            logger.info("Refreshed the configuration, no changes to the folders to watch")
+            return True
+        logger.info(
+            f"Refreshed the configuration. Added folders: {sorted(diff.added)}, removed folders: {sorted(diff.removed)}, changed folders: {sorted(diff.changed)}, updated folders: {sorted(diff.updated)}"
+        )
+        for descriptor in diff.removed:
+            self._stop_watching_folder(descriptor)
+        for descriptor in diff.updated:
+            # anything queued for the folder picks up the new settings, since they're looked up when it's handled
+            logger.info(f"Updating the settings of folder {descriptor} without watching it again")
+            self.watched_folders[descriptor] = new_config.folders_to_watch[descriptor]
+        for descriptor in diff.changed:
+            previous_folder_config = self.watched_folders[descriptor]
+            self._stop_watching_folder(descriptor)
+            if not self._try_start_watching_folder(descriptor, new_config.folders_to_watch[descriptor]):
+                _ = self._try_start_watching_folder(descriptor, previous_folder_config)
+        for descriptor in diff.added:
+            _ = self._try_start_watching_folder(descriptor, new_config.folders_to_watch[descriptor])
+        return True
+
+    def _try_start_watching_folder(self, descriptor: str, folder_config: FolderToWatch) -> bool:
+        """Start watching the folder, returning whether it could be (e.g. not if the folder doesn't exist), so one bad folder doesn't stop the others being watched.
+
+        A folder that couldn't be watched is tried again at the next refresh, since it doesn't match what's being watched.
+        """
+        try:
+            self._start_watching_folder(descriptor, folder_config)
+        except Exception:
+            logger.exception(f"Failed to start watching folder {descriptor}: {folder_config.folder_path}")
+            return False
+        return True
+
+    def _load_initial_config(self) -> CourierConfig:
+        """Start from the snapshot of the last configuration loaded from SSM when there is one, so monitoring begins without waiting on AWS (or while it can't be reached).
+
+        The snapshot is then reconciled with SSM by a refresh that's due straight away, which the periodic task thread runs once every folder is being watched.
+        Only the very first boot, before there's a snapshot, has to wait for SSM.
+        """
+        snapshot = load_config_snapshot(self.config_snapshot_path)
+        if snapshot is not None:
+            logger.info(
+                f"Starting from the configuration snapshot {self.config_snapshot_path}, it will be reconciled with SSM once monitoring has started"
+            )
+            self.config_reconciled = False
+            return snapshot
+        config = load_config_from_aws(self.boto_session)
+        save_config_snapshot(config, self.config_snapshot_path)
+        self.last_config_refresh_timestamp = datetime.datetime.now(tz=datetime.UTC)
+        return config
+
+    def _configure_upload_record(self):
+        app_config = self.config.app_config
+        self.uploaded_files.set_commit_policy(
+            commit_interval_seconds=app_config.upload_record_commit_interval_ms / 1000,
+            commit_max_entries=app_config.upload_record_commit_max_entries,
+            fsync=app_config.upload_record_fsync,
+        )
+        self.uploaded_files.set_bloom_filter(enabled=app_config.upload_record_bloom_filter)
 
     def _boot_up(self):
         """Perform initial activities before starting passive monitoring.
 
-        This happens when the loop first starts, and also after any difference is detected in the configuration.
+        This happens when the loop first starts. The configuration comes from the local snapshot when there is one (see _load_initial_config).
+        Files that were still pending when the agent last stopped are replayed from the work journal,
+        and existing files in each folder are scanned in the background, so monitoring begins right away. Later changes to the configuration are applied by _refresh_config.
         """
-        self.file_system_events = SimpleQueue()
+        self.watches.clear()
+        self.watched_folders.clear()
+        self.folder_scans.clear()
+
+        self.config = self._load_initial_config()
+        self.startup_timer.mark("load_config")
+        self._choose_config_refresh_jitter()
+        self._configure_upload_record()
+        self.file_system_events = SpillingEventQueue(
+            spill_file_path=self.previously_uploaded_files_record_path.parent / EVENT_QUEUE_SPILL_FILE_NAME,
+            max_in_memory=self.config.app_config.max_in_memory_queued_events,
+        )
         if self.create_duplicate_event_stream_for_test_monitoring:
             self.file_system_events_for_test_monitoring = SimpleQueue()
-        self.observers.clear()  # type: ignore[reportUnknownMemberType] # pyright doesn't seem to like Observer
-
-        self.config = load_config_from_aws(self.boto_session)
+        self.work_journal.remove_folders_except(self.config.folders_to_watch.keys())
         # TODO: check all the folders and raise an error if any don't exist
-        # TODO: implement refreshing the config
-        self._send_heartbeat_if_needed()
-        folder_config = next(iter(self.config.folders_to_watch.values()))  # TODO: support multiple folders to search
-        folder_path = Path(folder_config.folder_path)
-        glob_path = "*"
-        if folder_config.recursive:
-            glob_path = "**/*"
-        for file in folder_path.glob(glob_path):
-            if file.is_file():
-                # This isn't truly a FileClosedEvent, but it's easier to just have a single codepath for all uploading
-                event_info = FileEventInfo(
-                    file_system_event=FileClosedEvent(src_path=str(file)), folder_config=folder_config
+        # created here on the main thread, since creating clients from a boto session isn't thread-safe (using a client is)
+        self.cloudwatch_client = self.boto_session.client("cloudwatch")
+        periodic_tasks = [self._send_heartbeat_if_needed, self._refresh_config_if_needed, report_suppressed_log_records]
+        if self.log_file_path is not None:
+            self.log_shipping_s3_client = self.boto_session.client("s3")
+            self.log_shipper = LogShipper(
+                log_file_path=self.log_file_path,
+                state_path=self.previously_uploaded_files_record_path.parent / LOG_SHIPPING_STATE_FILE_NAME,
+                upload_batch=self._upload_log_batch,
+                max_batch_bytes=self.config.app_config.log_shipping_batch_max_bytes,
+                interval_seconds=self.config.app_config.log_shipping_interval_seconds,
+                backup_count=LOG_BACKUP_COUNT,
+            )
+            periodic_tasks.append(self._ship_logs_if_due)
+        if self.profiler is not None:
+            periodic_tasks.extend((self.profiler.check_control_file, self.profiler.dump_if_needed))
+        self.periodic_tasks = PeriodicTaskThread(tasks=periodic_tasks, tick_seconds=self._periodic_task_tick_seconds)
+        if self._status_port is not None:
+            self.status_server = StatusServer(
+                address=self._status_address,
+                port=self._status_port,
+                render_metrics=self._render_status_metrics,
+                build_status=self._build_status,
+            )
+            self.status_server.start()
+        self.observer = Observer()
+        self.observer.start()  # type: ignore[reportUnknownMemberType] # pyright doesn't seem to like Observer
+        _ = watch_credentials_file(self.boto_session, self.observer)  # type: ignore[reportUnknownMemberType] # pyright doesn't seem to like Observer
+        for descriptor, folder_config in self.config.folders_to_watch.items():
+            self._start_watching_folder(descriptor, folder_config)
+        self.startup_timer.mark("start_watching_folders")
+        # only started once every folder is being watched, since a configuration refresh changes the watches
+        self.periodic_tasks.start()
+        self.startup_timer.log()
+
+    def _enqueue_file(self, file_path: str, folder_descriptor: str):
+        # Both file system events and files found by scanning come through here, so there's a single codepath for all uploading
+        folder_config = self.watched_folders.get(folder_descriptor)
+        if (
+            folder_config is None
+        ):  # pragma: no cover # only happens if an event arrives while the folder is being unscheduled
+            return
+        # journal it before queueing, so that if the agent stops before it's uploaded it will be replayed at the next boot
+        self.work_journal.add_pending(
+            file_path=file_path,
+            folder_descriptor=folder_descriptor,
+            ready_at=time.time() + folder_config.delay_seconds_before_upload,
+        )
+        self._put_in_queue(FileEvent(file_path, folder_descriptor, _monotonic_seconds()))
+
+    def _put_in_queue(self, file_event: FileEvent):
+        self.file_system_events.put(file_event)
+        if self.create_duplicate_event_stream_for_test_monitoring:
+            self.file_system_events_for_test_monitoring.put(file_event)
+
+    def _replay_pending_files(self, descriptor: str, folder_config: FolderToWatch):
+        pending_files = self.work_journal.pending_files(descriptor)
+        if not pending_files:
+            return
+        logger.info(f"Replaying {len(pending_files)} pending files for folder {descriptor} from the work journal")
+        wall_clock_now = time.time()
+        monotonic_now = _monotonic_seconds()
+        for pending_file in pending_files:
+            if pending_file.attempts >= self.config.app_config.max_upload_attempts:
+                logger.error(
+                    f"Giving up on {pending_file.file_path} because {pending_file.attempts} attempts to upload it did not complete"
                 )
-                self.file_system_events.put(event_info)
-                if self.create_duplicate_event_stream_for_test_monitoring:
-                    self.file_system_events_for_test_monitoring.put(event_info)
+                self.work_journal.remove_pending(pending_file.file_path)
+                continue
+            # convert the ready-at time back into an equivalent monotonic event time, so the remaining delay is honored
+            seconds_until_ready = pending_file.ready_at - wall_clock_now
+            event_timestamp = monotonic_now + seconds_until_ready - folder_config.delay_seconds_before_upload
+            self._put_in_queue(FileEvent(pending_file.file_path, descriptor, event_timestamp))
+
+    def _start_watching_folder(self, descriptor: str, folder_config: FolderToWatch):
+        logger.info(f"Starting to watch folder {descriptor}: {folder_config.folder_path}")
+        file_filter = FileFilter(folder_config)
+        # scheduled before anything else is changed, so if it fails (e.g. the folder doesn't exist) nothing is left half set up
+        self.watches[descriptor] = self.observer.schedule(  # type: ignore[reportUnknownMemberType] # pyright doesn't seem to like Observer
+            EventHandler(folder_descriptor=descriptor, file_filter=file_filter, enqueue=self._enqueue_file),
+            folder_config.folder_path,
+            recursive=folder_config.recursive,
+        )
+        self.watched_folders[descriptor] = folder_config
+        self.work_journal.start_folder(descriptor, folder_matching_key(folder_config))
+        self._replay_pending_files(descriptor, folder_config)
+        # the watch is already active, so monitoring continues while the existing files are being scanned
+        scan = FolderScan(
+            descriptor=descriptor,
+            folder_config=folder_config,
+            file_filter=file_filter,
+            # the current settings are looked up for each file, so a change of policy applied in place also applies to the scan
+            is_already_uploaded=lambda file_path: self._is_uploaded_and_unchanged(
+                file_path, self.watched_folders.get(descriptor, folder_config)
+            ),
+            enqueue=self._enqueue_file,
+            work_journal=self.work_journal,
+        )
+        self.folder_scans[descriptor] = scan
+        scan.start()
+
+    def _stop_watching_folder(self, descriptor: str):
+        logger.info(f"Stopping watching folder {descriptor}: {self.watched_folders[descriptor].folder_path}")
+        self.observer.unschedule(self.watches.pop(descriptor))  # type: ignore[reportUnknownMemberType] # pyright doesn't seem to like Observer
+        del self.watched_folders[descriptor]
+        scan = self.folder_scans.pop(descriptor)
+        scan.stop()
+        scan.join()  # so the scan can't write anything else about this folder into the journal after it's cleared
+        self.work_journal.remove_folder(descriptor)
+
+    def _stop_folder_scans(self):
+        for scan in self.folder_scans.values():
+            scan.stop()
+        for scan in self.folder_scans.values():
+            scan.join()
+
+    def _is_uploaded_and_unchanged(self, file_path: Path, folder_config: FolderToWatch) -> bool:
+        """Check whether the file was already uploaded, and unless changes are ignored for its folder, still has the same size and modification time.
+
+        This never reads the file, so checking a file that hasn't changed stays cheap.
+        """
+        if file_path not in self.uploaded_files:
+            return False
+        if folder_config.change_policy == "ignore":
+            return True
+        try:
+            file_stats = file_path.stat()
+        except OSError:
+            return True  # it no longer exists, so there's nothing new to upload
+        return self.uploaded_files.file_stat(file_path) == FileStat(file_stats.st_size, file_stats.st_mtime_ns)
 
     def _upload_file(self, file_path: Path, folder_config: FolderToWatch):
+        # read the size and modification time before the contents, so a change part way through the upload is spotted the next time
+        file_stats = file_path.stat()
+        file_stat = FileStat(file_stats.st_size, file_stats.st_mtime_ns)
         object_key = convert_path_to_s3_object_key(str(file_path), folder_config)
-        checksum = upload_to_s3(
+        checksum = None
+        if file_path in self.uploaded_files:
+            # it's changed since it was uploaded (or was uploaded before sizes and modification times were recorded), so check whether the contents actually did
+            checksum = calculate_aws_checksum(file_path)
+            if checksum in self.uploaded_files.checksums(file_path):
+                logger.info(
+                    f"Skipping {file_path} because its contents are the same as when it was uploaded",
+                    extra=AUDIT_LOG_EXTRA,
+                )
+                self.uploaded_files.add(
+                    file_path=file_path,
+                    checksum=checksum,
+                    cloud_path=f"s3://{folder_config.s3_bucket_name}/{object_key}",
+                    file_stat=file_stat,
+                )
+                return
+            if folder_config.change_policy == "new_key":
+                object_key = versioned_object_key(object_key, checksum)
+            logger.info(
+                f"Uploading a new version of {file_path} because it changed since it was uploaded",
+                extra=AUDIT_LOG_EXTRA,
+            )
+        upload_started_at = time.perf_counter()
+        self.liveness.upload_started(str(file_path), total_bytes=file_stat.size)
+        try:
+            checksum = upload_to_s3(
+                file_path=file_path,
+                boto_session=self.boto_session,
+                bucket_name=folder_config.s3_bucket_name,
+                object_key=object_key,
+                checksum=checksum,
+                on_progress=functools.partial(self.liveness.record_upload_progress, str(file_path)),
+            )
+        finally:
+            self.liveness.upload_finished(str(file_path))
+        upload_seconds = time.perf_counter() - upload_started_at
+        self.metrics.increment(FILES_UPLOADED_METRIC_NAME)
+        self.metrics.increment(BYTES_UPLOADED_METRIC_NAME, file_stat.size, unit="Bytes")
+        self.metrics.record(UPLOAD_DURATION_METRIC_NAME, upload_seconds, unit="Seconds")
+        if (
+            upload_seconds > 0
+        ):  # pragma: no branch # perf_counter always advances across an upload, this only guards against a zero division
+            self.metrics.record(UPLOAD_THROUGHPUT_METRIC_NAME, file_stat.size / upload_seconds, unit="Bytes/Second")
+        self.uploaded_files.add(
             file_path=file_path,
-            boto_session=self.boto_session,
-            bucket_name=folder_config.s3_bucket_name,
-            object_key=object_key,
-        )
-        self.uploaded_files[file_path].add(checksum)
-        add_to_upload_record(
-            record_file_path=self.previously_uploaded_files_record_path,
-            uploaded_file_path=file_path,
             checksum=checksum,
             cloud_path=f"s3://{folder_config.s3_bucket_name}/{object_key}",
+            file_stat=file_stat,
         )
 
-    def _process_file_event_queue(self):
+    def _process_file_event_queue(self) -> bool:
+        """Handle the next event in the queue, returning whether there was one that was ready to be handled."""
         try:
-            event_info = self.file_system_events.get(timeout=0.05)
+            file_event = self.file_system_events.get(timeout=0.05)
         except queue.Empty:
-            return
-        event = event_info.file_system_event
-
-        seconds_since_event = (datetime.datetime.now(tz=datetime.UTC) - event_info.timestamp).total_seconds()
-        if seconds_since_event < event_info.folder_config.delay_seconds_before_upload:
+            return False
+        folder_config = self.watched_folders.get(file_event.folder_descriptor)
+        if folder_config is None:
+            logger.info(f"Skipping {file_event.src_path} because its folder is no longer being watched")
+            return True
+
+        seconds_since_event = _monotonic_seconds() - file_event.monotonic_timestamp
+        if seconds_since_event < folder_config.delay_seconds_before_upload:
             logger.info(
-                f"Skipping {event.src_path} because it was created less than {event_info.folder_config.delay_seconds_before_upload} seconds ago"
+                f"Skipping {file_event.src_path} because it was created less than {folder_config.delay_seconds_before_upload} seconds ago"
             )
             self.file_system_events.put(
-                event_info
+                file_event
             )  # put it back in the queue to check again later if enough time has elapsed
-            return
+            return False
 
-        assert isinstance(event.src_path, str), (
-            f"Expected event.src_path to be a string, but got {event.src_path} of type {type(event.src_path)}"
-        )
-        file_path = Path(event.src_path)
-        if file_path in self.uploaded_files:
+        file_path = Path(file_event.src_path)
+        if self._is_uploaded_and_unchanged(file_path, folder_config):
             logger.info(f"Skipping {file_path} because it has already been uploaded")
-            return  # TODO: decide how to handle changes to the file that alter the checksum
-        self._upload_file(file_path, event_info.folder_config)
+            self.work_journal.remove_pending(file_event.src_path)
+            return True
+        if not file_path.is_file():
+            # this can easily happen for files replayed from the work journal that were deleted while the agent was stopped
+            logger.warning(f"Skipping {file_path} because it no longer exists")
+            self.work_journal.remove_pending(file_event.src_path)
+            return True
+        return self._attempt_upload(file_event, folder_config)
+
+    def _attempt_upload(self, file_event: FileEvent, folder_config: FolderToWatch) -> bool:
+        """Upload the file, returning whether it was handled (rather than left in the queue because AWS couldn't be reached)."""
+        self.work_journal.record_attempt(file_event.src_path)
+        try:
+            self._upload_file(Path(file_event.src_path), folder_config)
+        except Exception as e:
+            self.liveness.record_failure(file_event.src_path, e)
+            if is_connectivity_error(e):
+                self.connectivity.report_failure(e)
+                # an outage is no fault of the file's, so it shouldn't count towards giving up on it.
+                # It's put back in the queue, and it's still in the work journal in case the agent stops during the outage
+                self.work_journal.forget_attempt(file_event.src_path)
+                self.file_system_events.put(file_event)
+                return False
+            self.metrics.increment(UPLOAD_FAILURES_METRIC_NAME)
+            self._flush_metrics()  # the agent is about to stop, so report the failure now
+            raise
+        self.work_journal.remove_pending(file_event.src_path)
+        return True
 
     def run(self) -> int:
         self._boot_up()
-        self.observers.append(Observer())  # type: ignore[reportUnknownMemberType] # pyright doesn't seem to like Observer
-        folder_config = next(iter(self.config.folders_to_watch.values()))
-        folder_path = folder_config.folder_path
-        self.observers[0].schedule(  # type: ignore[reportUnknownMemberType] # pyright doesn't seem to like Observer
-            EventHandler(
-                file_system_events=self.file_system_events,
-                folder_config=folder_config,
-                file_system_events_for_test_monitoring=self.file_system_events_for_test_monitoring
-                if self.create_duplicate_event_stream_for_test_monitoring
-                else None,
-            ),
-            folder_path,
-            recursive=folder_config.recursive,
-        )
-        self.observers[0].start()  # type: ignore[reportUnknownMemberType] # pyright doesn't seem to like Observer
         self.main_loop_entered.set()
+        try:
+            self._run_until_stop_flag()
+        finally:
+            self._shut_down()
+        return 0
+
+    def _run_until_stop_flag(self):
         while True:
-            self._send_heartbeat_if_needed()
+            self.liveness.record_progress()
             if any(
                 item.is_file() for item in self.stop_flag_dir.iterdir()
             ):  # TODO: maybe use a separate observer for the stop file
@@ -287,24 +798,74 @@ class MainLoop:
                     if item.is_file():
                         logger.info(f"Found stop flag file: {item}. Deleting it now")
                         item.unlink()
-                break
-            logger.info(f"Connected to AWS as: {get_role_arn(self.boto_session)}")
-            self._process_file_event_queue()
-
-            self._idle_loop_sleep()
+                return
+            self._log_aws_identity()
+            self._update_instance_tag_if_needed()
+            handled_event = False
+            # while offline, files keep being queued (and journaled) but nothing is taken off the queue until the probe finds AWS can be reached again
+            if self.connectivity.check() and self.upload_scheduler.is_upload_allowed(
+                self.config.app_config,
+                local_time=datetime.datetime.now(tz=datetime.UTC).astimezone(),
+                monotonic_now=_monotonic_seconds(),
+            ):
+                handled_event = self._process_file_event_queue()
+            self.work_journal.flush()
+
+            if not handled_event:  # while there's a backlog ready to upload, keep going without sleeping so it's drained as fast as possible
+                self._idle_loop_sleep()
             self.num_loop_iterations += 1
             if self.num_loop_iterations > RESET_POINT_FOR_LOOP_ITERATION_COUNTER:
                 self.num_loop_iterations = 0
-        self.observers[0].stop()  # type: ignore[reportUnknownMemberType] # pyright doesn't seem to like Observer
-        self.observers[0].join()  # type: ignore[reportUnknownMemberType] # pyright doesn't seem to like Observer
-        return 0
+
+    def _shut_down(self):
+        """Stop the background threads and close the files, whether the main loop stopped because of the stop flag or an error."""
+        try:
+            self.uploaded_files.commit()  # commit before anything else in the shutdown, in case it's interrupted
+        finally:
+            self.periodic_tasks.stop()
+            self.periodic_tasks.join()  # so it can't use the work journal after it's closed, or start watching a folder while shutting down
+            self._stop_folder_scans()
+            if self.status_server is not None:
+                self.status_server.stop()
+            if self.profiler is not None:
+                self.profiler.disable()
+            self.observer.stop()  # type: ignore[reportUnknownMemberType] # pyright doesn't seem to like Observer
+            self.observer.join()  # type: ignore[reportUnknownMemberType] # pyright doesn't seem to like Observer
+            self.file_system_events.close()
+            self.work_journal.close()
+            self.uploaded_files.close()
+
+    def _log_aws_identity(self):
+        if self.role_arn is not None or not self.connectivity.is_online:
+            return
+        with self.connectivity.detect_outage():
+            self.role_arn = get_role_arn(self.boto_session)
+            logger.info(f"Connected to AWS as: {self.role_arn}")
+
+    def _update_instance_tag_if_needed(self):
+        """Tag the managed instance with the agent version, once AWS can be reached.
+
+        This is left until the main loop is running, so booting during an outage still starts monitoring from the configuration snapshot.
+        The tag is only informational, so any other failure is logged rather than stopping the agent.
+        """
+        if self.instance_tag_attempted or self.role_arn is None or not self.connectivity.is_online:
+            return
+        try:
+            with self.connectivity.detect_outage():
+                _update_instance_tag(boto_session=self.boto_session, role_arn=self.role_arn)
+                self.instance_tag_attempted = True
+        except Exception:
+            logger.exception(
+                "Failed to tag the managed instance with the agent version, not trying again until restarted"
+            )
+            self.instance_tag_attempted = True
 
     def _idle_loop_sleep(self):
         # breaking out as separate method for easier testing
-        time.sleep(self._idle_loop_sleep_seconds)  # TODO: dont sleep if there are events in the queue
+        time.sleep(self._idle_loop_sleep_seconds)
 
 
-def _create_ssm_client(boto_session: boto3.Session) -> SSMClient:
+def _create_ssm_client(boto_session: boto3.Session) -> "SSMClient":
     # separate function for easy mocking in unit tests
     return boto_session.client(  # pragma: no cover # The SSM Client is always stubbed during tests, so this code never executes
         "ssm"
@@ -338,7 +899,20 @@ def _update_instance_tag(*, boto_session: boto3.Session, role_arn: str):
     )
 
 
+def _export_or_import_upload_record(*, export_path: str | None, import_path: str | None):
+    upload_record = open_upload_record(path_to_previously_uploaded_files_record())
+    try:
+        if import_path is not None:
+            upload_record.import_tsv(Path(import_path))
+        if export_path is not None:
+            _ = upload_record.export_tsv(Path(export_path))
+    finally:
+        upload_record.close()
+
+
 def entrypoint(argv: Sequence[str]) -> int:
+    startup_timer = StartupTimer(started_at=IMPORTS_STARTED_AT)
+    startup_timer.mark("imports")
     try:
         try:
             cli_args = parser.parse_args(argv)
@@ -348,22 +922,32 @@ def entrypoint(argv: Sequence[str]) -> int:
         log_folder = Path("logs")
         if cli_args.log_folder is not None:
             log_folder = Path(cli_args.log_folder)
-        configure_logging(
+        log_filename_prefix = str(log_folder / "cloud-courier-")
+        _ = configure_logging(
             log_level=cli_args.log_level,
-            log_filename_prefix=str(log_folder / "cloud-courier-"),
+            log_filename_prefix=log_filename_prefix,
             suppress_console_logging=bool(cli_args.no_console_logging),
+            asynchronous=not cli_args.synchronous_logging,
         )  # TODO: move the logs folder into ProgramData by default
+        startup_timer.mark("configure_logging")
         logger.info('Starting "cloud-courier"')
+        migrate_legacy_record_folder(record_path=path_to_previously_uploaded_files_record())
+        if cli_args.export_upload_record is not None or cli_args.import_upload_record is not None:
+            _export_or_import_upload_record(
+                export_path=cli_args.export_upload_record, import_path=cli_args.import_upload_record
+            )
+            return 0
         boto_session = (
             boto3.Session() if cli_args.use_generic_boto_session else create_boto_session(cli_args.aws_region)
         )
+        startup_timer.mark("create_boto_session")
         if cli_args.immediate_shut_down:
+            startup_timer.log()
             logger.info("Exiting due to --immediate-shut-down")
             return 0
-        role_arn = get_role_arn(boto_session)
-        logger.info(f"Connected to AWS as: {role_arn}")
-        _update_instance_tag(boto_session=boto_session, role_arn=role_arn)
         if cli_args.shut_down_before_main_loop:
+            # checks the credentials reach AWS without monitoring anything (the main loop is what tags the managed instance)
+            logger.info(f"Connected to AWS as: {get_role_arn(boto_session)}")
             logger.info("Exiting due to --shut-down-before-main-loop")
             return 0
         return MainLoop(
@@ -371,7 +955,19 @@ def entrypoint(argv: Sequence[str]) -> int:
             boto_session=boto_session,
             idle_loop_sleep_seconds=cli_args.idle_loop_sleep_seconds,
             previously_uploaded_files_record_path=path_to_previously_uploaded_files_record(),
+            status_port=cli_args.status_port,
+            status_address=cli_args.status_address,
+            profiler=Profiler(
+                output_dir=log_folder / "profiles",
+                control_file_path=log_folder / PROFILING_CONTROL_FILE_NAME,
+                always_enabled=bool(cli_args.profile),
+                dump_interval_seconds=cli_args.profiling_dump_interval_seconds,
+            ),
+            startup_timer=startup_timer,
+            log_file_path=path_to_log_file(log_filename_prefix),
         ).run()
     except Exception:
         logger.exception("An unhandled exception occurred")
         raise
+    finally:
+        stop_log_listener()  # so everything logged is written out, rather than waiting for the process to exit
@@ -0,0 +1,152 @@
+import datetime
+import logging
+import threading
+from collections import defaultdict
+from collections.abc import Sequence
+from typing import TYPE_CHECKING
+from typing import Literal
+from typing import NamedTuple
+
+if TYPE_CHECKING:
+    from mypy_boto3_cloudwatch.client import CloudWatchClient
+    from mypy_boto3_cloudwatch.type_defs import DimensionTypeDef
+    from mypy_boto3_cloudwatch.type_defs import MetricDatumTypeDef
+
+logger = logging.getLogger(__name__)
+
+MAX_METRIC_DATA_PER_PUT = 1000  # the limit for a single put_metric_data call
+type MetricUnit = Literal["Count", "Bytes", "Seconds", "Bytes/Second", "None"]
+
+
+class StatisticSet:
+    """The count, sum, minimum and maximum of the values recorded for a metric, which CloudWatch accepts in place of every individual value."""
+
+    def __init__(self):
+        super().__init__()
+        self.sample_count = 0
+        self.sum = 0.0
+        self.minimum = float("inf")
+        self.maximum = float("-inf")
+
+    def add(self, value: float) -> None:
+        self.sample_count += 1
+        self.sum += value
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+
+    def merge(self, other: "StatisticSet") -> None:
+        self.sample_count += other.sample_count
+        self.sum += other.sum
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+
+
+class MetricsSnapshot(NamedTuple):
+    """The totals of everything recorded since the agent started, which unlike what's sent to CloudWatch are never reset."""
+
+    counters: dict[str, float]
+    gauges: dict[str, float]
+    statistic_sets: dict[str, StatisticSet]
+    units: dict[str, MetricUnit]
+
+
+class MetricsAggregator:
+    """Collect metrics in memory and send them to CloudWatch in as few put_metric_data calls as possible.
+
+    Counters are summed and statistic sets are accumulated between flushes, then reset, while a gauge keeps its latest value and is sent on every flush.
+    A counter is sent as zero when nothing was counted, so a quiet period shows up in CloudWatch as zero rather than missing data.
+    Recording is thread-safe, since metrics come from the main loop, the folder scans and the watchdog threads.
+    """
+
+    def __init__(self, *, namespace: str):
+        super().__init__()
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._units: dict[str, MetricUnit] = {}
+        self._counters: dict[str, float] = defaultdict(float)
+        self._gauges: dict[str, float] = {}
+        self._statistic_sets: dict[str, StatisticSet] = defaultdict(StatisticSet)
+        self._counter_totals: dict[str, float] = defaultdict(float)
+        self._statistic_set_totals: dict[str, StatisticSet] = defaultdict(StatisticSet)
+
+    def increment(self, name: str, value: float = 1, unit: MetricUnit = "Count") -> None:
+        with self._lock:
+            self._units[name] = unit
+            self._counters[name] += value
+            self._counter_totals[name] += value
+
+    def set_gauge(self, name: str, value: float, unit: MetricUnit = "Count") -> None:
+        with self._lock:
+            self._units[name] = unit
+            self._gauges[name] = value
+
+    def record(self, name: str, value: float, unit: MetricUnit = "Count") -> None:
+        """Add a value to the statistic set for the metric (e.g. the duration of each upload)."""
+        with self._lock:
+            self._units[name] = unit
+            self._statistic_sets[name].add(value)
+            self._statistic_set_totals[name].add(value)
+
+    def snapshot(self) -> MetricsSnapshot:
+        with self._lock:
+            statistic_sets: dict[str, StatisticSet] = {}
+            for name, total in self._statistic_set_totals.items():
+                statistic_sets[name] = StatisticSet()
+                statistic_sets[name].merge(total)
+            return MetricsSnapshot(dict(self._counter_totals), dict(self._gauges), statistic_sets, dict(self._units))
+
+    def flush(
+        self,
+        cloudwatch_client: "CloudWatchClient",
+        *,
+        dimensions: Sequence["DimensionTypeDef"],
+        timestamp: datetime.datetime,
+    ) -> int:
+        """Send everything collected since the last flush, returning the number of put_metric_data calls made.
+
+        If sending fails, the counters and statistic sets that weren't sent are kept so they're included in the next flush.
+        """
+        with self._lock:
+            counters: dict[str, float] = self._counters
+            self._counters = defaultdict(float, dict.fromkeys(counters, 0.0))
+            statistic_sets: dict[str, StatisticSet] = self._statistic_sets
+            self._statistic_sets = defaultdict(StatisticSet)
+            gauges = dict(self._gauges)
+            units = dict(self._units)
+        metric_data: list[MetricDatumTypeDef] = [
+            {"MetricName": name, "Value": value, "Unit": units[name], "Dimensions": dimensions, "Timestamp": timestamp}
+            for name, value in [*counters.items(), *gauges.items()]
+        ]
+        metric_data.extend(
+            {
+                "MetricName": name,
+                "StatisticValues": {
+                    "SampleCount": statistic_set.sample_count,
+                    "Sum": statistic_set.sum,
+                    "Minimum": statistic_set.minimum,
+                    "Maximum": statistic_set.maximum,
+                },
+                "Unit": units[name],
+                "Dimensions": dimensions,
+                "Timestamp": timestamp,
+            }
+            for name, statistic_set in statistic_sets.items()
+        )
+        num_calls = 0
+        for start in range(0, len(metric_data), MAX_METRIC_DATA_PER_PUT):
+            try:
+                _ = cloudwatch_client.put_metric_data(
+                    Namespace=self.namespace, MetricData=metric_data[start : start + MAX_METRIC_DATA_PER_PUT]
+                )
+            except Exception:
+                logger.exception("Failed to send metrics to CloudWatch, they will be included in the next attempt")
+                unsent_names = {datum["MetricName"] for datum in metric_data[start:]}
+                with self._lock:
+                    for name in unsent_names & counters.keys():
+                        self._counters[name] += counters[name]
+                    for name in unsent_names & statistic_sets.keys():
+                        self._statistic_sets[name].merge(statistic_sets[name])
+                return num_calls
+            num_calls += 1
+        logger.info(f"Sent {len(metric_data)} metrics to CloudWatch in {num_calls} calls")
+        return num_calls
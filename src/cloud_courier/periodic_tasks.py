@@ -0,0 +1,51 @@
+import logging
+import threading
+from collections.abc import Callable
+from collections.abc import Sequence
+
+logger = logging.getLogger(__name__)
+
+PERIODIC_TASK_TICK_SECONDS = 1.0
+
+
+class PeriodicTaskThread:
+    """Run periodic tasks (like the heartbeat) in a background thread, so they keep running while the main loop is busy with a long upload.
+
+    Each task is called on every tick and decides for itself whether it's due. A task that raises is logged and tried again on the next tick,
+    so a transient network error doesn't stop the heartbeat for good.
+    """
+
+    def __init__(
+        self,
+        *,
+        tasks: Sequence[Callable[[], None]],
+        tick_seconds: float = PERIODIC_TASK_TICK_SECONDS,
+        name: str = "periodic-tasks",
+    ):
+        super().__init__()
+        self._tasks = tasks
+        self._tick_seconds = tick_seconds
+        self._stop_requested = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop_requested.set()
+
+    def join(self, timeout: float | None = None):
+        self._thread.join(timeout=timeout)
+
+    def is_alive(self) -> bool:
+        return self._thread.is_alive()
+
+    def _run(self):
+        while True:
+            for task in self._tasks:
+                try:
+                    task()
+                except Exception:
+                    logger.exception(f"Periodic task {getattr(task, '__name__', task)} failed, it will be tried again")
+            if self._stop_requested.wait(self._tick_seconds):
+                return
@@ -0,0 +1,220 @@
+import datetime
+import functools
+import logging
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from collections.abc import Callable
+from pathlib import Path
+from types import FrameType
+
+from .metrics import StatisticSet
+
+logger = logging.getLogger(__name__)
+
+# kept out of the stop flag directory, where any file is taken as a request to stop
+PROFILING_CONTROL_FILE_NAME = "enable-profiling"
+DEFAULT_PROFILING_DUMP_INTERVAL_SECONDS = 300
+DEFAULT_PROFILING_SAMPLE_INTERVAL_SECONDS = 0.01
+DEFAULT_PROFILING_TOP_N = 25
+TRACEMALLOC_FRAMES = 10
+
+
+class StageTimers:
+    """The time spent in each instrumented stage (e.g. calculating checksums), only collected while profiling is enabled."""
+
+    def __init__(self):
+        super().__init__()
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._timings: dict[str, StatisticSet] = {}
+
+    def record(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self._timings.setdefault(stage, StatisticSet()).add(seconds)
+
+    def pop_timings(self) -> dict[str, StatisticSet]:
+        with self._lock:
+            timings, self._timings = self._timings, {}
+        return timings
+
+
+STAGE_TIMERS = StageTimers()
+
+
+def timed_stage[**P, R](stage: str) -> Callable[[Callable[P, R]], Callable[P, R]]:
+    """Time every call of the decorated function as the given stage while profiling is enabled. When it's disabled, the only cost is checking a flag."""
+
+    def decorator(func: Callable[P, R]) -> Callable[P, R]:
+        @functools.wraps(func)
+        def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+            if not STAGE_TIMERS.enabled:
+                return func(*args, **kwargs)
+            started_at = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                STAGE_TIMERS.record(stage, time.perf_counter() - started_at)
+
+        return wrapper
+
+    return decorator
+
+
+def collapse_stack(frame: FrameType | None) -> str:
+    """Describe the call stack, outermost call first, in the collapsed format that flame graph tools read."""
+    calls: list[str] = []
+    while frame is not None:
+        calls.append(f"{frame.f_code.co_qualname} ({Path(frame.f_code.co_filename).name}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(calls))
+
+
+class StackSampler:
+    """A statistical CPU profiler, which periodically records the call stack of every thread (the main loop, the folder scans, the watchdog observers...).
+
+    Unlike cProfile, it covers all threads, and its overhead depends only on the sampling interval rather than on the number of function calls.
+    """
+
+    def __init__(self, *, interval_seconds: float):
+        super().__init__()
+        self._interval_seconds = interval_seconds
+        self._lock = threading.Lock()
+        self._stacks: Counter[str] = Counter()
+        self._stop_requested = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop_requested.set()
+        self._thread.join()
+
+    def pop_stacks(self) -> Counter[str]:
+        with self._lock:
+            stacks, self._stacks = self._stacks, Counter()
+        return stacks
+
+    def _run(self):
+        own_thread_id = threading.get_ident()
+        while not self._stop_requested.wait(self._interval_seconds):
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            frames = sys._current_frames()  # noqa: SLF001 # the standard way to sample other threads' stacks
+            with self._lock:
+                for thread_id, frame in frames.items():
+                    if thread_id == own_thread_id:
+                        continue
+                    self._stacks[f"{thread_names.get(thread_id, thread_id)};{collapse_stack(frame)}"] += 1
+
+
+class Profiler:
+    """Profile the running agent, to diagnose slow uploads or memory growth without redeploying.
+
+    Profiling is enabled either for the whole run (e.g. by the --profile CLI flag) or while the control file exists, so it can be turned on and off on a running agent.
+    While it's enabled, every dump interval it writes to the output directory: the sampled CPU stacks of all threads (in the collapsed format for flame graphs),
+    the top allocations from tracemalloc along with how they grew since the previous dump, and the per-stage timings.
+    The check_control_file and dump_if_needed methods are meant to be called periodically, e.g. by the PeriodicTaskThread.
+    """
+
+    def __init__(  # noqa: PLR0913 # all keyword-only, with defaults for everything except where the output goes
+        self,
+        *,
+        output_dir: Path,
+        control_file_path: Path | None = None,
+        always_enabled: bool = False,
+        dump_interval_seconds: float = DEFAULT_PROFILING_DUMP_INTERVAL_SECONDS,
+        sample_interval_seconds: float = DEFAULT_PROFILING_SAMPLE_INTERVAL_SECONDS,
+        top_n: int = DEFAULT_PROFILING_TOP_N,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        super().__init__()
+        self.output_dir = output_dir
+        self.control_file_path = control_file_path
+        self.always_enabled = always_enabled
+        self._dump_interval_seconds = dump_interval_seconds
+        self._sample_interval_seconds = sample_interval_seconds
+        self._top_n = top_n
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._sampler: StackSampler | None = None
+        self._previous_memory_snapshot: tracemalloc.Snapshot | None = None
+        self._last_dumped_at = clock()
+        self.dumped_file_paths: list[Path] = []
+        """Everything written so far, mostly for the unit tests."""
+
+    @property
+    def enabled(self) -> bool:
+        return self._sampler is not None
+
+    def enable(self) -> None:
+        with self._lock:
+            if self._sampler is not None:
+                return
+            logger.info(f"Enabling profiling, the results will be written to {self.output_dir}")
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            STAGE_TIMERS.enabled = True
+            self._sampler = StackSampler(interval_seconds=self._sample_interval_seconds)
+            self._sampler.start()
+            self._last_dumped_at = self._clock()
+
+    def disable(self) -> None:
+        """Write out what was collected since the last dump, and stop profiling."""
+        with self._lock:
+            if self._sampler is None:
+                return
+            self._dump()
+            self._sampler.stop()
+            self._sampler = None
+            STAGE_TIMERS.enabled = False
+            tracemalloc.stop()
+            self._previous_memory_snapshot = None
+            logger.info("Disabled profiling")
+
+    def check_control_file(self) -> None:
+        if self.always_enabled or (self.control_file_path is not None and self.control_file_path.exists()):
+            self.enable()
+        else:
+            self.disable()
+
+    def dump_if_needed(self) -> None:
+        with self._lock:
+            if self._sampler is None or self._clock() - self._last_dumped_at < self._dump_interval_seconds:
+                return
+            self._dump()
+
+    def _dump(self) -> None:
+        assert self._sampler is not None, "The sampler should only ever be missing while profiling is disabled"
+        self._last_dumped_at = self._clock()
+        prefix = self.output_dir / datetime.datetime.now(tz=datetime.UTC).strftime("profile-%Y%m%dT%H%M%S%fZ")
+
+        cpu_profile_path = prefix.with_name(f"{prefix.name}-cpu.collapsed")
+        stacks = self._sampler.pop_stacks()
+        _ = cpu_profile_path.write_text("".join(f"{stack} {count}\n" for stack, count in stacks.most_common()))
+
+        memory_path = prefix.with_name(f"{prefix.name}-memory.txt")
+        snapshot = tracemalloc.take_snapshot()
+        lines = [f"Top {self._top_n} allocations by line:"]
+        lines.extend(str(stat) for stat in snapshot.statistics("lineno")[: self._top_n])
+        if self._previous_memory_snapshot is not None:
+            lines.append(f"Top {self._top_n} changes since the previous dump:")
+            lines.extend(
+                str(stat) for stat in snapshot.compare_to(self._previous_memory_snapshot, "lineno")[: self._top_n]
+            )
+        self._previous_memory_snapshot = snapshot
+        _ = memory_path.write_text("\n".join(lines) + "\n")
+
+        stages_path = prefix.with_name(f"{prefix.name}-stages.tsv")
+        stage_lines = ["stage\tcalls\ttotal_seconds\tmin_seconds\tmax_seconds"]
+        for stage, timing in sorted(STAGE_TIMERS.pop_timings().items()):
+            stage_lines.append(f"{stage}\t{timing.sample_count}\t{timing.sum}\t{timing.minimum}\t{timing.maximum}")
+            logger.info(
+                f"Profiled stage {stage}: {timing.sample_count} calls taking {timing.sum:.3f} seconds in total (longest {timing.maximum:.3f} seconds)"
+            )
+        _ = stages_path.write_text("\n".join(stage_lines) + "\n")
+
+        self.dumped_file_paths.extend((cpu_profile_path, memory_path, stages_path))
+        logger.info(f"Wrote the profile ({sum(stacks.values())} stack samples) to {prefix}-*")
@@ -0,0 +1,36 @@
+import logging
+import time
+from collections.abc import Callable
+
+logger = logging.getLogger(__name__)
+
+# the package imports this module before anything else, so this is (close to) when importing the agent began
+IMPORTS_STARTED_AT = time.perf_counter()
+
+
+class StartupTimer:
+    """Time each phase of starting up (importing, configuring logging, loading the configuration...), so a slow start can be traced to its cause from the logs.
+
+    Each phase is taken to begin when the previous one was marked as finished.
+    """
+
+    def __init__(self, *, started_at: float | None = None, clock: Callable[[], float] = time.perf_counter):
+        super().__init__()
+        self._clock = clock
+        self._started_at = clock() if started_at is None else started_at
+        self._last_marked_at = self._started_at
+        self.phases: list[tuple[str, float]] = []
+
+    def mark(self, phase: str) -> None:
+        now = self._clock()
+        self.phases.append((phase, now - self._last_marked_at))
+        self._last_marked_at = now
+
+    @property
+    def total_seconds(self) -> float:
+        return self._last_marked_at - self._started_at
+
+    def log(self) -> None:
+        logger.info(
+            f"Started up in {self.total_seconds:.3f} seconds ({', '.join(f'{phase}: {seconds:.3f}' for phase, seconds in self.phases)})"
+        )
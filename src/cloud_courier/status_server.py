@@ -0,0 +1,153 @@
+import json
+import logging
+import re
+import threading
+from collections.abc import Callable
+from collections.abc import Mapping
+from collections.abc import Sequence
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from typing import Any
+from typing import NamedTuple
+from typing import override
+
+from .metrics import MetricsSnapshot
+from .metrics import MetricUnit
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATUS_ADDRESS = "127.0.0.1"  # only reachable from this computer unless a LAN address is chosen explicitly
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+PROMETHEUS_METRIC_PREFIX = "cloud_courier"
+_PROMETHEUS_UNIT_SUFFIXES: dict[MetricUnit, str] = {
+    "Bytes": "bytes",
+    "Seconds": "seconds",
+    "Bytes/Second": "bytes_per_second",
+}
+
+
+class PrometheusGauge(NamedTuple):
+    """A gauge that only appears on the status endpoint (not in CloudWatch), optionally with labels (e.g. the folder)."""
+
+    name: str
+    value: float
+    labels: Mapping[str, str] | None = None
+
+
+def prometheus_name(metric_name: str, unit: MetricUnit = "Count") -> str:
+    """Convert a CloudWatch metric name to a Prometheus one (e.g. UploadDuration in Seconds -> cloud_courier_upload_duration_seconds)."""
+    name = re.sub(r"(?<!^)(?=[A-Z])", "_", metric_name).lower()
+    suffix = _PROMETHEUS_UNIT_SUFFIXES.get(unit)
+    if suffix is not None and suffix not in name:
+        name = f"{name}_{suffix}"
+    return f"{PROMETHEUS_METRIC_PREFIX}_{name}"
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Mapping[str, str] | None) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label_value(value)}"' for key, value in labels.items()) + "}"
+
+
+def render_prometheus(snapshot: MetricsSnapshot, *, extra_gauges: Sequence[PrometheusGauge] = ()) -> str:
+    """Render the metrics in the Prometheus text exposition format.
+
+    Counters are the totals since the agent started, and statistic sets (e.g. upload durations) become summaries with only a count and a sum.
+    """
+    lines: list[str] = []
+    for name, value in sorted(snapshot.counters.items()):
+        metric = f"{prometheus_name(name, snapshot.units[name])}_total"
+        lines.extend((f"# TYPE {metric} counter", f"{metric} {value}"))
+    for name, value in sorted(snapshot.gauges.items()):
+        metric = prometheus_name(name, snapshot.units[name])
+        lines.extend((f"# TYPE {metric} gauge", f"{metric} {value}"))
+    for name, statistic_set in sorted(snapshot.statistic_sets.items()):
+        metric = prometheus_name(name, snapshot.units[name])
+        lines.extend(
+            (
+                f"# TYPE {metric} summary",
+                f"{metric}_sum {statistic_set.sum}",
+                f"{metric}_count {statistic_set.sample_count}",
+            )
+        )
+    gauge_types_written: set[str] = set()
+    for gauge in extra_gauges:
+        metric = f"{PROMETHEUS_METRIC_PREFIX}_{gauge.name}"
+        if metric not in gauge_types_written:
+            lines.append(f"# TYPE {metric} gauge")
+            gauge_types_written.add(metric)
+        lines.append(f"{metric}{_format_labels(gauge.labels)} {gauge.value}")
+    return "\n".join(lines) + "\n"
+
+
+def _create_request_handler(routes: Mapping[str, tuple[str, Callable[[], str]]]) -> type[BaseHTTPRequestHandler]:
+    class StatusRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            route = routes.get(self.path.split("?", 1)[0])
+            if route is None:
+                self.send_error(404)
+                return
+            content_type, render = route
+            try:
+                body = render().encode()
+            except Exception:
+                logger.exception(f"Failed to render the status for {self.path}")
+                self.send_error(500)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            _ = self.wfile.write(body)
+
+        @override
+        def log_message(self, format: str, *args: Any) -> None:
+            logger.debug(format % args)  # noqa: G002 # the format string comes from BaseHTTPRequestHandler
+
+    return StatusRequestHandler
+
+
+class StatusServer:
+    """Serve the agent's live status over HTTP, so it can be checked (or scraped by Prometheus) without reading the logs or calling AWS.
+
+    /metrics is in the Prometheus text format and /status is a JSON document. Each request is rendered on demand from the current state of the agent.
+    """
+
+    def __init__(
+        self,
+        *,
+        address: str,
+        port: int,
+        render_metrics: Callable[[], str],
+        build_status: Callable[[], Mapping[str, Any]],
+    ):
+        super().__init__()
+        self._server = ThreadingHTTPServer(
+            (address, port),
+            _create_request_handler(
+                {
+                    "/metrics": (PROMETHEUS_CONTENT_TYPE, render_metrics),
+                    "/status": ("application/json", lambda: json.dumps(build_status(), indent=2)),
+                }
+            ),
+        )
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="status-server", daemon=True)
+
+    @property
+    def port(self) -> int:
+        """The port being listened on, which is chosen by the operating system when the server is created with port 0."""
+        return self._server.server_address[1]
+
+    def start(self):
+        self._thread.start()
+        logger.info(f"Serving the status on http://{self._server.server_address[0]}:{self.port} (/metrics and /status)")
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
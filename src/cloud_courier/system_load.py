@@ -0,0 +1,246 @@
+import logging
+import os
+import time
+from abc import ABC
+from abc import abstractmethod
+from collections.abc import Callable
+from pathlib import Path
+from typing import NamedTuple
+from typing import override
+
+logger = logging.getLogger(__name__)
+
+_PROC_STAT_NUM_CPU_FIELDS = (
+    8  # user, nice, system, idle, iowait, irq, softirq, steal (guest time is already included in user and nice)
+)
+_PROC_STAT_IDLE_FIELDS = (3, 4)  # idle and iowait
+# in /proc/self/stat, counting from the field after the parenthesized command name (which can itself contain spaces)
+_PROC_SELF_STAT_UTIME_FIELD = 11
+_PROC_SELF_STAT_STIME_FIELD = 12
+_PROC_DISKSTATS_IO_TICKS_FIELD = 12  # milliseconds spent doing I/O
+_VIRTUAL_DISK_PREFIXES = ("loop", "ram", "zram", "dm-", "md")
+
+
+class LoadSample(NamedTuple):
+    """The system load since the previous sample, as percentages (None when it couldn't be measured)."""
+
+    cpu_percent: float | None
+    disk_busy_percent: float | None
+    """The busiest disk's share of the time it spent doing I/O."""
+
+
+class CpuTimes(NamedTuple):
+    busy: int
+    """Excludes the CPU time of this process, so the agent's own work (e.g. calculating the checksum of a large file) doesn't pause its uploads."""
+    total: int
+
+
+def _percent(numerator: float, denominator: float) -> float | None:
+    if denominator <= 0:
+        return None
+    # the agent's own CPU time is read separately from the system's, so subtracting it can overshoot slightly
+    return min(100.0, max(0.0, 100.0 * numerator / denominator))
+
+
+class LoadSampler(ABC):
+    """Measure CPU and disk load as the change in the operating system's cumulative counters between one sample and the next."""
+
+    def __init__(self, *, clock: Callable[[], float] = time.monotonic):
+        super().__init__()
+        self._clock = clock
+        self._previous_cpu_times = self._read_cpu_times()
+        self._previous_disk_io_ms = self._read_disk_io_ms()
+        self._previous_sampled_at = clock()
+
+    def sample(self) -> LoadSample:
+        cpu_times = self._read_cpu_times()
+        disk_io_ms = self._read_disk_io_ms()
+        sampled_at = self._clock()
+        cpu_percent = None
+        if cpu_times is not None and self._previous_cpu_times is not None:
+            cpu_percent = _percent(
+                cpu_times.busy - self._previous_cpu_times.busy, cpu_times.total - self._previous_cpu_times.total
+            )
+        disk_busy_percent = None
+        if disk_io_ms is not None and self._previous_disk_io_ms is not None:
+            disk_busy_percent = max(
+                (
+                    _percent(
+                        io_ms - self._previous_disk_io_ms.get(disk, io_ms),
+                        1000 * (sampled_at - self._previous_sampled_at),
+                    )
+                    or 0.0
+                    for disk, io_ms in disk_io_ms.items()
+                ),
+                default=None,
+            )
+        self._previous_cpu_times, self._previous_disk_io_ms, self._previous_sampled_at = (
+            cpu_times,
+            disk_io_ms,
+            sampled_at,
+        )
+        return LoadSample(cpu_percent, disk_busy_percent)
+
+    @abstractmethod
+    def _read_cpu_times(self) -> CpuTimes | None: ...
+
+    @abstractmethod
+    def _read_disk_io_ms(self) -> dict[str, int] | None:
+        """Get the cumulative milliseconds each physical disk has spent doing I/O."""
+
+
+class ProcLoadSampler(LoadSampler):
+    """Read the load on Linux from /proc/stat (less this process's time from /proc/self/stat) and /proc/diskstats."""
+
+    def __init__(
+        self,
+        *,
+        proc_dir: Path | None = None,
+        sys_block_dir: Path | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._proc_dir = Path("/proc") if proc_dir is None else proc_dir
+        self._sys_block_dir = Path("/sys/block") if sys_block_dir is None else sys_block_dir
+        super().__init__(clock=clock)
+
+    @override
+    def _read_cpu_times(self) -> CpuTimes | None:
+        try:
+            with (self._proc_dir / "stat").open() as f:
+                fields = f.readline().split()
+        except OSError:
+            logger.warning("Unable to read the CPU times", exc_info=True)
+            return None
+        times = [int(field) for field in fields[1 : _PROC_STAT_NUM_CPU_FIELDS + 1]]
+        total = sum(times)
+        busy = total - sum(times[idx] for idx in _PROC_STAT_IDLE_FIELDS)
+        return CpuTimes(busy - self._read_own_cpu_ticks(), total)
+
+    def _read_own_cpu_ticks(self) -> int:
+        """Get the CPU time used by all the threads of this process, in the same clock ticks as /proc/stat."""
+        try:
+            stat = (self._proc_dir / "self" / "stat").read_text()
+        except OSError:
+            logger.warning(
+                "Unable to read the CPU time of this process, so it is counted in the CPU load", exc_info=True
+            )
+            return 0
+        fields = stat.rpartition(")")[2].split()
+        return int(fields[_PROC_SELF_STAT_UTIME_FIELD]) + int(fields[_PROC_SELF_STAT_STIME_FIELD])
+
+    @override
+    def _read_disk_io_ms(self) -> dict[str, int] | None:
+        try:
+            lines = (self._proc_dir / "diskstats").read_text().splitlines()
+        except OSError:
+            logger.warning("Unable to read the disk statistics", exc_info=True)
+            return None
+        disk_io_ms: dict[str, int] = {}
+        for line in lines:
+            fields = line.split()
+            name = fields[2]
+            # partitions and virtual devices would count the same I/O again, so only whole physical disks (those listed in /sys/block) are included
+            if name.startswith(_VIRTUAL_DISK_PREFIXES) or not (self._sys_block_dir / name).exists():
+                continue
+            disk_io_ms[name] = int(fields[_PROC_DISKSTATS_IO_TICKS_FIELD])
+        return disk_io_ms
+
+
+class WindowsLoadSampler(LoadSampler):  # pragma: no cover # only runs on Windows
+    """Read the CPU load on Windows from GetSystemTimes (less this process's GetProcessTimes). Disk load isn't measured on Windows yet."""
+
+    @override
+    def _read_cpu_times(self) -> CpuTimes | None:
+        import ctypes  # noqa: PLC0415 # only available with the Windows API on Windows
+        from ctypes import wintypes  # noqa: PLC0415 # only available with the Windows API on Windows
+
+        idle, kernel, user = wintypes.FILETIME(), wintypes.FILETIME(), wintypes.FILETIME()
+        if not ctypes.windll.kernel32.GetSystemTimes(ctypes.byref(idle), ctypes.byref(kernel), ctypes.byref(user)):  # type: ignore[attr-defined] # windll only exists on Windows
+            return None
+
+        def to_int(file_time: wintypes.FILETIME) -> int:
+            return (file_time.dwHighDateTime << 32) | file_time.dwLowDateTime
+
+        total = to_int(kernel) + to_int(user)  # kernel time includes the idle time
+        creation, exit_, own_kernel, own_user = (
+            wintypes.FILETIME(),
+            wintypes.FILETIME(),
+            wintypes.FILETIME(),
+            wintypes.FILETIME(),
+        )
+        own = 0
+        if ctypes.windll.kernel32.GetProcessTimes(  # type: ignore[attr-defined] # windll only exists on Windows
+            ctypes.windll.kernel32.GetCurrentProcess(),  # type: ignore[attr-defined] # windll only exists on Windows
+            ctypes.byref(creation),
+            ctypes.byref(exit_),
+            ctypes.byref(own_kernel),
+            ctypes.byref(own_user),
+        ):
+            own = to_int(own_kernel) + to_int(own_user)  # the same 100 nanosecond units as the system times
+        return CpuTimes(total - to_int(idle) - own, total)
+
+    @override
+    def _read_disk_io_ms(self) -> dict[str, int] | None:
+        return None
+
+
+class NullLoadSampler(LoadSampler):
+    """For platforms where the load can't be measured, so it never defers uploads."""
+
+    @override
+    def _read_cpu_times(self) -> CpuTimes | None:
+        return None
+
+    @override
+    def _read_disk_io_ms(self) -> dict[str, int] | None:
+        return None
+
+
+def create_load_sampler() -> LoadSampler:
+    if os.name == "nt":  # pragma: no cover # the unit tests run on Linux
+        return WindowsLoadSampler()
+    if Path("/proc/stat").exists():
+        return ProcLoadSampler()
+    return NullLoadSampler()  # pragma: no cover # the unit tests run on Linux
+
+
+def _windows_process_rss_bytes() -> int | None:  # pragma: no cover # only runs on Windows
+    import ctypes  # noqa: PLC0415 # only available with the Windows API on Windows
+    from ctypes import wintypes  # noqa: PLC0415 # only available with the Windows API on Windows
+
+    class ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = (
+            ("cb", wintypes.DWORD),
+            ("PageFaultCount", wintypes.DWORD),
+            ("PeakWorkingSetSize", ctypes.c_size_t),
+            ("WorkingSetSize", ctypes.c_size_t),
+            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+            ("PagefileUsage", ctypes.c_size_t),
+            ("PeakPagefileUsage", ctypes.c_size_t),
+        )
+
+    counters = ProcessMemoryCounters()
+    counters.cb = ctypes.sizeof(counters)
+    if not ctypes.windll.psapi.GetProcessMemoryInfo(  # type: ignore[attr-defined] # windll only exists on Windows
+        ctypes.windll.kernel32.GetCurrentProcess(),  # type: ignore[attr-defined] # windll only exists on Windows
+        ctypes.byref(counters),
+        counters.cb,
+    ):
+        return None
+    return counters.WorkingSetSize
+
+
+def process_rss_bytes(*, proc_dir: Path | None = None) -> int | None:
+    """Get the resident set size (the physical memory in use) of this process, or None where it can't be read."""
+    if os.name == "nt":  # pragma: no cover # the unit tests run on Linux
+        return _windows_process_rss_bytes()
+    if proc_dir is None:
+        proc_dir = Path("/proc")
+    try:
+        resident_pages = int((proc_dir / "self" / "statm").read_text().split()[1])
+    except OSError:
+        return None
+    return resident_pages * os.sysconf("SC_PAGE_SIZE")
@@ -1,19 +1,28 @@
 import datetime
 import hashlib
 import logging
+from collections.abc import Callable
 from pathlib import Path
 from typing import TYPE_CHECKING
 
 import boto3
+from botocore.exceptions import ClientError
 
+from .aws_credentials import refresh_session_credentials
 from .courier_config_models import FolderToWatch
+from .logger_config import AUDIT_LOG_EXTRA
+from .profiling import timed_stage
 
 if TYPE_CHECKING:
+    from mypy_boto3_s3 import S3Client
     from mypy_boto3_s3.type_defs import CompletedPartTypeDef
 
 logger = logging.getLogger(__name__)
 
 MIN_MULTIPART_BYTES = 5 * 1024 * 1024
+VERSION_SUFFIX_LENGTH = 12
+# what S3 answers a request signed with credentials that have expired, e.g. because the SSM agent rotated them part way through a long upload
+EXPIRED_CREDENTIALS_ERROR_CODES = frozenset(("ExpiredToken", "TokenRefreshRequired", "RequestExpired"))
 
 
 class ChecksumMismatchError(Exception):
@@ -21,6 +30,34 @@ class ChecksumMismatchError(Exception):
         super().__init__(f"Checksum mismatch! Locally calculated: {local_checksum}, S3: {s3_checksum}")
 
 
+def _is_expired_credentials_error(error: BaseException) -> bool:
+    current: BaseException | None = error
+    while current is not None:
+        if (
+            isinstance(current, ClientError)
+            and current.response.get("Error", {}).get("Code") in EXPIRED_CREDENTIALS_ERROR_CODES
+        ):
+            return True
+        current = (
+            current.__cause__ or current.__context__
+        )  # e.g. upload_fileobj wraps the ClientError in an S3UploadFailedError
+    return False
+
+
+def _resign_if_credentials_expired[R](boto_session: boto3.Session, request: Callable[[], R]) -> R:
+    """Make the request, and if it's rejected because the credentials expired, refresh them and make it again (so it's signed with the new ones) rather than losing the upload."""
+    try:
+        return request()
+    except Exception as e:
+        if not _is_expired_credentials_error(e):
+            raise
+        logger.warning(
+            f"The AWS credentials expired part way through the upload, refreshing them and trying again: {e}"
+        )
+        _ = refresh_session_credentials(boto_session)
+        return request()
+
+
 def _get_part_size(file_path: Path, part_size_bytes: int = MIN_MULTIPART_BYTES) -> tuple[bool, int]:
     file_size = file_path.stat().st_size
     if file_size <= part_size_bytes:
@@ -38,11 +75,25 @@ def convert_path_to_s3_object_key(file_path: str, folder_config: FolderToWatch)
     return f"{folder_config.s3_key_prefix}/{file_path}"
 
 
+def versioned_object_key(object_key: str, checksum: str) -> str:
+    """Insert a version suffix, taken from the start of the checksum, before the extension of the object key (e.g. data/run.csv -> data/run.v0123456789ab.csv).
+
+    The suffix depends only on the contents of the file, so retrying an interrupted upload reuses the same key.
+    """
+    directory, _, file_name = object_key.rpartition("/")
+    stem, dot, extension = file_name.rpartition(".")
+    if not stem:  # no extension (or a dotfile)
+        stem, dot, extension = file_name, "", ""
+    versioned_name = f"{stem}.v{checksum[:VERSION_SUFFIX_LENGTH]}{dot}{extension}"
+    return f"{directory}/{versioned_name}" if directory else versioned_name
+
+
 def convert_path_to_s3_object_tag(file_path: str) -> str:
     # https://docs.aws.amazon.com/AmazonS3/latest/userguide/object-tagging.html
     return file_path.replace(":", "").replace("\\", "/")[-256:]
 
 
+@timed_stage("calculate_aws_checksum")
 def calculate_aws_checksum(file_path: Path, part_size_bytes: int = MIN_MULTIPART_BYTES) -> str:
     is_multi_part, part_size_bytes = _get_part_size(file_path, part_size_bytes)
     md5_list: list[bytes] = []
@@ -69,22 +120,62 @@ def dummy_function_during_multipart_upload():
     """
 
 
-def upload_to_s3(
+@timed_stage("upload_to_s3")
+def _upload_single_part(  # noqa: PLR0913 # all keyword-only
+    *,
+    boto_session: boto3.Session,
+    s3_client: "S3Client",
+    file_path: Path,
+    bucket_name: str,
+    object_key: str,
+    on_progress: Callable[[int], None] | None,
+) -> None:
+    num_bytes_reported = 0
+
+    def report_progress(num_bytes: int) -> None:
+        nonlocal num_bytes_reported
+        num_bytes_reported += num_bytes
+        if on_progress is not None:
+            on_progress(num_bytes)
+
+    def upload_attempt() -> None:
+        nonlocal num_bytes_reported
+        if num_bytes_reported > 0 and on_progress is not None:
+            # a retry sends the file from the start, so take back what the failed attempt reported rather than counting those bytes twice
+            on_progress(-num_bytes_reported)
+        num_bytes_reported = 0
+        with file_path.open("rb") as f:  # opened for each attempt, so a retry sends the file from the start
+            s3_client.upload_fileobj(f, bucket_name, object_key, Callback=report_progress)
+
+    _resign_if_credentials_expired(boto_session, upload_attempt)
+
+
+def upload_to_s3(  # noqa: PLR0913 # all keyword-only
     *,
     file_path: Path,
     boto_session: boto3.Session,
     bucket_name: str,
     object_key: str,
+    checksum: str | None = None,
+    on_progress: Callable[[int], None] | None = None,
 ) -> str:
-    checksum = calculate_aws_checksum(file_path)
+    """Upload the file and return its checksum (the S3 ETag), which is verified against S3. Pass the checksum if it was already calculated, to avoid reading the file an extra time.
+
+    on_progress is called with the number of bytes sent each time more of the file has been uploaded (and with a negative number if it has to start again).
+    """
+    if checksum is None:
+        checksum = calculate_aws_checksum(file_path)
     s3_client = boto_session.client("s3")
     is_multi_part, part_size_bytes = _get_part_size(file_path)
     file_size = file_path.stat().st_size
     logger.info(
-        f"Starting {'multi-' if is_multi_part else 'single '}part upload for '{file_path}' ({file_size} bytes) with part size {part_size_bytes} bytes. Destination: s3://{bucket_name}/{object_key}"
+        f"Starting {'multi-' if is_multi_part else 'single '}part upload for '{file_path}' ({file_size} bytes) with part size {part_size_bytes} bytes. Destination: s3://{bucket_name}/{object_key}",
+        extra=AUDIT_LOG_EXTRA,
     )
     if is_multi_part:
-        response = s3_client.create_multipart_upload(Bucket=bucket_name, Key=object_key)
+        response = _resign_if_credentials_expired(
+            boto_session, lambda: s3_client.create_multipart_upload(Bucket=bucket_name, Key=object_key)
+        )
         upload_id = response["UploadId"]
         parts: list[CompletedPartTypeDef] = []
 
@@ -97,47 +188,70 @@ def upload_to_s3(
                         break  # End of file reached
                     logger.info(f"Uploading part {part_number}...")
 
-                    part_response = s3_client.upload_part(
-                        Bucket=bucket_name, Key=object_key, PartNumber=part_number, UploadId=upload_id, Body=data
+                    part_response = _resign_if_credentials_expired(
+                        boto_session,
+                        lambda data=data, part_number=part_number: s3_client.upload_part(
+                            Bucket=bucket_name, Key=object_key, PartNumber=part_number, UploadId=upload_id, Body=data
+                        ),
                     )
                     parts.append({"ETag": part_response["ETag"], "PartNumber": part_number})
                     part_number += 1
+                    if on_progress is not None:
+                        on_progress(len(data))
                     dummy_function_during_multipart_upload()
 
             logger.info("Completing multipart upload...")
-            _ = s3_client.complete_multipart_upload(
-                Bucket=bucket_name, Key=object_key, UploadId=upload_id, MultipartUpload={"Parts": parts}
+            _ = _resign_if_credentials_expired(
+                boto_session,
+                lambda: s3_client.complete_multipart_upload(
+                    Bucket=bucket_name, Key=object_key, UploadId=upload_id, MultipartUpload={"Parts": parts}
+                ),
             )
 
         except Exception:
             logger.exception("An error occurred, aborting multipart upload.")
-            _ = s3_client.abort_multipart_upload(Bucket=bucket_name, Key=object_key, UploadId=upload_id)
+            _ = _resign_if_credentials_expired(
+                boto_session,
+                lambda: s3_client.abort_multipart_upload(Bucket=bucket_name, Key=object_key, UploadId=upload_id),
+            )
             raise
     else:
-        # Single part upload
-        with file_path.open("rb") as f:
-            s3_client.upload_fileobj(f, bucket_name, object_key)
+        _upload_single_part(
+            boto_session=boto_session,
+            s3_client=s3_client,
+            file_path=file_path,
+            bucket_name=bucket_name,
+            object_key=object_key,
+            on_progress=on_progress,
+        )
     file_stats = file_path.stat()
     last_modified_time = datetime.datetime.fromtimestamp(file_stats.st_mtime, tz=datetime.UTC).isoformat()
     # Creation time on Windows (st_ctime). On Linux, this is metadata change time.
     creation_time = datetime.datetime.fromtimestamp(file_stats.st_ctime, tz=datetime.UTC).isoformat()
     # TODO: add custom tags specified by the config
     # TODO: catch client error and log the attempted tag keys/values for easier troubleshooting---botocore.exceptions.ClientError: An error occurred (InvalidTag) when calling the PutObjectTagging operation: The TagValue you have provided is invalid
-    _ = s3_client.put_object_tagging(
-        Bucket=bucket_name,
-        Key=object_key,
-        Tagging={
-            "TagSet": [
-                {"Key": "uploaded-by", "Value": "cloud-courier"},
-                {"Key": "original-file-path", "Value": convert_path_to_s3_object_tag(str(file_path))},
-                {"Key": "file-last-modified-at", "Value": last_modified_time},
-                {"Key": "file-created-at", "Value": creation_time},
-            ]
-        },
+    _ = _resign_if_credentials_expired(
+        boto_session,
+        lambda: s3_client.put_object_tagging(
+            Bucket=bucket_name,
+            Key=object_key,
+            Tagging={
+                "TagSet": [
+                    {"Key": "uploaded-by", "Value": "cloud-courier"},
+                    {"Key": "original-file-path", "Value": convert_path_to_s3_object_tag(str(file_path))},
+                    {"Key": "file-last-modified-at", "Value": last_modified_time},
+                    {"Key": "file-created-at", "Value": creation_time},
+                ]
+            },
+        ),
     )
 
-    s3_etag = s3_client.head_object(Bucket=bucket_name, Key=object_key)["ETag"].strip('"')
+    s3_etag = _resign_if_credentials_expired(
+        boto_session, lambda: s3_client.head_object(Bucket=bucket_name, Key=object_key)
+    )["ETag"].strip('"')
     if s3_etag != checksum:
         raise ChecksumMismatchError(checksum, s3_etag)
-    logger.info("Upload completed successfully!")
+    logger.info(
+        f"Upload of '{file_path}' to s3://{bucket_name}/{object_key} completed successfully!", extra=AUDIT_LOG_EXTRA
+    )
     return checksum
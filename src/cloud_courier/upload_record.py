@@ -0,0 +1,464 @@
+import logging
+import os
+import sqlite3
+import threading
+from abc import ABC
+from abc import abstractmethod
+from collections import defaultdict
+from collections.abc import Iterable
+from collections.abc import Iterator
+from pathlib import Path
+from typing import NamedTuple
+from typing import override
+
+from .constants import Checksum
+from .profiling import timed_stage
+from .uploaded_files_index import BloomFilter
+from .uploaded_files_index import FileStat
+from .uploaded_files_index import UploadedFilesIndex
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_RECORD_TSV_HEADER = "file_path\tcloud_path\tchecksum\tsize\tmtime_ns\n"
+MIGRATED_TSV_SUFFIX = ".migrated"
+SQLITE_EXPORT_PAGE_SIZE = 10_000
+PARTIAL_LINE_SEARCH_BLOCK_BYTES = 64 * 1024
+BLOOM_FILTER_MIN_CAPACITY = 100_000
+_NUM_LEGACY_TSV_FIELDS = 3
+
+
+class UploadRecordEntry(NamedTuple):
+    file_path: str
+    cloud_path: str
+    checksum: Checksum
+    size: int | None = None
+    """The size and modification time of the file when it was uploaded (None in entries recorded before these were tracked)."""
+    mtime_ns: int | None = None
+
+    @property
+    def file_stat(self) -> FileStat | None:
+        if self.size is None or self.mtime_ns is None:
+            return None
+        return FileStat(self.size, self.mtime_ns)
+
+    def to_tsv_line(self) -> str:
+        size = "" if self.size is None else str(self.size)
+        mtime_ns = "" if self.mtime_ns is None else str(self.mtime_ns)
+        return f"{self.file_path}\t{self.cloud_path}\t{self.checksum}\t{size}\t{mtime_ns}\n"
+
+
+def _path_key(file_path: object) -> str:
+    # normcase makes lookups case-insensitive on Windows, matching how pathlib compares paths there (and the in-memory index)
+    return os.path.normcase(str(file_path))
+
+
+def create_record_file(record_file_path: Path):
+    if record_file_path.exists():
+        return
+
+    parent_dir = record_file_path.parent
+    parent_dir.mkdir(parents=True, exist_ok=True)
+    with record_file_path.open("w") as f:
+        _ = f.write(UPLOAD_RECORD_TSV_HEADER)
+
+
+def add_to_upload_record(*, record_file_path: Path, uploaded_file_path: Path, checksum: str, cloud_path: str):
+    with record_file_path.open("a") as f:
+        _ = f.write(UploadRecordEntry(str(uploaded_file_path), cloud_path, checksum).to_tsv_line())
+
+
+def _parse_optional_int(field: str) -> int | None:
+    return int(field) if field else None
+
+
+def _parse_tsv_line(line: str) -> UploadRecordEntry | None:
+    if not line.endswith("\n"):
+        return None
+    fields = line.removesuffix("\n").split("\t")
+    if len(fields) == _NUM_LEGACY_TSV_FIELDS:  # recorded before the size and modification time were tracked
+        file_path, cloud_path, checksum = fields
+        return UploadRecordEntry(file_path, cloud_path, checksum)
+    if len(fields) != len(UploadRecordEntry._fields):
+        return None
+    file_path, cloud_path, checksum, size, mtime_ns = fields
+    try:
+        return UploadRecordEntry(
+            file_path, cloud_path, checksum, _parse_optional_int(size), _parse_optional_int(mtime_ns)
+        )
+    except ValueError:
+        return None
+
+
+def iter_upload_record_tsv(record_file_path: Path) -> Iterator[UploadRecordEntry]:
+    """Read the entries of a TSV upload record.
+
+    A crash while appending can leave a partial last line, which is skipped with a warning rather than failing to start.
+    Lines without the size and modification time columns (from records written before they were added) are still read.
+    """
+    with record_file_path.open("r") as f:
+        for line_idx, line in enumerate(f):
+            if line_idx == 0:
+                continue  # skip header
+            entry = _parse_tsv_line(line)
+            if entry is None:
+                logger.warning(f"Skipping incomplete line {line_idx + 1} in {record_file_path}: {line!r}")
+                continue
+            yield entry
+
+
+def parse_upload_record(record_file_path: Path) -> dict[Path, set[Checksum]]:
+    uploaded_files: dict[Path, set[Checksum]] = defaultdict(set)
+    for entry in iter_upload_record_tsv(record_file_path):
+        uploaded_files[Path(entry.file_path)].add(entry.checksum)
+    return uploaded_files
+
+
+def _truncate_partial_last_line(record_file_path: Path):
+    # otherwise the next entry would be appended onto the end of the partial line, corrupting it too.
+    # The record can be millions of lines long, so the last newline is found by reading backwards from the end a block at a time
+    with record_file_path.open("rb+") as f:
+        file_size = f.seek(0, os.SEEK_END)
+        block_end = file_size
+        while block_end > 0:
+            block_start = max(0, block_end - PARTIAL_LINE_SEARCH_BLOCK_BYTES)
+            _ = f.seek(block_start)
+            last_newline = f.read(block_end - block_start).rfind(b"\n")
+            if last_newline != -1:
+                complete_lines_end = block_start + last_newline + 1
+                break
+            block_end = block_start
+        else:
+            complete_lines_end = 0
+        if complete_lines_end == file_size:
+            return
+        logger.warning(f"Removing the incomplete last line of {record_file_path}, probably left by a crash")
+        _ = f.truncate(complete_lines_end)
+        if complete_lines_end == 0:  # not even the header was finished
+            _ = f.seek(0)
+            _ = f.write(UPLOAD_RECORD_TSV_HEADER.encode())
+
+
+class UploadRecord(ABC):
+    """The record of which files have already been uploaded, and their checksums.
+
+    Added entries are committed together (group commit): once commit_max_entries are waiting, or commit_interval_seconds after the first of them was added
+    (by a timer, independent of the main loop), whichever comes first. So a crash can lose at most that many entries or that much time's worth of entries,
+    and those files would just be uploaded again. With fsync, committed entries also survive a power loss, otherwise they only survive a crash of the agent.
+    The default interval of zero commits every entry as soon as it's added. Entries that are waiting to be committed are already visible to lookups.
+
+    Each path also has the size and modification time it had at its most recent upload, so a change to the file can be spotted without reading it.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.RLock()
+        self._uncommitted: list[UploadRecordEntry] = []
+        self._uncommitted_checksums: dict[str, set[Checksum]] = defaultdict(set)
+        self._uncommitted_file_stats: dict[str, FileStat] = {}
+        self._commit_timer: threading.Timer | None = None
+        self.commit_interval_seconds = 0.0
+        self.commit_max_entries = 1
+        self.fsync = True
+
+    def set_commit_policy(self, *, commit_interval_seconds: float, commit_max_entries: int, fsync: bool) -> None:
+        with self._lock:
+            self.commit_interval_seconds = commit_interval_seconds
+            self.commit_max_entries = commit_max_entries
+            self.fsync = fsync
+            self._apply_fsync_policy()
+
+    def set_bloom_filter(self, *, enabled: bool) -> None:
+        """Turn on or off a Bloom filter in front of lookups, so that paths which were never uploaded can usually be ruled out without reading the record."""
+        with self._lock:
+            self._set_bloom_filter(enabled=enabled)
+
+    def __contains__(self, file_path: object) -> bool:
+        with self._lock:
+            return _path_key(file_path) in self._uncommitted_checksums or self._contains_committed(file_path)
+
+    def checksums(self, file_path: Path) -> set[Checksum]:
+        with self._lock:
+            return self._committed_checksums(file_path) | self._uncommitted_checksums.get(_path_key(file_path), set())
+
+    def file_stat(self, file_path: Path) -> FileStat | None:
+        """Get the size and modification time the file had when it was most recently uploaded (None if they weren't recorded)."""
+        with self._lock:
+            uncommitted = self._uncommitted_file_stats.get(_path_key(file_path))
+            if uncommitted is not None:
+                return uncommitted
+            return self._committed_file_stat(file_path)
+
+    def add(self, *, file_path: Path, checksum: Checksum, cloud_path: str, file_stat: FileStat | None = None) -> None:
+        """Record an upload of the file.
+
+        Adding a checksum that's already recorded for the path just updates its size and modification time (the existing cloud path is kept in the SQLite record).
+        """
+        size, mtime_ns = (None, None) if file_stat is None else file_stat
+        with self._lock:
+            self._uncommitted.append(UploadRecordEntry(str(file_path), cloud_path, checksum, size, mtime_ns))
+            self._uncommitted_checksums[_path_key(file_path)].add(checksum)
+            if file_stat is not None:
+                self._uncommitted_file_stats[_path_key(file_path)] = file_stat
+            if len(self._uncommitted) >= self.commit_max_entries or self.commit_interval_seconds <= 0:
+                self.commit()
+            elif self._commit_timer is None:
+                self._commit_timer = threading.Timer(self.commit_interval_seconds, self.commit)
+                self._commit_timer.daemon = True
+                self._commit_timer.start()
+
+    def commit(self) -> None:
+        """Durably write all entries that are waiting to be committed."""
+        with self._lock:
+            if self._commit_timer is not None:
+                self._commit_timer.cancel()
+                self._commit_timer = None
+            if not self._uncommitted:
+                return
+            self._write(self._uncommitted)
+            self._uncommitted = []
+            self._uncommitted_checksums.clear()
+            self._uncommitted_file_stats.clear()
+
+    def add_many(self, entries: Iterable[UploadRecordEntry]) -> None:
+        """Write a batch of entries straight away (e.g. when importing)."""
+        with self._lock:
+            self.commit()
+            self._write(entries)
+
+    def entries(self) -> Iterator[UploadRecordEntry]:
+        self.commit()
+        return self._committed_entries()
+
+    def close(self) -> None:
+        with self._lock:
+            self.commit()
+            self._close()
+
+    def export_tsv(self, tsv_path: Path) -> int:
+        num_entries = 0
+        with tsv_path.open("w") as f:
+            _ = f.write(UPLOAD_RECORD_TSV_HEADER)
+            for entry in self.entries():
+                _ = f.write(entry.to_tsv_line())
+                num_entries += 1
+        logger.info(f"Exported {num_entries} upload record entries to {tsv_path}")
+        return num_entries
+
+    def import_tsv(self, tsv_path: Path) -> None:
+        self.add_many(iter_upload_record_tsv(tsv_path))
+        logger.info(f"Imported the upload record entries from {tsv_path}")
+
+    @abstractmethod
+    def _contains_committed(self, file_path: object) -> bool: ...
+
+    @abstractmethod
+    def _committed_checksums(self, file_path: Path) -> set[Checksum]: ...
+
+    @abstractmethod
+    def _committed_file_stat(self, file_path: Path) -> FileStat | None: ...
+
+    @abstractmethod
+    def _committed_entries(self) -> Iterator[UploadRecordEntry]: ...
+
+    @abstractmethod
+    def _write(self, entries: Iterable[UploadRecordEntry]) -> None: ...
+
+    @abstractmethod
+    def _apply_fsync_policy(self) -> None: ...
+
+    @abstractmethod
+    def _set_bloom_filter(self, *, enabled: bool) -> None: ...
+
+    @abstractmethod
+    def _close(self) -> None: ...
+
+
+class TsvUploadRecord(UploadRecord):
+    """An append-only TSV file, which is loaded at startup into a compact in-memory index.
+
+    The file is kept open for appending, rather than being opened and closed for every entry.
+    """
+
+    def __init__(self, record_file_path: Path):
+        super().__init__()
+        self._record_file_path = record_file_path
+        create_record_file(record_file_path)
+        _truncate_partial_last_line(record_file_path)
+        self._uploaded_files = UploadedFilesIndex()
+        self._uploaded_files.add_many(
+            (entry.file_path, entry.checksum, entry.file_stat) for entry in iter_upload_record_tsv(record_file_path)
+        )
+        self._file = record_file_path.open("a")
+
+    @override
+    def _contains_committed(self, file_path: object) -> bool:
+        return file_path in self._uploaded_files
+
+    @override
+    def _committed_checksums(self, file_path: Path) -> set[Checksum]:
+        return self._uploaded_files.checksums(file_path)
+
+    @override
+    def _committed_file_stat(self, file_path: Path) -> FileStat | None:
+        return self._uploaded_files.file_stat(file_path)
+
+    @override
+    def _committed_entries(self) -> Iterator[UploadRecordEntry]:
+        return iter_upload_record_tsv(self._record_file_path)
+
+    @override
+    def _write(self, entries: Iterable[UploadRecordEntry]) -> None:
+        for entry in entries:
+            self._uploaded_files.add(entry.file_path, entry.checksum, entry.file_stat)
+            _ = self._file.write(entry.to_tsv_line())
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    @override
+    def _apply_fsync_policy(self) -> None:
+        pass  # checked on every write
+
+    @override
+    def _set_bloom_filter(self, *, enabled: bool) -> None:
+        pass  # the in-memory index already answers every lookup quickly
+
+    @override
+    def _close(self) -> None:
+        self._file.close()
+
+
+class SqliteUploadRecord(UploadRecord):
+    """A SQLite database (in WAL mode) indexed on path and checksum.
+
+    Lookups are answered by the database, so nothing is loaded into memory at startup no matter how large the record grows,
+    and every commit is an atomic transaction, so a crash can never leave a partial entry behind.
+    """
+
+    def __init__(self, record_file_path: Path):
+        super().__init__()
+        record_file_path.parent.mkdir(parents=True, exist_ok=True)
+        self._bloom_filter: BloomFilter | None = None
+        self._connection = sqlite3.connect(record_file_path, isolation_level=None, check_same_thread=False)
+        _ = self._connection.execute("PRAGMA journal_mode=WAL")
+        self._apply_fsync_policy()
+        _ = self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS uploaded_files (file_path TEXT NOT NULL, cloud_path TEXT NOT NULL, checksum TEXT NOT NULL, size INTEGER, mtime_ns INTEGER, PRIMARY KEY (file_path, checksum)) WITHOUT ROWID"
+        )
+        _ = self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS uploaded_files_by_checksum ON uploaded_files (checksum)"
+        )
+        columns = {row[1] for row in self._connection.execute("PRAGMA table_info(uploaded_files)")}
+        for column in ("size", "mtime_ns"):
+            if column not in columns:  # a record created before the size and modification time were tracked
+                _ = self._connection.execute(f"ALTER TABLE uploaded_files ADD COLUMN {column} INTEGER")
+
+    @override
+    def _contains_committed(self, file_path: object) -> bool:
+        if self._bloom_filter is not None and not self._bloom_filter.might_contain(file_path):
+            return False
+        row = self._connection.execute(
+            "SELECT 1 FROM uploaded_files WHERE file_path = ? LIMIT 1", (_path_key(file_path),)
+        ).fetchone()
+        return row is not None
+
+    @override
+    def _committed_checksums(self, file_path: Path) -> set[Checksum]:
+        rows = self._connection.execute(
+            "SELECT checksum FROM uploaded_files WHERE file_path = ?", (_path_key(file_path),)
+        ).fetchall()
+        return {row[0] for row in rows}
+
+    @override
+    def _committed_file_stat(self, file_path: Path) -> FileStat | None:
+        # only the row for the most recent upload of the path has its size and modification time set
+        row = self._connection.execute(
+            "SELECT size, mtime_ns FROM uploaded_files WHERE file_path = ? AND size IS NOT NULL LIMIT 1",
+            (_path_key(file_path),),
+        ).fetchone()
+        return None if row is None else FileStat(*row)
+
+    @override
+    def _committed_entries(self) -> Iterator[UploadRecordEntry]:
+        # read a page at a time (continuing from the last primary key seen), so an export never holds the whole record in memory
+        last_key = ("", "")
+        while True:
+            with self._lock:
+                rows = self._connection.execute(
+                    "SELECT file_path, cloud_path, checksum, size, mtime_ns FROM uploaded_files WHERE (file_path, checksum) > (?, ?) ORDER BY file_path, checksum LIMIT ?",
+                    (*last_key, SQLITE_EXPORT_PAGE_SIZE),
+                ).fetchall()
+            for row in rows:
+                yield UploadRecordEntry(*row)
+            if len(rows) < SQLITE_EXPORT_PAGE_SIZE:
+                return
+            last_key = (rows[-1][0], rows[-1][2])
+
+    @override
+    def _write(self, entries: Iterable[UploadRecordEntry]) -> None:
+        _ = self._connection.execute("BEGIN")
+        try:
+            for entry in entries:
+                # the stored path is the lookup key
+                row = entry._replace(file_path=_path_key(entry.file_path))
+                if row.size is not None:
+                    _ = self._connection.execute(
+                        "UPDATE uploaded_files SET size = NULL, mtime_ns = NULL WHERE file_path = ? AND checksum != ? AND size IS NOT NULL",
+                        (row.file_path, row.checksum),
+                    )
+                _ = self._connection.execute(
+                    "INSERT INTO uploaded_files (file_path, cloud_path, checksum, size, mtime_ns) VALUES (?, ?, ?, ?, ?) ON CONFLICT (file_path, checksum) DO UPDATE SET size = coalesce(excluded.size, size), mtime_ns = coalesce(excluded.mtime_ns, mtime_ns)",
+                    row,
+                )
+                if self._bloom_filter is not None:
+                    self._bloom_filter.add(row.file_path)
+            _ = self._connection.execute("COMMIT")
+        except BaseException:
+            # otherwise the transaction would be left open (including when the COMMIT itself fails, e.g. the disk is full), and the next write's BEGIN would fail
+            self._connection.rollback()  # a no-op if the failure already ended the transaction
+            raise
+        if self._bloom_filter is not None and self._bloom_filter.num_added > self._bloom_filter.capacity:
+            self._build_bloom_filter()
+
+    @override
+    def _set_bloom_filter(self, *, enabled: bool) -> None:
+        if not enabled:
+            self._bloom_filter = None
+        elif self._bloom_filter is None:
+            self._build_bloom_filter()
+
+    @timed_stage("build_upload_record_bloom_filter")
+    def _build_bloom_filter(self):
+        num_paths = self._connection.execute("SELECT COUNT(DISTINCT file_path) FROM uploaded_files").fetchone()[0]
+        # leave room to grow, so it doesn't need rebuilding again soon
+        self._bloom_filter = BloomFilter(max(BLOOM_FILTER_MIN_CAPACITY, 2 * num_paths))
+        for (file_path,) in self._connection.execute("SELECT DISTINCT file_path FROM uploaded_files"):
+            self._bloom_filter.add(file_path)
+        logger.info(f"Built a Bloom filter of the {num_paths} paths in the upload record")
+
+    @override
+    def _apply_fsync_policy(self) -> None:
+        # in WAL mode, FULL syncs the WAL on every commit, while NORMAL only syncs it at checkpoints (so only survives a crash of the process)
+        _ = self._connection.execute(f"PRAGMA synchronous={'FULL' if self.fsync else 'NORMAL'}")
+
+    @override
+    def _close(self) -> None:
+        self._connection.close()
+
+
+@timed_stage("open_upload_record")
+def open_upload_record(record_file_path: Path) -> UploadRecord:
+    """Open the upload record, choosing the backend from the file suffix (.tsv for TSV, anything else for SQLite).
+
+    When opening a SQLite record, a TSV record with the same name next to it is imported once and then renamed with a .migrated suffix.
+    The import is a single transaction and ignores duplicates, so if the agent stops part way through it is simply repeated at the next start.
+    """
+    if record_file_path.suffix == ".tsv":
+        return TsvUploadRecord(record_file_path)
+    record = SqliteUploadRecord(record_file_path)
+    legacy_tsv_path = record_file_path.with_suffix(".tsv")
+    if legacy_tsv_path.exists():
+        logger.info(f"Migrating the upload record from {legacy_tsv_path} to {record_file_path}")
+        record.import_tsv(legacy_tsv_path)
+        _ = legacy_tsv_path.rename(legacy_tsv_path.with_name(legacy_tsv_path.name + MIGRATED_TSV_SUFFIX))
+    return record
@@ -0,0 +1,85 @@
+import datetime
+import logging
+
+from .courier_config_models import WEEKDAYS
+from .courier_config_models import AppConfig
+from .courier_config_models import PauseWindow
+from .system_load import LoadSample
+from .system_load import LoadSampler
+
+logger = logging.getLogger(__name__)
+
+
+def is_in_pause_window(pause_window: PauseWindow, local_time: datetime.datetime) -> bool:
+    weekday = WEEKDAYS[local_time.weekday()]
+    time_of_day = local_time.time()
+    if pause_window.start <= pause_window.end:
+        return weekday in pause_window.days and pause_window.start <= time_of_day < pause_window.end
+    # the window runs past midnight, so it could have started today or yesterday
+    previous_weekday = WEEKDAYS[local_time.weekday() - 1]
+    return (weekday in pause_window.days and time_of_day >= pause_window.start) or (
+        previous_weekday in pause_window.days and time_of_day < pause_window.end
+    )
+
+
+def _is_over_thresholds(app_config: AppConfig, load_sample: LoadSample) -> bool:
+    return (
+        app_config.max_cpu_percent_for_upload is not None
+        and load_sample.cpu_percent is not None
+        and load_sample.cpu_percent > app_config.max_cpu_percent_for_upload
+    ) or (
+        app_config.max_disk_busy_percent_for_upload is not None
+        and load_sample.disk_busy_percent is not None
+        and load_sample.disk_busy_percent > app_config.max_disk_busy_percent_for_upload
+    )
+
+
+class UploadScheduler:
+    """Decide whether uploads may run right now, based on the pause windows and the CPU and disk load thresholds in the AppConfig.
+
+    The load is only sampled when a threshold is set, at most once per load_sample_interval_seconds. Uploads are deferred (left in the queue) while the load
+    is above a threshold, and until it has stayed below them for load_idle_seconds_before_upload.
+    The configuration is passed in on every check, so a refreshed configuration applies straight away.
+    """
+
+    def __init__(self, *, load_sampler: LoadSampler):
+        super().__init__()
+        self._load_sampler = load_sampler
+        self._last_sampled_at: float | None = None
+        self._below_thresholds_since: float | None = None
+        self.latest_load_sample: LoadSample | None = None
+        self.pause_reason: str | None = None
+
+    def is_upload_allowed(self, app_config: AppConfig, *, local_time: datetime.datetime, monotonic_now: float) -> bool:
+        pause_reason = self._find_pause_reason(app_config, local_time=local_time, monotonic_now=monotonic_now)
+        if pause_reason != self.pause_reason:  # only log when it changes, not on every loop iteration
+            if pause_reason is None:
+                logger.info("Resuming uploads")
+            else:
+                logger.info(f"Pausing uploads because {pause_reason}")
+        self.pause_reason = pause_reason
+        return pause_reason is None
+
+    def _find_pause_reason(
+        self, app_config: AppConfig, *, local_time: datetime.datetime, monotonic_now: float
+    ) -> str | None:
+        for pause_window in app_config.upload_pause_windows:
+            if is_in_pause_window(pause_window, local_time):
+                return f"it is within the pause window {pause_window.start}-{pause_window.end} on {','.join(pause_window.days)}"
+        if app_config.max_cpu_percent_for_upload is None and app_config.max_disk_busy_percent_for_upload is None:
+            return None
+        if (
+            self._last_sampled_at is None
+            or monotonic_now - self._last_sampled_at >= app_config.load_sample_interval_seconds
+        ):
+            self._last_sampled_at = monotonic_now
+            self.latest_load_sample = self._load_sampler.sample()
+            if _is_over_thresholds(app_config, self.latest_load_sample):
+                self._below_thresholds_since = None
+            elif self._below_thresholds_since is None:
+                self._below_thresholds_since = monotonic_now
+        if self._below_thresholds_since is None:
+            return f"the system load is above the thresholds ({self.latest_load_sample})"
+        if monotonic_now - self._below_thresholds_since < app_config.load_idle_seconds_before_upload:
+            return f"the system load has been below the thresholds for less than {app_config.load_idle_seconds_before_upload} seconds"
+        return None
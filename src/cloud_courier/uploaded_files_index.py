@@ -0,0 +1,223 @@
+import hashlib
+import math
+import os
+from array import array
+from collections import defaultdict
+from collections.abc import Iterable
+from typing import NamedTuple
+from typing import Self
+
+from .constants import Checksum
+
+_EMPTY_SLOT = 0
+_MAX_LOAD_FACTOR = 0.7
+_MIN_CAPACITY = 1024
+_MD5_DIGEST_SIZE = 16
+_MAX_PART_COUNT = 2**32 - 2
+_NO_DIGEST = 2**32 - 1  # stored as the part count when a path's checksum couldn't be encoded as a digest
+_NO_STAT = -1  # stored as the size when a path's size and modification time weren't recorded
+BLOOM_FILTER_FALSE_POSITIVE_RATE = 0.01
+
+
+class FileStat(NamedTuple):
+    """The size and modification time of a file, which are compared to spot changes without reading the file."""
+
+    size: int
+    mtime_ns: int
+
+
+def _path_digest(file_path: object) -> bytes:
+    # normcase makes the key case-insensitive on Windows, matching how pathlib compares paths there
+    return hashlib.blake2b(os.path.normcase(str(file_path)).encode(errors="surrogateescape"), digest_size=16).digest()
+
+
+def path_key(file_path: object) -> int:
+    """Hash a path to a non-zero 64-bit key."""
+    return int.from_bytes(_path_digest(file_path)[:8]) or 1
+
+
+def encode_checksum(checksum: Checksum) -> tuple[bytes, int] | None:
+    """Encode an S3 ETag style checksum (an MD5 in hex, optionally followed by -<part count>) as a binary digest and part count (0 for a single part).
+
+    Returns None for anything that wouldn't decode back to exactly the same string.
+    """
+    md5_hex, separator, part_count_text = checksum.partition("-")
+    if len(md5_hex) != 2 * _MD5_DIGEST_SIZE or md5_hex != md5_hex.lower():
+        return None
+    try:
+        digest = bytes.fromhex(md5_hex)
+        part_count = int(part_count_text) if separator else 0
+    except ValueError:
+        return None
+    if not 0 <= part_count <= _MAX_PART_COUNT or decode_checksum(digest, part_count) != checksum:
+        return None
+    return digest, part_count
+
+
+def decode_checksum(digest: bytes, part_count: int) -> Checksum:
+    return f"{digest.hex()}-{part_count}" if part_count else digest.hex()
+
+
+class _Slots(NamedTuple):
+    """The flat arrays of an UploadedFilesIndex, with one element per slot (16 bytes per slot for the digests)."""
+
+    keys: array[int]
+    digests: bytearray
+    part_counts: array[int]
+    sizes: array[int]
+    mtimes_ns: array[int]
+
+    @classmethod
+    def allocate(cls, capacity: int) -> Self:
+        return cls(
+            keys=array("Q", bytes(8 * capacity)),
+            digests=bytearray(_MD5_DIGEST_SIZE * capacity),
+            part_counts=array("I", bytes(4 * capacity)),
+            sizes=array("q", [_NO_STAT]) * capacity,
+            mtimes_ns=array("q", bytes(8 * capacity)),
+        )
+
+
+class UploadedFilesIndex:
+    """A compact in-memory set of uploaded file paths and their checksums.
+
+    It is an open-addressing hash table stored in flat arrays, with one slot per path holding a 64-bit hash of the path, a 16-byte MD5 digest, a 4-byte part count,
+    and the size and modification time most recently recorded for the path. That is around 60 bytes per path, compared to several hundred for a dict of Path objects
+    to sets of checksum strings.
+    Paths are only identified by their hash, so with 10 million entries there's roughly a 1 in 2 trillion chance that a new path is mistaken for an uploaded one.
+    A path's additional checksums, and any checksum that isn't an MD5 based ETag, are kept in a small overflow dict.
+    It backs the TSV upload record; the SQLite upload record looks paths up in its database instead of holding them in memory.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._num_entries = 0
+        self._capacity = _MIN_CAPACITY
+        slots = _Slots.allocate(_MIN_CAPACITY)
+        self._keys = slots.keys
+        self._digests = slots.digests
+        self._part_counts = slots.part_counts
+        self._sizes = slots.sizes
+        self._mtimes_ns = slots.mtimes_ns
+        self._extra_checksums: dict[int, set[Checksum]] = defaultdict(set)
+
+    def __len__(self) -> int:
+        return self._num_entries
+
+    def _find_slot(self, key: int) -> int:
+        mask = self._capacity - 1
+        slot = key & mask
+        keys = self._keys
+        while True:
+            existing = keys[slot]
+            if existing in (key, _EMPTY_SLOT):
+                return slot
+            slot = (slot + 1) & mask
+
+    def __contains__(self, file_path: object) -> bool:
+        key = path_key(file_path)
+        return self._keys[self._find_slot(key)] == key
+
+    def add(self, file_path: object, checksum: Checksum, file_stat: FileStat | None = None) -> None:
+        """Add a checksum for the path, and if given, replace the size and modification time recorded for it."""
+        key = path_key(file_path)
+        slot = self._find_slot(key)
+        if file_stat is not None:
+            self._sizes[slot], self._mtimes_ns[slot] = file_stat
+        if self._keys[slot] == key:
+            if checksum not in self._checksums_for_slot(key, slot):
+                self._extra_checksums[key].add(checksum)
+            return
+        encoded = encode_checksum(checksum)
+        self._keys[slot] = key
+        if encoded is None:
+            self._part_counts[slot] = _NO_DIGEST
+            self._extra_checksums[key].add(checksum)
+        else:
+            digest, self._part_counts[slot] = encoded
+            self._digests[_MD5_DIGEST_SIZE * slot : _MD5_DIGEST_SIZE * (slot + 1)] = digest
+        self._num_entries += 1
+        if self._num_entries > _MAX_LOAD_FACTOR * self._capacity:
+            self._grow()
+
+    def add_many(self, entries: Iterable[tuple[object, Checksum, FileStat | None]]) -> None:
+        for file_path, checksum, file_stat in entries:
+            self.add(file_path, checksum, file_stat)
+
+    def checksums(self, file_path: object) -> set[Checksum]:
+        key = path_key(file_path)
+        slot = self._find_slot(key)
+        if self._keys[slot] != key:
+            return set()
+        return self._checksums_for_slot(key, slot)
+
+    def file_stat(self, file_path: object) -> FileStat | None:
+        slot = self._find_slot(path_key(file_path))
+        size = self._sizes[slot]
+        if size == _NO_STAT:
+            return None
+        return FileStat(size, self._mtimes_ns[slot])
+
+    def _checksums_for_slot(self, key: int, slot: int) -> set[Checksum]:
+        checksums = set(self._extra_checksums.get(key, ()))
+        part_count = self._part_counts[slot]
+        if part_count != _NO_DIGEST:
+            checksums.add(
+                decode_checksum(
+                    bytes(self._digests[_MD5_DIGEST_SIZE * slot : _MD5_DIGEST_SIZE * (slot + 1)]), part_count
+                )
+            )
+        return checksums
+
+    def _grow(self):
+        old_keys, old_digests, old_part_counts = self._keys, self._digests, self._part_counts
+        old_sizes, old_mtimes_ns = self._sizes, self._mtimes_ns
+        self._capacity *= 2
+        slots = _Slots.allocate(self._capacity)
+        self._keys = slots.keys
+        self._digests = slots.digests
+        self._part_counts = slots.part_counts
+        self._sizes = slots.sizes
+        self._mtimes_ns = slots.mtimes_ns
+        for old_slot, key in enumerate(old_keys):
+            if key == _EMPTY_SLOT:
+                continue
+            slot = self._find_slot(key)
+            self._keys[slot] = key
+            self._digests[_MD5_DIGEST_SIZE * slot : _MD5_DIGEST_SIZE * (slot + 1)] = old_digests[
+                _MD5_DIGEST_SIZE * old_slot : _MD5_DIGEST_SIZE * (old_slot + 1)
+            ]
+            self._part_counts[slot] = old_part_counts[old_slot]
+            self._sizes[slot] = old_sizes[old_slot]
+            self._mtimes_ns[slot] = old_mtimes_ns[old_slot]
+
+
+class BloomFilter:
+    """A Bloom filter of file paths, for quickly ruling out paths that are definitely not in a set.
+
+    It uses about 10 bits per path for a 1% false positive rate at its capacity. It is not thread-safe, the owner must serialize access to it.
+    """
+
+    def __init__(self, capacity: int, false_positive_rate: float = BLOOM_FILTER_FALSE_POSITIVE_RATE):
+        super().__init__()
+        self.capacity = capacity
+        self._num_bits = max(8, math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        self._num_hashes = max(1, round(self._num_bits / capacity * math.log(2)))
+        self._bits = bytearray((self._num_bits + 7) // 8)
+        self.num_added = 0
+
+    def _bit_indexes(self, file_path: object) -> list[int]:
+        # double hashing: two independent 64-bit hashes generate all the bit indexes
+        digest = _path_digest(file_path)
+        first_hash = int.from_bytes(digest[:8])
+        second_hash = int.from_bytes(digest[8:]) | 1
+        return [(first_hash + idx * second_hash) % self._num_bits for idx in range(self._num_hashes)]
+
+    def add(self, file_path: object) -> None:
+        for bit_index in self._bit_indexes(file_path):
+            self._bits[bit_index >> 3] |= 1 << (bit_index & 7)
+        self.num_added += 1
+
+    def might_contain(self, file_path: object) -> bool:
+        bits = self._bits
+        return all(bits[bit_index >> 3] & (1 << (bit_index & 7)) for bit_index in self._bit_indexes(file_path))
@@ -0,0 +1,219 @@
+import itertools
+import json
+import logging
+import operator
+import sqlite3
+import threading
+from collections.abc import Iterable
+from pathlib import Path
+from typing import Any
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_WRITE_BUFFER_SIZE = 1000
+
+
+class PendingFile(NamedTuple):
+    file_path: str
+    folder_descriptor: str
+    ready_at: float
+    """Wall-clock time (seconds since the epoch) after which the file may be uploaded."""
+    attempts: int
+
+
+class Backlog(NamedTuple):
+    num_pending: int
+    oldest_ready_at: float | None
+    sampled_file_paths: list[str]
+    """Up to the requested number of the pending files, for estimating the size of the whole backlog."""
+    num_pending_by_folder: dict[str, int]
+
+
+class ScannedDirectory(NamedTuple):
+    path: str
+    mtime_ns: int
+    subdirectories: list[str]
+
+
+class WorkJournal:
+    """Crash-safe record of the files waiting to be uploaded, stored in SQLite in WAL mode.
+
+    Every queued file is recorded along with when it becomes ready for upload and how many upload attempts have been made, and it is removed once it has been handled.
+    After a restart the pending files are replayed from here, so events that arrived but were not yet uploaded are not lost.
+
+    The journal also remembers the modification time and subdirectories of every directory that has been scanned.
+    A directory's modification time changes whenever an entry is added, removed or renamed, so at the next boot only directories whose modification time changed need to be listed again.
+
+    Writes are buffered and committed together in a single transaction by flush() (which the main loop calls every iteration), or once the buffer fills up.
+    New pending files are the exception and never fill the buffer up, because they are added from the file system event thread, which shouldn't wait on disk I/O.
+    A new file that was never committed is still found at the next boot, because creating it changed its directory's modification time.
+    """
+
+    def __init__(self, journal_path: Path):
+        super().__init__()
+        journal_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._buffer_lock = threading.Lock()
+        self._buffered_writes: list[tuple[str, tuple[Any, ...]]] = []
+        # isolation_level=None means autocommit, and buffered writes are wrapped in an explicit transaction by flush
+        self._connection = sqlite3.connect(journal_path, isolation_level=None, check_same_thread=False)
+        _ = self._connection.execute("PRAGMA journal_mode=WAL")
+        _ = self._connection.execute(
+            "PRAGMA synchronous=NORMAL"
+        )  # in WAL mode this survives a crash of the process, and only risks the last few transactions on power loss
+        _ = self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS pending_files (file_path TEXT PRIMARY KEY, folder_descriptor TEXT NOT NULL, ready_at REAL NOT NULL, attempts INTEGER NOT NULL DEFAULT 0)"
+        )
+        _ = self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS pending_files_by_folder ON pending_files (folder_descriptor)"
+        )
+        _ = self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS scanned_directories (folder_descriptor TEXT NOT NULL, directory_path TEXT NOT NULL, mtime_ns INTEGER NOT NULL, subdirectories TEXT NOT NULL, PRIMARY KEY (folder_descriptor, directory_path))"
+        )
+        _ = self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS folders (folder_descriptor TEXT PRIMARY KEY, folder_config TEXT NOT NULL)"
+        )
+
+    def close(self) -> None:
+        self.flush()
+        with self._lock:
+            self._connection.close()
+
+    def _buffer_write(self, sql: str, parameters: tuple[Any, ...], *, flush_if_full: bool = True) -> None:
+        with self._buffer_lock:
+            self._buffered_writes.append((sql, parameters))
+            is_full = len(self._buffered_writes) >= JOURNAL_WRITE_BUFFER_SIZE
+        if is_full and flush_if_full:
+            self.flush()
+
+    def flush(self) -> None:
+        """Commit all buffered writes in a single transaction."""
+        with self._lock:
+            with self._buffer_lock:
+                writes = self._buffered_writes
+                self._buffered_writes = []
+            if not writes:
+                return
+            _ = self._connection.execute("BEGIN")
+            try:
+                # consecutive writes of the same kind go through a single executemany, which keeps their order and avoids re-preparing the statement
+                for sql, group in itertools.groupby(writes, key=operator.itemgetter(0)):
+                    _ = self._connection.executemany(sql, (parameters for _, parameters in group))
+                _ = self._connection.execute("COMMIT")
+            except BaseException:
+                # otherwise the transaction would be left open (and the next BEGIN would fail), or half of the writes committed by the next one
+                self._connection.rollback()  # a no-op if the failed COMMIT already ended the transaction
+                with self._buffer_lock:
+                    # kept in front of anything buffered since, so they're tried again in the same order by the next flush
+                    self._buffered_writes[:0] = writes
+                raise
+
+    def add_pending(self, *, file_path: str, folder_descriptor: str, ready_at: float) -> None:
+        self._buffer_write(
+            "INSERT INTO pending_files (file_path, folder_descriptor, ready_at) VALUES (?, ?, ?) ON CONFLICT (file_path) DO UPDATE SET folder_descriptor = excluded.folder_descriptor, ready_at = excluded.ready_at",
+            (file_path, folder_descriptor, ready_at),
+            flush_if_full=False,  # called from the watchdog emitter thread, so it's left to the main loop's flush to commit
+        )
+
+    def record_attempt(self, file_path: str) -> None:
+        self._buffer_write("UPDATE pending_files SET attempts = attempts + 1 WHERE file_path = ?", (file_path,))
+
+    def forget_attempt(self, file_path: str) -> None:
+        """Undo record_attempt, for an attempt that failed for reasons that have nothing to do with the file (like a network outage)."""
+        self._buffer_write("UPDATE pending_files SET attempts = attempts - 1 WHERE file_path = ?", (file_path,))
+
+    def remove_pending(self, file_path: str) -> None:
+        self._buffer_write("DELETE FROM pending_files WHERE file_path = ?", (file_path,))
+
+    def pending_files(self, folder_descriptor: str) -> list[PendingFile]:
+        self.flush()
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT file_path, folder_descriptor, ready_at, attempts FROM pending_files WHERE folder_descriptor = ?",
+                (folder_descriptor,),
+            ).fetchall()
+        return [PendingFile(*row) for row in rows]
+
+    def backlog(self, *, sample_size: int) -> Backlog:
+        self.flush()
+        with self._lock:
+            oldest_ready_at = self._connection.execute("SELECT min(ready_at) FROM pending_files").fetchone()[0]
+            num_pending_by_folder = dict(
+                self._connection.execute(
+                    "SELECT folder_descriptor, count(*) FROM pending_files GROUP BY folder_descriptor"
+                ).fetchall()
+            )
+            rows = self._connection.execute("SELECT file_path FROM pending_files LIMIT ?", (sample_size,)).fetchall()
+        return Backlog(
+            sum(num_pending_by_folder.values()), oldest_ready_at, [row[0] for row in rows], num_pending_by_folder
+        )
+
+    def scanned_directories(self, folder_descriptor: str) -> dict[str, ScannedDirectory]:
+        self.flush()
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT directory_path, mtime_ns, subdirectories FROM scanned_directories WHERE folder_descriptor = ?",
+                (folder_descriptor,),
+            ).fetchall()
+        return {
+            path: ScannedDirectory(path, mtime_ns, json.loads(subdirectories))
+            for path, mtime_ns, subdirectories in rows
+        }
+
+    def record_scanned_directory(self, folder_descriptor: str, directory: ScannedDirectory) -> None:
+        # buffered behind the writes for the directory's files, so it can never be committed before them
+        self._buffer_write(
+            "INSERT OR REPLACE INTO scanned_directories (folder_descriptor, directory_path, mtime_ns, subdirectories) VALUES (?, ?, ?, ?)",
+            (folder_descriptor, directory.path, directory.mtime_ns, json.dumps(directory.subdirectories)),
+        )
+
+    def remove_scanned_directories(self, folder_descriptor: str, directory_paths: Iterable[str]) -> None:
+        self.flush()
+        with self._lock:
+            _ = self._connection.executemany(
+                "DELETE FROM scanned_directories WHERE folder_descriptor = ? AND directory_path = ?",
+                ((folder_descriptor, path) for path in directory_paths),
+            )
+
+    def start_folder(self, folder_descriptor: str, folder_config_json: str) -> None:
+        """Record the configuration a folder is being watched with (only the settings that decide which files belong to it, see folder_matching_key).
+
+        If it differs from the configuration stored previously, everything known about the folder is discarded, so the next scan is a full one.
+        """
+        self.flush()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT folder_config FROM folders WHERE folder_descriptor = ?", (folder_descriptor,)
+            ).fetchone()
+        if row is not None and row[0] == folder_config_json:
+            return
+        self.remove_folder(folder_descriptor)
+        with self._lock:
+            _ = self._connection.execute(
+                "INSERT INTO folders (folder_descriptor, folder_config) VALUES (?, ?)",
+                (folder_descriptor, folder_config_json),
+            )
+
+    def remove_folder(self, folder_descriptor: str) -> None:
+        self.flush()
+        with self._lock:
+            for table in ("pending_files", "scanned_directories", "folders"):
+                _ = self._connection.execute(
+                    f"DELETE FROM {table} WHERE folder_descriptor = ?",  # noqa: S608 # the table names are hardcoded above
+                    (folder_descriptor,),
+                )
+
+    def remove_folders_except(self, folder_descriptors: Iterable[str]) -> None:
+        self.flush()
+        with self._lock:
+            known_descriptors = {
+                row[0]
+                for table in ("pending_files", "scanned_directories", "folders")
+                for row in self._connection.execute(
+                    f"SELECT DISTINCT folder_descriptor FROM {table}"  # noqa: S608 # the table names are hardcoded above
+                )
+            }
+        for descriptor in known_descriptors - set(folder_descriptors):
+            logger.info(f"Discarding the work journal entries for folder {descriptor}, which is no longer configured")
+            self.remove_folder(descriptor)
@@ -1,8 +1,11 @@
 import sys  # pragma: no cover # we can't unit test the entrypoint itself. It is tested in the E2E test of the executable
 
-from cloud_courier.main import (
-    entrypoint,
+from cloud_courier.cli import (
+    handle_informational_args,
 )  # pragma: no cover # we can't unit test the entrypoint itself. It is tested in the E2E test of the executable
 
 if __name__ == "__main__":
+    handle_informational_args(sys.argv[1:])  # before importing the rest of the agent, so --version is answered quickly
+    from cloud_courier.main import entrypoint  # deliberately imported late, see above
+
     sys.exit(entrypoint(sys.argv[1:]))
@@ -11,11 +11,13 @@ from pytest_mock import MockerFixture
 
 from cloud_courier import CourierConfig
 from cloud_courier import MainLoop
+from cloud_courier import Profiler
 from cloud_courier import aws_credentials
 from cloud_courier import get_role_arn
 from cloud_courier import load_config_from_aws
 from cloud_courier import main
 from cloud_courier import upload_to_s3
+from cloud_courier.courier_config_models import APP_CONFIG_PARAMETER_NAME
 from cloud_courier.courier_config_models import SSM_PARAMETER_PREFIX
 from cloud_courier.courier_config_models import SSM_PARAMETER_PREFIX_TO_ALIASES
 
@@ -38,6 +40,11 @@ def store_config_in_aws(config: CourierConfig):
         Value=alias,
         Type="String",
     )
+    _ = ssm_client.put_parameter(
+        Name=f"{SSM_PARAMETER_PREFIX}/{alias}/{APP_CONFIG_PARAMETER_NAME}",
+        Value=config.app_config.model_dump_json(),
+        Type="String",
+    )
     for descriptor, folder_to_watch in config.folders_to_watch.items():
         _ = ssm_client.put_parameter(
             Name=f"{SSM_PARAMETER_PREFIX}/{alias}/folders/{descriptor}",
@@ -50,6 +57,8 @@ def cleanup_config_in_aws(config: CourierConfig):
     ssm_client = boto3.client("ssm", region_name=config.aws_region)
     alias = config.role_name if config.alias_name is None else config.alias_name
     _ = ssm_client.delete_parameter(Name=f"{SSM_PARAMETER_PREFIX_TO_ALIASES}/{config.role_name}")
+    # deleted in a way that doesn't fail if a test already removed it
+    _ = ssm_client.delete_parameters(Names=[f"{SSM_PARAMETER_PREFIX}/{alias}/{APP_CONFIG_PARAMETER_NAME}"])
     for descriptor in config.folders_to_watch:
         _ = ssm_client.delete_parameter(Name=f"{SSM_PARAMETER_PREFIX}/{alias}/folders/{descriptor}")
 
@@ -68,18 +77,27 @@ class MainLoopMixin:
             tempfile.TemporaryDirectory() as stop_flag_dir,
             tempfile.TemporaryDirectory() as watch_dir,
             tempfile.TemporaryDirectory() as record_dir,
+            tempfile.TemporaryDirectory() as second_watch_dir,
         ):
             self.watch_dir = watch_dir
+            self.second_watch_dir = second_watch_dir
             self.stop_flag_dir = stop_flag_dir
             self.config = deepcopy(GENERIC_COURIER_CONFIG)
             self.config.folders_to_watch["fcs-files"] = self.config.folders_to_watch["fcs-files"].model_copy(
                 update={"folder_path": watch_dir}
             )
             self.folder_config = self.config.folders_to_watch["fcs-files"]
-            _ = mocker.patch.object(main, load_config_from_aws.__name__, autospec=True, return_value=self.config)
-            _ = mocker.patch.object(
+            self.mocked_load_config = mocker.patch.object(
+                main, load_config_from_aws.__name__, autospec=True, return_value=self.config
+            )
+            self.mocked_get_role_arn = mocker.patch.object(
                 main, get_role_arn.__name__, autospec=True, return_value="arn:aws:iam::000000000000:role/role_name"
             )
+            self.mocked_update_instance_tag = mocker.patch.object(
+                main,
+                main._update_instance_tag.__name__,  # noqa: SLF001 # yes, this is private, but Localstack and moto don't support SSM managed instances
+                autospec=True,
+            )
             self.upload_record_file_path = Path(record_dir) / str(uuid.uuid4()) / "record.tsv"
 
             yield
@@ -92,20 +110,27 @@ class MainLoopMixin:
 
         assert self.thread.is_alive() is False
 
-    def _start_loop(
+    def _start_loop(  # noqa: PLR0913 # all keyword-only
         self,
         *,
         mock_upload_to_s3: bool = True,
         mock_send_heartbeat: bool = True,
         create_duplicate_event_stream_for_test_monitoring: bool = False,
+        status_port: int | None = None,
+        profiler: Profiler | None = None,
+        log_file_path: Path | None = None,
     ):
         self.spied_upload_file = self.mocker.spy(MainLoop, "_upload_file")
         self.loop = MainLoop(
             boto_session=self.boto_session,
             stop_flag_dir=self.stop_flag_dir,
             idle_loop_sleep_seconds=0.01,
+            periodic_task_tick_seconds=0.01,
             previously_uploaded_files_record_path=self.upload_record_file_path,
             create_duplicate_event_stream_for_test_monitoring=create_duplicate_event_stream_for_test_monitoring,
+            status_port=status_port,
+            profiler=profiler,
+            log_file_path=log_file_path,
         )
         if mock_upload_to_s3:
             _ = self.mocker.patch.object(main, upload_to_s3.__name__, autospec=True, return_value=str(uuid.uuid4()))
@@ -1,10 +1,29 @@
+import configparser
+import os
 import sys
+import tempfile
+import time
+from pathlib import Path
 
+import boto3
 import pytest
 import time_machine
+from pytest_mock import MockerFixture
+from watchdog.events import DirModifiedEvent
+from watchdog.events import FileClosedEvent
+from watchdog.events import FileDeletedEvent
+from watchdog.events import FileModifiedEvent
+from watchdog.events import FileMovedEvent
+from watchdog.events import FileSystemEvent
+from watchdog.observers import Observer
 
 from cloud_courier import aws_credentials
+from cloud_courier import get_role_arn
 from cloud_courier import path_to_aws_credentials
+from cloud_courier.aws_credentials import CredentialsFileEventHandler
+from cloud_courier.aws_credentials import SsmAgentCredentials
+from cloud_courier.aws_credentials import refresh_session_credentials
+from cloud_courier.aws_credentials import watch_credentials_file
 
 from .fixtures import mock_path_to_aws_credentials
 
@@ -42,3 +61,150 @@ class TestReadAwsCreds:
         actual = aws_credentials.read_aws_creds()
 
         assert actual["expiry_time"] == "1988-01-19T20:26:02Z"
+
+
+def _write_creds_file(creds_path: Path, *, access_key: str) -> None:
+    _ = creds_path.write_text(
+        f"[default]\naws_access_key_id = {access_key}\naws_secret_access_key = secret\naws_session_token = token\n"
+    )
+
+
+class CredsFileMixin:
+    @pytest.fixture(autouse=True)
+    def _setup(self, mocker: MockerFixture):
+        with tempfile.TemporaryDirectory() as creds_dir:
+            self.creds_path = Path(creds_dir) / "credentials"
+            _write_creds_file(self.creds_path, access_key="ASIAORIGINAL")
+            _ = mocker.patch.object(
+                aws_credentials, path_to_aws_credentials.__name__, autospec=True, return_value=self.creds_path
+            )
+            self.mocker = mocker
+            yield
+
+    def _access_key(self, session: boto3.Session) -> str:
+        credentials = session.get_credentials()
+        assert credentials is not None
+        access_key = credentials.get_frozen_credentials().access_key
+        assert access_key is not None
+        return access_key
+
+
+class TestCachedCredsFile(CredsFileMixin):
+    def test_Given_file_unchanged__When_read_again__Then_not_parsed_again(self):
+        spied_read = self.mocker.spy(configparser.ConfigParser, "read_string")
+        _ = aws_credentials.read_aws_creds()
+
+        actual = aws_credentials.read_aws_creds()
+
+        assert actual["access_key"] == "ASIAORIGINAL"
+        spied_read.assert_called_once()
+
+    def test_Given_file_rotated__When_read_again__Then_new_creds(self):
+        _ = aws_credentials.read_aws_creds()
+        _write_creds_file(self.creds_path, access_key="ASIAROTATED-WITH-A-DIFFERENT-LENGTH")
+
+        actual = aws_credentials.read_aws_creds()
+
+        assert actual["access_key"] == "ASIAROTATED-WITH-A-DIFFERENT-LENGTH"
+
+    def test_Given_file_rotated_to_same_size_and_modification_time__When_read_again__Then_new_creds(self):
+        original_stats = self.creds_path.stat()
+        _ = aws_credentials.read_aws_creds()
+        _write_creds_file(self.creds_path, access_key="ASIAROTATEDX")
+        os.utime(self.creds_path, ns=(original_stats.st_atime_ns, original_stats.st_mtime_ns))
+
+        actual = aws_credentials.read_aws_creds()
+
+        assert actual["access_key"] == "ASIAROTATEDX"
+
+
+def test_When_role_arn_requested__Then_arn_of_the_caller():
+    actual = get_role_arn(boto3.Session(region_name="us-east-1"))
+
+    assert actual.startswith("arn:aws:")
+
+
+class TestRefreshCreds(CredsFileMixin):
+    def test_Given_file_rotated__When_session_refreshed__Then_new_creds_used_without_waiting_for_expiry(self):
+        session = aws_credentials.create_boto_session("us-east-1")
+        _write_creds_file(self.creds_path, access_key="ASIAROTATED-WITH-A-DIFFERENT-LENGTH")
+
+        assert refresh_session_credentials(session) is True
+
+        assert self._access_key(session) == "ASIAROTATED-WITH-A-DIFFERENT-LENGTH"
+
+    def test_Given_rotated_file_cannot_be_read__When_refreshed__Then_error_raised_and_current_creds_kept(self):
+        session = aws_credentials.create_boto_session("us-east-1")
+        _ = self.creds_path.write_text("[default]\naws_access_key_id = ASIAHALFWRITTEN\n")
+
+        with pytest.raises(KeyError, match="aws_secret_access_key"):
+            _ = refresh_session_credentials(session)
+
+        assert self._access_key(session) == "ASIAORIGINAL"
+
+    def test_Given_generic_session__Then_not_refreshed(self):
+        assert refresh_session_credentials(boto3.Session(region_name="us-east-1")) is False
+        assert watch_credentials_file(boto3.Session(region_name="us-east-1"), Observer()) is False
+
+    def test_Given_file_watched__When_rotated__Then_session_refreshed(self):
+        session = aws_credentials.create_boto_session("us-east-1")
+        observer = Observer()
+        observer.start()
+        try:
+            assert watch_credentials_file(session, observer) is True
+            _write_creds_file(self.creds_path, access_key="ASIAROTATED-WITH-A-DIFFERENT-LENGTH")
+
+            for _ in range(200):
+                if self._access_key(session) != "ASIAORIGINAL":
+                    break
+                time.sleep(0.01)
+        finally:
+            observer.stop()
+            observer.join()
+
+        assert self._access_key(session) == "ASIAROTATED-WITH-A-DIFFERENT-LENGTH"
+
+
+class TestCredentialsFileEventHandler(CredsFileMixin):
+    @pytest.fixture(autouse=True)
+    def _setup_handler(self, _setup: None):  # noqa: ARG002 # requested so that this runs after the CredsFileMixin setup
+        self.mocked_credentials = self.mocker.create_autospec(SsmAgentCredentials, instance=True)
+        self.handler = CredentialsFileEventHandler(credentials=self.mocked_credentials, creds_path=self.creds_path)
+
+    @pytest.mark.parametrize(
+        "event_type",
+        [
+            pytest.param(FileModifiedEvent, id="modified"),
+            pytest.param(FileClosedEvent, id="closed after writing"),
+        ],
+    )
+    def test_When_creds_file_written__Then_refreshed(self, event_type: type[FileSystemEvent]):
+        self.handler.on_any_event(event_type(str(self.creds_path)))
+
+        self.mocked_credentials.refresh_now.assert_called_once()
+
+    def test_When_new_file_moved_into_place__Then_refreshed(self):
+        self.handler.on_any_event(FileMovedEvent(str(self.creds_path) + ".tmp", str(self.creds_path)))
+
+        self.mocked_credentials.refresh_now.assert_called_once()
+
+    @pytest.mark.parametrize(
+        "event",
+        [
+            pytest.param(FileModifiedEvent("/some/other/file"), id="other file"),
+            pytest.param(DirModifiedEvent("/some/dir"), id="directory"),
+            pytest.param(FileDeletedEvent("credentials"), id="deleted"),
+        ],
+    )
+    def test_When_anything_else__Then_not_refreshed(self, event: FileSystemEvent):
+        self.handler.on_any_event(event)
+
+        self.mocked_credentials.refresh_now.assert_not_called()
+
+    def test_Given_refresh_errors__Then_error_logged_and_not_raised(self):
+        spied_logger_exception = self.mocker.spy(aws_credentials.logger, "exception")
+        self.mocked_credentials.refresh_now.side_effect = configparser.Error("the file is only half written")
+
+        self.handler.on_any_event(FileModifiedEvent(str(self.creds_path)))
+
+        spied_logger_exception.assert_called_once()
@@ -0,0 +1,287 @@
+import datetime
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import pytest
+import time_machine
+from botocore.exceptions import EndpointConnectionError
+
+from cloud_courier import CourierConfig
+from cloud_courier import FolderToWatch
+from cloud_courier import MainLoop
+from cloud_courier import main
+from cloud_courier import upload_to_s3
+
+from .fixtures import MainLoopMixin
+from .fixtures import mocked_generic_config
+
+_fixtures = (mocked_generic_config,)
+
+
+class TestConfigRefresh(MainLoopMixin):
+    _expected_num_folder_watches = 2  # once at boot, once for the new folder
+
+    def _seconds_until_refresh(self) -> float:
+        return (
+            self.config.app_config.config_refresh_frequency_minutes * 60 + self.loop.config_refresh_jitter_seconds + 1
+        )
+
+    def _wait_for_config_load_count(self, expected_count: int):
+        for _ in range(200):
+            if self.mocked_load_config.call_count >= expected_count:
+                break
+            time.sleep(0.01)
+        else:
+            pytest.fail(f"Config was only loaded {self.mocked_load_config.call_count} times, not {expected_count}")
+        self._wait_for_loop_iterations(2)
+
+    def _add_second_folder(self) -> None:
+        new_config = self.config.model_copy(
+            update={
+                "folders_to_watch": {
+                    **self.config.folders_to_watch,
+                    "second-folder": self.folder_config.model_copy(update={"folder_path": self.second_watch_dir}),
+                }
+            }
+        )
+        self.mocked_load_config.return_value = new_config
+
+    def test_Given_refresh_frequency_not_elapsed__Then_config_not_reloaded(self):
+        with time_machine.travel("2025-02-19 08:00:00", tick=False) as traveller:
+            self._start_loop()
+
+            traveller.shift(datetime.timedelta(seconds=self._seconds_until_refresh() - 2))
+            self._wait_for_loop_iterations(2)
+
+            assert self.mocked_load_config.call_count == 1
+
+    def test_When_booted__Then_refresh_delayed_by_jitter_within_configured_maximum(self):
+        self._start_loop()
+
+        assert 0 <= self.loop.config_refresh_jitter_seconds <= self.config.app_config.config_refresh_jitter_seconds
+
+    def test_Given_long_upload_in_progress__When_refresh_due__Then_refreshed_without_waiting_for_upload(self):
+        file_path = Path(self.watch_dir) / f"{uuid.uuid4()}.txt"
+        upload_started = threading.Event()
+        finish_upload = threading.Event()
+        config_reloaded = threading.Event()
+
+        def slow_upload(**_: object) -> str:
+            upload_started.set()
+            if not finish_upload.wait(timeout=10):
+                raise TimeoutError("The test never let the upload finish")
+            return str(uuid.uuid4())
+
+        def load_then_signal(*_: object, **__: object) -> CourierConfig:
+            config_reloaded.set()
+            return self.config
+
+        with time_machine.travel("2025-02-19 08:00:00", tick=False) as traveller:
+            _ = self.mocker.patch.object(main, upload_to_s3.__name__, autospec=True, side_effect=slow_upload)
+            self._start_loop(mock_upload_to_s3=False)
+            self.mocked_load_config.side_effect = load_then_signal
+            _ = file_path.write_text("test")
+            assert upload_started.wait(timeout=5) is True
+
+            traveller.shift(datetime.timedelta(seconds=self._seconds_until_refresh()))
+
+            assert config_reloaded.wait(timeout=5) is True
+            assert self.loop.liveness.is_upload_in_progress is True
+            finish_upload.set()
+            self._fail_if_file_not_uploaded(file_path)
+
+    def test_When_refreshed__Then_previous_config_passed_so_unchanged_folders_reused(self):
+        with time_machine.travel("2025-02-19 08:00:00", tick=False) as traveller:
+            self._start_loop()
+
+            traveller.shift(datetime.timedelta(seconds=self._seconds_until_refresh()))
+            self._wait_for_config_load_count(2)
+
+            assert self.mocked_load_config.call_args.kwargs == {"previous": self.config}
+
+    def test_Given_folder_added_to_config__When_refreshed__Then_file_in_new_folder_mock_uploaded(self):
+        file_path = Path(self.second_watch_dir) / f"{uuid.uuid4()}.txt"
+        with time_machine.travel("2025-02-19 08:00:00", tick=False) as traveller:
+            self._start_loop()
+            self._add_second_folder()
+
+            traveller.shift(datetime.timedelta(seconds=self._seconds_until_refresh()))
+            self._wait_for_config_load_count(2)
+            with file_path.open("w") as file:
+                _ = file.write("test")
+            self._wait_for_loop_iterations(2)
+            traveller.shift(datetime.timedelta(seconds=1))
+
+            self._fail_if_file_not_uploaded(file_path)
+
+    def test_Given_folder_removed_from_config__When_refreshed__Then_file_in_removed_folder_not_uploaded(self):
+        file_path = Path(self.watch_dir) / f"{uuid.uuid4()}.txt"
+        with time_machine.travel("2025-02-19 08:00:00", tick=False) as traveller:
+            self._start_loop()
+            self.mocked_load_config.return_value = self.config.model_copy(update={"folders_to_watch": {}})
+
+            traveller.shift(datetime.timedelta(seconds=self._seconds_until_refresh()))
+            self._wait_for_config_load_count(2)
+            with file_path.open("w") as file:
+                _ = file.write("test")
+            traveller.shift(datetime.timedelta(seconds=1))
+
+            self._fail_if_file_uploaded(file_path)
+
+    def test_Given_event_queued_for_folder__When_folder_removed_before_upload__Then_not_uploaded(self):
+        file_path = Path(self.watch_dir) / f"{uuid.uuid4()}.txt"
+        self.config.folders_to_watch["fcs-files"] = self.folder_config.model_copy(
+            update={"delay_seconds_before_upload": 60}
+        )
+        with time_machine.travel("2025-02-19 08:00:00", tick=False) as traveller:
+            self._start_loop(create_duplicate_event_stream_for_test_monitoring=True)
+            with file_path.open("w") as file:
+                _ = file.write("test")
+            for _ in range(200):
+                if not self.loop.file_system_events_for_test_monitoring.empty():
+                    break
+                time.sleep(0.01)
+            else:
+                pytest.fail("No event was queued")
+            self.mocked_load_config.return_value = self.config.model_copy(update={"folders_to_watch": {}})
+
+            traveller.shift(datetime.timedelta(seconds=self._seconds_until_refresh()))
+
+            self._wait_for_config_load_count(2)
+            self._fail_if_file_uploaded(file_path)
+
+    def test_Given_only_new_folder_added__When_refreshed__Then_existing_folder_not_rescanned(self):
+        with time_machine.travel("2025-02-19 08:00:00", tick=False) as traveller:
+            spied_start_watching = self.mocker.spy(MainLoop, "_start_watching_folder")
+            self._start_loop()
+            self._add_second_folder()
+
+            traveller.shift(datetime.timedelta(seconds=self._seconds_until_refresh()))
+            self._wait_for_config_load_count(2)
+
+        assert spied_start_watching.call_count == self._expected_num_folder_watches
+        assert spied_start_watching.call_args_list[1].args[1] == "second-folder"
+        assert set(self.loop.watches) == {"fcs-files", "second-folder"}
+
+    def _change_folder_config(self, new_folder_config: FolderToWatch):
+        self.mocked_load_config.return_value = self.config.model_copy(
+            update={"folders_to_watch": {"fcs-files": new_folder_config}}
+        )
+
+    def test_Given_only_upload_settings_changed__When_refreshed__Then_applied_without_watching_again(self):
+        with time_machine.travel("2025-02-19 08:00:00", tick=False) as traveller:
+            spied_start_watching = self.mocker.spy(MainLoop, "_start_watching_folder")
+            self._start_loop()
+            original_watch = self.loop.watches["fcs-files"]
+            new_folder_config = self.folder_config.model_copy(
+                update={"s3_key_prefix": str(uuid.uuid4()), "delay_seconds_before_upload": 30}
+            )
+
+            self._change_folder_config(new_folder_config)
+            traveller.shift(datetime.timedelta(seconds=self._seconds_until_refresh()))
+            self._wait_for_config_load_count(2)
+
+        assert self.loop.watched_folders == {"fcs-files": new_folder_config}
+        assert self.loop.watches["fcs-files"] is original_watch
+        spied_start_watching.assert_called_once()
+
+    def test_Given_folder_matching_changed__When_refreshed__Then_folder_watched_with_new_config(self):
+        with time_machine.travel("2025-02-19 08:00:00", tick=False) as traveller:
+            spied_start_watching = self.mocker.spy(MainLoop, "_start_watching_folder")
+            self._start_loop()
+            new_folder_config = self.folder_config.model_copy(update={"file_pattern": "*.fcs"})
+
+            self._change_folder_config(new_folder_config)
+            traveller.shift(datetime.timedelta(seconds=self._seconds_until_refresh()))
+            self._wait_for_config_load_count(2)
+
+        assert self.loop.watched_folders == {"fcs-files": new_folder_config}
+        assert spied_start_watching.call_count == 2  # noqa: PLR2004 # once at boot, once with the new config
+
+    def test_Given_changed_folder_cannot_be_watched__When_refreshed__Then_error_logged_and_previous_config_still_watched(
+        self,
+    ):
+        spied_exception = self.mocker.spy(main.logger, "exception")
+        with time_machine.travel("2025-02-19 08:00:00", tick=False) as traveller:
+            self._start_loop()
+            new_folder_config = self.folder_config.model_copy(
+                update={"folder_path": str(Path(self.watch_dir) / "does-not-exist")}
+            )
+
+            self._change_folder_config(new_folder_config)
+            traveller.shift(datetime.timedelta(seconds=self._seconds_until_refresh()))
+            self._wait_for_config_load_count(2)
+
+        spied_exception.assert_called_once()
+        assert self.loop.watched_folders == {"fcs-files": self.folder_config}
+        assert set(self.loop.watches) == {"fcs-files"}
+        assert self.thread.is_alive() is True
+
+    def test_Given_added_folder_cannot_be_watched__When_refreshed__Then_error_logged_and_other_folders_still_watched(
+        self,
+    ):
+        spied_exception = self.mocker.spy(main.logger, "exception")
+        with time_machine.travel("2025-02-19 08:00:00", tick=False) as traveller:
+            self._start_loop()
+            self.mocked_load_config.return_value = self.config.model_copy(
+                update={
+                    "folders_to_watch": {
+                        **self.config.folders_to_watch,
+                        "second-folder": self.folder_config.model_copy(
+                            update={"folder_path": str(Path(self.second_watch_dir) / "does-not-exist")}
+                        ),
+                    }
+                }
+            )
+
+            traveller.shift(datetime.timedelta(seconds=self._seconds_until_refresh()))
+            self._wait_for_config_load_count(2)
+
+        spied_exception.assert_called_once()
+        assert set(self.loop.watched_folders) == {"fcs-files"}
+        assert self.thread.is_alive() is True
+
+    def test_Given_refresh_errors__Then_loop_keeps_running_with_current_config(self):
+        expected_error = str(uuid.uuid4())
+        file_path = Path(self.watch_dir) / f"{uuid.uuid4()}.txt"
+        with time_machine.travel("2025-02-19 08:00:00", tick=False) as traveller:
+            self._start_loop()
+            self.mocked_load_config.side_effect = RuntimeError(expected_error)
+
+            traveller.shift(datetime.timedelta(seconds=self._seconds_until_refresh()))
+            self._wait_for_config_load_count(2)
+            with file_path.open("w") as file:
+                _ = file.write("test")
+            self._wait_for_loop_iterations(2)
+            traveller.shift(datetime.timedelta(seconds=1))
+
+            self._fail_if_file_not_uploaded(file_path)
+
+    def test_Given_offline__When_refresh_due__Then_not_reloaded(self):
+        with time_machine.travel("2025-02-19 08:00:00", tick=False) as traveller:
+            self._start_loop()
+            self.loop.connectivity.report_failure(
+                EndpointConnectionError(endpoint_url="https://ssm.us-east-1.amazonaws.com")
+            )
+
+            traveller.shift(datetime.timedelta(seconds=self._seconds_until_refresh()))
+            self._wait_for_loop_iterations(2)
+
+            assert self.mocked_load_config.call_count == 1
+
+    def test_Given_ssm_unreachable__When_refreshed__Then_offline_and_loop_keeps_running(self):
+        spied_exception = self.mocker.spy(main.logger, "exception")
+        with time_machine.travel("2025-02-19 08:00:00", tick=False) as traveller:
+            self._start_loop()
+            self.mocked_load_config.side_effect = EndpointConnectionError(
+                endpoint_url="https://ssm.us-east-1.amazonaws.com"
+            )
+
+            traveller.shift(datetime.timedelta(seconds=self._seconds_until_refresh()))
+            self._wait_for_config_load_count(2)
+
+            assert self.loop.connectivity.is_online is False
+            spied_exception.assert_not_called()
+            assert self.thread.is_alive() is True
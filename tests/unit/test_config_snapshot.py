@@ -0,0 +1,114 @@
+import datetime
+import tempfile
+import uuid
+from pathlib import Path
+
+import pytest
+import time_machine
+from pytest_mock import MockerFixture
+
+from cloud_courier import AppConfig
+from cloud_courier import PauseWindow
+from cloud_courier import config_snapshot
+from cloud_courier import load_config_snapshot
+from cloud_courier import save_config_snapshot
+from cloud_courier.main import CONFIG_RECONCILE_RETRY_SECONDS
+from cloud_courier.main import CONFIG_SNAPSHOT_FILE_NAME
+
+from .constants import COMPLEX_COURIER_CONFIG
+from .fixtures import MainLoopMixin
+
+
+class TestSnapshotFile:
+    @pytest.fixture(autouse=True)
+    def _setup(self):
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            self.snapshot_path = Path(snapshot_dir) / "nested" / CONFIG_SNAPSHOT_FILE_NAME
+            yield
+
+    def test_When_saved_then_loaded__Then_same_config_including_app_config_and_parameter_versions(self):
+        expected = COMPLEX_COURIER_CONFIG.model_copy(
+            update={
+                "parameter_versions": {"/cloud-courier/a/folders/0": 3, "/cloud-courier/a/app-config": 2},
+                "app_config": AppConfig(
+                    log_shipping_s3_bucket_name="my-log-bucket",
+                    upload_pause_windows=[PauseWindow(start=datetime.time(8), end=datetime.time(18))],
+                ),
+            }
+        )
+
+        save_config_snapshot(expected, self.snapshot_path)
+
+        assert load_config_snapshot(self.snapshot_path) == expected
+        assert list(self.snapshot_path.parent.iterdir()) == [self.snapshot_path]
+
+    def test_Given_no_snapshot__Then_none(self):
+        assert load_config_snapshot(self.snapshot_path) is None
+
+    def test_Given_invalid_snapshot__Then_none_and_error_logged(self, mocker: MockerFixture):
+        spied_logger_exception = mocker.spy(config_snapshot.logger, "exception")
+        self.snapshot_path.parent.mkdir(parents=True)
+        _ = self.snapshot_path.write_text('{"folders_to_watch": ')
+
+        assert load_config_snapshot(self.snapshot_path) is None
+
+        spied_logger_exception.assert_called_once()
+
+
+class TestBootFromSnapshot(MainLoopMixin):
+    def _save_snapshot(self):
+        save_config_snapshot(self.config, self.upload_record_file_path.parent / CONFIG_SNAPSHOT_FILE_NAME)
+
+    def _wait_for_config_load_count(self, expected_count: int):
+        self._wait_for_loop_iterations(2)
+        assert self.mocked_load_config.call_count == expected_count
+
+    def test_Given_no_snapshot__When_booted__Then_config_from_ssm_saved_as_snapshot(self):
+        self._start_loop()
+
+        assert load_config_snapshot(self.loop.config_snapshot_path) == self.config
+        assert self.loop.config_reconciled is True
+
+    def test_Given_snapshot_and_ssm_unreachable__When_booted__Then_files_still_uploaded(self):
+        self._save_snapshot()
+        self.mocked_load_config.side_effect = RuntimeError("Could not connect to the endpoint URL")
+        file_path = Path(self.watch_dir) / f"{uuid.uuid4()}.txt"
+
+        self._start_loop()
+        with file_path.open("w") as file:
+            _ = file.write("test")
+
+        self._fail_if_file_not_uploaded(file_path)
+        self.mocked_load_config.assert_called_once_with(self.boto_session, previous=self.config)
+        assert self.loop.config_reconciled is False
+
+    def test_Given_snapshot__When_ssm_config_changed__Then_reconciled_and_snapshot_updated(self):
+        self._save_snapshot()
+        new_config = self.config.model_copy(
+            update={
+                "folders_to_watch": {
+                    "second-folder": self.folder_config.model_copy(update={"folder_path": self.second_watch_dir})
+                }
+            }
+        )
+        self.mocked_load_config.return_value = new_config
+
+        self._start_loop()
+        self._wait_for_config_load_count(1)
+
+        assert set(self.loop.watches) == {"second-folder"}
+        assert self.loop.config_reconciled is True
+        assert load_config_snapshot(self.loop.config_snapshot_path) == new_config
+
+    def test_Given_snapshot_and_ssm_unreachable__When_retry_interval_elapsed__Then_reconcile_retried(self):
+        self._save_snapshot()
+        self.mocked_load_config.side_effect = RuntimeError("Could not connect to the endpoint URL")
+        with time_machine.travel("2025-02-19 08:00:00", tick=False) as traveller:
+            self._start_loop()
+            self._wait_for_config_load_count(1)
+            self.mocked_load_config.side_effect = None
+
+            traveller.shift(datetime.timedelta(seconds=CONFIG_RECONCILE_RETRY_SECONDS + 1))
+            self._wait_for_config_load_count(2)
+
+        assert self.loop.config_reconciled is True
@@ -0,0 +1,213 @@
+import datetime
+import uuid
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import pytest
+from botocore.exceptions import ClientError
+from botocore.exceptions import EndpointConnectionError
+from botocore.exceptions import ReadTimeoutError
+
+from cloud_courier import ConnectivityMonitor
+from cloud_courier import main
+from cloud_courier import upload_to_s3
+from cloud_courier.connectivity import DEFAULT_PROBE_INITIAL_BACKOFF_SECONDS
+from cloud_courier.connectivity import is_connectivity_error
+
+from .fixtures import MainLoopMixin
+
+
+def _connection_error() -> EndpointConnectionError:
+    return EndpointConnectionError(endpoint_url="https://s3.us-east-1.amazonaws.com")
+
+
+def _client_error() -> ClientError:
+    return ClientError({"Error": {"Code": "AccessDenied", "Message": "Access Denied"}}, "PutObject")
+
+
+class TestIsConnectivityError:
+    @pytest.mark.parametrize(
+        "error",
+        [
+            pytest.param(_connection_error(), id="could not connect"),
+            pytest.param(ReadTimeoutError(endpoint_url="https://s3.us-east-1.amazonaws.com"), id="read timed out"),
+        ],
+    )
+    def test_Given_network_failure__Then_true(self, error: Exception):
+        assert is_connectivity_error(error) is True
+
+    def test_Given_network_failure_wrapped_in_another_error__Then_true(self):
+        def upload():
+            try:
+                raise _connection_error()
+            except EndpointConnectionError as e:
+                raise RuntimeError("The upload failed") from e
+
+        with pytest.raises(RuntimeError, match="upload failed") as exc_info:
+            upload()
+
+        assert is_connectivity_error(exc_info.value) is True
+
+    def test_Given_aws_rejected_request__Then_false(self):
+        assert is_connectivity_error(_client_error()) is False
+
+
+class TestConnectivityMonitor:
+    @pytest.fixture(autouse=True)
+    def _setup(self):
+        self.now = [100.0]
+        self.probe = MagicMock()
+        self.monitor = ConnectivityMonitor(
+            probe=self.probe, clock=lambda: self.now[0], initial_backoff_seconds=5, max_backoff_seconds=15
+        )
+
+    def test_Given_no_failures__Then_online_without_probing(self):
+        assert self.monitor.check() is True
+
+        self.probe.assert_not_called()
+        assert self.monitor.seconds_offline() == 0
+
+    def test_When_failure_reported__Then_offline_and_not_probed_until_backoff_elapsed(self):
+        self.monitor.report_failure(_connection_error())
+        self.now[0] += 4
+
+        assert self.monitor.check() is False
+        assert self.monitor.is_online is False
+        self.probe.assert_not_called()
+
+    def test_Given_probe_keeps_failing__Then_backoff_doubles_up_to_maximum(self):
+        self.probe.side_effect = _connection_error()
+        self.monitor.report_failure(_connection_error())
+        probe_times: list[float] = []
+
+        for _ in range(50):
+            self.now[0] += 1
+            num_probes = self.probe.call_count
+            assert self.monitor.check() is False
+            if self.probe.call_count > num_probes:
+                probe_times.append(self.now[0])
+
+        assert probe_times == [105, 115, 130, 145]
+
+    def test_When_probe_succeeds__Then_online_and_outage_added_to_time_offline(self):
+        self.monitor.report_failure(_connection_error())
+        self.now[0] += 7
+        self.monitor.report_failure(
+            _connection_error()
+        )  # already offline, so the outage still started at the first failure
+
+        assert self.monitor.check() is True
+
+        assert self.monitor.is_online is True
+        assert self.monitor.seconds_offline() == 7  # noqa: PLR2004 # the time that passed
+        self.now[0] += 100
+        assert self.monitor.seconds_offline() == 7  # noqa: PLR2004 # no longer growing
+
+    def test_Given_probe_rejected_by_aws__Then_online(self):
+        self.probe.side_effect = _client_error()
+        self.monitor.report_failure(_connection_error())
+        self.now[0] += 5
+
+        assert self.monitor.check() is True
+
+    def test_When_outage_in_block__Then_not_raised_and_offline(self):
+        with self.monitor.detect_outage():
+            raise _connection_error()
+
+        assert self.monitor.is_online is False
+
+    def test_When_other_error_in_block__Then_raised_and_still_online(self):
+        with pytest.raises(ClientError, match="Access Denied"), self.monitor.detect_outage():
+            raise _client_error()
+
+        assert self.monitor.is_online is True
+
+
+class TestMainLoopOffline(MainLoopMixin):
+    @pytest.fixture(autouse=True)
+    def _setup_clock(self, _setup: None):  # noqa: ARG002 # requested so that this runs after the MainLoopMixin setup
+        self.fake_monotonic_seconds = [1000.0]
+        _ = self.mocker.patch.object(
+            main,
+            main._monotonic_seconds.__name__,  # noqa: SLF001 # yes, this is private, but time_machine cannot control time.monotonic
+            autospec=True,
+            side_effect=lambda: self.fake_monotonic_seconds[0],
+        )
+
+    def test_Given_upload_fails_for_lack_of_connectivity__Then_queued_until_back_online(self):
+        file_path = Path(self.watch_dir) / f"{uuid.uuid4()}.txt"
+        mocked_upload = self.mocker.patch.object(
+            main, upload_to_s3.__name__, autospec=True, side_effect=[_connection_error(), str(uuid.uuid4())]
+        )
+        self._start_loop(mock_upload_to_s3=False)
+        _ = file_path.write_text("test")
+        self._wait_for_loop_iterations(2)
+        self.fake_monotonic_seconds[0] += self.folder_config.delay_seconds_before_upload + 1
+        self._wait_for_loop_iterations(2)
+
+        assert mocked_upload.call_count == 1
+        assert self.loop.connectivity.is_online is False
+        assert [pending.attempts for pending in self.loop.work_journal.pending_files("fcs-files")] == [0]
+
+        self.fake_monotonic_seconds[0] += DEFAULT_PROBE_INITIAL_BACKOFF_SECONDS
+
+        self._fail_if_file_not_uploaded(file_path)
+        assert self.loop.connectivity.seconds_offline() == DEFAULT_PROBE_INITIAL_BACKOFF_SECONDS
+        assert self.thread.is_alive() is True
+
+    def test_Given_heartbeat_fails_for_lack_of_connectivity__Then_offline_and_not_retried_until_back_online(self):
+        self._start_loop()
+        self.mocked_send_heartbeat.side_effect = _connection_error()
+        self.loop.last_heartbeat_timestamp = datetime.datetime(year=1988, month=1, day=19, tzinfo=datetime.UTC)
+
+        for _ in range(300):
+            if not self.loop.connectivity.is_online:
+                break
+            self._wait_for_loop_iterations(1)
+        else:
+            pytest.fail("Never went offline")
+        num_heartbeats = self.mocked_send_heartbeat.call_count
+        self.loop._send_heartbeat_if_needed()  # noqa: SLF001 # calling it directly, since waiting for the periodic task thread would slow down the test
+
+        assert self.mocked_send_heartbeat.call_count == num_heartbeats
+        assert self.thread.is_alive() is True
+
+    def test_Given_aws_unreachable_at_boot__Then_monitoring_starts_and_instance_tagged_once_back_online(self):
+        self.mocked_update_instance_tag.side_effect = [_connection_error(), None]
+        self._start_loop()
+        self._wait_for_loop_iterations(2)
+
+        assert self.loop.connectivity.is_online is False
+        assert self.mocked_update_instance_tag.call_count == 1
+
+        self.fake_monotonic_seconds[0] += DEFAULT_PROBE_INITIAL_BACKOFF_SECONDS
+        self._wait_for_loop_iterations(2)
+
+        assert self.loop.connectivity.is_online is True
+        assert self.mocked_update_instance_tag.call_count == 2  # noqa: PLR2004 # the failed attempt and the one once back online
+        self._wait_for_loop_iterations(2)
+        assert self.mocked_update_instance_tag.call_count == 2  # noqa: PLR2004 # not tagged again once it worked
+
+    def test_When_loop_runs__Then_aws_identity_only_looked_up_at_boot_and_when_back_online(self):
+        self._start_loop()
+        self._wait_for_loop_iterations(3)
+
+        self.mocked_get_role_arn.assert_called_once()
+
+        self.loop.connectivity.report_failure(_connection_error())
+        self.fake_monotonic_seconds[0] += DEFAULT_PROBE_INITIAL_BACKOFF_SECONDS
+        self._wait_for_loop_iterations(3)
+
+        assert self.loop.connectivity.is_online is True
+        assert self.mocked_get_role_arn.call_count == 2  # noqa: PLR2004 # at boot and by the probe that found AWS again
+
+    def test_Given_tagging_instance_rejected__Then_error_logged_and_not_retried(self):
+        spied_exception = self.mocker.spy(main.logger, "exception")
+        self.mocked_update_instance_tag.side_effect = _client_error()
+        self._start_loop()
+        self._wait_for_loop_iterations(3)
+
+        self.mocked_update_instance_tag.assert_called_once()
+        spied_exception.assert_called_once()
+        assert self.loop.connectivity.is_online is True
+        assert self.thread.is_alive() is True
@@ -0,0 +1,125 @@
+import json
+import queue
+import tempfile
+import threading
+import uuid
+from pathlib import Path
+
+import pytest
+
+from cloud_courier import FileEvent
+from cloud_courier import SpillingEventQueue
+
+
+class TestSpillingEventQueue:
+    @pytest.fixture(autouse=True)
+    def _setup(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            self.spill_file_path = Path(temp_dir) / str(uuid.uuid4()) / "spill.jsonl"
+            self.max_in_memory = 4
+            self.queue = SpillingEventQueue(spill_file_path=self.spill_file_path, max_in_memory=self.max_in_memory)
+            yield
+            self.queue.close()
+
+    def _make_events(self, num_events: int) -> list[FileEvent]:
+        return [FileEvent(f"/data/{uuid.uuid4()}\t\n.txt", "folder", float(idx)) for idx in range(num_events)]
+
+    def test_Given_fewer_events_than_limit__Then_nothing_spilled(self):
+        events = self._make_events(self.max_in_memory)
+
+        for event in events:
+            self.queue.put(event)
+
+        assert self.queue.in_memory_size == self.max_in_memory
+        assert self.queue.spilled_size == 0
+        assert self.spill_file_path.stat().st_size == 0
+
+    def test_Given_more_events_than_limit__Then_overflow_spilled_to_disk(self):
+        num_events = self.max_in_memory * 3 + 1
+
+        for event in self._make_events(num_events):
+            self.queue.put(event)
+
+        assert self.queue.in_memory_size == self.max_in_memory
+        assert self.queue.spilled_size == num_events - self.max_in_memory
+        assert self.queue.qsize() == num_events
+
+    def test_Given_events_spilled__When_drained__Then_all_returned_in_order_and_spill_file_truncated(self):
+        events = self._make_events(self.max_in_memory * 3 + 1)
+        for event in events[:6]:
+            self.queue.put(event)
+
+        actual = [self.queue.get(timeout=1) for _ in range(3)]
+        for event in events[6:]:
+            self.queue.put(event)
+        while not self.queue.empty():
+            actual.append(self.queue.get(timeout=1))
+            assert self.queue.in_memory_size <= self.max_in_memory
+
+        assert actual == events
+        assert self.spill_file_path.stat().st_size == 0
+
+    def test_Given_spill_file_drained__When_more_events_spilled__Then_still_returned_in_order(self):
+        events = self._make_events(self.max_in_memory * 4)
+        for event in events[: self.max_in_memory * 2]:
+            self.queue.put(event)
+        actual = [self.queue.get(timeout=1) for _ in range(self.max_in_memory * 2)]
+
+        for event in events[self.max_in_memory * 2 :]:
+            self.queue.put(event)
+        actual.extend(self.queue.get(timeout=1) for _ in range(self.max_in_memory * 2))
+
+        assert actual == events
+
+    def test_Given_much_of_spill_file_paged_in__When_more_paged_in__Then_compacted_and_still_returned_in_order(self):
+        self.queue.close()
+        self.queue = SpillingEventQueue(
+            spill_file_path=self.spill_file_path, max_in_memory=self.max_in_memory, compact_after_bytes=1
+        )
+        events = self._make_events(self.max_in_memory * 4)
+        for event in events:
+            self.queue.put(event)
+
+        actual = [self.queue.get(timeout=1) for _ in range(self.max_in_memory + 1)]
+
+        num_paged_in = self.max_in_memory // 2
+        assert self.spill_file_path.read_text().splitlines() == [
+            json.dumps(event) for event in events[self.max_in_memory + num_paged_in :]
+        ]
+        actual.extend(self.queue.get(timeout=1) for _ in range(len(events) - len(actual)))
+        assert actual == events
+
+    def test_Given_threads_putting_at_once__When_overflowing__Then_each_threads_events_returned_in_order(self):
+        num_threads = 4
+        events_by_thread = [self._make_events(self.max_in_memory * 5) for _ in range(num_threads)]
+        all_started = threading.Barrier(num_threads)
+
+        def put_all(events: list[FileEvent]):
+            _ = all_started.wait(timeout=5)
+            for event in events:
+                self.queue.put(event)
+
+        threads = [threading.Thread(target=put_all, args=(events,)) for events in events_by_thread]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=5)
+        actual = [self.queue.get(timeout=1) for _ in range(self.queue.qsize())]
+
+        assert len(actual) == num_threads * self.max_in_memory * 5
+        for events in events_by_thread:
+            assert [event for event in actual if event in events] == events
+
+    def test_Given_empty__When_get_with_timeout__Then_raises_empty(self):
+        with pytest.raises(queue.Empty):  # noqa: PT011 # queue.Empty has no message to match against
+            _ = self.queue.get(timeout=0.01)
+
+    def test_Given_empty__When_event_put_from_another_thread__Then_get_returns_it(self):
+        event = self._make_events(1)[0]
+        timer = threading.Timer(0.05, self.queue.put, args=(event,))
+        timer.start()
+
+        actual = self.queue.get()
+
+        timer.join()
+        assert actual == event
@@ -0,0 +1,66 @@
+import pytest
+
+from cloud_courier import FileFilter
+from cloud_courier import FolderToWatch
+from cloud_courier.file_filter import (
+    _CompiledPatterns,
+)  # the case-insensitive Windows behavior can't otherwise be exercised on Linux
+
+
+@pytest.mark.parametrize(
+    ("file_pattern", "ignore_patterns", "file_path", "expected"),
+    [
+        pytest.param("*", [], "/data/run1/plate.fcs", True, id="default patterns upload everything"),
+        pytest.param("*.fcs", [], "/data/run1/plate.fcs", True, id="file pattern matches file name"),
+        pytest.param("*.fcs", [], "/data/run1/plate.csv", False, id="file pattern does not match file name"),
+        pytest.param("run1/*", [], "/data/run1/plate.csv", True, id="file pattern matches relative path"),
+        pytest.param("run1/*", [], "/data/run2/plate.csv", False, id="file pattern does not match relative path"),
+        pytest.param("*", ["~$*"], "/data/run1/~$report.docx", False, id="office lock file ignored"),
+        pytest.param("*", ["*.tmp", "*.lock"], "/data/run1/plate.lock", False, id="second ignore pattern applied"),
+        pytest.param("*", ["*.tmp", "*.lock"], "/data/run1/plate.fcs", True, id="not matching any ignore pattern"),
+        pytest.param("*", ["scratch/*"], "/data/scratch/plate.fcs", False, id="ignore pattern matches relative path"),
+        pytest.param("*.fcs", ["~$*"], "/data/~$plate.fcs", False, id="ignore takes precedence over file pattern"),
+        pytest.param("*.fcs", [], r"C:\data\run1\plate.fcs", True, id="windows separators"),
+        pytest.param("plate_[0-9].fcs", [], "/data/plate_1.fcs", True, id="character class matches"),
+        pytest.param("plate_[0-9].fcs", [], "/data/plate_a.fcs", False, id="character class does not match"),
+        pytest.param("*", ["Thumbs.db"], "/data/run1/Thumbs.db", False, id="literal file name ignored"),
+        pytest.param("*", ["Thumbs.db"], "/data/run1/Thumbs.dbx", True, id="literal file name must match exactly"),
+    ],
+)
+def test_file_filter(file_pattern: str, ignore_patterns: list[str], file_path: str, expected: bool):
+    folder_path = r"C:\data" if file_path.startswith("C:") else "/data"
+    folder_config = FolderToWatch(
+        folder_path=folder_path,
+        s3_key_prefix="prefix",
+        s3_bucket_name="bucket",
+        file_pattern=file_pattern,
+        ignore_patterns=ignore_patterns,
+    )
+
+    actual = FileFilter(folder_config).should_upload(file_path)
+
+    assert actual is expected
+
+
+def test_Given_ignore_case__Then_patterns_match_regardless_of_case():
+    patterns = _CompiledPatterns(["*.TMP", "~$*", "Thumbs.db", "plate_[0-9].fcs"], ignore_case=True)
+
+    assert patterns.matches("foo.tmp") is True
+    assert patterns.matches("~$REPORT.DOCX") is True
+    assert patterns.matches("THUMBS.DB") is True
+    assert patterns.matches("PLATE_1.FCS") is True
+    assert patterns.matches("plate.fcs") is False
+
+
+def test_Given_ignore_case_and_folder_path_capitalized_differently_from_file_path__Then_relative_path_patterns_match():
+    folder_config = FolderToWatch(
+        folder_path=r"C:\Data",
+        s3_key_prefix="prefix",
+        s3_bucket_name="bucket",
+        file_pattern="*",
+        ignore_patterns=["scratch/*"],
+    )
+    file_filter = FileFilter(folder_config, ignore_case=True)
+
+    assert file_filter.should_upload(r"c:\data\Scratch\plate.fcs") is False
+    assert file_filter.should_upload(r"c:\data\run1\plate.fcs") is True
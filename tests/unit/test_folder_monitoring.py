@@ -1,4 +1,6 @@
 import datetime
+import logging
+import os
 import random
 import shutil
 import tempfile
@@ -6,23 +8,43 @@ import time
 import uuid
 from pathlib import Path
 from unittest.mock import ANY
+from unittest.mock import MagicMock
 
 import pytest
-import time_machine
+from watchdog.events import FileModifiedEvent
 
+from cloud_courier import FileFilter
+from cloud_courier import PauseWindow
 from cloud_courier import add_to_upload_record
 from cloud_courier import calculate_aws_checksum
 from cloud_courier import create_record_file
 from cloud_courier import main
 from cloud_courier import parse_upload_record
 from cloud_courier import upload_to_s3
+from cloud_courier.upload import versioned_object_key
+from cloud_courier.uploaded_files_index import FileStat
 
+from .constants import GENERIC_COURIER_CONFIG
 from .fixtures import MainLoopMixin
 from .fixtures import mocked_generic_config
 
 _fixtures = (mocked_generic_config,)
 
 
+def test_Given_debug_logging__When_any_event__Then_logged(caplog: pytest.LogCaptureFixture):
+    caplog.set_level(logging.DEBUG, logger=main.__name__)
+    file_path = str(Path(tempfile.gettempdir()) / f"{uuid.uuid4()}.txt")
+    handler = main.EventHandler(
+        folder_descriptor="fcs-files",
+        file_filter=FileFilter(GENERIC_COURIER_CONFIG.folders_to_watch["fcs-files"]),
+        enqueue=MagicMock(),
+    )
+
+    handler.on_any_event(FileModifiedEvent(file_path))
+
+    assert any(file_path in record.getMessage() for record in caplog.records if record.levelno == logging.DEBUG)
+
+
 class TestFolderMonitoring(MainLoopMixin):
     def test_When_file_created_by_opening_and_closing__Then_mock_uploaded_with_correct_args_and_added_to_internal_memory(
         self,
@@ -43,6 +65,8 @@ class TestFolderMonitoring(MainLoopMixin):
             boto_session=ANY,
             bucket_name=self.folder_config.s3_bucket_name,
             object_key=f"{self.folder_config.s3_key_prefix}{file_path}",
+            checksum=None,
+            on_progress=ANY,
         )
 
     def test_When_file_created_by_copying__Then_mock_uploaded(
@@ -114,6 +138,40 @@ class TestFolderMonitoring(MainLoopMixin):
 
         self._fail_if_file_uploaded(file_path)
 
+    def test_Given_ignore_pattern__When_matching_file_created__Then_not_queued_or_uploaded(self):
+        self.config.folders_to_watch["fcs-files"] = self.folder_config.model_copy(update={"ignore_patterns": ["*.tmp"]})
+        ignored_file_path = Path(self.watch_dir) / f"{uuid.uuid4()}.tmp"
+        file_path = Path(self.watch_dir) / f"{uuid.uuid4()}.txt"
+        self._start_loop(create_duplicate_event_stream_for_test_monitoring=True)
+
+        with ignored_file_path.open("w") as file:
+            _ = file.write("test")
+        with file_path.open("w") as file:
+            _ = file.write("test")
+
+        self._fail_if_file_not_uploaded(file_path)
+        assert ignored_file_path not in self.loop.uploaded_files
+        while not self.loop.file_system_events_for_test_monitoring.empty():
+            assert self.loop.file_system_events_for_test_monitoring.get().src_path != str(ignored_file_path)
+
+    def test_Given_in_upload_pause_window__When_file_created__Then_queued_but_not_uploaded(self):
+        self.mocked_load_config.return_value = self.config.model_copy(
+            update={
+                "app_config": self.config.app_config.model_copy(
+                    update={"upload_pause_windows": [PauseWindow(start=datetime.time.min, end=datetime.time.max)]}
+                )
+            }
+        )
+        file_path = Path(self.watch_dir) / f"{uuid.uuid4()}.txt"
+        self._start_loop()
+
+        with file_path.open("w") as file:
+            _ = file.write("test")
+
+        self._fail_if_file_uploaded(file_path)
+        assert self.loop.file_system_events.empty() is False
+        assert self.loop.upload_scheduler.pause_reason is not None
+
     def test_When_multiple_file_system_events_triggered_in_rapid_succession__Then_only_single_upload(
         self,
     ):
@@ -151,27 +209,33 @@ class TestFolderMonitoring(MainLoopMixin):
         self.config.folders_to_watch["fcs-files"] = self.config.folders_to_watch["fcs-files"].model_copy(
             update={"delay_seconds_before_upload": delay_seconds_before_upload}
         )
-        with time_machine.travel("2025-02-19 08:00:00", tick=False) as traveller:
-            self._start_loop(create_duplicate_event_stream_for_test_monitoring=True)
-            with file_path.open("w") as file:
-                _ = file.write("test")
+        fake_monotonic_seconds = [1000.0]
+        _ = self.mocker.patch.object(
+            main,
+            main._monotonic_seconds.__name__,  # noqa: SLF001 # yes, this is private, but time_machine cannot control time.monotonic
+            autospec=True,
+            side_effect=lambda: fake_monotonic_seconds[0],
+        )
+        self._start_loop(create_duplicate_event_stream_for_test_monitoring=True)
+        with file_path.open("w") as file:
+            _ = file.write("test")
 
-            # confirm an event was triggered
-            for _ in range(200):
-                if self.loop.file_system_events_for_test_monitoring.qsize() >= 0:
-                    break
-                time.sleep(0.01)
-            assert self.loop.file_system_events_for_test_monitoring.qsize() >= 0
+        # confirm an event was triggered
+        for _ in range(200):
+            if self.loop.file_system_events_for_test_monitoring.qsize() >= 0:
+                break
+            time.sleep(0.01)
+        assert self.loop.file_system_events_for_test_monitoring.qsize() >= 0
 
-            self._wait_for_loop_iterations(2)  # wait for a potential upload to occur
+        self._wait_for_loop_iterations(2)  # wait for a potential upload to occur
 
-            assert self.spied_upload_file.call_count == 0
+        assert self.spied_upload_file.call_count == 0
 
-            traveller.shift(datetime.timedelta(seconds=delay_seconds_before_upload + 1))
+        fake_monotonic_seconds[0] += delay_seconds_before_upload + 1
 
-            self._wait_for_loop_iterations(2)  # wait for a potential upload to occur
+        self._wait_for_loop_iterations(2)  # wait for a potential upload to occur
 
-            assert self.spied_upload_file.call_count == 1
+        assert self.spied_upload_file.call_count == 1
 
     def test_When_loop_run_for_large_number_of_iterations__Then_loop_counter_eventually_resets_and_does_not_overflow(
         self,
@@ -203,8 +267,12 @@ class TestInitialFolderSearch(MainLoopMixin):
         self._start_loop()
 
         self._fail_if_file_not_uploaded(file_path)
-        uploaded_files = parse_upload_record(self.upload_record_file_path)
-        assert file_path in uploaded_files
+        for _ in range(200):  # the record is group committed, so it may take a moment to be written
+            if file_path in parse_upload_record(self.upload_record_file_path):
+                break
+            time.sleep(0.01)
+        else:
+            pytest.fail("File was never added to the upload record file")
 
     def test_Given_folder_config_does_not_include_subfolders__When_file_initially_exists_in_subfolders__Then_no_upload(
         self,
@@ -234,6 +302,140 @@ class TestInitialFolderSearch(MainLoopMixin):
             cloud_path=str(uuid.uuid4()),
         )
 
+        self._start_loop(create_duplicate_event_stream_for_test_monitoring=True)
+
+        scan = self.loop.folder_scans["fcs-files"]
+        scan.join(timeout=5)
+        assert scan.is_alive() is False
+        assert scan.num_files_skipped == 1
+        assert self.loop.file_system_events_for_test_monitoring.empty() is True  # not even queued
+        self._wait_for_loop_iterations(2)  # so the loop has had the chance to upload anything it was going to
+        assert self.spied_upload_file.call_count == 0
+
+    def test_Given_many_files_initially_exist__Then_all_mock_uploaded(self):
+        num_files = 5
+        file_paths = [Path(self.watch_dir) / f"{uuid.uuid4()}.txt" for _ in range(num_files)]
+        for file_path in file_paths:
+            file_path.touch()
+
         self._start_loop()
 
-        self._fail_if_any_file_uploaded()
+        for file_path in file_paths:
+            self._fail_if_file_not_uploaded(file_path)
+
+
+class TestChangedFiles(MainLoopMixin):
+    @pytest.fixture(autouse=True)
+    def _setup_file(self, _setup: None):  # noqa: ARG002 # requested so that this runs after the MainLoopMixin setup
+        self.file_path = Path(self.watch_dir) / f"{uuid.uuid4()}.txt"
+        _ = self.file_path.write_text("test")
+
+    def _set_change_policy(self, change_policy: str):
+        self.config.folders_to_watch["fcs-files"] = self.folder_config.model_copy(
+            update={"change_policy": change_policy}
+        )
+
+    def _start_loop_with_checksumming_upload(self):
+        self.mocked_upload_to_s3 = self.mocker.patch.object(
+            main,
+            upload_to_s3.__name__,
+            autospec=True,
+            side_effect=lambda *, file_path, checksum, **_: checksum or calculate_aws_checksum(file_path),
+        )
+        self._start_loop(mock_upload_to_s3=False)
+
+    def _wait_for_num_uploads(self, num_uploads: int):
+        for _ in range(200):
+            if self.mocked_upload_to_s3.call_count >= num_uploads:
+                break
+            time.sleep(0.01)
+        else:
+            pytest.fail(f"Only {self.mocked_upload_to_s3.call_count} uploads happened, expected {num_uploads}")
+
+    def _wait_for_recorded_file_stat(self):
+        file_stats = self.file_path.stat()
+        expected = FileStat(file_stats.st_size, file_stats.st_mtime_ns)
+        for _ in range(200):
+            if self.loop.uploaded_files.file_stat(self.file_path) == expected:
+                break
+            time.sleep(0.01)
+        else:
+            pytest.fail("The file's current size and modification time were never recorded")
+
+    @pytest.mark.parametrize("change_policy", ["overwrite", "new_key"])
+    def test_Given_folder_tracks_changes__When_uploaded_file_changed__Then_new_version_uploaded(
+        self, change_policy: str
+    ):
+        self._set_change_policy(change_policy)
+        self._start_loop_with_checksumming_upload()
+        self._wait_for_num_uploads(1)
+        self._wait_for_recorded_file_stat()  # otherwise the change could land before the first upload has read the file
+
+        with self.file_path.open("a") as file:
+            _ = file.write("more")
+
+        self._wait_for_num_uploads(2)
+        new_checksum = calculate_aws_checksum(self.file_path)
+        object_key = f"{self.folder_config.s3_key_prefix}{self.file_path}"
+        expected_object_key = (
+            object_key if change_policy == "overwrite" else versioned_object_key(object_key, new_checksum)
+        )
+        assert self.mocked_upload_to_s3.call_args.kwargs["object_key"] == expected_object_key
+        assert self.mocked_upload_to_s3.call_args.kwargs["checksum"] == new_checksum
+        self._wait_for_recorded_file_stat()
+
+    def test_Given_folder_tracks_changes__When_uploaded_file_rewritten_with_same_contents__Then_not_uploaded_again(
+        self,
+    ):
+        self._set_change_policy("overwrite")
+        self._start_loop_with_checksumming_upload()
+        self._wait_for_num_uploads(1)
+        self._wait_for_recorded_file_stat()
+        previous_mtime_ns = self.file_path.stat().st_mtime_ns
+
+        os.utime(self.file_path, ns=(previous_mtime_ns, previous_mtime_ns + 1_000_000_000))
+        _ = self.file_path.write_text("test")
+
+        self._wait_for_recorded_file_stat()
+        assert self.mocked_upload_to_s3.call_count == 1
+
+    def test_Given_folder_ignores_changes__When_uploaded_file_changed__Then_not_uploaded_again(self):
+        self._start_loop_with_checksumming_upload()
+        self._wait_for_num_uploads(1)
+
+        with self.file_path.open("a") as file:
+            _ = file.write("more")
+
+        self._wait_for_loop_iterations(5)
+        assert self.mocked_upload_to_s3.call_count == 1
+
+    def test_Given_folder_tracks_changes_and_file_uploaded_before_file_stats_were_recorded__When_loop_starts__Then_checksum_matches_and_not_uploaded_again(
+        self,
+    ):
+        self._set_change_policy("new_key")
+        create_record_file(self.upload_record_file_path)
+        add_to_upload_record(
+            record_file_path=self.upload_record_file_path,
+            uploaded_file_path=self.file_path,
+            checksum=calculate_aws_checksum(self.file_path),
+            cloud_path=str(uuid.uuid4()),
+        )
+
+        self._start_loop_with_checksumming_upload()
+
+        self._wait_for_recorded_file_stat()
+        assert self.mocked_upload_to_s3.call_count == 0
+
+    def test_Given_folder_tracks_changes__When_uploaded_file_no_longer_exists__Then_treated_as_unchanged(self):
+        self._set_change_policy("overwrite")
+        self._start_loop_with_checksumming_upload()
+        self._wait_for_recorded_file_stat()
+
+        self.file_path.unlink()
+
+        assert (
+            self.loop._is_uploaded_and_unchanged(  # noqa: SLF001 # yes, this is private, but a deleted file can't otherwise be checked without a race against the event for it
+                self.file_path, self.config.folders_to_watch["fcs-files"]
+            )
+            is True
+        )
@@ -0,0 +1,248 @@
+import tempfile
+import uuid
+from pathlib import Path
+
+import pytest
+
+from cloud_courier import FileFilter
+from cloud_courier import FolderScan
+from cloud_courier import FolderToWatch
+from cloud_courier import WorkJournal
+from cloud_courier.folder_scan import iter_files_in_folder
+from cloud_courier.folder_scan import walk_folder
+from cloud_courier.work_journal import ScannedDirectory
+
+
+class TestIterFilesInFolder:
+    @pytest.fixture(autouse=True)
+    def _setup(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            self.folder = Path(temp_dir)
+            self.top_level_file = self.folder / f"{uuid.uuid4()}.txt"
+            self.top_level_file.touch()
+            self.nested_file = self.folder / str(uuid.uuid4()) / str(uuid.uuid4()) / f"{uuid.uuid4()}.txt"
+            self.nested_file.parent.mkdir(parents=True)
+            self.nested_file.touch()
+            yield
+
+    def test_Given_recursive__Then_files_in_all_subfolders_found(self):
+        actual = {entry.path for entry in iter_files_in_folder(str(self.folder), recursive=True)}
+
+        assert actual == {str(self.top_level_file), str(self.nested_file)}
+
+    def test_Given_not_recursive__Then_only_top_level_files_found(self):
+        actual = {entry.path for entry in iter_files_in_folder(str(self.folder), recursive=False)}
+
+        assert actual == {str(self.top_level_file)}
+
+    def test_Given_symlink_to_directory__Then_not_followed(self):
+        (self.folder / str(uuid.uuid4())).symlink_to(self.nested_file.parent, target_is_directory=True)
+
+        actual = [entry.path for entry in iter_files_in_folder(str(self.folder), recursive=True)]
+
+        assert sorted(actual) == sorted([str(self.top_level_file), str(self.nested_file)])
+
+    def test_Given_folder_does_not_exist__Then_nothing_found(self):
+        actual = list(iter_files_in_folder(str(self.folder / str(uuid.uuid4())), recursive=True))
+
+        assert actual == []
+
+
+class TestWalkFolder:
+    @pytest.fixture(autouse=True)
+    def _setup(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            self.folder = Path(temp_dir)
+            self.top_level_file = self.folder / f"{uuid.uuid4()}.txt"
+            self.top_level_file.touch()
+            self.nested_file = self.folder / str(uuid.uuid4()) / f"{uuid.uuid4()}.txt"
+            self.nested_file.parent.mkdir(parents=True)
+            self.nested_file.touch()
+            yield
+
+    def test_Given_no_previous_scan__Then_every_directory_yielded_after_its_files(self):
+        actual = [
+            item if isinstance(item, ScannedDirectory) else item.path
+            for item in walk_folder(str(self.folder), recursive=True)
+        ]
+
+        assert actual == [
+            str(self.top_level_file),
+            ScannedDirectory(str(self.folder), self.folder.stat().st_mtime_ns, [str(self.nested_file.parent)]),
+            str(self.nested_file),
+            ScannedDirectory(str(self.nested_file.parent), self.nested_file.parent.stat().st_mtime_ns, []),
+        ]
+
+    def test_Given_top_level_directory_unchanged_since_previous_scan__Then_only_its_subdirectory_listed(self):
+        previously_scanned = {
+            str(self.folder): ScannedDirectory(
+                str(self.folder), self.folder.stat().st_mtime_ns, [str(self.nested_file.parent)]
+            )
+        }
+
+        actual = [
+            item.path
+            for item in walk_folder(str(self.folder), recursive=True, previously_scanned=previously_scanned)
+            if not isinstance(item, ScannedDirectory)
+        ]
+
+        assert actual == [str(self.nested_file)]
+
+    def test_Given_directory_changed_since_previous_scan__Then_listed_again(self):
+        previously_scanned = {
+            str(self.folder): ScannedDirectory(
+                str(self.folder), self.folder.stat().st_mtime_ns - 1, [str(self.nested_file.parent)]
+            )
+        }
+
+        actual = {
+            item.path
+            for item in walk_folder(str(self.folder), recursive=True, previously_scanned=previously_scanned)
+            if not isinstance(item, ScannedDirectory)
+        }
+
+        assert actual == {str(self.top_level_file), str(self.nested_file)}
+
+    def test_Given_not_recursive_and_directory_unchanged__Then_nothing_listed(self):
+        previously_scanned = {
+            str(self.folder): ScannedDirectory(
+                str(self.folder), self.folder.stat().st_mtime_ns, [str(self.nested_file.parent)]
+            )
+        }
+
+        actual = list(walk_folder(str(self.folder), recursive=False, previously_scanned=previously_scanned))
+
+        assert actual == [previously_scanned[str(self.folder)]]
+
+
+class TestFolderScan:
+    @pytest.fixture(autouse=True)
+    def _setup(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            self.folder = Path(temp_dir)
+            self.folder_config = FolderToWatch(folder_path=temp_dir, s3_key_prefix="prefix", s3_bucket_name="bucket")
+            self.queued: list[str] = []
+            yield
+
+    def _create_files(self, num_files: int) -> list[Path]:
+        files = [self.folder / f"{uuid.uuid4()}.txt" for _ in range(num_files)]
+        for file in files:
+            file.touch()
+        return files
+
+    def _enqueue(self, file_path: str, folder_descriptor: str):
+        assert folder_descriptor == "foo"
+        self.queued.append(file_path)
+
+    def test_Given_some_files_already_uploaded__Then_only_others_queued(self):
+        files = self._create_files(5)
+        uploaded = set(files[:2])
+        scan = FolderScan(
+            descriptor="foo",
+            folder_config=self.folder_config,
+            file_filter=FileFilter(self.folder_config),
+            is_already_uploaded=uploaded.__contains__,
+            enqueue=self._enqueue,
+            batch_size=2,
+        )
+
+        scan.start()
+        scan.join(timeout=5)
+
+        assert sorted(self.queued) == sorted(str(file) for file in files[2:])
+        assert scan.num_files_queued == len(files) - len(uploaded)
+        assert scan.num_files_skipped == len(uploaded)
+        assert scan.is_alive() is False
+
+    def test_Given_stop_requested__Then_scan_ends_after_current_batch(self):
+        _ = self._create_files(5)
+        batch_size = 2
+        scan = FolderScan(
+            descriptor="foo",
+            folder_config=self.folder_config,
+            file_filter=FileFilter(self.folder_config),
+            is_already_uploaded=lambda _: False,
+            enqueue=self._enqueue,
+            batch_size=batch_size,
+        )
+        scan.stop()
+
+        scan.start()
+        scan.join(timeout=5)
+
+        assert len(self.queued) == batch_size
+
+    def test_Given_ignore_pattern__Then_matching_files_not_queued(self):
+        files = self._create_files(2)
+        ignored_file = self.folder / "~$report.docx"
+        ignored_file.touch()
+        folder_config = self.folder_config.model_copy(update={"ignore_patterns": ["~$*"]})
+        scan = FolderScan(
+            descriptor="foo",
+            folder_config=folder_config,
+            file_filter=FileFilter(folder_config),
+            is_already_uploaded=lambda _: False,
+            enqueue=self._enqueue,
+        )
+
+        scan.start()
+        scan.join(timeout=5)
+
+        assert sorted(self.queued) == sorted(str(file) for file in files)
+        assert scan.num_files_filtered == 1
+
+    def _scan(self, work_journal: WorkJournal) -> FolderScan:
+        self.queued.clear()
+        scan = FolderScan(
+            descriptor="foo",
+            folder_config=self.folder_config,
+            file_filter=FileFilter(self.folder_config),
+            is_already_uploaded=lambda _: False,
+            enqueue=self._enqueue,
+            work_journal=work_journal,
+        )
+        scan.start()
+        scan.join(timeout=5)
+        return scan
+
+    def test_Given_work_journal_and_nothing_changed__When_scanned_again__Then_nothing_queued(self):
+        files = self._create_files(3)
+        with tempfile.TemporaryDirectory() as journal_dir:
+            work_journal = WorkJournal(Path(journal_dir) / "journal.sqlite3")
+            _ = self._scan(work_journal)
+            assert sorted(self.queued) == sorted(str(file) for file in files)
+
+            scan = self._scan(work_journal)
+
+            work_journal.close()
+        assert self.queued == []
+        assert scan.num_directories_unchanged == 1
+
+    def test_Given_work_journal__When_file_added_to_subdirectory_and_scanned_again__Then_only_that_file_queued(self):
+        subdirectory = self.folder / str(uuid.uuid4())
+        subdirectory.mkdir()
+        _ = self._create_files(2)
+        with tempfile.TemporaryDirectory() as journal_dir:
+            work_journal = WorkJournal(Path(journal_dir) / "journal.sqlite3")
+            _ = self._scan(work_journal)
+            new_file = subdirectory / f"{uuid.uuid4()}.txt"
+            new_file.touch()
+
+            scan = self._scan(work_journal)
+
+            work_journal.close()
+        assert self.queued == [str(new_file)]
+        assert scan.num_directories_unchanged == 1
+
+    def test_Given_work_journal__When_subdirectory_removed_and_scanned_again__Then_it_is_forgotten(self):
+        subdirectory = self.folder / str(uuid.uuid4())
+        subdirectory.mkdir()
+        with tempfile.TemporaryDirectory() as journal_dir:
+            work_journal = WorkJournal(Path(journal_dir) / "journal.sqlite3")
+            _ = self._scan(work_journal)
+            subdirectory.rmdir()
+
+            _ = self._scan(work_journal)
+
+            assert set(work_journal.scanned_directories("foo")) == {str(self.folder)}
+            work_journal.close()
@@ -0,0 +1,38 @@
+import pytest
+
+from cloud_courier import PipelineLiveness
+from cloud_courier.liveness import InFlightUpload
+
+
+class TestPipelineLiveness:
+    @pytest.fixture(autouse=True)
+    def _setup(self):
+        self.now = [100.0]
+        self.liveness = PipelineLiveness(clock=lambda: self.now[0])
+
+    def test_Given_no_progress__Then_time_since_progress_grows(self):
+        self.now[0] += 30
+
+        assert self.liveness.seconds_since_progress() == 30  # noqa: PLR2004 # the time that passed
+
+    def test_Given_long_upload_still_sending__Then_in_progress_and_recently_progressed(self):
+        self.liveness.upload_started("/data/run.fcs", total_bytes=10)
+        self.now[0] += 600
+        self.liveness.record_upload_progress("/data/run.fcs", 4)
+        self.now[0] += 1
+
+        assert self.liveness.is_upload_in_progress is True
+        assert self.liveness.seconds_since_progress() == 1
+        assert self.liveness.in_flight_uploads() == [
+            InFlightUpload(file_path="/data/run.fcs", total_bytes=10, bytes_sent=4, seconds_elapsed=601)
+        ]
+
+    def test_When_upload_finished__Then_no_longer_in_progress(self):
+        self.liveness.upload_started("/data/run.fcs", total_bytes=10)
+        self.now[0] += 10
+
+        self.liveness.upload_finished("/data/run.fcs")
+
+        assert self.liveness.is_upload_in_progress is False
+        assert self.liveness.in_flight_uploads() == []
+        assert self.liveness.seconds_since_progress() == 0
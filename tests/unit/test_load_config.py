@@ -1,13 +1,20 @@
+import math
 import uuid
+from collections import Counter
+from typing import Any
 
 import boto3
 import pytest
 from pydantic import ValidationError
 from pytest_mock import MockerFixture
 
+from cloud_courier import AppConfig
+from cloud_courier import FolderToWatch
+from cloud_courier import diff_folders_to_watch
 from cloud_courier import extract_role_name_from_arn
 from cloud_courier import load_config
 from cloud_courier import load_config_from_aws
+from cloud_courier.courier_config_models import APP_CONFIG_PARAMETER_NAME
 
 from .constants import COMPLEX_COURIER_CONFIG
 from .constants import GENERIC_COURIER_CONFIG
@@ -36,6 +43,57 @@ def test_extract_role_name_from_arn(arn: str, expected: str):
     assert actual == expected
 
 
+class TestDiffFoldersToWatch:
+    @pytest.fixture(autouse=True)
+    def _setup(self):
+        self.folder = FolderToWatch(folder_path="foo", s3_key_prefix="my-prefix", s3_bucket_name="baz")
+
+    def test_Given_identical_folders__Then_diff_is_empty(self):
+        actual = diff_folders_to_watch({"a": self.folder}, {"a": self.folder.model_copy()})
+
+        assert actual.is_empty is True
+
+    def test_Given_folder_only_in_new__Then_added(self):
+        actual = diff_folders_to_watch({"a": self.folder}, {"a": self.folder, "b": self.folder})
+
+        assert actual.added == {"b"}
+        assert actual.removed == set()
+        assert actual.changed == set()
+
+    def test_Given_folder_only_in_current__Then_removed(self):
+        actual = diff_folders_to_watch({"a": self.folder, "b": self.folder}, {"a": self.folder})
+
+        assert actual.removed == {"b"}
+        assert actual.added == set()
+        assert actual.is_empty is False
+
+    def test_Given_folder_setting_differs__Then_changed(self):
+        actual = diff_folders_to_watch(
+            {"a": self.folder, "b": self.folder},
+            {"a": self.folder, "b": self.folder.model_copy(update={"recursive": False})},
+        )
+
+        assert actual.changed == {"b"}
+        assert actual.added == set()
+        assert actual.removed == set()
+        assert actual.updated == set()
+
+    @pytest.mark.parametrize(
+        "update",
+        [
+            pytest.param({"delay_seconds_before_upload": 30}, id="delay"),
+            pytest.param({"s3_bucket_name": "other-bucket"}, id="bucket"),
+            pytest.param({"change_policy": "overwrite"}, id="change policy"),
+        ],
+    )
+    def test_Given_only_upload_setting_differs__Then_updated_rather_than_changed(self, update: dict[str, object]):
+        actual = diff_folders_to_watch({"a": self.folder}, {"a": self.folder.model_copy(update=update)})
+
+        assert actual.updated == {"a"}
+        assert actual.changed == set()
+        assert actual.is_empty is False
+
+
 class LoadConfigFromAws:
     _config = GENERIC_COURIER_CONFIG
 
@@ -49,6 +107,9 @@ class LoadConfigFromAws:
             autospec=True,
             return_value=f"arn:aws:sts::423123810054:assumed-role/{self._config.role_name}/mi-085b6ad72febfabf4",
         )
+        self.app_config_parameter_name = (
+            f"/cloud-courier/{self._config.alias_name or self._config.role_name}/{APP_CONFIG_PARAMETER_NAME}"
+        )
         yield
         cleanup_config_in_aws(self._config)
 
@@ -78,6 +139,77 @@ class TestLoadGenericConfigFromAws(LoadConfigFromAws):
         actual_call = spied_logger_exception.call_args_list[0]
         assert f"for {expected_descriptor}" in actual_call[0][0]
 
+    def test_Given_previous_config__When_parameter_unchanged__Then_folder_not_validated_again(
+        self, mocker: MockerFixture
+    ):
+        previous = load_config_from_aws(self.session)
+        spied_validate = mocker.spy(FolderToWatch, "model_validate_json")
+
+        actual = load_config_from_aws(self.session, previous=previous)
+
+        spied_validate.assert_not_called()
+        assert actual.folders_to_watch["fcs-files"] is previous.folders_to_watch["fcs-files"]
+        assert actual.parameter_versions == previous.parameter_versions
+
+    def test_Given_previous_config__When_parameter_changed__Then_new_value_used(self):
+        previous = load_config_from_aws(self.session)
+        parameter_name = f"/cloud-courier/{GENERIC_COURIER_CONFIG.alias_name}/folders/fcs-files"
+        new_folder = GENERIC_COURIER_CONFIG.folders_to_watch["fcs-files"].model_copy(update={"file_pattern": "*.csv"})
+        _ = self.session.client("ssm").put_parameter(
+            Name=parameter_name, Value=new_folder.model_dump_json(), Type="String", Overwrite=True
+        )
+
+        actual = load_config_from_aws(self.session, previous=previous)
+
+        assert actual.folders_to_watch["fcs-files"] == new_folder
+        assert actual.parameter_versions[parameter_name] == previous.parameter_versions[parameter_name] + 1
+
+    def test_Given_app_config_parameter__Then_settings_loaded_and_others_defaulted(self):
+        _ = self.session.client("ssm").put_parameter(
+            Name=self.app_config_parameter_name,
+            Value='{"log_shipping_s3_bucket_name": "my-log-bucket", "max_upload_attempts": 3}',
+            Type="String",
+            Overwrite=True,
+        )
+
+        actual = load_config_from_aws(self.session)
+
+        assert actual.app_config == AppConfig(log_shipping_s3_bucket_name="my-log-bucket", max_upload_attempts=3)
+        assert actual.folders_to_watch == GENERIC_COURIER_CONFIG.folders_to_watch
+        assert self.app_config_parameter_name in actual.parameter_versions
+
+    def test_Given_no_app_config_parameter__Then_defaults_used(self):
+        _ = self.session.client("ssm").delete_parameter(Name=self.app_config_parameter_name)
+
+        actual = load_config_from_aws(self.session)
+
+        assert actual.app_config == AppConfig()
+        assert actual.folders_to_watch == GENERIC_COURIER_CONFIG.folders_to_watch
+
+    def test_Given_malformed_app_config__Then_error_logged_and_raised(self, mocker: MockerFixture):
+        spied_logger_exception = mocker.spy(load_config.logger, "exception")
+        _ = self.session.client("ssm").put_parameter(
+            Name=self.app_config_parameter_name,
+            Value='{"max_upload_attempts": 0}',
+            Type="String",
+            Overwrite=True,
+        )
+
+        with pytest.raises(ValidationError, match="max_upload_attempts"):
+            _ = load_config_from_aws(self.session)
+
+        spied_logger_exception.assert_called_once()
+        assert self.app_config_parameter_name in spied_logger_exception.call_args_list[0][0][0]
+
+    def test_Given_previous_config__When_app_config_unchanged__Then_not_validated_again(self, mocker: MockerFixture):
+        previous = load_config_from_aws(self.session)
+        spied_validate = mocker.spy(AppConfig, "model_validate_json")
+
+        actual = load_config_from_aws(self.session, previous=previous)
+
+        spied_validate.assert_not_called()
+        assert actual.app_config is previous.app_config
+
 
 class TestLoadComplexConfigFromAws(LoadConfigFromAws):
     _config = COMPLEX_COURIER_CONFIG
@@ -88,3 +220,22 @@ class TestLoadComplexConfigFromAws(LoadConfigFromAws):
 
         assert len(actual.folders_to_watch) > arbitrary_min_expected_num_folders
         assert actual.folders_to_watch == COMPLEX_COURIER_CONFIG.folders_to_watch
+
+    def test_Then_parameters_fetched_in_pages_of_ten_without_describing_them(self):
+        calls: Counter[str] = Counter()
+
+        def count_call(model: Any, **_: Any) -> None:  # noqa: ANN401 # botocore's event handlers aren't typed
+            calls[model.name] += 1
+
+        self.session.events.register("before-call.ssm", count_call)
+
+        actual = load_config_from_aws(self.session)
+
+        assert calls.keys() == {"GetParameter", "GetParametersByPath"}
+        assert calls["GetParameter"] == 1  # the alias
+        # the app config comes in the same pages as the folders
+        expected_num_pages = math.ceil(
+            len(actual.parameter_versions) / load_config.SSM_GET_PARAMETERS_BY_PATH_PAGE_SIZE
+        )
+        # when the last page is full, SSM may still hand back a token that leads to one final empty page
+        assert calls["GetParametersByPath"] in (expected_num_pages, expected_num_pages + 1)
@@ -0,0 +1,350 @@
+import gzip
+import logging
+import tempfile
+import time
+import uuid
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+from cloud_courier import LogShipper
+from cloud_courier import load_config
+from cloud_courier import load_config_from_aws
+from cloud_courier import log_shipping
+from cloud_courier.courier_config_models import APP_CONFIG_PARAMETER_NAME
+from cloud_courier.courier_config_models import SSM_PARAMETER_PREFIX
+from cloud_courier.log_shipping import LOG_SHIPPING_STATE_FILE_NAME
+from cloud_courier.log_shipping import LogShippingState
+from cloud_courier.log_shipping import load_log_shipping_state
+from cloud_courier.log_shipping import save_log_shipping_state
+
+from .fixtures import MainLoopMixin
+from .fixtures import cleanup_config_in_aws
+from .fixtures import store_config_in_aws
+
+INTERVAL_SECONDS = 300
+MAX_BATCH_BYTES = 200
+BACKUP_COUNT = 3
+
+
+def _line(number: int) -> bytes:
+    return f'{{"message": "line {number}", "padding": "{"x" * 20}"}}\n'.encode()
+
+
+class LogFileMixin:
+    @pytest.fixture(autouse=True)
+    def _setup(self, mocker: MockerFixture):
+        self.mocker = mocker
+        with tempfile.TemporaryDirectory() as log_dir:
+            self.log_file_path = Path(log_dir) / "cloud-courier-courier.log"
+            self.state_path = Path(log_dir) / LOG_SHIPPING_STATE_FILE_NAME
+            self.now = [1000.0]
+            self.uploaded: dict[str, bytes] = {}
+            self.upload_names: list[str] = []
+            yield
+
+    def _upload_batch(self, batch_name: str, compressed_batch: bytes):
+        self.upload_names.append(batch_name)
+        self.uploaded[batch_name] = gzip.decompress(compressed_batch)
+
+    def _create_shipper(self) -> LogShipper:
+        return LogShipper(
+            log_file_path=self.log_file_path,
+            state_path=self.state_path,
+            upload_batch=self._upload_batch,
+            max_batch_bytes=MAX_BATCH_BYTES,
+            interval_seconds=INTERVAL_SECONDS,
+            backup_count=BACKUP_COUNT,
+            clock=lambda: self.now[0],
+        )
+
+    def _append(self, data: bytes, path: Path | None = None):
+        with (self.log_file_path if path is None else path).open("ab") as file:
+            _ = file.write(data)
+
+    def _shipped(self) -> bytes:
+        # the batch names sort in the order they were written within each file, so put them back in upload order (without any re-uploads)
+        return b"".join(self.uploaded[name] for name in dict.fromkeys(self.upload_names))
+
+
+class TestLogShipper(LogFileMixin):
+    def test_Given_less_than_a_batch__When_interval_not_elapsed__Then_nothing_shipped(self):
+        self._append(_line(0) + _line(1))
+        shipper = self._create_shipper()
+
+        assert shipper.ship_if_due() == 0
+
+        assert self.uploaded == {}
+
+    def test_Given_less_than_a_batch__When_interval_elapsed__Then_shipped_compressed_and_offset_saved(self):
+        expected = _line(0) + _line(1)
+        self._append(expected)
+        shipper = self._create_shipper()
+        self.now[0] += INTERVAL_SECONDS
+
+        assert shipper.ship_if_due() == 1
+
+        assert self._shipped() == expected
+        state = load_log_shipping_state(self.state_path)
+        assert state is not None
+        assert state.offset == len(expected)
+
+    def test_Given_more_than_a_batch__Then_shipped_in_batches_of_complete_lines_without_waiting(self):
+        expected = b"".join(_line(number) for number in range(20))
+        self._append(expected)
+        shipper = self._create_shipper()
+
+        num_batches = shipper.ship_if_due()
+
+        assert num_batches > 1
+        assert self._shipped() == expected
+        assert all(batch.endswith(b"\n") and len(batch) <= MAX_BATCH_BYTES for batch in self.uploaded.values())
+
+    def test_Given_line_still_being_written__Then_only_complete_lines_shipped(self):
+        self._append(_line(0) + b'{"message": "half wri')
+        shipper = self._create_shipper()
+        self.now[0] += INTERVAL_SECONDS
+
+        _ = shipper.ship_if_due()
+        self._append(b'tten"}\n')
+        self.now[0] += INTERVAL_SECONDS
+        _ = shipper.ship_if_due()
+
+        assert self._shipped() == _line(0) + b'{"message": "half written"}\n'
+
+    def test_Given_line_longer_than_a_batch__Then_shipped_whole(self):
+        expected = b'{"message": "' + b"x" * MAX_BATCH_BYTES * 2 + b'"}\n'
+        self._append(_line(0) + expected)
+        shipper = self._create_shipper()
+
+        _ = shipper.ship_if_due()
+
+        assert self._shipped() == _line(0) + expected
+
+    def test_Given_first_line_still_being_written__Then_nothing_shipped(self):
+        self._append(b'{"message": "half wri')
+        shipper = self._create_shipper()
+        self.now[0] += INTERVAL_SECONDS
+
+        assert shipper.ship_if_due() == 0
+
+    def test_Given_no_log_file_yet__Then_nothing_shipped(self):
+        self.now[0] += INTERVAL_SECONDS
+
+        assert self._create_shipper().ship_if_due() == 0
+
+    def test_Given_restarted__Then_carries_on_from_saved_offset_without_duplicates(self):
+        self._append(_line(0) + _line(1))
+        self.now[0] += INTERVAL_SECONDS
+        _ = self._create_shipper().ship_if_due()
+        self._append(_line(2))
+
+        restarted_shipper = self._create_shipper()
+        self.now[0] += INTERVAL_SECONDS
+        _ = restarted_shipper.ship_if_due()
+
+        assert self._shipped() == _line(0) + _line(1) + _line(2)
+
+    def test_Given_upload_fails__Then_offset_not_saved_and_same_batch_uploaded_again(self):
+        self._append(_line(0))
+        upload_batch = self._upload_batch
+
+        def upload_then_lose_connection(batch_name: str, compressed_batch: bytes):
+            upload_batch(batch_name, compressed_batch)
+            raise ConnectionError("Connection reset before the response arrived")
+
+        self._upload_batch = upload_then_lose_connection
+        shipper = self._create_shipper()
+        self.now[0] += INTERVAL_SECONDS
+        with pytest.raises(ConnectionError, match="reset"):
+            _ = shipper.ship_if_due()
+        self._upload_batch = upload_batch
+        restarted_shipper = self._create_shipper()
+        self.now[0] += INTERVAL_SECONDS
+        _ = restarted_shipper.ship_if_due()
+
+        assert len(self.upload_names) == 2  # noqa: PLR2004 # the failed attempt and the retry
+        assert len(set(self.upload_names)) == 1
+        assert self._shipped() == _line(0)
+
+    def test_When_log_rotated_while_agent_running_and_restarting__Then_every_line_shipped_exactly_once(self):
+        handler = RotatingFileHandler(self.log_file_path, maxBytes=300, backupCount=BACKUP_COUNT)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        test_logger = logging.getLogger(str(uuid.uuid4()))
+        test_logger.propagate = False
+        test_logger.addHandler(handler)
+        expected_lines: list[str] = []
+        try:
+            shipper = self._create_shipper()
+            for number in range(60):
+                message = f"line {number} {'x' * 30}"
+                test_logger.warning(message)
+                expected_lines.append(message)
+                if number % 7 == 0:
+                    _ = shipper.ship_if_due()
+                if number % 17 == 0:
+                    shipper = self._create_shipper()  # restarted
+            self.now[0] += INTERVAL_SECONDS
+            _ = shipper.ship_if_due()
+        finally:
+            test_logger.removeHandler(handler)
+            handler.close()
+
+        assert self._shipped().decode().splitlines() == expected_lines
+
+    def test_Given_file_being_shipped_rotated_away__Then_warning_logged_and_oldest_file_shipped(self):
+        spied_warning = self.mocker.spy(log_shipping.logger, "warning")
+        save_log_shipping_state(LogShippingState(fingerprint="gone", offset=123), self.state_path)
+        backup_path = self.log_file_path.with_name(f"{self.log_file_path.name}.1")
+        self._append(_line(0), backup_path)
+        self._append(_line(1))
+        shipper = self._create_shipper()
+        self.now[0] += INTERVAL_SECONDS
+
+        _ = shipper.ship_if_due()
+
+        spied_warning.assert_called_once()
+        assert self._shipped() == _line(0) + _line(1)
+
+    def test_Given_rotated_while_shipping__Then_stops_and_picks_up_next_time(self):
+        self._append(_line(0))
+        shipper = self._create_shipper()
+        self.now[0] += INTERVAL_SECONDS
+
+        actual = shipper._read_batch(  # noqa: SLF001 # the window between listing the files and reading one is too small to hit reliably
+            self.log_file_path, fingerprint="from-before-the-rotation", offset=0
+        )
+
+        assert actual is None
+
+    def test_Given_file_missing_while_rotating__Then_stops_and_picks_up_next_time(self):
+        shipper = self._create_shipper()
+
+        actual = shipper._read_batch(  # noqa: SLF001 # the window between renaming the file and creating the new one is too small to hit reliably
+            self.log_file_path, fingerprint="anything", offset=0
+        )
+
+        assert actual is None
+
+    def test_Given_rotated_between_listing_and_reading__Then_nothing_more_shipped_this_time(self):
+        self._append(_line(0))
+        self._append(_line(1), self.log_file_path.with_name(f"{self.log_file_path.name}.1"))
+        shipper = self._create_shipper()
+        _ = self.mocker.patch.object(shipper, "_read_batch", autospec=True, return_value=None)
+
+        assert shipper.ship_if_due() == 0
+
+
+class TestLogShippingState(LogFileMixin):
+    def test_When_saved_then_loaded__Then_same(self):
+        expected = LogShippingState(fingerprint=str(uuid.uuid4()), offset=42)
+
+        save_log_shipping_state(expected, self.state_path)
+
+        assert load_log_shipping_state(self.state_path) == expected
+
+    def test_Given_invalid__Then_none_and_error_logged(self):
+        spied_exception = self.mocker.spy(log_shipping.logger, "exception")
+        _ = self.state_path.write_text('{"fingerprint": ')
+
+        assert load_log_shipping_state(self.state_path) is None
+
+        spied_exception.assert_called_once()
+
+
+class TestMainLoopLogShipping(MainLoopMixin):
+    @pytest.fixture(autouse=True)
+    def _setup_bucket(self, _setup: None):  # noqa: ARG002 # requested so that this runs after the MainLoopMixin setup
+        self.bucket_name = str(uuid.uuid4())
+        self.s3_client = self.boto_session.client("s3")
+        _ = self.s3_client.create_bucket(Bucket=self.bucket_name)
+        self.log_file_path = self.upload_record_file_path.parent / "cloud-courier-courier.log"
+        self.log_file_path.parent.mkdir(parents=True)
+        yield
+        for item in self.s3_client.list_objects_v2(Bucket=self.bucket_name).get("Contents", []):
+            assert "Key" in item
+            _ = self.s3_client.delete_object(Bucket=self.bucket_name, Key=item["Key"])
+        _ = self.s3_client.delete_bucket(Bucket=self.bucket_name)
+
+    def _configure_log_shipping(self, **app_config_updates: object):
+        self.mocked_load_config.return_value = self.config.model_copy(
+            update={"app_config": self.config.app_config.model_copy(update=app_config_updates)}
+        )
+
+    @pytest.fixture
+    def config_in_ssm(self):
+        """Load the configuration from (the mocked) SSM, rather than the mocked loader returning a model built by the test."""
+        store_config_in_aws(self.config)
+        self.mocked_load_config.side_effect = load_config_from_aws
+        _ = self.mocker.patch.object(
+            load_config,
+            "get_role_arn",
+            autospec=True,
+            return_value=f"arn:aws:sts::423123810054:assumed-role/{self.config.role_name}/mi-085b6ad72febfabf4",
+        )
+        yield
+        cleanup_config_in_aws(self.config)
+
+    def _wait_for_log_shipped(self, num_bytes: int):
+        state_path = self.upload_record_file_path.parent / LOG_SHIPPING_STATE_FILE_NAME
+        for _ in range(300):
+            state = load_log_shipping_state(state_path)
+            if state is not None and state.offset == num_bytes:
+                break
+            time.sleep(0.01)
+        else:
+            pytest.fail("The log was never shipped")
+
+    def test_Given_bucket_configured__Then_log_shipped_to_s3_under_role_name(self):
+        expected = b"".join(_line(number) for number in range(10))
+        _ = self.log_file_path.write_bytes(expected)
+        self._configure_log_shipping(log_shipping_s3_bucket_name=self.bucket_name, log_shipping_batch_max_bytes=100)
+
+        self._start_loop(log_file_path=self.log_file_path)
+        self._wait_for_log_shipped(len(expected))
+
+        objects = self.s3_client.list_objects_v2(Bucket=self.bucket_name).get("Contents", [])
+        keys = sorted(item["Key"] for item in objects if "Key" in item)
+        assert all(key.startswith(f"cloud-courier-logs/{self.config.role_name}/") for key in keys)
+        shipped = b"".join(
+            gzip.decompress(self.s3_client.get_object(Bucket=self.bucket_name, Key=key)["Body"].read()) for key in keys
+        )
+        assert shipped == expected
+
+    @pytest.mark.usefixtures("config_in_ssm")
+    def test_Given_bucket_configured_in_ssm_app_config__Then_log_shipped(self):
+        expected = b"".join(_line(number) for number in range(10))
+        _ = self.log_file_path.write_bytes(expected)
+        _ = self.boto_session.client("ssm").put_parameter(
+            Name=f"{SSM_PARAMETER_PREFIX}/{self.config.alias_name}/{APP_CONFIG_PARAMETER_NAME}",
+            Value=f'{{"log_shipping_s3_bucket_name": "{self.bucket_name}", "log_shipping_batch_max_bytes": 100}}',
+            Type="String",
+            Overwrite=True,
+        )
+
+        self._start_loop(log_file_path=self.log_file_path)
+        self._wait_for_log_shipped(len(expected))
+
+        assert self.loop.config.app_config.log_shipping_s3_bucket_name == self.bucket_name
+
+    def test_Given_bucket_and_smaller_batches_configured_by_refresh__Then_log_shipped_without_waiting_for_interval(
+        self,
+    ):
+        expected = b"".join(_line(number) for number in range(10))
+        _ = self.log_file_path.write_bytes(expected)
+        self._start_loop(log_file_path=self.log_file_path)
+
+        self._configure_log_shipping(log_shipping_s3_bucket_name=self.bucket_name, log_shipping_batch_max_bytes=100)
+        assert self.loop._refresh_config() is True  # noqa: SLF001 # calling it directly, rather than waiting minutes for the refresh to be due
+
+        self._wait_for_log_shipped(len(expected))
+
+    def test_Given_no_bucket_configured__Then_nothing_shipped(self):
+        _ = self.log_file_path.write_bytes(_line(0))
+
+        self._start_loop(log_file_path=self.log_file_path)
+        self.loop._ship_logs_if_due()  # noqa: SLF001 # calling it directly, since waiting for the periodic task thread would slow down the test
+
+        assert load_log_shipping_state(self.upload_record_file_path.parent / LOG_SHIPPING_STATE_FILE_NAME) is None
@@ -0,0 +1,382 @@
+import json
+import logging
+import queue
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from collections.abc import Callable
+from logging.handlers import BufferingHandler
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+from cloud_courier import configure_logging
+from cloud_courier import logger_config
+from cloud_courier.logger_config import AUDIT_LOG_EXTRA
+from cloud_courier.logger_config import DroppingQueueHandler
+from cloud_courier.logger_config import HostFields
+from cloud_courier.logger_config import LogRateLimit
+from cloud_courier.logger_config import RateLimitingFilter
+
+
+def _wait_for(condition_met: Callable[[], bool]) -> None:
+    for _ in range(500):
+        if condition_met():
+            return
+        time.sleep(0.01)
+    pytest.fail("Timed out waiting")
+
+
+class TestConfigureLogging:
+    @pytest.fixture(autouse=True)
+    def _setup(self, mocker: MockerFixture):
+        self.mocker = mocker
+        root_logger = logging.getLogger()
+        original_handlers = list(root_logger.handlers)
+        original_level = root_logger.level
+        with tempfile.TemporaryDirectory() as log_dir:
+            self.log_filename_prefix = str(Path(log_dir) / "cloud-courier-")
+            self.log_path = Path(f"{self.log_filename_prefix}{logger_config.SUBSYSTEM_NAME}.log")
+            yield
+            logger_config._LogQueueListener.replace(None)  # noqa: SLF001 # stopping the background thread so the log folder can be deleted
+            logger_config._CurrentRateLimitingFilter.current = None  # noqa: SLF001 # so what this test suppressed isn't reported during the next one
+            for handler in list(root_logger.handlers):
+                root_logger.removeHandler(handler)
+                handler.close()
+        for handler in original_handlers:
+            root_logger.addHandler(handler)
+        root_logger.setLevel(original_level)
+
+    def _logged_entries(self) -> list[dict[str, object]]:
+        if not self.log_path.exists():
+            return []
+        return [json.loads(line) for line in self.log_path.read_text().splitlines()]
+
+    def test_Given_asynchronous__When_logged__Then_written_to_file_by_background_thread(self):
+        threads_writing: list[threading.Thread] = []
+        original_emit = RotatingFileHandler.emit
+
+        def record_thread_then_emit(handler: RotatingFileHandler, record: logging.LogRecord) -> None:
+            threads_writing.append(threading.current_thread())
+            original_emit(handler, record)
+
+        _ = self.mocker.patch.object(RotatingFileHandler, "emit", autospec=True, side_effect=record_thread_then_emit)
+        expected_message = str(uuid.uuid4())
+
+        queue_handler = configure_logging(log_filename_prefix=self.log_filename_prefix, suppress_console_logging=True)
+        logging.getLogger(__name__).info(expected_message)
+
+        assert isinstance(queue_handler, DroppingQueueHandler)
+        _wait_for(lambda: any(entry["message"] == expected_message for entry in self._logged_entries()))
+        assert threading.current_thread() not in threads_writing
+
+    def test_Given_asynchronous__When_exception_logged__Then_traceback_rendered(self):
+        expected_error = str(uuid.uuid4())
+        _ = configure_logging(log_filename_prefix=self.log_filename_prefix, suppress_console_logging=True)
+
+        try:
+            raise RuntimeError(expected_error)  # noqa: TRY301 # raising here so there is a real traceback to render
+        except RuntimeError:
+            logging.getLogger(__name__).exception("Something went wrong")
+
+        _wait_for(lambda: expected_error in self.log_path.read_text() if self.log_path.exists() else False)
+        (entry,) = [entry for entry in self._logged_entries() if entry["message"] == "Something went wrong"]
+        assert "exception" in entry
+
+    def test_Given_synchronous__When_logged__Then_already_written(self):
+        expected_message = str(uuid.uuid4())
+
+        assert (
+            configure_logging(
+                log_filename_prefix=self.log_filename_prefix, suppress_console_logging=True, asynchronous=False
+            )
+            is None
+        )
+        logging.getLogger(__name__).info(expected_message)
+
+        assert [entry["message"] for entry in self._logged_entries()] == [expected_message]
+
+    def test_When_logged__Then_host_name_included(self):
+        _ = configure_logging(
+            log_filename_prefix=self.log_filename_prefix, suppress_console_logging=True, asynchronous=False
+        )
+
+        logging.getLogger(__name__).info("test")
+
+        assert [entry["host.name"] for entry in self._logged_entries()] == [socket.gethostname()]
+
+    def test_Given_rate_limit__When_logged_in_a_loop__Then_only_limit_and_audit_lines_written(self):
+        _ = configure_logging(
+            log_filename_prefix=self.log_filename_prefix,
+            suppress_console_logging=True,
+            asynchronous=False,
+            rate_limits={"": LogRateLimit(max_per_window=1, window_seconds=60)},
+        )
+        test_logger = logging.getLogger(__name__)
+
+        for i in range(3):
+            test_logger.info(f"Connected to AWS as: {i}")
+            test_logger.info(f"Uploaded {i}", extra=AUDIT_LOG_EXTRA)
+
+        assert [entry["message"] for entry in self._logged_entries()] == [
+            "Connected to AWS as: 0",
+            "Uploaded 0",
+            "Uploaded 1",
+            "Uploaded 2",
+        ]
+
+    def test_Given_records_suppressed__When_logging_reconfigured__Then_number_suppressed_written_first(self):
+        _ = configure_logging(
+            log_filename_prefix=self.log_filename_prefix,
+            suppress_console_logging=True,
+            asynchronous=False,
+            rate_limits={"": LogRateLimit(max_per_window=1, window_seconds=60)},
+        )
+        test_logger = logging.getLogger(__name__)
+        for i in range(3):
+            test_logger.info(f"Connected to AWS as: {i}")
+
+        _ = configure_logging(
+            log_filename_prefix=self.log_filename_prefix, suppress_console_logging=True, asynchronous=False
+        )
+
+        entries = self._logged_entries()
+        assert len(entries) == 2  # noqa: PLR2004 # the one allowed and the report
+        assert entries[-1]["num_suppressed"] == 2  # noqa: PLR2004 # the rest
+
+
+class TestRateLimitingFilter:
+    @pytest.fixture(autouse=True)
+    def _setup(self):
+        self.now = [100.0]
+        self.filter = RateLimitingFilter(
+            rate_limits={
+                "": LogRateLimit(max_per_window=2, window_seconds=60),
+                "quiet": None,
+                "chatty": LogRateLimit(max_per_window=1, window_seconds=10),
+            },
+            clock=lambda: self.now[0],
+        )
+        self.handler = BufferingHandler(capacity=1000)
+        self.handler.addFilter(self.filter)
+        self.loggers: list[logging.Logger] = []
+        self.logger = self._logger(str(uuid.uuid4()))
+        yield
+        for logger in self.loggers:
+            logger.removeHandler(self.handler)
+
+    def _logger(self, name: str) -> logging.Logger:
+        logger = logging.getLogger(name)
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        logger.addHandler(self.handler)
+        self.loggers.append(logger)
+        return logger
+
+    def _messages(self) -> list[str]:
+        return [record.getMessage() for record in self.handler.buffer]
+
+    def test_When_call_site_logs_more_than_limit__Then_rest_suppressed_but_other_call_sites_still_logged(self):
+        for i in range(5):
+            self.logger.info(f"Skipping file {i}")
+        self.logger.info("Something else")
+
+        assert self._messages() == ["Skipping file 0", "Skipping file 1", "Something else"]
+
+    def test_Given_records_suppressed__When_window_ends__Then_next_record_says_how_many(self):
+        for i in range(6):
+            if i == 5:  # noqa: PLR2004 # the last one
+                self.now[0] += 60
+            self.logger.info(f"Connected {i}")
+
+        assert self._messages() == [
+            "Connected 0",
+            "Connected 1",
+            "Connected 5 [3 more from the same place suppressed in the previous 60 s]",
+        ]
+        assert getattr(self.handler.buffer[-1], "num_suppressed", None) == 3  # noqa: PLR2004 # the ones in between
+
+    def test_Then_warnings_errors_and_audit_lines_always_kept(self):
+        for i in range(5):
+            self.logger.warning(f"Retrying {i}")
+            self.logger.error(f"Failed {i}")
+            self.logger.info(f"Uploaded {i}", extra=AUDIT_LOG_EXTRA)
+
+        assert len(self._messages()) == 15  # noqa: PLR2004 # all of them
+
+    def test_Given_call_site_went_quiet__When_reported_after_window_ends__Then_number_suppressed_logged_once(self):
+        for i in range(5):
+            self.logger.info(f"Skipping file {i}")
+        self.now[0] += 60
+
+        self.filter.report_suppressed()
+        self.filter.report_suppressed()
+
+        assert len(self._messages()) == 3  # noqa: PLR2004 # the 2 allowed and the report
+        assert getattr(self.handler.buffer[-1], "num_suppressed", None) == 3  # noqa: PLR2004 # the rest
+        assert self._messages()[-1].startswith("3 more log records from ")
+
+    def test_Given_window_not_ended__When_reported__Then_nothing_logged_until_window_ends(self):
+        for i in range(5):
+            self.logger.info(f"Skipping file {i}")
+
+        self.filter.report_suppressed()
+
+        assert len(self._messages()) == 2  # noqa: PLR2004 # only the ones allowed
+
+    def test_Given_window_not_ended__When_reported_including_current_windows__Then_logged_and_not_repeated_by_next_record(
+        self,
+    ):
+        for i in range(5):
+            self.logger.info(f"Skipping file {i}")
+
+        self.filter.report_suppressed(include_current_windows=True)
+        self.now[0] += 60
+        self.logger.info("Skipping file 5")
+
+        assert len(self._messages()) == 4  # noqa: PLR2004 # the 2 allowed, the report and the next one
+        assert self._messages()[-1] == "Skipping file 5"
+        assert getattr(self.handler.buffer[2], "num_suppressed", None) == 3  # noqa: PLR2004 # the rest
+
+    def test_Given_nothing_suppressed__When_reported__Then_nothing_logged(self):
+        self.logger.info("Skipping file 0")
+        quiet_logger = self._logger("quiet")
+        quiet_logger.info("Event")
+        self.now[0] += 60
+
+        self.filter.report_suppressed(include_current_windows=True)
+
+        assert self._messages() == ["Skipping file 0", "Event"]
+
+    @pytest.mark.parametrize(
+        ("logger_name", "expected"),
+        [
+            pytest.param("quiet", None, id="turned off"),
+            pytest.param("quiet.child", None, id="inherited from parent"),
+            pytest.param("chatty.child", LogRateLimit(max_per_window=1, window_seconds=10), id="own limit"),
+            pytest.param("quietly", LogRateLimit(max_per_window=2, window_seconds=60), id="only whole names match"),
+            pytest.param("root", LogRateLimit(max_per_window=2, window_seconds=60), id="root logger"),
+        ],
+    )
+    def test_When_rate_limit_looked_up__Then_most_specific_logger_name_used(
+        self, logger_name: str, expected: LogRateLimit | None
+    ):
+        assert self.filter.rate_limit_for(logger_name) == expected
+
+    def test_Given_no_default_rate_limit__Then_other_loggers_not_rate_limited(self):
+        rate_limiting_filter = RateLimitingFilter(
+            rate_limits={"chatty": LogRateLimit(max_per_window=1, window_seconds=10)}
+        )
+
+        assert rate_limiting_filter.rate_limit_for("cloud_courier.main") is None
+
+    def test_Given_logger_not_rate_limited__Then_everything_logged(self):
+        quiet_logger = self._logger("quiet")
+
+        for i in range(5):
+            quiet_logger.info(f"Event {i}")
+
+        assert len(self._messages()) == 5  # noqa: PLR2004 # all of them
+
+    def test_Given_record_filtered_by_several_handlers__Then_counted_once(self):
+        second_handler = BufferingHandler(capacity=1000)
+        second_handler.addFilter(self.filter)
+        self.logger.addHandler(second_handler)
+
+        for i in range(3):
+            self.logger.info(f"Event {i}")
+
+        self.logger.removeHandler(second_handler)
+        assert self._messages() == ["Event 0", "Event 1"]
+        assert [record.getMessage() for record in second_handler.buffer] == ["Event 0", "Event 1"]
+
+
+class TestDroppingQueueHandler:
+    @pytest.fixture(autouse=True)
+    def _setup(self):
+        self.queue: queue.Queue[logging.LogRecord] = queue.Queue(maxsize=2)
+        self.handler = DroppingQueueHandler(self.queue)
+        self.logger = logging.getLogger(f"{__name__}.{uuid.uuid4()}")
+        self.logger.propagate = False
+        self.logger.addHandler(self.handler)
+        yield
+        self.logger.removeHandler(self.handler)
+
+    def _drain(self) -> list[str]:
+        messages: list[str] = []
+        while not self.queue.empty():
+            messages.append(self.queue.get_nowait().getMessage())
+        return messages
+
+    def test_When_queue_full__Then_new_records_dropped_without_blocking(self):
+        for i in range(5):
+            self.logger.warning(f"record {i}")
+
+        assert self._drain() == ["record 0", "record 1"]
+        assert self.handler.num_dropped == 3  # noqa: PLR2004 # the ones that didn't fit
+
+    def test_Given_records_dropped__When_room_again__Then_warning_with_number_dropped_queued_first(self):
+        for i in range(4):
+            self.logger.warning(f"record {i}")
+        _ = self._drain()
+
+        self.logger.warning("after")
+
+        assert self._drain() == [
+            "Dropped 2 log records because they were logged faster than they could be written",
+            "after",
+        ]
+
+    def test_Given_records_dropped__When_still_no_room__Then_dropped_records_reported_later(self):
+        for i in range(4):
+            self.logger.warning(f"record {i}")
+
+        self.logger.warning("also dropped")
+        _ = self._drain()
+        self.logger.warning("after")
+
+        assert self._drain()[0] == "Dropped 3 log records because they were logged faster than they could be written"
+
+    def test_When_logged_with_arguments__Then_merged_into_message_and_exception_kept_for_the_formatter(self):
+        try:
+            raise RuntimeError("boom")  # noqa: TRY301 # raising here so there is a real traceback to keep
+        except RuntimeError:
+            self.logger.exception("Failed to upload %s", "file.txt")
+
+        (record,) = [self.queue.get_nowait()]
+        assert record.msg == "Failed to upload file.txt"
+        assert record.args is None
+        assert record.exc_info is not None
+
+
+class TestHostFields:
+    def test_Given_dns_slow__Then_created_without_waiting_and_ip_added_once_resolved(self, mocker: MockerFixture):
+        resolve = threading.Event()
+
+        def slow_gethostbyname(_host_name: str) -> str:  # noqa: ARG001 # the signature of socket.gethostbyname
+            _ = resolve.wait(timeout=10)
+            return "10.0.0.5"
+
+        _ = mocker.patch.object(socket, socket.gethostbyname.__name__, autospec=True, side_effect=slow_gethostbyname)
+
+        host_fields = HostFields()
+
+        assert "host.ip" not in host_fields(None, "info", {})
+        resolve.set()
+        _wait_for(lambda: host_fields.host_ip is not None)
+        assert host_fields(None, "info", {}) == {"host.name": socket.gethostname(), "host.ip": "10.0.0.5"}
+
+    def test_Given_dns_fails__Then_warning_logged_and_ip_left_out(self, mocker: MockerFixture):
+        spied_warning = mocker.spy(logger_config.logger, "warning")
+        _ = mocker.patch.object(
+            socket, socket.gethostbyname.__name__, autospec=True, side_effect=socket.gaierror("Name not known")
+        )
+
+        host_fields = HostFields()
+
+        _wait_for(lambda: spied_warning.call_count > 0)
+        assert host_fields(None, "info", {}) == {"host.name": socket.gethostname()}
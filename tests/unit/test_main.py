@@ -1,6 +1,7 @@
 import logging
 import random
 import tempfile
+import threading
 import uuid
 from collections.abc import Generator
 from pathlib import Path
@@ -14,10 +15,14 @@ from botocore.stub import Stubber
 from pytest_mock import MockerFixture
 
 from cloud_courier import INSTALLED_AGENT_VERSION_TAG_KEY
+from cloud_courier import add_to_upload_record
+from cloud_courier import create_record_file
 from cloud_courier import entrypoint
 from cloud_courier import get_role_arn
 from cloud_courier import get_version
 from cloud_courier import main
+from cloud_courier import open_upload_record
+from cloud_courier.upload_record import iter_upload_record_tsv
 
 from .fixtures import mock_path_to_aws_credentials
 from .fixtures import mocked_generic_config
@@ -64,8 +69,19 @@ class MainMixin:
         self,
         mock_path_to_aws_credentials: None,  # noqa: ARG002 # pytest.usefixture cannot be used on a fixturet
         flag_file_dir: Generator[str],
+        tmp_path: Path,
+        mocker: MockerFixture,
     ):
         self.flag_file_dir = str(flag_file_dir)
+        # so the upload record, work journal, config snapshot and event queue overflow are never written to the home directory of whoever runs the tests
+        self.record_dir = tmp_path
+        self.record_path = tmp_path / "record.sqlite3"
+        _ = mocker.patch.object(
+            main,
+            main.path_to_previously_uploaded_files_record.__name__,
+            autospec=True,
+            return_value=self.record_path,
+        )
 
 
 class TestArgParse(MainMixin):
@@ -104,7 +120,7 @@ class TestArgParse(MainMixin):
         )
 
         spied_configure_logging.assert_called_once_with(
-            log_level=expected_log_level, log_filename_prefix=ANY, suppress_console_logging=ANY
+            log_level=expected_log_level, log_filename_prefix=ANY, suppress_console_logging=ANY, asynchronous=ANY
         )
 
     def test_Given_log_folder_specified__Then_log_folder_passed_to_configure_logging(self, mocker: MockerFixture):
@@ -127,6 +143,7 @@ class TestArgParse(MainMixin):
             log_filename_prefix=str(Path(expected_log_folder) / "cloud-courier-"),
             log_level=ANY,
             suppress_console_logging=False,
+            asynchronous=True,
         )
 
     def test_Given_suppress_console_logging_specified__Then_kwarg_passed_to_configure_logging(
@@ -147,11 +164,32 @@ class TestArgParse(MainMixin):
         )
 
         spied_configure_logging.assert_called_once_with(
-            log_filename_prefix=ANY, log_level=ANY, suppress_console_logging=True
+            log_filename_prefix=ANY, log_level=ANY, suppress_console_logging=True, asynchronous=ANY
+        )
+
+    def test_Given_synchronous_logging_specified__Then_not_asynchronous(self, mocker: MockerFixture):
+        spied_configure_logging = mocker.spy(main, "configure_logging")
+
+        assert (
+            entrypoint(
+                [
+                    f"--stop-flag-dir={self.flag_file_dir}",
+                    "--immediate-shut-down",
+                    "--aws-region=us-east-1",
+                    "--synchronous-logging",
+                ]
+            )
+            == 0
+        )
+
+        spied_configure_logging.assert_called_once_with(
+            log_filename_prefix=ANY, log_level=ANY, suppress_console_logging=ANY, asynchronous=False
         )
 
 
 class TestUpdateInstanceTag(MainMixin):
+    @pytest.mark.timeout(15)
+    @pytest.mark.usefixtures(mocked_generic_config.__name__)
     def test_When_run__Then_managed_instance_tag_updated_to_version(self, mocker: MockerFixture):
         expected_version = str(uuid.uuid4())
         expected_computer_info = "cambridge--cytation-5"  # arbitrary
@@ -183,18 +221,31 @@ class TestUpdateInstanceTag(MainMixin):
         stubber.add_response("add_tags_to_resource", {"ResponseMetadata": {"HTTPStatusCode": 200}}, add_tags_params)
 
         stubber.activate()
+        update_instance_tag = main._update_instance_tag  # noqa: SLF001 # wrapped so the test knows when it has happened, rather than waiting an arbitrary time
+        instance_tag_updated = threading.Event()
 
-        assert (
-            entrypoint(
+        def update_then_signal(*, boto_session: boto3.Session, role_arn: str):
+            update_instance_tag(boto_session=boto_session, role_arn=role_arn)
+            instance_tag_updated.set()
+
+        _ = mocker.patch.object(main, update_instance_tag.__name__, autospec=True, side_effect=update_then_signal)
+        thread = Thread(
+            target=entrypoint,
+            args=(
                 [
                     f"--stop-flag-dir={self.flag_file_dir}",
-                    "--shut-down-before-main-loop",
                     "--aws-region",
                     random_region,
-                ]
-            )
-            == 0
+                    "--idle-loop-sleep-seconds=0.1",
+                ],
+            ),
         )
+        thread.start()
+
+        assert instance_tag_updated.wait(timeout=5) is True
+        (Path(self.flag_file_dir) / f"{uuid.uuid4()}.txt").touch()
+        thread.join(timeout=5)
+        assert thread.is_alive() is False
         stubber.assert_no_pending_responses()
 
         # Due to the way the Stubber works with the expected_params, the test would fail if the describe_instance_information method is called with a different role name than the one we are expecting
@@ -202,6 +253,28 @@ class TestUpdateInstanceTag(MainMixin):
 
 
 class TestShutdown(MainMixin):
+    def test_When_shut_down_before_main_loop__Then_aws_identity_checked_and_main_loop_not_started(
+        self, mocker: MockerFixture
+    ):
+        spied_main_loop = mocker.spy(main, main.MainLoop.__name__)
+        mocked_get_role_arn = mocker.patch.object(
+            main, get_role_arn.__name__, autospec=True, return_value=f"arn:aws:iam::000000000000:role/{uuid.uuid4()}"
+        )
+
+        assert entrypoint([*GENERIC_REQUIRED_CLI_ARGS, "--shut-down-before-main-loop"]) == 0
+
+        mocked_get_role_arn.assert_called_once()
+        spied_main_loop.assert_not_called()
+
+    def test_Given_aws_identity_cannot_be_checked__When_shut_down_before_main_loop__Then_error_raised(
+        self, mocker: MockerFixture
+    ):
+        expected_error = str(uuid.uuid4())
+        _ = mocker.patch.object(main, get_role_arn.__name__, autospec=True, side_effect=RuntimeError(expected_error))
+
+        with pytest.raises(RuntimeError, match=expected_error):
+            _ = entrypoint([*GENERIC_REQUIRED_CLI_ARGS, "--shut-down-before-main-loop"])
+
     @pytest.mark.timeout(10)
     @pytest.mark.usefixtures(mocked_generic_config.__name__)
     def test_Given_no_files_to_upload__When_flag_file_created__Then_clean_exit(self, mocker: MockerFixture):
@@ -229,3 +302,133 @@ class TestShutdown(MainMixin):
         thread.join(timeout=5)
 
         assert thread.is_alive() is False
+
+    @pytest.mark.timeout(10)
+    @pytest.mark.usefixtures(mocked_generic_config.__name__)
+    def test_When_main_loop_fails__Then_upload_record_committed_and_background_threads_stopped(
+        self, mocker: MockerFixture
+    ):
+        expected_error = str(uuid.uuid4())
+        _ = mocker.patch.object(
+            main.MainLoop, "_log_aws_identity", autospec=True, side_effect=RuntimeError(expected_error)
+        )
+        loop = main.MainLoop(
+            stop_flag_dir=self.flag_file_dir,
+            boto_session=boto3.Session(region_name="us-east-1"),
+            idle_loop_sleep_seconds=0.01,
+            previously_uploaded_files_record_path=self.record_path,
+        )
+        spied_commit = mocker.spy(loop.uploaded_files, "commit")
+
+        with pytest.raises(RuntimeError, match=expected_error):
+            _ = loop.run()
+
+        spied_commit.assert_called()
+        assert loop.periodic_tasks.is_alive() is False
+        assert loop.observer.is_alive() is False  # type: ignore[reportUnknownMemberType] # pyright doesn't seem to like Observer
+
+
+class TestUploadRecordExportAndImport(MainMixin):
+    def test_Given_tsv_to_import__When_imported_then_exported__Then_exported_tsv_has_the_imported_entries(self):
+        import_path = self.record_dir / "import.tsv"
+        create_record_file(import_path)
+        add_to_upload_record(
+            record_file_path=import_path,
+            uploaded_file_path=Path("/foo/bar.txt"),
+            checksum="abc",
+            cloud_path="s3://bucket/bar.txt",
+        )
+        export_path = self.record_dir / "export.tsv"
+
+        assert (
+            entrypoint(
+                [
+                    *GENERIC_REQUIRED_CLI_ARGS,
+                    f"--import-upload-record={import_path}",
+                    f"--export-upload-record={export_path}",
+                ]
+            )
+            == 0
+        )
+
+        assert export_path.read_text() == import_path.read_text()
+
+    def test_When_only_exported__Then_record_unchanged(self):
+        export_path = self.record_dir / "export.tsv"
+
+        assert entrypoint([*GENERIC_REQUIRED_CLI_ARGS, f"--export-upload-record={export_path}"]) == 0
+
+        assert list(iter_upload_record_tsv(export_path)) == []
+
+    def test_When_only_imported__Then_entries_added_to_record(self):
+        import_path = self.record_dir / "import.tsv"
+        create_record_file(import_path)
+        add_to_upload_record(
+            record_file_path=import_path,
+            uploaded_file_path=Path("/foo/bar.txt"),
+            checksum="abc",
+            cloud_path="s3://bucket/bar.txt",
+        )
+
+        assert entrypoint([*GENERIC_REQUIRED_CLI_ARGS, f"--import-upload-record={import_path}"]) == 0
+
+        record = open_upload_record(self.record_path)
+        assert Path("/foo/bar.txt") in record
+        record.close()
+
+
+class TestMigrateLegacyRecordFolder:
+    @pytest.fixture(autouse=True)
+    def _setup(self, tmp_path: Path):
+        self.legacy_folder = tmp_path / "~" / ".lab_automation_and_screening" / "cloud_courier"
+        self.legacy_folder.mkdir(parents=True)
+        self.record_path = tmp_path / "home" / "cloud_courier" / "previously_uploaded_files.sqlite3"
+
+    def test_Given_legacy_files__Then_moved_next_to_record(self):
+        expected_contents = {
+            name: str(uuid.uuid4()) for name in ("previously_uploaded_files.tsv", "work_journal.sqlite3")
+        }
+        for name, contents in expected_contents.items():
+            _ = (self.legacy_folder / name).write_text(contents)
+
+        main.migrate_legacy_record_folder(record_path=self.record_path, legacy_folder=self.legacy_folder)
+
+        assert {path.name: path.read_text() for path in self.record_path.parent.iterdir()} == expected_contents
+        assert list(self.legacy_folder.iterdir()) == []
+
+    def test_Given_file_already_at_new_location__Then_not_overwritten(self):
+        self.record_path.parent.mkdir(parents=True)
+        _ = self.record_path.write_text("new")
+        _ = (self.legacy_folder / self.record_path.name).write_text("legacy")
+
+        main.migrate_legacy_record_folder(record_path=self.record_path, legacy_folder=self.legacy_folder)
+
+        assert self.record_path.read_text() == "new"
+        assert (self.legacy_folder / self.record_path.name).read_text() == "legacy"
+
+    def test_Given_no_legacy_folder__Then_nothing_created(self):
+        main.migrate_legacy_record_folder(record_path=self.record_path, legacy_folder=self.legacy_folder / "missing")
+
+        assert self.record_path.parent.exists() is False
+
+
+class TestLegacyRecordMigrationAtStartup(MainMixin):
+    def test_Given_tsv_record_in_legacy_folder_under_working_directory__Then_its_history_kept(
+        self, monkeypatch: pytest.MonkeyPatch
+    ):
+        working_dir = self.record_dir / "working_dir"
+        legacy_tsv_path = working_dir / main.LEGACY_RECORD_FOLDER / self.record_path.with_suffix(".tsv").name
+        legacy_tsv_path.parent.mkdir(parents=True)
+        create_record_file(legacy_tsv_path)
+        add_to_upload_record(
+            record_file_path=legacy_tsv_path,
+            uploaded_file_path=Path("/foo/bar.txt"),
+            checksum="abc",
+            cloud_path="s3://bucket/bar.txt",
+        )
+        monkeypatch.chdir(working_dir)
+        export_path = self.record_dir / "export.tsv"
+
+        assert entrypoint([*GENERIC_REQUIRED_CLI_ARGS, f"--export-upload-record={export_path}"]) == 0
+
+        assert [entry.file_path for entry in iter_upload_record_tsv(export_path)] == ["/foo/bar.txt"]
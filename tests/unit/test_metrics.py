@@ -1,14 +1,43 @@
 import datetime
+import tempfile
+import threading
 import time
+import uuid
+from pathlib import Path
+from typing import Any
 
 import boto3
 import pytest
 import time_machine
+from pytest_mock import MockerFixture
 
 from cloud_courier import CLOUDWATCH_HEARTBEAT_NAMESPACE
 from cloud_courier import CLOUDWATCH_INSTANCE_ID_DIMENSION_NAME
 from cloud_courier import HEARTBEAT_METRIC_NAME
+from cloud_courier import FileEvent
+from cloud_courier import MainLoop
+from cloud_courier import MetricsAggregator
+from cloud_courier import SpillingEventQueue
+from cloud_courier import main
+from cloud_courier import upload_to_s3
+from cloud_courier.courier_config_models import BACKLOG_BYTES_METRIC_NAME
+from cloud_courier.courier_config_models import BYTES_UPLOADED_METRIC_NAME
+from cloud_courier.courier_config_models import CLOUDWATCH_AGENT_NAMESPACE
+from cloud_courier.courier_config_models import FILES_UPLOADED_METRIC_NAME
+from cloud_courier.courier_config_models import OLDEST_PENDING_FILE_AGE_METRIC_NAME
+from cloud_courier.courier_config_models import PENDING_FILES_METRIC_NAME
+from cloud_courier.courier_config_models import QUEUED_EVENTS_IN_MEMORY_METRIC_NAME
+from cloud_courier.courier_config_models import QUEUED_EVENTS_SPILLED_METRIC_NAME
+from cloud_courier.courier_config_models import SECONDS_OFFLINE_METRIC_NAME
+from cloud_courier.courier_config_models import SECONDS_SINCE_PIPELINE_PROGRESS_METRIC_NAME
+from cloud_courier.courier_config_models import UPLOAD_DURATION_METRIC_NAME
+from cloud_courier.courier_config_models import UPLOAD_FAILURES_METRIC_NAME
+from cloud_courier.courier_config_models import UPLOAD_IN_PROGRESS_METRIC_NAME
+from cloud_courier.courier_config_models import UPLOAD_THROUGHPUT_METRIC_NAME
+from cloud_courier.courier_config_models import UPLOADS_PAUSED_METRIC_NAME
+from cloud_courier.metrics import MAX_METRIC_DATA_PER_PUT
 
+from .constants import GENERIC_COURIER_CONFIG
 from .fixtures import MainLoopMixin
 from .fixtures import mocked_generic_config
 
@@ -55,6 +84,39 @@ class TestHeartbeat(MainLoopMixin):
         assert specific_dimension["Value"] == self.config.role_name
         # doesn't seem to be a way to assert things about the timestamp or other components of the metric
 
+    def test_When_boot_up__Then_backlog_metrics_sent_to_localstack(
+        self,
+    ):
+        cloudwatch_client = boto3.client("cloudwatch", region_name=self.config.aws_region)
+        expected_metric_names = {
+            QUEUED_EVENTS_IN_MEMORY_METRIC_NAME,
+            QUEUED_EVENTS_SPILLED_METRIC_NAME,
+            PENDING_FILES_METRIC_NAME,
+            BACKLOG_BYTES_METRIC_NAME,
+            OLDEST_PENDING_FILE_AGE_METRIC_NAME,
+            UPLOADS_PAUSED_METRIC_NAME,
+            UPLOAD_IN_PROGRESS_METRIC_NAME,
+            SECONDS_SINCE_PIPELINE_PROGRESS_METRIC_NAME,
+            SECONDS_OFFLINE_METRIC_NAME,
+        }
+
+        self._start_loop(mock_send_heartbeat=False)
+
+        metric_names: set[str | None] = set()
+        for _ in range(50):
+            metric_names = {
+                metric.get("MetricName")
+                for page in cloudwatch_client.get_paginator("list_metrics").paginate(
+                    Namespace=CLOUDWATCH_AGENT_NAMESPACE
+                )
+                for metric in page.get("Metrics", [])
+            }
+            if expected_metric_names <= metric_names:
+                break
+            time.sleep(0.1)
+        else:
+            pytest.fail(f"Expected metrics {expected_metric_names} but found {metric_names}")
+
     def test_Given_sending_mocked__When_bootup_then_heartbeat_sent_but_not_repeated__Then_after_config_time_passes_another_heartbeat_sent(
         self,
     ):
@@ -70,3 +132,180 @@ class TestHeartbeat(MainLoopMixin):
             traveller.shift(datetime.timedelta(seconds=self.config.app_config.heartbeat_frequency_seconds - 1))
 
             self._expect_metrics(2)
+
+    def test_Given_upload_taking_a_long_time__Then_heartbeats_still_sent_and_upload_shown_in_progress(self):
+        file_path = Path(self.watch_dir) / f"{uuid.uuid4()}.txt"
+        upload_started = threading.Event()
+        finish_upload = threading.Event()
+
+        def slow_upload(**_: object) -> str:
+            upload_started.set()
+            if not finish_upload.wait(timeout=10):
+                raise TimeoutError("The test never let the upload finish")
+            return str(uuid.uuid4())
+
+        with time_machine.travel("1999-12-31", tick=False) as traveller:
+            _ = self.mocker.patch.object(main, upload_to_s3.__name__, autospec=True, side_effect=slow_upload)
+            self._start_loop(mock_upload_to_s3=False)
+            self._expect_metrics(1)
+            _ = file_path.write_text("test")
+            assert upload_started.wait(timeout=5) is True
+
+            traveller.shift(datetime.timedelta(seconds=self.config.app_config.heartbeat_frequency_seconds + 1))
+
+            self._expect_metrics(2)
+            assert self.loop.liveness.is_upload_in_progress is True
+            finish_upload.set()
+            self._fail_if_file_not_uploaded(file_path)
+
+
+class FakeCloudWatchClient:
+    def __init__(self, *, fail_on_call: int | None = None):
+        super().__init__()
+        self.calls: list[dict[str, Any]] = []
+        self._fail_on_call = fail_on_call
+
+    def put_metric_data(self, **kwargs: Any) -> None:  # noqa: ANN401 # matches the boto3 signature loosely, only for the test
+        if len(self.calls) == self._fail_on_call:
+            self._fail_on_call = None
+            raise RuntimeError("CloudWatch is unavailable")
+        self.calls.append(kwargs)
+
+    def data(self, call_idx: int = -1) -> dict[str, dict[str, Any]]:
+        return {datum["MetricName"]: datum for datum in self.calls[call_idx]["MetricData"]}
+
+
+class TestMetricsAggregator:
+    @pytest.fixture(autouse=True)
+    def _setup(self):
+        self.aggregator = MetricsAggregator(namespace="Test/Namespace")
+        self.dimensions = [{"Name": "NodeRoleName", "Value": "role"}]
+
+    def _flush(self, client: FakeCloudWatchClient) -> int:
+        return self.aggregator.flush(
+            client,  # type: ignore[arg-type] # a fake with the only method used
+            dimensions=self.dimensions,  # type: ignore[arg-type] # a plain dict is the same shape as the TypedDict
+            timestamp=datetime.datetime.now(tz=datetime.UTC),
+        )
+
+    def test_When_flushed_twice__Then_counters_and_statistic_sets_reset_but_gauges_kept(self):
+        client = FakeCloudWatchClient()
+        self.aggregator.increment("Files")
+        self.aggregator.increment("Files", 2)
+        self.aggregator.set_gauge("Depth", 7)
+        self.aggregator.record("Duration", 1.5, unit="Seconds")
+        self.aggregator.record("Duration", 0.5, unit="Seconds")
+
+        assert self._flush(client) == 1
+        assert self._flush(client) == 1
+
+        first = client.data(0)
+        assert first["Files"]["Value"] == 3  # noqa: PLR2004 # the sum of the increments
+        assert first["Depth"]["Value"] == 7  # noqa: PLR2004 # the gauge value
+        assert first["Duration"]["StatisticValues"] == {
+            "SampleCount": 1 + 1,
+            "Sum": 2.0,
+            "Minimum": 0.5,
+            "Maximum": 1.5,
+        }
+        assert first["Duration"]["Unit"] == "Seconds"
+        assert first["Files"]["Dimensions"] == self.dimensions
+        assert client.calls[0]["Namespace"] == "Test/Namespace"
+        second = client.data(1)
+        assert second["Files"]["Value"] == 0
+        assert second["Depth"]["Value"] == 7  # noqa: PLR2004 # the gauge value
+        assert "Duration" not in second
+
+    def test_Given_more_metrics_than_fit_in_one_call__When_flushed__Then_sent_in_batches(self):
+        client = FakeCloudWatchClient()
+        for idx in range(MAX_METRIC_DATA_PER_PUT + 1):
+            self.aggregator.set_gauge(f"Gauge{idx}", idx)
+
+        assert self._flush(client) == 1 + 1
+        assert len(client.calls[0]["MetricData"]) == MAX_METRIC_DATA_PER_PUT
+
+    def test_Given_second_batch_fails__When_flushed_again__Then_only_unsent_values_resent(self):
+        client = FakeCloudWatchClient(fail_on_call=1)
+        for idx in range(MAX_METRIC_DATA_PER_PUT + 1):
+            self.aggregator.increment(f"Counter{idx}")
+        self.aggregator.record("Duration", 1)
+
+        assert self._flush(client) == 1
+        assert self._flush(client) == 1 + 1
+
+        resent = {**client.data(1), **client.data(2)}
+        assert resent["Counter0"]["Value"] == 0  # sent in the first batch before the failure
+        assert resent[f"Counter{MAX_METRIC_DATA_PER_PUT}"]["Value"] == 1
+        assert resent["Duration"]["StatisticValues"]["SampleCount"] == 1
+
+
+class TestMainLoopMetrics(MainLoopMixin):
+    def test_When_file_uploaded__Then_upload_metrics_recorded(self):
+        file_path = Path(self.watch_dir) / f"{uuid.uuid4()}.txt"
+        self._start_loop()
+        spied_increment = self.mocker.spy(self.loop.metrics, "increment")
+        spied_record = self.mocker.spy(self.loop.metrics, "record")
+
+        _ = file_path.write_text("test")
+
+        self._fail_if_file_not_uploaded(file_path)
+        assert {call.args[0] for call in spied_increment.call_args_list} == {
+            FILES_UPLOADED_METRIC_NAME,
+            BYTES_UPLOADED_METRIC_NAME,
+        }
+        assert {call.args[0] for call in spied_record.call_args_list} <= {
+            UPLOAD_DURATION_METRIC_NAME,
+            UPLOAD_THROUGHPUT_METRIC_NAME,
+        }
+
+    def test_Given_pending_files__When_backlog_metrics_updated__Then_gauges_estimate_backlog(self):
+        self._start_loop()
+        for idx in range(2):
+            file_path = (
+                Path(self.second_watch_dir) / f"pending-{idx}.txt"
+            )  # not watched, so only pending via the journal
+            _ = file_path.write_text("12345")
+            self.loop.work_journal.add_pending(file_path=str(file_path), folder_descriptor="other", ready_at=0)
+        self.loop.work_journal.add_pending(file_path="/deleted.txt", folder_descriptor="other", ready_at=0)
+        spied_set_gauge = self.mocker.spy(self.loop.metrics, "set_gauge")
+
+        backlog = self.loop._update_live_metrics()  # noqa: SLF001 # yes, this is private, but the metrics are only sent on the heartbeat cadence
+
+        gauges = {call.args[0]: call.args[1] for call in spied_set_gauge.call_args_list}
+        num_pending = 3
+        assert gauges[PENDING_FILES_METRIC_NAME] == num_pending
+        assert gauges[BACKLOG_BYTES_METRIC_NAME] == len("12345") * num_pending  # estimated from the files that exist
+        assert gauges[OLDEST_PENDING_FILE_AGE_METRIC_NAME] > 0
+        assert backlog.num_pending_by_folder == {"other": num_pending}
+
+
+class TestUploadFailureMetrics:
+    def test_Given_upload_fails__Then_failure_counted_and_metrics_flushed_before_raising(self, mocker: MockerFixture):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path = Path(temp_dir) / "data.txt"
+            _ = file_path.write_text("test")
+            loop = MainLoop(
+                stop_flag_dir=temp_dir,
+                boto_session=boto3.Session(region_name=GENERIC_COURIER_CONFIG.aws_region),
+                idle_loop_sleep_seconds=0.01,
+                previously_uploaded_files_record_path=Path(temp_dir) / "record" / "record.tsv",
+            )
+            loop.config = GENERIC_COURIER_CONFIG
+            loop.watched_folders = dict(GENERIC_COURIER_CONFIG.folders_to_watch)
+            loop.file_system_events = SpillingEventQueue(
+                spill_file_path=Path(temp_dir) / "spill.jsonl", max_in_memory=10
+            )
+            loop.file_system_events.put(FileEvent(str(file_path), "fcs-files", 0))
+            _ = mocker.patch.object(main, upload_to_s3.__name__, autospec=True, side_effect=RuntimeError("S3 is down"))
+            mocked_flush = mocker.patch.object(MainLoop, "_flush_metrics", autospec=True)
+            spied_increment = mocker.spy(loop.metrics, "increment")
+
+            with pytest.raises(RuntimeError, match="S3 is down"):
+                _ = loop._process_file_event_queue()  # noqa: SLF001 # yes, this is private, but an exception in the loop's thread would fail the test run
+
+            spied_increment.assert_called_once_with(UPLOAD_FAILURES_METRIC_NAME)
+            assert [failure.file_path for failure in loop.liveness.recent_failures()] == [str(file_path)]
+            mocked_flush.assert_called_once()
+            loop.file_system_events.close()
+            loop.work_journal.close()
+            loop.uploaded_files.close()
@@ -0,0 +1,35 @@
+import threading
+
+from cloud_courier import PeriodicTaskThread
+
+
+def test_Given_task_fails__Then_other_tasks_still_run_and_failing_task_tried_again():
+    num_failing_calls = 0
+    num_succeeded = threading.Event()
+
+    def failing_task():
+        nonlocal num_failing_calls
+        num_failing_calls += 1
+        raise RuntimeError("CloudWatch is unavailable")
+
+    def counting_task():
+        if num_failing_calls >= 1 + 1:
+            num_succeeded.set()
+
+    periodic_tasks = PeriodicTaskThread(tasks=[failing_task, counting_task], tick_seconds=0.01)
+    periodic_tasks.start()
+
+    assert num_succeeded.wait(timeout=5) is True
+    periodic_tasks.stop()
+    periodic_tasks.join(timeout=5)
+    assert periodic_tasks.is_alive() is False
+
+
+def test_When_stopped__Then_thread_ends_without_waiting_for_the_next_tick():
+    periodic_tasks = PeriodicTaskThread(tasks=[], tick_seconds=3600)
+    periodic_tasks.start()
+
+    periodic_tasks.stop()
+    periodic_tasks.join(timeout=5)
+
+    assert periodic_tasks.is_alive() is False
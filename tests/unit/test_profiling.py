@@ -0,0 +1,168 @@
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from cloud_courier import Profiler
+from cloud_courier import calculate_aws_checksum
+from cloud_courier import open_upload_record
+from cloud_courier.profiling import PROFILING_CONTROL_FILE_NAME
+from cloud_courier.profiling import STAGE_TIMERS
+from cloud_courier.profiling import collapse_stack
+from cloud_courier.profiling import timed_stage
+
+from .constants import PATH_TO_EXAMPLE_DATA_FILES
+from .fixtures import MainLoopMixin
+
+
+@pytest.fixture
+def enabled_stage_timers():
+    STAGE_TIMERS.enabled = True
+    _ = STAGE_TIMERS.pop_timings()
+    yield
+    STAGE_TIMERS.enabled = False
+    _ = STAGE_TIMERS.pop_timings()
+
+
+def test_Given_profiling_disabled__When_stage_called__Then_not_timed():
+    _ = calculate_aws_checksum(PATH_TO_EXAMPLE_DATA_FILES / "3_bytes.txt")
+
+    assert STAGE_TIMERS.pop_timings() == {}
+
+
+@pytest.mark.usefixtures(enabled_stage_timers.__name__)
+def test_Given_profiling_enabled__When_stage_called__Then_timed_even_when_it_raises():
+    @timed_stage("failing_stage")
+    def failing_stage():
+        raise RuntimeError("disk is gone")
+
+    _ = calculate_aws_checksum(PATH_TO_EXAMPLE_DATA_FILES / "3_bytes.txt")
+    with pytest.raises(RuntimeError, match="disk is gone"):
+        failing_stage()
+
+    timings = STAGE_TIMERS.pop_timings()
+    assert timings["calculate_aws_checksum"].sample_count == 1
+    assert timings["failing_stage"].sample_count == 1
+
+
+@pytest.mark.usefixtures(enabled_stage_timers.__name__)
+def test_Given_profiling_enabled__When_sqlite_upload_record_opened__Then_loading_it_timed(tmp_path: Path):
+    record = open_upload_record(tmp_path / "record.sqlite3")
+    record.set_bloom_filter(enabled=True)
+    record.close()
+
+    timings = STAGE_TIMERS.pop_timings()
+    assert timings["open_upload_record"].sample_count == 1
+    assert timings["build_upload_record_bloom_filter"].sample_count == 1
+
+
+def test_When_stack_collapsed__Then_outermost_call_first():
+    def inner() -> str:
+        return collapse_stack(sys._getframe())  # noqa: SLF001 # the simplest way to get a real frame
+
+    actual = inner().split(";")
+
+    assert actual[-1].startswith(
+        "test_When_stack_collapsed__Then_outermost_call_first.<locals>.inner (test_profiling.py:"
+    )
+    assert actual[-2].startswith("test_When_stack_collapsed__Then_outermost_call_first (test_profiling.py:")
+
+
+class TestProfiler:
+    @pytest.fixture(autouse=True)
+    def _setup(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            self.now = [100.0]
+            self.control_file_path = Path(temp_dir) / PROFILING_CONTROL_FILE_NAME
+            self.profiler = Profiler(
+                output_dir=Path(temp_dir) / "profiles",
+                control_file_path=self.control_file_path,
+                dump_interval_seconds=60,
+                sample_interval_seconds=0.001,
+                clock=lambda: self.now[0],
+            )
+            yield
+            self.profiler.disable()
+
+    def test_When_control_file_created_then_deleted__Then_profiling_enabled_then_disabled_with_a_final_dump(self):
+        self.control_file_path.touch()
+        self.profiler.check_control_file()
+        assert self.profiler.enabled is True
+        assert STAGE_TIMERS.enabled is True
+        self.profiler.check_control_file()  # already enabled
+
+        self.control_file_path.unlink()
+        self.profiler.check_control_file()
+
+        assert self.profiler.enabled is False
+        assert STAGE_TIMERS.enabled is False
+        assert len(self.profiler.dumped_file_paths) == 1 + 1 + 1
+
+    def test_Given_always_enabled__Then_enabled_without_control_file(self):
+        self.profiler.always_enabled = True
+
+        self.profiler.check_control_file()
+
+        assert self.profiler.enabled is True
+
+    def test_Given_enabled__When_interval_passes__Then_profile_of_all_threads_dumped(self):
+        stop_working = threading.Event()
+
+        def busy_worker():
+            while not stop_working.is_set():
+                time.sleep(0.001)
+
+        worker = threading.Thread(target=busy_worker, name="busy-worker")
+        worker.start()
+        self.profiler.enable()
+        _ = calculate_aws_checksum(PATH_TO_EXAMPLE_DATA_FILES / "3_bytes.txt")
+        time.sleep(0.1)
+        self.profiler.dump_if_needed()
+        assert self.profiler.dumped_file_paths == []  # the interval hasn't passed yet
+
+        self.now[0] += 60
+        self.profiler.dump_if_needed()
+        self.now[0] += 60
+        self.profiler.dump_if_needed()
+
+        stop_working.set()
+        worker.join()
+        cpu_profile_path, memory_path, stages_path = self.profiler.dumped_file_paths[:3]
+        assert any(line.startswith("busy-worker;") for line in cpu_profile_path.read_text().splitlines())
+        assert memory_path.read_text().startswith("Top 25 allocations by line:")
+        assert stages_path.read_text().splitlines()[1].startswith("calculate_aws_checksum\t1\t")
+        second_memory_path = self.profiler.dumped_file_paths[4]
+        assert "changes since the previous dump" in second_memory_path.read_text()
+
+    def test_Given_disabled__Then_nothing_dumped(self):
+        self.now[0] += 600
+
+        self.profiler.dump_if_needed()
+        self.profiler.disable()
+
+        assert self.profiler.dumped_file_paths == []
+
+
+class TestMainLoopProfiling(MainLoopMixin):
+    def test_Given_control_file__When_loop_running__Then_profiling_enabled_until_stopped(self):
+        with tempfile.TemporaryDirectory() as log_dir:
+            profiler = Profiler(
+                output_dir=Path(log_dir) / "profiles", control_file_path=Path(log_dir) / PROFILING_CONTROL_FILE_NAME
+            )
+            (Path(log_dir) / PROFILING_CONTROL_FILE_NAME).touch()
+            self._start_loop(profiler=profiler)
+
+            for _ in range(50):
+                if profiler.enabled:
+                    break
+                time.sleep(0.1)
+            else:
+                pytest.fail("Profiling was never enabled")
+
+            (Path(self.stop_flag_dir) / "stop.txt").touch()
+            self.thread.join(timeout=5)
+            assert profiler.enabled is False
+            assert len(profiler.dumped_file_paths) > 0
@@ -0,0 +1,138 @@
+import ast
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+import cloud_courier
+from cloud_courier import StartupTimer
+from cloud_courier import entrypoint
+from cloud_courier import get_version
+from cloud_courier import startup_timer
+from cloud_courier import upload
+from cloud_courier.cli import handle_informational_args
+
+from .fixtures import MainLoopMixin
+from .fixtures import mock_path_to_aws_credentials
+
+_fixtures = (mock_path_to_aws_credentials,)
+
+# generous, since CI runners (especially Windows ones) import much more slowly than a developer's computer. It's meant to catch something heavy being imported by accident
+IMPORT_TIME_BUDGET_SECONDS = 1.5
+HEAVY_DEPENDENCIES = ("boto3", "botocore", "pydantic", "watchdog", "structlog")
+
+
+def _run_python(*args: str) -> subprocess.CompletedProcess[str]:
+    return subprocess.run(  # noqa: S603 # this is known trusted input
+        [sys.executable, *args], capture_output=True, text=True, check=True
+    )
+
+
+class TestStartupTimer:
+    def test_When_phases_marked__Then_each_timed_from_the_end_of_the_previous_one(self):
+        now = [10.0]
+        timer = StartupTimer(started_at=9.0, clock=lambda: now[0])
+
+        timer.mark("imports")
+        now[0] = 10.5
+        timer.mark("configure_logging")
+
+        assert timer.phases == [("imports", 1.0), ("configure_logging", 0.5)]
+        assert timer.total_seconds == 1.5  # noqa: PLR2004 # the sum of the phases above
+
+    def test_When_logged__Then_total_and_every_phase_in_the_message(self, mocker: MockerFixture):
+        spied_info = mocker.spy(startup_timer.logger, "info")
+        now = [0.0]
+        timer = StartupTimer(clock=lambda: now[0])
+        now[0] = 0.25
+        timer.mark("load_config")
+
+        timer.log()
+
+        spied_info.assert_called_once_with("Started up in 0.250 seconds (load_config: 0.250)")
+
+
+@pytest.mark.usefixtures(mock_path_to_aws_credentials.__name__)
+def test_Given_immediate_shut_down__When_run__Then_startup_phases_logged(mocker: MockerFixture, flag_file_dir: str):
+    spied_log = mocker.spy(StartupTimer, "log")
+
+    assert entrypoint([f"--stop-flag-dir={flag_file_dir}", "--aws-region=us-east-1", "--immediate-shut-down"]) == 0
+
+    spied_log.assert_called_once()
+    timer = spied_log.call_args.args[0]
+    assert [phase for phase, _ in timer.phases] == ["imports", "configure_logging", "create_boto_session"]
+
+
+class TestMainLoopStartup(MainLoopMixin):
+    def test_When_booted__Then_startup_phases_timed(self):
+        self._start_loop()
+
+        assert [phase for phase, _ in self.loop.startup_timer.phases] == ["load_config", "start_watching_folders"]
+
+
+class TestLazyPackage:
+    def test_Then_imports_for_type_checkers_match_the_names_exported_at_runtime(self):
+        exports_by_submodule = cloud_courier._EXPORTS_BY_SUBMODULE  # noqa: SLF001 # the single list of what's exported, which the imports must be kept in sync with
+        tree = ast.parse(Path(cloud_courier.__file__).read_text())
+        type_checking_block = next(
+            node for node in tree.body if isinstance(node, ast.If) and ast.unparse(node.test) == "TYPE_CHECKING"
+        )
+        imports = [node for node in type_checking_block.body if isinstance(node, ast.ImportFrom)]
+
+        assert {alias.name for node in imports if node.module is None for alias in node.names} == set(
+            exports_by_submodule
+        )
+        assert {(node.module, alias.name) for node in imports if node.module is not None for alias in node.names} == {
+            (submodule, name) for submodule, names in exports_by_submodule.items() for name in names
+        }
+        for name in [*exports_by_submodule, *(name for names in exports_by_submodule.values() for name in names)]:
+            assert getattr(cloud_courier, name) is not None
+            assert name in dir(cloud_courier)
+
+    def test_When_submodule_looked_up__Then_imported_module(self):
+        # called directly, since once any test has imported the submodule it's an attribute of the package and the lookup never gets this far
+        actual = cloud_courier.__getattr__("upload")
+
+        assert actual is upload
+
+    def test_When_unknown_name__Then_attribute_error(self):
+        with pytest.raises(AttributeError, match="has no attribute 'not_a_real_name'"):
+            _ = cloud_courier.not_a_real_name
+
+    def test_When_cli_imported__Then_heavy_dependencies_not_imported(self):
+        result = _run_python("-c", "import sys; import cloud_courier.cli; print(' '.join(sorted(sys.modules)))")
+
+        imported = set(result.stdout.split())
+        assert [dependency for dependency in HEAVY_DEPENDENCIES if dependency in imported] == []
+
+    def test_When_main_imported__Then_within_the_time_budget(self):
+        _ = _run_python("-c", "import cloud_courier.main")  # so compiling the bytecode isn't counted
+
+        result = _run_python("-X", "importtime", "-c", "import cloud_courier.main")
+
+        match = re.search(r"\|\s*(\d+) \| cloud_courier\.main$", result.stderr, re.MULTILINE)
+        assert match is not None
+        import_seconds = int(match.group(1)) / 1_000_000
+        assert import_seconds < IMPORT_TIME_BUDGET_SECONDS
+
+
+class TestInformationalArgs:
+    def test_When_version__Then_printed_and_exits(self, capsys: pytest.CaptureFixture[str]):
+        with pytest.raises(SystemExit) as e:  # noqa: PT011 # there is nothing meaningful to match against for the text of this error, we are asserting the exit code
+            handle_informational_args(["--version"])
+
+        assert e.value.code == 0
+        assert capsys.readouterr().out.strip() == get_version()
+
+    @pytest.mark.parametrize(
+        "argv",
+        [
+            pytest.param(["--aws-region=us-east-1", "--stop-flag-dir=/tmp"], id="nothing informational"),
+            pytest.param(["--status-port=not-a-number", "--version"], id="invalid before the version"),
+        ],
+    )
+    def test_When_nothing_to_answer__Then_returns_so_the_entrypoint_handles_it(self, argv: list[str]):
+        handle_informational_args(argv)
@@ -0,0 +1,159 @@
+import json
+import urllib.error
+import urllib.request
+import uuid
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from cloud_courier import MetricsAggregator
+from cloud_courier import StatusServer
+from cloud_courier.courier_config_models import FILES_UPLOADED_METRIC_NAME
+from cloud_courier.courier_config_models import PENDING_FILES_METRIC_NAME
+from cloud_courier.courier_config_models import UPLOAD_DURATION_METRIC_NAME
+from cloud_courier.status_server import PROMETHEUS_CONTENT_TYPE
+from cloud_courier.status_server import PrometheusGauge
+from cloud_courier.status_server import prometheus_name
+from cloud_courier.status_server import render_prometheus
+
+from .fixtures import MainLoopMixin
+
+
+def _get(url: str) -> tuple[str, str]:
+    with urllib.request.urlopen(url, timeout=5) as response:  # noqa: S310 # only ever a local http URL in the tests
+        return response.headers["Content-Type"], response.read().decode()
+
+
+@pytest.mark.parametrize(
+    ("metric_name", "unit", "expected"),
+    [
+        pytest.param("FilesUploaded", "Count", "cloud_courier_files_uploaded", id="count has no unit suffix"),
+        pytest.param("UploadDuration", "Seconds", "cloud_courier_upload_duration_seconds", id="unit suffix added"),
+        pytest.param("BacklogBytes", "Bytes", "cloud_courier_backlog_bytes", id="unit already in the name"),
+        pytest.param(
+            "UploadThroughput", "Bytes/Second", "cloud_courier_upload_throughput_bytes_per_second", id="rate unit"
+        ),
+    ],
+)
+def test_prometheus_name(metric_name: str, unit: Any, expected: str):  # noqa: ANN401 # the MetricUnit literal
+    assert prometheus_name(metric_name, unit) == expected
+
+
+def test_When_rendered__Then_counters_totalled_and_statistic_sets_become_summaries():
+    aggregator = MetricsAggregator(namespace="Test/Namespace")
+    aggregator.increment(FILES_UPLOADED_METRIC_NAME, 2)
+    aggregator.set_gauge(PENDING_FILES_METRIC_NAME, 5)
+    aggregator.record(UPLOAD_DURATION_METRIC_NAME, 1.5, unit="Seconds")
+    aggregator.record(UPLOAD_DURATION_METRIC_NAME, 0.5, unit="Seconds")
+
+    actual = render_prometheus(
+        aggregator.snapshot(),
+        extra_gauges=[
+            PrometheusGauge("pending_files_by_folder", 2, {"folder": 'say "hi"\\'}),
+            PrometheusGauge("pending_files_by_folder", 3, {"folder": "b"}),
+            PrometheusGauge("upload_record_size_bytes", 100),
+        ],
+    )
+
+    assert actual.splitlines() == [
+        "# TYPE cloud_courier_files_uploaded_total counter",
+        "cloud_courier_files_uploaded_total 2.0",
+        "# TYPE cloud_courier_pending_files gauge",
+        "cloud_courier_pending_files 5",
+        "# TYPE cloud_courier_upload_duration_seconds summary",
+        "cloud_courier_upload_duration_seconds_sum 2.0",
+        "cloud_courier_upload_duration_seconds_count 2",
+        "# TYPE cloud_courier_pending_files_by_folder gauge",
+        'cloud_courier_pending_files_by_folder{folder="say \\"hi\\"\\\\"} 2',
+        'cloud_courier_pending_files_by_folder{folder="b"} 3',
+        "# TYPE cloud_courier_upload_record_size_bytes gauge",
+        "cloud_courier_upload_record_size_bytes 100",
+    ]
+
+
+def test_Given_metrics_flushed_to_cloudwatch__Then_rendered_counters_still_total_since_start():
+    aggregator = MetricsAggregator(namespace="Test/Namespace")
+    aggregator.increment(FILES_UPLOADED_METRIC_NAME)
+    _ = aggregator.flush(
+        type("FakeClient", (), {"put_metric_data": lambda *_, **__: None})(),  # type: ignore[arg-type] # only put_metric_data is used
+        dimensions=[],
+        timestamp=None,  # type: ignore[arg-type] # not used by the fake client
+    )
+    aggregator.increment(FILES_UPLOADED_METRIC_NAME)
+
+    assert aggregator.snapshot().counters[FILES_UPLOADED_METRIC_NAME] == 1 + 1
+
+
+class TestStatusServer:
+    @pytest.fixture(autouse=True)
+    def _setup(self):
+        self.status: dict[str, Any] = {"files_uploaded": 3}
+        self.server = StatusServer(
+            address="127.0.0.1",
+            port=0,
+            render_metrics=lambda: "cloud_courier_files_uploaded_total 3\n",
+            build_status=lambda: self.status,
+        )
+        self.server.start()
+        self.base_url = f"http://127.0.0.1:{self.server.port}"
+        yield
+        self.server.stop()
+
+    def test_When_metrics_requested__Then_prometheus_text_served(self):
+        content_type, body = _get(f"{self.base_url}/metrics")
+
+        assert content_type == PROMETHEUS_CONTENT_TYPE
+        assert body == "cloud_courier_files_uploaded_total 3\n"
+
+    def test_When_status_requested__Then_json_served(self):
+        content_type, body = _get(f"{self.base_url}/status?pretty")
+
+        assert content_type == "application/json"
+        assert json.loads(body) == self.status
+
+    def test_When_unknown_path_requested__Then_not_found(self):
+        with pytest.raises(urllib.error.HTTPError, match="404"):
+            _ = _get(f"{self.base_url}/{uuid.uuid4()}")
+
+    def test_Given_rendering_fails__Then_server_error_and_server_keeps_serving(self):
+        self.status["not serializable"] = object()
+
+        with pytest.raises(urllib.error.HTTPError, match="500"):
+            _ = _get(f"{self.base_url}/status")
+
+        _, body = _get(f"{self.base_url}/metrics")
+        assert body.startswith("cloud_courier")
+
+
+class TestMainLoopStatus(MainLoopMixin):
+    def test_Given_status_port__When_file_uploaded__Then_status_and_metrics_show_it(self):
+        file_path = Path(self.watch_dir) / f"{uuid.uuid4()}.txt"
+        self._start_loop(status_port=0)
+        assert self.loop.status_server is not None
+        base_url = f"http://127.0.0.1:{self.loop.status_server.port}"
+
+        _ = file_path.write_text("test")
+        self._fail_if_file_not_uploaded(file_path)
+
+        _, body = _get(f"{base_url}/status")
+        status = json.loads(body)
+        assert status["files_uploaded"] == 1
+        assert status["bytes_uploaded"] == len("test")
+        assert status["in_flight_uploads"] == []
+        assert status["recent_failures"] == []
+        assert status["upload_record_size_bytes"] > 0
+        assert status["process_resident_memory_bytes"] > 0
+        _, body = _get(f"{base_url}/metrics")
+        assert "cloud_courier_files_uploaded_total 1.0" in body.splitlines()
+        assert "cloud_courier_process_resident_memory_bytes" in body
+
+    def test_Given_upload_record_not_created_yet__Then_its_size_unknown(self):
+        self._start_loop(status_port=0)
+        self.loop.previously_uploaded_files_record_path = Path(self.watch_dir) / "missing" / "record.tsv"
+
+        status = self.loop._build_status()  # noqa: SLF001 # yes, this is private, but it's simpler than serving it
+
+        assert status["upload_record_size_bytes"] is None
+        assert status["average_throughput_bytes_per_second"] is None
+        assert "upload_record_size_bytes" not in self.loop._render_status_metrics()  # noqa: SLF001 # yes, this is private, but it's simpler than serving it
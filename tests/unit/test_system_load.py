@@ -0,0 +1,115 @@
+import os
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from cloud_courier.system_load import LoadSample
+from cloud_courier.system_load import NullLoadSampler
+from cloud_courier.system_load import ProcLoadSampler
+from cloud_courier.system_load import create_load_sampler
+from cloud_courier.system_load import process_rss_bytes
+
+
+def _diskstats_line(name: str, io_ticks_ms: int) -> str:
+    return f"   8       0 {name} 100 0 800 50 20 0 160 30 0 {io_ticks_ms} 80\n"
+
+
+class TestProcLoadSampler:
+    @pytest.fixture(autouse=True)
+    def _setup(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            self.proc_dir = Path(temp_dir) / "proc"
+            self.sys_block_dir = Path(temp_dir) / "sys" / "block"
+            (self.proc_dir / "self").mkdir(parents=True)
+            for disk in ("sda", "nvme0n1", "loop0"):
+                (self.sys_block_dir / disk).mkdir(parents=True)
+            self.now = [100.0]
+            yield
+
+    def _write_counters(  # noqa: PLR0913 # all keyword-only
+        self, *, busy: int, idle: int, iowait: int, disk_io_ms: dict[str, int], own_user: int = 0, own_system: int = 0
+    ):
+        _ = (self.proc_dir / "stat").write_text(
+            f"cpu  {busy} 0 0 {idle} {iowait} 0 0 0 0 0\ncpu0 {busy} 0 0 {idle} {iowait} 0 0 0 0 0\n"
+        )
+        _ = (self.proc_dir / "self" / "stat").write_text(
+            f"1234 (cloud courier) S 1 1234 1234 0 -1 4194560 500 0 0 0 {own_user} {own_system} 0 0 20 0 9 0 100 0 0\n"
+        )
+        _ = (self.proc_dir / "diskstats").write_text(
+            "".join(_diskstats_line(name, io_ms) for name, io_ms in disk_io_ms.items())
+        )
+
+    def _create_sampler(self) -> ProcLoadSampler:
+        return ProcLoadSampler(proc_dir=self.proc_dir, sys_block_dir=self.sys_block_dir, clock=lambda: self.now[0])
+
+    def test_When_sampled__Then_load_since_previous_sample_calculated_from_busiest_physical_disk(self):
+        self._write_counters(busy=1000, idle=3000, iowait=0, disk_io_ms={"sda": 0, "sda1": 0, "nvme0n1": 0, "loop0": 0})
+        sampler = self._create_sampler()
+        self._write_counters(
+            busy=1300, idle=3600, iowait=100, disk_io_ms={"sda": 500, "sda1": 2000, "nvme0n1": 250, "loop0": 2000}
+        )
+        self.now[0] += 2
+
+        actual = sampler.sample()
+
+        assert actual == LoadSample(cpu_percent=30.0, disk_busy_percent=25.0)
+
+    def test_Given_this_process_used_cpu__Then_its_time_not_counted_in_the_load(self):
+        self._write_counters(busy=1000, idle=3000, iowait=0, disk_io_ms={}, own_user=100, own_system=50)
+        sampler = self._create_sampler()
+        self._write_counters(busy=1300, idle=3700, iowait=0, disk_io_ms={}, own_user=250, own_system=100)
+
+        actual = sampler.sample()
+
+        assert actual.cpu_percent == pytest.approx(10.0)
+
+    def test_Given_own_cpu_time_unreadable__Then_counted_in_the_load(self):
+        (self.proc_dir / "self").rmdir()
+        _ = (self.proc_dir / "stat").write_text("cpu  1000 0 0 3000 0 0 0 0 0 0\n")
+        sampler = self._create_sampler()
+        _ = (self.proc_dir / "stat").write_text("cpu  1300 0 0 3700 0 0 0 0 0 0\n")
+
+        actual = sampler.sample()
+
+        assert actual.cpu_percent == pytest.approx(30.0)
+
+    def test_Given_disk_appeared_since_previous_sample__Then_its_load_counted_from_the_next_sample(self):
+        self._write_counters(busy=0, idle=0, iowait=0, disk_io_ms={})
+        sampler = self._create_sampler()
+        self._write_counters(busy=0, idle=0, iowait=0, disk_io_ms={"sda": 500})
+        self.now[0] += 1
+
+        actual = sampler.sample()
+
+        assert actual == LoadSample(cpu_percent=None, disk_busy_percent=0.0)
+
+    def test_Given_counters_unreadable__Then_load_is_unknown(self):
+        sampler = self._create_sampler()
+
+        actual = sampler.sample()
+
+        assert actual == LoadSample(cpu_percent=None, disk_busy_percent=None)
+
+
+def test_Given_platform_without_load_counters__Then_load_is_unknown():
+    assert NullLoadSampler().sample() == LoadSample(cpu_percent=None, disk_busy_percent=None)
+
+
+def test_When_load_sampler_created_on_linux__Then_it_reads_proc():
+    assert isinstance(create_load_sampler(), ProcLoadSampler)
+
+
+def test_When_process_rss_read__Then_resident_pages_converted_to_bytes():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        (Path(temp_dir) / "self").mkdir()
+        _ = (Path(temp_dir) / "self" / "statm").write_text("5000 1200 300 10 0 900 0\n")
+
+        actual = process_rss_bytes(proc_dir=Path(temp_dir))
+
+    assert actual == 1200 * os.sysconf("SC_PAGE_SIZE")
+
+
+def test_Given_no_proc__When_process_rss_read__Then_unknown():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        assert process_rss_bytes(proc_dir=Path(temp_dir)) is None
@@ -1,19 +1,27 @@
 import tempfile
 import uuid
+from collections.abc import Iterator
 from pathlib import Path
 
 import boto3
 import pytest
+from botocore.awsrequest import AWSPreparedRequest
+from botocore.awsrequest import AWSResponse
+from botocore.awsrequest import HTTPHeaders
+from botocore.exceptions import ClientError
 from pytest_mock import MockerFixture
 
 from cloud_courier import MIN_MULTIPART_BYTES
 from cloud_courier import ChecksumMismatchError
 from cloud_courier import FolderToWatch
+from cloud_courier import calculate_aws_checksum
 from cloud_courier import convert_path_to_s3_object_key
 from cloud_courier import convert_path_to_s3_object_tag
 from cloud_courier import dummy_function_during_multipart_upload
 from cloud_courier import upload
 from cloud_courier import upload_to_s3
+from cloud_courier.aws_credentials import refresh_session_credentials
+from cloud_courier.upload import versioned_object_key
 
 from .constants import PATH_TO_EXAMPLE_DATA_FILES
 
@@ -31,6 +39,20 @@ def test_make_path_safe_for_s3_object_tag(original_file_path: str, expected: str
     assert actual == expected
 
 
+_EXPIRED_TOKEN_RESPONSE_BODY = (
+    b"<Error><Code>ExpiredToken</Code><Message>The provided token has expired.</Message></Error>"
+)
+
+
+class _RawResponse:
+    def __init__(self, body: bytes):
+        super().__init__()
+        self._body = body
+
+    def stream(self, **_: object) -> Iterator[bytes]:
+        yield self._body
+
+
 class TestUploadToS3:
     @pytest.fixture(
         autouse=True
@@ -90,6 +112,22 @@ class TestUploadToS3:
             object_key=object_key,
         )
 
+    def test_Given_checksum_already_calculated__Then_file_not_hashed_again(self, mocker: MockerFixture):
+        file_path = PATH_TO_EXAMPLE_DATA_FILES / "3_bytes.txt"
+        expected_checksum = calculate_aws_checksum(file_path)
+        spied_calculate_checksum = mocker.spy(upload, calculate_aws_checksum.__name__)
+
+        actual_checksum = upload_to_s3(
+            file_path=file_path,
+            boto_session=self.boto_session,
+            bucket_name=self.bucket_name,
+            object_key=str(uuid.uuid4()),
+            checksum=expected_checksum,
+        )
+
+        assert actual_checksum == expected_checksum
+        spied_calculate_checksum.assert_not_called()
+
     def test_Given_mocked_checksum_mismatch__Then_error(self, mocker: MockerFixture):
         local_checksum = str(uuid.uuid4())
         _ = mocker.patch.object(upload, "calculate_aws_checksum", autospec=True, return_value=local_checksum)
@@ -114,6 +152,7 @@ class TestUploadToS3:
         ],
     )
     def test_large_files(self, num_bytes: int, expected_checksum: str):
+        bytes_sent: list[int] = []
         with tempfile.NamedTemporaryFile() as f:
             _ = f.write(b"0" * num_bytes)
             f.flush()
@@ -123,9 +162,71 @@ class TestUploadToS3:
                 boto_session=self.boto_session,
                 bucket_name=self.bucket_name,
                 object_key=str(uuid.uuid4()),
+                on_progress=bytes_sent.append,
             )
 
         assert actual_checksum == expected_checksum
+        assert sum(bytes_sent) == num_bytes
+
+    @pytest.mark.parametrize(
+        ("num_bytes", "rejected_operation"),
+        [
+            pytest.param(MIN_MULTIPART_BYTES + 1, "UploadPart", id="part of a multi-part upload"),
+            pytest.param(10, "PutObject", id="single-part upload"),
+        ],
+    )
+    def test_Given_credentials_expire_mid_upload__Then_refreshed_and_request_signed_again(
+        self, mocker: MockerFixture, num_bytes: int, rejected_operation: str
+    ):
+        spied_refresh = mocker.spy(upload, refresh_session_credentials.__name__)
+        num_rejected: list[int] = [0]
+        bytes_sent: list[int] = []
+
+        def reject_first_request(request: AWSPreparedRequest, **_: object) -> AWSResponse | None:
+            if num_rejected[0] > 0:
+                return None
+            num_rejected[0] += 1
+            read_body = getattr(request.body, "read", None)
+            if read_body is not None:
+                read_body()  # sent before the response arrives, reporting progress for the upload
+            return AWSResponse(request.url, 400, HTTPHeaders(), _RawResponse(_EXPIRED_TOKEN_RESPONSE_BODY))
+
+        self.boto_session.events.register(
+            f"before-send.s3.{rejected_operation}",
+            reject_first_request,  # type: ignore[reportArgumentType] # the stubs expect handlers to return None, but a before-send handler returns the response to use instead of sending the request
+        )
+        object_key = str(uuid.uuid4())
+        with tempfile.NamedTemporaryFile() as f:
+            _ = f.write(b"0" * num_bytes)
+            f.flush()
+
+            _ = upload_to_s3(
+                file_path=Path(f.name),
+                boto_session=self.boto_session,
+                bucket_name=self.bucket_name,
+                object_key=object_key,
+                on_progress=bytes_sent.append,
+            )
+
+        assert num_rejected[0] == 1
+        assert sum(bytes_sent) == num_bytes
+        spied_refresh.assert_called_once_with(self.boto_session)
+        assert self.s3_client.head_object(Bucket=self.bucket_name, Key=object_key)["ContentLength"] == num_bytes
+
+    def test_Given_request_rejected_for_another_reason__Then_error_raised_without_refreshing(
+        self, mocker: MockerFixture
+    ):
+        spied_refresh = mocker.spy(upload, refresh_session_credentials.__name__)
+
+        with pytest.raises(ClientError, match="NoSuchBucket"):
+            _ = upload_to_s3(
+                file_path=PATH_TO_EXAMPLE_DATA_FILES / "3_bytes.txt",
+                boto_session=self.boto_session,
+                bucket_name=str(uuid.uuid4()),
+                object_key=str(uuid.uuid4()),
+            )
+
+        spied_refresh.assert_not_called()
 
     def test_Then_default_object_tags_are_present(self):
         object_key = str(uuid.uuid4())
@@ -192,3 +293,21 @@ def test_convert_path_to_s3_object_key(file_path: str, folder_config: FolderToWa
     actual = convert_path_to_s3_object_key(file_path, folder_config)
 
     assert actual == expected
+
+
+@pytest.mark.parametrize(
+    ("object_key", "expected"),
+    [
+        pytest.param("prefix/C/data/run.csv", "prefix/C/data/run.v0123456789ab.csv", id="before the extension"),
+        pytest.param(
+            "prefix/C/data/run.tar.gz", "prefix/C/data/run.tar.v0123456789ab.gz", id="only the last extension"
+        ),
+        pytest.param("prefix/C/data/README", "prefix/C/data/README.v0123456789ab", id="no extension"),
+        pytest.param("prefix/C/data/.hidden", "prefix/C/data/.hidden.v0123456789ab", id="dotfile"),
+        pytest.param("run.csv", "run.v0123456789ab.csv", id="no directory"),
+    ],
+)
+def test_versioned_object_key(object_key: str, expected: str):
+    actual = versioned_object_key(object_key, "0123456789abcdef0123456789abcdef-3")
+
+    assert actual == expected
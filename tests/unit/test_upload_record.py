@@ -0,0 +1,348 @@
+import os
+import sqlite3
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+from cloud_courier import add_to_upload_record
+from cloud_courier import create_record_file
+from cloud_courier import open_upload_record
+from cloud_courier import parse_upload_record
+from cloud_courier.upload_record import MIGRATED_TSV_SUFFIX
+from cloud_courier.upload_record import PARTIAL_LINE_SEARCH_BLOCK_BYTES
+from cloud_courier.upload_record import SQLITE_EXPORT_PAGE_SIZE
+from cloud_courier.upload_record import UPLOAD_RECORD_TSV_HEADER
+from cloud_courier.upload_record import SqliteUploadRecord
+from cloud_courier.upload_record import TsvUploadRecord
+from cloud_courier.upload_record import UploadRecordEntry
+from cloud_courier.upload_record import iter_upload_record_tsv
+from cloud_courier.uploaded_files_index import FileStat
+
+
+@pytest.fixture
+def record_dir():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        yield Path(temp_dir)
+
+
+@pytest.mark.parametrize("suffix", [".tsv", ".sqlite3"])
+class TestUploadRecordBackends:
+    @pytest.fixture(autouse=True)
+    def _setup(self, record_dir: Path, suffix: str):
+        self.record_path = record_dir / str(uuid.uuid4()) / f"record{suffix}"
+        self.record = open_upload_record(self.record_path)
+        yield
+        self.record.close()
+
+    def test_When_file_added__Then_it_is_in_the_record_after_reopening(self):
+        file_path = Path("/foo") / f"{uuid.uuid4()}.txt"
+        checksum = str(uuid.uuid4())
+
+        self.record.add(file_path=file_path, checksum=checksum, cloud_path="s3://bucket/key")
+        self.record.close()
+        self.record = open_upload_record(self.record_path)
+
+        assert file_path in self.record
+        assert self.record.checksums(file_path) == {checksum}
+        assert Path("/foo/other.txt") not in self.record
+        assert self.record.checksums(Path("/foo/other.txt")) == set()
+
+    def test_Given_same_file_added_with_two_checksums__Then_both_recorded(self):
+        file_path = Path("/foo/bar.txt")
+
+        self.record.add(file_path=file_path, checksum="abc", cloud_path="s3://bucket/key")
+        self.record.add(file_path=file_path, checksum="def", cloud_path="s3://bucket/key")
+
+        assert self.record.checksums(file_path) == {"abc", "def"}
+
+    def test_Given_paths_case_insensitive__When_added_and_reopened__Then_found_with_any_case(
+        self, mocker: MockerFixture
+    ):
+        _ = mocker.patch.object(
+            os.path, os.path.normcase.__name__, autospec=True, side_effect=str.lower
+        )  # as on Windows
+        self.record.set_commit_policy(commit_interval_seconds=60, commit_max_entries=100, fsync=False)
+
+        self.record.add(
+            file_path=Path("/Foo/Bar.TXT"), checksum="abc", cloud_path="s3://bucket/key", file_stat=FileStat(3, 100)
+        )
+
+        assert Path("/foo/bar.txt") in self.record
+        assert self.record.file_stat(Path("/FOO/bar.txt")) == FileStat(3, 100)
+        self.record.close()
+        self.record = open_upload_record(self.record_path)
+        assert Path("/foo/bar.txt") in self.record
+        assert self.record.checksums(Path("/FOO/BAR.txt")) == {"abc"}
+        assert self.record.file_stat(Path("/foo/BAR.txt")) == FileStat(3, 100)
+
+    def test_When_exported_and_imported_into_other_record__Then_entries_match(self, record_dir: Path):
+        expected = [UploadRecordEntry(f"/foo/{idx}.txt", f"s3://bucket/foo/{idx}.txt", str(idx)) for idx in range(3)]
+        self.record.add_many(expected)
+        tsv_path = record_dir / "export.tsv"
+
+        assert self.record.export_tsv(tsv_path) == len(expected)
+        other_record = SqliteUploadRecord(record_dir / "other.sqlite3")
+        other_record.import_tsv(tsv_path)
+
+        assert sorted(other_record.entries()) == sorted(expected)
+        other_record.close()
+
+    def test_When_file_uploaded_again_with_new_checksum__Then_file_stat_is_from_latest_upload_after_reopening(self):
+        file_path = Path("/foo/bar.txt")
+        self.record.add(file_path=file_path, checksum="abc", cloud_path="s3://bucket/key", file_stat=FileStat(3, 100))
+
+        self.record.add(file_path=file_path, checksum="def", cloud_path="s3://bucket/key", file_stat=FileStat(5, 200))
+        self.record.close()
+        self.record = open_upload_record(self.record_path)
+
+        assert self.record.file_stat(file_path) == FileStat(5, 200)
+        assert self.record.checksums(file_path) == {"abc", "def"}
+        assert self.record.file_stat(Path("/foo/other.txt")) is None
+
+    def test_Given_file_stat_recorded__When_same_checksum_added_with_new_file_stat__Then_file_stat_updated(self):
+        file_path = Path("/foo/bar.txt")
+        self.record.add(file_path=file_path, checksum="abc", cloud_path="s3://bucket/key", file_stat=FileStat(3, 100))
+        self.record.add(file_path=file_path, checksum="def", cloud_path="s3://bucket/key", file_stat=FileStat(5, 200))
+
+        self.record.add(file_path=file_path, checksum="abc", cloud_path="s3://bucket/key", file_stat=FileStat(3, 300))
+
+        assert self.record.file_stat(file_path) == FileStat(3, 300)
+
+    def test_Given_file_stat_recorded__When_entry_without_file_stat_added__Then_file_stat_kept(self):
+        file_path = Path("/foo/bar.txt")
+        self.record.add(file_path=file_path, checksum="abc", cloud_path="s3://bucket/key", file_stat=FileStat(3, 100))
+
+        self.record.add_many([UploadRecordEntry(str(file_path), "s3://bucket/key", "def")])
+
+        assert self.record.file_stat(file_path) == FileStat(3, 100)
+
+    def test_Given_long_commit_interval__When_file_added_with_file_stat__Then_file_stat_visible_before_commit(self):
+        self.record.set_commit_policy(commit_interval_seconds=60, commit_max_entries=100, fsync=False)
+        file_path = Path("/foo/bar.txt")
+
+        self.record.add(file_path=file_path, checksum="abc", cloud_path="s3://bucket/key", file_stat=FileStat(3, 100))
+
+        assert self.record.file_stat(file_path) == FileStat(3, 100)
+
+    def _is_committed(self, file_path: Path) -> bool:
+        other_record = open_upload_record(self.record_path)
+        is_committed = file_path in other_record
+        other_record.close()
+        return is_committed
+
+    def test_Given_long_commit_interval__When_files_added__Then_visible_but_not_committed_until_commit(self):
+        self.record.set_commit_policy(commit_interval_seconds=60, commit_max_entries=100, fsync=False)
+        file_paths = [Path(f"/foo/{idx}.txt") for idx in range(2)]
+
+        for file_path in file_paths:
+            self.record.add(file_path=file_path, checksum="abc", cloud_path="s3://bucket/key")
+
+        assert all(file_path in self.record for file_path in file_paths)
+        assert self.record.checksums(file_paths[0]) == {"abc"}
+        assert self._is_committed(file_paths[0]) is False
+        self.record.commit()
+        assert all(self._is_committed(file_path) for file_path in file_paths)
+
+    def test_Given_max_entries__When_that_many_added__Then_committed(self):
+        self.record.set_commit_policy(commit_interval_seconds=60, commit_max_entries=2, fsync=True)
+        file_paths = [Path(f"/foo/{idx}.txt") for idx in range(2)]
+
+        for file_path in file_paths:
+            self.record.add(file_path=file_path, checksum="abc", cloud_path="s3://bucket/key")
+
+        assert all(self._is_committed(file_path) for file_path in file_paths)
+
+    def test_Given_short_commit_interval__When_file_added__Then_committed_without_further_activity(self):
+        self.record.set_commit_policy(commit_interval_seconds=0.05, commit_max_entries=100, fsync=True)
+        file_path = Path("/foo/bar.txt")
+
+        self.record.add(file_path=file_path, checksum="abc", cloud_path="s3://bucket/key")
+
+        for _ in range(200):
+            if self._is_committed(file_path):
+                break
+            time.sleep(0.01)
+        else:
+            pytest.fail("Entry was never committed")
+
+
+class TestTsvUploadRecord:
+    @pytest.fixture(autouse=True)
+    def _setup(self, record_dir: Path):
+        self.record_path = record_dir / "record.tsv"
+        create_record_file(self.record_path)
+        add_to_upload_record(
+            record_file_path=self.record_path,
+            uploaded_file_path=Path("/foo/complete.txt"),
+            checksum="abc",
+            cloud_path="s3://bucket/complete.txt",
+        )
+        with self.record_path.open("a") as f:
+            _ = f.write("/foo/partial.txt\ts3://bu")  # simulate a crash part way through appending
+
+    def test_Given_partial_last_line__When_parsed__Then_it_is_skipped(self):
+        actual = parse_upload_record(self.record_path)
+
+        assert actual == {Path("/foo/complete.txt"): {"abc"}}
+
+    def test_Given_partial_last_line__When_opened_and_file_added__Then_record_is_not_corrupted(self):
+        record = TsvUploadRecord(self.record_path)
+
+        record.add(file_path=Path("/foo/new.txt"), checksum="def", cloud_path="s3://bucket/new.txt")
+
+        assert list(iter_upload_record_tsv(self.record_path)) == [
+            UploadRecordEntry("/foo/complete.txt", "s3://bucket/complete.txt", "abc"),
+            UploadRecordEntry("/foo/new.txt", "s3://bucket/new.txt", "def"),
+        ]
+
+    def test_Given_partial_last_line_longer_than_search_block__When_opened_and_file_added__Then_record_is_not_corrupted(
+        self,
+    ):
+        with self.record_path.open("a") as f:
+            _ = f.write("x" * PARTIAL_LINE_SEARCH_BLOCK_BYTES)
+        record = TsvUploadRecord(self.record_path)
+
+        record.add(file_path=Path("/foo/new.txt"), checksum="def", cloud_path="s3://bucket/new.txt")
+
+        record.close()
+        assert list(iter_upload_record_tsv(self.record_path)) == [
+            UploadRecordEntry("/foo/complete.txt", "s3://bucket/complete.txt", "abc"),
+            UploadRecordEntry("/foo/new.txt", "s3://bucket/new.txt", "def"),
+        ]
+
+    def test_Given_partial_header__When_opened_and_file_added__Then_header_rewritten(self):
+        _ = self.record_path.write_text(UPLOAD_RECORD_TSV_HEADER[:5])
+        record = TsvUploadRecord(self.record_path)
+
+        record.add(file_path=Path("/foo/new.txt"), checksum="def", cloud_path="s3://bucket/new.txt")
+
+        record.close()
+        assert self.record_path.read_text().startswith(UPLOAD_RECORD_TSV_HEADER)
+        assert list(iter_upload_record_tsv(self.record_path)) == [
+            UploadRecordEntry("/foo/new.txt", "s3://bucket/new.txt", "def"),
+        ]
+
+    def test_Given_lines_without_file_stat_columns__When_parsed__Then_read_without_file_stat(self):
+        legacy_path = self.record_path.with_name("legacy.tsv")
+        _ = legacy_path.write_text("file_path\tcloud_path\tchecksum\n/foo/old.txt\ts3://bucket/old.txt\tabc\n")
+
+        record = TsvUploadRecord(legacy_path)
+
+        assert Path("/foo/old.txt") in record
+        assert record.file_stat(Path("/foo/old.txt")) is None
+        record.close()
+
+    @pytest.mark.parametrize(
+        "line",
+        [
+            pytest.param("/foo/bad.txt\ts3://bucket/bad.txt\tabc\tbig\t100\n", id="size not a number"),
+            pytest.param("/foo/bad.txt\ts3://bucket/bad.txt\tabc\t3\n", id="wrong number of columns"),
+        ],
+    )
+    def test_Given_invalid_line__When_parsed__Then_it_is_skipped(self, line: str):
+        invalid_path = self.record_path.with_name("invalid.tsv")
+        _ = invalid_path.write_text(f"{UPLOAD_RECORD_TSV_HEADER}{line}")
+
+        actual = list(iter_upload_record_tsv(invalid_path))
+
+        assert actual == []
+
+
+class TestSqliteUploadRecord:
+    def test_Given_legacy_tsv_record_alongside__When_opened__Then_migrated_once(self, record_dir: Path):
+        legacy_path = record_dir / "record.tsv"
+        create_record_file(legacy_path)
+        add_to_upload_record(
+            record_file_path=legacy_path,
+            uploaded_file_path=Path("/foo/bar.txt"),
+            checksum="abc",
+            cloud_path="s3://bucket/bar.txt",
+        )
+
+        record = open_upload_record(record_dir / "record.sqlite3")
+
+        assert Path("/foo/bar.txt") in record
+        assert legacy_path.exists() is False
+        assert (record_dir / f"record.tsv{MIGRATED_TSV_SUFFIX}").exists() is True
+        record.close()
+
+    def test_Given_record_created_before_file_stats_were_tracked__When_opened__Then_columns_added(
+        self, record_dir: Path
+    ):
+        record_path = record_dir / "record.sqlite3"
+        connection = sqlite3.connect(record_path)
+        _ = connection.execute(
+            "CREATE TABLE uploaded_files (file_path TEXT NOT NULL, cloud_path TEXT NOT NULL, checksum TEXT NOT NULL, PRIMARY KEY (file_path, checksum)) WITHOUT ROWID"
+        )
+        _ = connection.execute("INSERT INTO uploaded_files VALUES ('/foo/old.txt', 's3://bucket/old.txt', 'abc')")
+        connection.commit()
+        connection.close()
+
+        record = SqliteUploadRecord(record_path)
+        record.add(
+            file_path=Path("/foo/new.txt"), checksum="def", cloud_path="s3://bucket/new.txt", file_stat=FileStat(3, 100)
+        )
+
+        assert record.file_stat(Path("/foo/old.txt")) is None
+        assert record.file_stat(Path("/foo/new.txt")) == FileStat(3, 100)
+        record.close()
+
+    def test_Given_more_entries_than_export_page_size__When_exported__Then_all_exported(self, record_dir: Path):
+        record = SqliteUploadRecord(record_dir / "record.sqlite3")
+        record.add_many(
+            UploadRecordEntry(f"/foo/{idx}.txt", f"s3://bucket/{idx}.txt", "abc")
+            for idx in range(SQLITE_EXPORT_PAGE_SIZE + 1)
+        )
+
+        actual = record.export_tsv(record_dir / "export.tsv")
+
+        assert actual == SQLITE_EXPORT_PAGE_SIZE + 1
+        record.close()
+
+    def test_Given_commit_fails__Then_rolled_back_and_entry_committed_by_next_write(self, record_dir: Path):
+        record = SqliteUploadRecord(record_dir / "record.sqlite3")
+        connection = record._connection  # noqa: SLF001 # the only way to make the COMMIT itself fail (as it would with the disk full)
+
+        class FailFirstCommit:
+            failed = False
+
+            def execute(self, sql: str, *args: object) -> sqlite3.Cursor:
+                if sql == "COMMIT" and not self.failed:
+                    self.failed = True
+                    raise sqlite3.OperationalError("database or disk is full")
+                return connection.execute(sql, *args)  # pyright: ignore[reportArgumentType] # passed straight through
+
+            def rollback(self):
+                connection.rollback()
+
+        record._connection = FailFirstCommit()  # type: ignore[assignment] # noqa: SLF001 # only execute and rollback are used while writing
+
+        with pytest.raises(sqlite3.OperationalError, match="disk is full"):
+            record.add(file_path=Path("/foo/first.txt"), checksum="abc", cloud_path="s3://bucket/first.txt")
+        record.add(file_path=Path("/foo/second.txt"), checksum="def", cloud_path="s3://bucket/second.txt")
+        record._connection = connection  # noqa: SLF001 # put back so it can be closed
+
+        record.close()
+        reopened = SqliteUploadRecord(record_dir / "record.sqlite3")
+        assert Path("/foo/first.txt") in reopened
+        assert Path("/foo/second.txt") in reopened
+        reopened.close()
+
+    def test_Given_write_fails_part_way__Then_rolled_back_and_later_writes_succeed(self, record_dir: Path):
+        record = SqliteUploadRecord(record_dir / "record.sqlite3")
+
+        def entries_then_fail():
+            yield UploadRecordEntry("/foo/first.txt", "s3://bucket/first.txt", "abc")
+            raise OSError("Import file could not be read")
+
+        with pytest.raises(OSError, match="could not be read"):
+            record.add_many(entries_then_fail())
+        record.add(file_path=Path("/foo/second.txt"), checksum="def", cloud_path="s3://bucket/second.txt")
+
+        assert Path("/foo/first.txt") not in record
+        assert Path("/foo/second.txt") in record
+        record.close()
@@ -0,0 +1,106 @@
+import datetime
+from typing import override
+
+import pytest
+
+from cloud_courier import AppConfig
+from cloud_courier import PauseWindow
+from cloud_courier import UploadScheduler
+from cloud_courier.system_load import CpuTimes
+from cloud_courier.system_load import LoadSampler
+from cloud_courier.upload_scheduler import is_in_pause_window
+
+WEEKDAY_DAYTIME = PauseWindow(days=["mon", "tue", "wed", "thu", "fri"], start=datetime.time(8), end=datetime.time(18))
+OVERNIGHT = PauseWindow(days=["fri"], start=datetime.time(22), end=datetime.time(6))
+A_MONDAY = datetime.datetime(2026, 10, 19, tzinfo=datetime.UTC)
+
+
+@pytest.mark.parametrize(
+    ("pause_window", "local_time", "expected"),
+    [
+        pytest.param(WEEKDAY_DAYTIME, A_MONDAY.replace(hour=8), True, id="start of window"),
+        pytest.param(WEEKDAY_DAYTIME, A_MONDAY.replace(hour=17, minute=59), True, id="end of window"),
+        pytest.param(WEEKDAY_DAYTIME, A_MONDAY.replace(hour=18), False, id="window has ended"),
+        pytest.param(WEEKDAY_DAYTIME, A_MONDAY.replace(hour=7, minute=59), False, id="window not started"),
+        pytest.param(WEEKDAY_DAYTIME, A_MONDAY.replace(day=18, hour=12), False, id="not on sunday"),
+        pytest.param(OVERNIGHT, A_MONDAY.replace(day=23, hour=23), True, id="overnight window on its first day"),
+        pytest.param(OVERNIGHT, A_MONDAY.replace(day=24, hour=5), True, id="overnight window past midnight"),
+        pytest.param(OVERNIGHT, A_MONDAY.replace(day=24, hour=6), False, id="overnight window has ended"),
+        pytest.param(OVERNIGHT, A_MONDAY.replace(day=24, hour=23), False, id="overnight window not on saturday"),
+        pytest.param(OVERNIGHT, A_MONDAY.replace(day=23, hour=5), False, id="overnight window not from thursday"),
+    ],
+)
+def test_is_in_pause_window(pause_window: PauseWindow, local_time: datetime.datetime, *, expected: bool):
+    assert is_in_pause_window(pause_window, local_time) is expected
+
+
+class FakeLoadSampler(LoadSampler):
+    """Report a CPU usage that the test sets directly (as busy time out of 100 since the previous sample)."""
+
+    def __init__(self):
+        self.cpu_percent = 0
+        self._busy = 0
+        self._total = 0
+        super().__init__()
+
+    @override
+    def _read_cpu_times(self) -> CpuTimes | None:
+        self._busy += self.cpu_percent
+        self._total += 100
+        return CpuTimes(self._busy, self._total)
+
+    @override
+    def _read_disk_io_ms(self) -> dict[str, int] | None:
+        return None
+
+
+class TestUploadScheduler:
+    @pytest.fixture(autouse=True)
+    def _setup(self):
+        self.load_sampler = FakeLoadSampler()
+        self.scheduler = UploadScheduler(load_sampler=self.load_sampler)
+        self.app_config = AppConfig(
+            max_cpu_percent_for_upload=50,
+            max_disk_busy_percent_for_upload=50,
+            load_idle_seconds_before_upload=60,
+            load_sample_interval_seconds=5,
+        )
+
+    def _is_upload_allowed(self, monotonic_now: float, app_config: AppConfig | None = None) -> bool:
+        return self.scheduler.is_upload_allowed(
+            self.app_config if app_config is None else app_config,
+            local_time=A_MONDAY.replace(hour=20),
+            monotonic_now=monotonic_now,
+        )
+
+    def test_Given_no_thresholds_or_windows__Then_allowed_without_sampling(self):
+        assert self._is_upload_allowed(0, AppConfig()) is True
+        assert self.scheduler.latest_load_sample is None
+
+    def test_Given_in_pause_window__Then_not_allowed(self):
+        app_config = AppConfig(
+            upload_pause_windows=[WEEKDAY_DAYTIME, PauseWindow(start=datetime.time(19), end=datetime.time(21))]
+        )
+
+        assert self._is_upload_allowed(0, app_config) is False
+        assert self.scheduler.pause_reason is not None
+
+    def test_Given_load_high__When_load_drops__Then_allowed_only_once_it_stayed_low_long_enough(self):
+        self.load_sampler.cpu_percent = 80
+        assert self._is_upload_allowed(0) is False
+
+        self.load_sampler.cpu_percent = 10
+        assert self._is_upload_allowed(1) is False  # not sampled again yet
+        assert self._is_upload_allowed(5) is False
+        assert self._is_upload_allowed(64) is False
+
+        assert self._is_upload_allowed(65) is True
+        assert self.scheduler.pause_reason is None
+
+    def test_Given_uploads_allowed__When_load_rises__Then_deferred_again(self):
+        assert self._is_upload_allowed(0) is False  # the load has to be seen to stay low from the start too
+        assert self._is_upload_allowed(60) is True
+
+        self.load_sampler.cpu_percent = 80
+
+        assert self._is_upload_allowed(65) is False
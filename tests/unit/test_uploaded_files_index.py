@@ -0,0 +1,130 @@
+import tempfile
+import uuid
+from pathlib import Path
+
+import pytest
+
+from cloud_courier import UploadedFilesIndex
+from cloud_courier import upload_record
+from cloud_courier.upload_record import SqliteUploadRecord
+from cloud_courier.upload_record import UploadRecordEntry
+from cloud_courier.uploaded_files_index import BloomFilter
+from cloud_courier.uploaded_files_index import FileStat
+from cloud_courier.uploaded_files_index import decode_checksum
+from cloud_courier.uploaded_files_index import encode_checksum
+
+MD5_HEX = "0123456789abcdef0123456789abcdef"
+
+
+@pytest.mark.parametrize(
+    ("checksum", "expected"),
+    [
+        pytest.param(MD5_HEX, (bytes.fromhex(MD5_HEX), 0), id="single part"),
+        pytest.param(f"{MD5_HEX}-12", (bytes.fromhex(MD5_HEX), 12), id="multipart"),
+        pytest.param(MD5_HEX.upper(), None, id="uppercase would not round trip"),
+        pytest.param(f"{MD5_HEX}-012", None, id="leading zero would not round trip"),
+        pytest.param(f"{MD5_HEX}--1", None, id="negative part count"),
+        pytest.param(f"{MD5_HEX}-abc", None, id="part count not a number"),
+        pytest.param("z" * 32, None, id="not hex"),
+        pytest.param(str(uuid.uuid4()), None, id="not an MD5"),
+    ],
+)
+def test_encode_checksum(checksum: str, expected: tuple[bytes, int] | None):
+    actual = encode_checksum(checksum)
+
+    assert actual == expected
+    if actual is not None:
+        assert decode_checksum(*actual) == checksum
+
+
+class TestUploadedFilesIndex:
+    def test_When_files_added__Then_contained_with_their_checksums(self):
+        index = UploadedFilesIndex()
+        file_path = Path("/foo/bar.txt")
+
+        index.add(file_path, MD5_HEX)
+        index.add(file_path, MD5_HEX)
+        index.add(file_path, f"{MD5_HEX}-2")
+
+        assert file_path in index
+        assert str(file_path) in index
+        assert Path("/foo/other.txt") not in index
+        assert index.checksums(file_path) == {MD5_HEX, f"{MD5_HEX}-2"}
+        assert index.checksums(Path("/foo/other.txt")) == set()
+        assert len(index) == 1
+
+    def test_Given_checksum_that_is_not_an_md5__When_added__Then_still_recorded(self):
+        index = UploadedFilesIndex()
+        checksum = str(uuid.uuid4())
+
+        index.add("/foo/bar.txt", checksum)
+
+        assert index.checksums("/foo/bar.txt") == {checksum}
+
+    def test_When_many_files_added__Then_all_found_after_growing(self):
+        num_files = 5000
+        index = UploadedFilesIndex()
+
+        index.add_many((f"/foo/{idx}.txt", f"{idx:032x}", FileStat(idx, idx)) for idx in range(num_files))
+
+        assert len(index) == num_files
+        assert all(index.checksums(f"/foo/{idx}.txt") == {f"{idx:032x}"} for idx in range(num_files))
+        assert all(index.file_stat(f"/foo/{idx}.txt") == FileStat(idx, idx) for idx in range(num_files))
+        assert not any(f"/bar/{idx}.txt" in index for idx in range(num_files))
+
+
+class TestBloomFilter:
+    def test_When_filled_to_capacity__Then_no_false_negatives_and_few_false_positives(self):
+        capacity = 10_000
+        max_false_positive_rate = 0.03
+        bloom_filter = BloomFilter(capacity)
+
+        for idx in range(capacity):
+            bloom_filter.add(f"/foo/{idx}.txt")
+
+        assert all(bloom_filter.might_contain(f"/foo/{idx}.txt") for idx in range(capacity))
+        num_false_positives = sum(bloom_filter.might_contain(f"/bar/{idx}.txt") for idx in range(capacity))
+        assert num_false_positives < max_false_positive_rate * capacity
+
+
+class TestSqliteUploadRecordBloomFilter:
+    @pytest.fixture(autouse=True)
+    def _setup(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            self.record = SqliteUploadRecord(Path(temp_dir) / "record.sqlite3")
+            self.record.add_many([UploadRecordEntry("/foo/existing.txt", "s3://bucket/existing.txt", MD5_HEX)])
+            yield
+            self.record.close()
+
+    def test_Given_bloom_filter_enabled__Then_existing_and_new_files_found_and_others_not(self):
+        self.record.set_bloom_filter(enabled=True)
+
+        self.record.add(file_path=Path("/foo/new.txt"), checksum=MD5_HEX, cloud_path="s3://bucket/new.txt")
+        self.record.add_many(  # a generator, like when importing
+            UploadRecordEntry(f"/foo/{idx}.txt", "s3://bucket/key", MD5_HEX) for idx in range(3)
+        )
+
+        assert Path("/foo/existing.txt") in self.record
+        assert Path("/foo/new.txt") in self.record
+        assert Path("/foo/2.txt") in self.record
+        assert Path("/foo/other.txt") not in self.record
+
+    def test_Given_bloom_filter_enabled__When_more_than_its_capacity_added__Then_rebuilt_and_still_correct(
+        self, monkeypatch: pytest.MonkeyPatch
+    ):
+        monkeypatch.setattr(upload_record, "BLOOM_FILTER_MIN_CAPACITY", 2)
+        self.record.set_bloom_filter(enabled=True)
+        file_paths = [Path(f"/foo/{idx}.txt") for idx in range(5)]
+
+        for file_path in file_paths:
+            self.record.add(file_path=file_path, checksum=MD5_HEX, cloud_path="s3://bucket/key")
+
+        assert all(file_path in self.record for file_path in file_paths)
+
+    def test_Given_bloom_filter_enabled_twice__When_disabled__Then_lookups_still_work(self):
+        self.record.set_bloom_filter(enabled=True)
+        self.record.set_bloom_filter(enabled=True)
+
+        self.record.set_bloom_filter(enabled=False)
+
+        assert Path("/foo/existing.txt") in self.record
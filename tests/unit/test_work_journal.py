@@ -0,0 +1,226 @@
+import sqlite3
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+import pytest
+
+from cloud_courier import WorkJournal
+from cloud_courier.load_config import folder_matching_key
+from cloud_courier.main import WORK_JOURNAL_FILE_NAME
+from cloud_courier.work_journal import JOURNAL_WRITE_BUFFER_SIZE
+from cloud_courier.work_journal import PendingFile
+from cloud_courier.work_journal import ScannedDirectory
+
+from .fixtures import MainLoopMixin
+
+
+class TestWorkJournal:
+    @pytest.fixture(autouse=True)
+    def _setup(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            self.journal_path = Path(temp_dir) / str(uuid.uuid4()) / "journal.sqlite3"
+            self.journal = WorkJournal(self.journal_path)
+            yield
+            self.journal.close()
+
+    def test_When_pending_file_added__Then_it_survives_reopening_the_journal(self):
+        self.journal.add_pending(file_path="/foo/bar.txt", folder_descriptor="foo", ready_at=123.5)
+        self.journal.close()
+
+        self.journal = WorkJournal(self.journal_path)
+
+        assert self.journal.pending_files("foo") == [PendingFile("/foo/bar.txt", "foo", 123.5, 0)]
+
+    def test_When_pending_file_added__Then_not_committed_until_flushed(self):
+        self.journal.add_pending(file_path="/foo/bar.txt", folder_descriptor="foo", ready_at=1)
+        other_journal = WorkJournal(self.journal_path)
+        assert other_journal.pending_files("foo") == []
+
+        self.journal.flush()
+
+        assert len(other_journal.pending_files("foo")) == 1
+        other_journal.close()
+
+    def test_When_write_buffer_fills_up__Then_committed_without_explicit_flush(self):
+        for idx in range(JOURNAL_WRITE_BUFFER_SIZE - 1):
+            self.journal.add_pending(file_path=f"/foo/{idx}.txt", folder_descriptor="foo", ready_at=1)
+
+        self.journal.record_attempt("/foo/0.txt")
+
+        other_journal = WorkJournal(self.journal_path)
+        assert len(other_journal.pending_files("foo")) == JOURNAL_WRITE_BUFFER_SIZE - 1
+        other_journal.close()
+
+    def test_When_write_buffer_fills_up_with_pending_files__Then_not_committed_until_flushed(self):
+        # pending files are added from the file system event thread, which shouldn't be blocked by a commit
+        for idx in range(JOURNAL_WRITE_BUFFER_SIZE + 1):
+            self.journal.add_pending(file_path=f"/foo/{idx}.txt", folder_descriptor="foo", ready_at=1)
+        other_journal = WorkJournal(self.journal_path)
+        assert other_journal.pending_files("foo") == []
+
+        self.journal.flush()
+
+        assert len(other_journal.pending_files("foo")) == JOURNAL_WRITE_BUFFER_SIZE + 1
+        other_journal.close()
+
+    def test_Given_attempt_recorded__When_pending_file_added_again__Then_ready_at_updated_and_attempts_kept(self):
+        self.journal.add_pending(file_path="/foo/bar.txt", folder_descriptor="foo", ready_at=1)
+        self.journal.record_attempt("/foo/bar.txt")
+
+        self.journal.add_pending(file_path="/foo/bar.txt", folder_descriptor="foo", ready_at=2)
+
+        assert self.journal.pending_files("foo") == [PendingFile("/foo/bar.txt", "foo", 2, 1)]
+
+    def test_Given_flush_fails_part_way__Then_rolled_back_and_writes_committed_by_next_flush(self):
+        self.journal.add_pending(file_path="/foo/bar.txt", folder_descriptor="foo", ready_at=1)
+        self.journal.record_scanned_directory("foo", ScannedDirectory("/foo", 1, []))
+        self.journal._buffer_write("INSERT INTO no_such_table VALUES (?)", (1,))  # noqa: SLF001 # there's no other way to make a write fail part way through the transaction
+        with pytest.raises(sqlite3.OperationalError, match="no such table"):
+            self.journal.flush()
+        other_journal = WorkJournal(self.journal_path)
+        assert other_journal.pending_files("foo") == []
+        _ = self.journal._buffered_writes.pop()  # noqa: SLF001 # removing the bad write, so the rest can be committed
+
+        self.journal.flush()
+
+        assert len(other_journal.pending_files("foo")) == 1
+        assert list(other_journal.scanned_directories("foo")) == ["/foo"]
+        other_journal.close()
+
+    def test_When_pending_file_removed__Then_no_longer_pending(self):
+        self.journal.add_pending(file_path="/foo/bar.txt", folder_descriptor="foo", ready_at=1)
+
+        self.journal.remove_pending("/foo/bar.txt")
+
+        assert self.journal.pending_files("foo") == []
+
+    def test_When_scanned_directories_recorded_and_some_removed__Then_only_others_returned(self):
+        kept = ScannedDirectory("/foo", 123, ["/foo/bar"])
+        self.journal.record_scanned_directory("foo", kept)
+        self.journal.record_scanned_directory("foo", ScannedDirectory("/foo/bar", 456, []))
+
+        self.journal.remove_scanned_directories("foo", ["/foo/bar"])
+
+        assert self.journal.scanned_directories("foo") == {"/foo": kept}
+
+    def test_Given_folder_started__When_started_again_with_same_config__Then_entries_kept(self):
+        self.journal.start_folder("foo", "config")
+        self.journal.add_pending(file_path="/foo/bar.txt", folder_descriptor="foo", ready_at=1)
+
+        self.journal.start_folder("foo", "config")
+
+        assert len(self.journal.pending_files("foo")) == 1
+
+    def test_Given_folder_started__When_started_again_with_different_config__Then_entries_discarded(self):
+        self.journal.start_folder("foo", "config")
+        self.journal.add_pending(file_path="/foo/bar.txt", folder_descriptor="foo", ready_at=1)
+        self.journal.record_scanned_directory("foo", ScannedDirectory("/foo", 123, []))
+
+        self.journal.start_folder("foo", "new config")
+
+        assert self.journal.pending_files("foo") == []
+        assert self.journal.scanned_directories("foo") == {}
+
+    def test_When_removing_folders_except_some__Then_only_those_kept(self):
+        for descriptor in ("foo", "bar"):
+            self.journal.start_folder(descriptor, "config")
+            self.journal.add_pending(file_path=f"/{descriptor}/a.txt", folder_descriptor=descriptor, ready_at=1)
+
+        self.journal.remove_folders_except(["foo"])
+
+        assert len(self.journal.pending_files("foo")) == 1
+        assert self.journal.pending_files("bar") == []
+
+
+class TestMainLoopWorkJournal(MainLoopMixin):
+    @pytest.fixture(autouse=True)
+    def _setup_journal(self, _setup: None):  # noqa: ARG002 # requested so that this runs after the MainLoopMixin setup
+        self.file_path = Path(self.watch_dir) / f"{uuid.uuid4()}.txt"
+        self.file_path.touch()
+        self.journal = WorkJournal(self.upload_record_file_path.parent / WORK_JOURNAL_FILE_NAME)
+        self.journal.start_folder("fcs-files", folder_matching_key(self.folder_config))
+
+    def _record_watch_dir_as_unchanged(self):
+        self.journal.record_scanned_directory(
+            "fcs-files", ScannedDirectory(self.watch_dir, Path(self.watch_dir).stat().st_mtime_ns, [])
+        )
+
+    def _start_loop_with_journal(self):
+        self.journal.close()
+        self._start_loop()
+
+    def test_Given_file_pending_in_journal_and_folder_unchanged__When_loop_starts__Then_uploaded_and_no_longer_pending(
+        self,
+    ):
+        self._record_watch_dir_as_unchanged()
+        self.journal.add_pending(file_path=str(self.file_path), folder_descriptor="fcs-files", ready_at=time.time())
+
+        self._start_loop_with_journal()
+
+        self._fail_if_file_not_uploaded(self.file_path)
+        for _ in range(100):
+            if not self.loop.work_journal.pending_files("fcs-files"):
+                break
+            time.sleep(0.01)
+        else:
+            pytest.fail("File is still pending in the journal")
+        assert self.loop.folder_scans["fcs-files"].num_directories_unchanged == 1
+
+    def test_Given_file_not_pending_and_folder_unchanged__When_loop_starts__Then_folder_not_rescanned(self):
+        self._record_watch_dir_as_unchanged()
+
+        self._start_loop_with_journal()
+
+        self._fail_if_any_file_uploaded()
+
+    def test_Given_only_settings_not_affecting_which_files_belong_changed_while_stopped__When_loop_starts__Then_folder_not_rescanned(
+        self,
+    ):
+        self._record_watch_dir_as_unchanged()
+        self.config.folders_to_watch["fcs-files"] = self.folder_config.model_copy(
+            update={"s3_bucket_name": f"{self.folder_config.s3_bucket_name}-moved"}
+        )
+
+        self._start_loop_with_journal()
+
+        self._fail_if_any_file_uploaded()
+
+    def test_Given_folder_config_changed_while_stopped__When_loop_starts__Then_folder_fully_rescanned(self):
+        self._record_watch_dir_as_unchanged()
+        self.journal.start_folder("fcs-files", "the previous config")
+
+        self._start_loop_with_journal()
+
+        self._fail_if_file_not_uploaded(self.file_path)
+
+    def test_Given_pending_file_reached_max_attempts__When_loop_starts__Then_not_uploaded(self):
+        self._record_watch_dir_as_unchanged()
+        self.journal.add_pending(file_path=str(self.file_path), folder_descriptor="fcs-files", ready_at=time.time())
+        for _ in range(self.config.app_config.max_upload_attempts):
+            self.journal.record_attempt(str(self.file_path))
+
+        self._start_loop_with_journal()
+
+        self._fail_if_any_file_uploaded()
+        assert self.loop.work_journal.pending_files("fcs-files") == []
+
+    def test_Given_pending_file_deleted_while_stopped__When_loop_starts__Then_not_uploaded_and_no_longer_pending(
+        self,
+    ):
+        self.file_path.unlink()
+        self._record_watch_dir_as_unchanged()
+        self.journal.add_pending(file_path=str(self.file_path), folder_descriptor="fcs-files", ready_at=time.time())
+
+        self._start_loop_with_journal()
+
+        self._fail_if_any_file_uploaded()
+        assert self.loop.work_journal.pending_files("fcs-files") == []
+
+    def test_Given_entries_for_folder_no_longer_configured__When_loop_starts__Then_discarded(self):
+        self.journal.add_pending(file_path="/foo/bar.txt", folder_descriptor="not-configured", ready_at=time.time())
+
+        self._start_loop_with_journal()
+
+        assert self.loop.work_journal.pending_files("not-configured") == []